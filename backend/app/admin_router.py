@@ -12,6 +12,7 @@ from app.services.statistics_service import get_statistics_service
 from app.services.stock_alert_service import get_stock_alert_service
 from app.services.cache_service import get_cache_service
 from app.services import review_service
+from app.services.product_catalog import on_products_changed
 
 security = HTTPBasic()
 
@@ -46,6 +47,7 @@ def admin_list_products(_: bool = Depends(verify_admin), search: str | None = No
 def admin_create_product(payload: schemas.ProductCreate, _: bool = Depends(verify_admin), db: Session = Depends(get_db)):
     p = Product(**payload.model_dump())
     db.add(p); db.commit(); db.refresh(p)
+    on_products_changed(db, [p.id])
     return p
 
 @admin_router.put("/products/{product_id}", response_model=schemas.ProductRead)
@@ -68,6 +70,8 @@ def admin_update_product(product_id: int, payload: schemas.ProductUpdate, _: boo
     
     for k,v in data.items(): setattr(p,k,v)
     db.commit(); db.refresh(p)
+    # 名称/分类/描述未变时不会重新向量化
+    on_products_changed(db, [p.id])
     return p
 
 @admin_router.delete("/products/{product_id}")
@@ -79,6 +83,7 @@ def admin_delete_product(product_id: int, _: bool = Depends(verify_admin), db: S
     if ref_order or ref_cart:
         raise HTTPException(status_code=400, detail="商品已被订单或购物车引用，禁止删除")
     db.delete(p); db.commit()
+    on_products_changed(db, removed_ids=[product_id])
     return {"status":"ok"}
 
 @admin_router.get("/orders", response_model=list[schemas.OrderRead])
@@ -158,6 +163,7 @@ def admin_bulk_create_products(payload: list[schemas.ProductCreate], _: bool = D
     products = [Product(**p.model_dump()) for p in payload]
     db.add_all(products); db.commit()
     for p in products: db.refresh(p)
+    on_products_changed(db, [p.id for p in products])
     return products
 
 @admin_router.get("/stats")
@@ -416,6 +422,20 @@ def admin_get_cache_status(_: bool = Depends(verify_admin)):
             except Exception as e:
                 stats["error"] = str(e)
         
+        # RAG 嵌入向量持久化缓存（与 Redis 无关，单独统计）
+        try:
+            from app.services.embedding_cache import get_embedding_cache
+            stats["embedding_cache"] = get_embedding_cache().stats()
+        except Exception as e:
+            stats["embedding_cache"] = {"enabled": False, "error": str(e)}
+        
+        # RAG 进程内缓存（查询向量 LRU 等）
+        try:
+            from app.services.rag_service import get_rag_cache_stats
+            stats.update(get_rag_cache_stats())
+        except Exception as e:
+            stats["query_embedding_cache"] = {"error": str(e)}
+        
         return stats
     except Exception as e:
         return {"enabled": False, "connected": False, "error": str(e)}
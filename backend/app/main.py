@@ -77,9 +77,28 @@ def create_app() -> FastAPI:
                 conn.exec_driver_sql("ALTER TABLE knowledge_documents ADD COLUMN metadata TEXT")
             if "quality_score" not in kdcols:
                 conn.exec_driver_sql("ALTER TABLE knowledge_documents ADD COLUMN quality_score FLOAT")
+            # 数据表同步按 source_url 查找行对应的文档
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_knowledge_documents_source_url ON knowledge_documents (source_url)")
         except Exception:
             pass  # 表可能不存在，会在首次创建时自动创建
         
+        # 检查并更新 knowledge_ingest_jobs 表（批量导入任务）
+        kjcols = {r[1] for r in conn.exec_driver_sql("PRAGMA table_info(knowledge_ingest_jobs)").fetchall()}
+        if kjcols and "kind" not in kjcols:
+            conn.exec_driver_sql("ALTER TABLE knowledge_ingest_jobs ADD COLUMN kind VARCHAR(20) NOT NULL DEFAULT 'file'")
+        if kjcols and "result" not in kjcols:
+            conn.exec_driver_sql("ALTER TABLE knowledge_ingest_jobs ADD COLUMN result TEXT")
+        
+        # 检查并更新 knowledge_chunks 表（持久化分词结果、近重复块引用）
+        kccols = {r[1] for r in conn.exec_driver_sql("PRAGMA table_info(knowledge_chunks)").fetchall()}
+        if kccols and "token_ids" not in kccols:
+            conn.exec_driver_sql("ALTER TABLE knowledge_chunks ADD COLUMN token_ids BLOB")
+        if kccols and "token_version" not in kccols:
+            conn.exec_driver_sql("ALTER TABLE knowledge_chunks ADD COLUMN token_version VARCHAR(32)")
+        if kccols and "duplicate_of" not in kccols:
+            conn.exec_driver_sql("ALTER TABLE knowledge_chunks ADD COLUMN duplicate_of INTEGER")
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_knowledge_chunks_duplicate_of ON knowledge_chunks (duplicate_of)")
+        
         cnt = conn.exec_driver_sql("SELECT COUNT(1) FROM membership_plans").scalar()
         if not cnt:
             conn.exec_driver_sql(
@@ -119,7 +138,13 @@ def create_app() -> FastAPI:
     try:
         from app.admin_router import admin_router
         from app.routers import knowledge_base_route, reviews_route
-        app.include_router(knowledge_base_route.router)
+        from app.services.rag_client import get_service_url
+        if get_service_url():
+            # 使用独立检索服务：知识库管理接口转发给检索服务进程
+            from app.routers.knowledge_base_proxy import create_proxy_router
+            app.include_router(create_proxy_router())
+        else:
+            app.include_router(knowledge_base_route.router)
         app.include_router(reviews_route.router)
         app.include_router(admin_router)
     except ModuleNotFoundError as e:
@@ -164,10 +189,27 @@ def create_app() -> FastAPI:
                 print("⚠ RAG 服务初始化完成但嵌入模型未加载")
         except Exception as e:
             print(f"⚠ RAG 服务后台初始化失败: {e}")
+        # 商品索引与商品表对账（补上模型加载期间和其他途径产生的商品变更）
+        try:
+            from app.services.product_catalog import reconcile_product_catalog
+            reconcile_product_catalog()
+        except Exception as e:
+            print(f"⚠ 商品索引对账失败: {e}")
+        # RAG 服务就绪后恢复上次未完成的文档导入任务
+        try:
+            from app.services.ingest_service import get_ingest_service
+            get_ingest_service().resume_pending()
+        except Exception as e:
+            print(f"⚠ 恢复文档导入任务失败: {e}")
     
-    rag_thread = threading.Thread(target=init_rag_background, daemon=True)
-    rag_thread.start()
-    print("✓ RAG 服务后台初始化已启动")
+    from app.services.rag_client import get_service_url
+    if get_service_url():
+        # 模型和索引由独立检索服务进程（python -m app.rag_server）加载，本进程不再加载
+        print(f"✓ 使用独立检索服务: {get_service_url()}")
+    else:
+        rag_thread = threading.Thread(target=init_rag_background, daemon=True)
+        rag_thread.start()
+        print("✓ RAG 服务后台初始化已启动")
 
     @app.get("/")
     def read_root():
@@ -183,6 +225,16 @@ def create_app() -> FastAPI:
                 auto_issue_service.shutdown()
         except Exception:
             pass
+        try:
+            from app.services.ingest_service import get_ingest_service
+            get_ingest_service().shutdown()
+        except Exception:
+            pass
+        try:
+            from app.services.ocr_service import get_ocr_service
+            get_ocr_service().shutdown()
+        except Exception:
+            pass
 
     return app
 
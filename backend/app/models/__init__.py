@@ -11,7 +11,7 @@ from .coupon_models import Coupon, UserCoupon, DiscountType
 from .membership_plan_models import MembershipPlan
 from .membership_card_models import MembershipCard
 from .chat_models import ChatMessage
-from .knowledge_base_models import KnowledgeDocument, KnowledgeChunk
+from .knowledge_base_models import KnowledgeDocument, KnowledgeChunk, KnowledgeIngestJob, KnowledgeSyncSource
 from .review_models import Review
 
 __all__ = [
@@ -37,5 +37,7 @@ __all__ = [
     "ChatMessage",
     "KnowledgeDocument",
     "KnowledgeChunk",
+    "KnowledgeIngestJob",
+    "KnowledgeSyncSource",
     "Review",
 ]
\ No newline at end of file
@@ -1,7 +1,9 @@
 from __future__ import annotations
 
+from datetime import datetime
 from typing import TYPE_CHECKING
-from sqlalchemy import Integer, String, Text, Float, Boolean
+
+from sqlalchemy import Integer, String, Text, Float, Boolean, LargeBinary, DateTime
 from sqlalchemy.orm import Mapped, mapped_column
 
 from ..database import Base
@@ -19,7 +21,7 @@ class KnowledgeDocument(Base, TimestampMixin):
     title: Mapped[str] = mapped_column(String(500), nullable=False, index=True)
     content: Mapped[str] = mapped_column(Text, nullable=False)
     source_type: Mapped[str] = mapped_column(String(50), nullable=False, default="manual")  # manual, pdf, web, api, database
-    source_url: Mapped[str | None] = mapped_column(String(500), nullable=True)
+    source_url: Mapped[str | None] = mapped_column(String(500), nullable=True, index=True)  # 数据表同步的文档为 table:表名#主键
     category: Mapped[str | None] = mapped_column(String(100), nullable=True, index=True)
     tags: Mapped[str | None] = mapped_column(String(500), nullable=True)  # 逗号分隔的标签
     active: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False, index=True)
@@ -38,6 +40,48 @@ class KnowledgeChunk(Base, TimestampMixin):
     content: Mapped[str] = mapped_column(Text, nullable=False)
     chunk_metadata: Mapped[str | None] = mapped_column("metadata", Text, nullable=True)  # JSON 格式的元数据
     vector_id: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True)  # FAISS 向量索引 ID
+    token_ids: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)  # 分词结果（int64 token id 序列，BM25 建索引时复用）
+    token_version: Mapped[str | None] = mapped_column(String(32), nullable=True)  # 生成 token_ids 的分词器版本
+    duplicate_of: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True)  # 近重复块引用的规范块ID（不单独写入向量）
+
+
+class KnowledgeIngestJob(Base, TimestampMixin):
+    """知识库文档导入任务（上传后由后台工作线程解析、清洗、分块、向量化、建索引）"""
+    __tablename__ = "knowledge_ingest_jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    kind: Mapped[str] = mapped_column(String(20), nullable=False, default="file")  # file（单个文件）, archive（压缩包批量导入）
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="pending", index=True)  # pending, running, succeeded, failed
+    stage: Mapped[str] = mapped_column(String(20), nullable=False, default="queued")  # queued, parse, clean, embed, index, done
+    progress: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)  # 0-1
+    filename: Mapped[str] = mapped_column(String(500), nullable=False)
+    content_type: Mapped[str | None] = mapped_column(String(100), nullable=True)
+    file_path: Mapped[str] = mapped_column(String(1000), nullable=False)  # 上传文件的暂存路径（重启后可继续处理）
+    title: Mapped[str | None] = mapped_column(String(500), nullable=True)
+    category: Mapped[str | None] = mapped_column(String(100), nullable=True)
+    tags: Mapped[str | None] = mapped_column(String(500), nullable=True)
+    document_id: Mapped[int | None] = mapped_column(Integer, nullable=True)  # 成功后生成的文档ID
+    result: Mapped[str | None] = mapped_column(Text, nullable=True)  # JSON 格式的批量导入结果（成功数、失败列表等）
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
+class KnowledgeSyncSource(Base, TimestampMixin):
+    """数据表同步配置与水位（每行一个文档，按 updated 列增量同步）"""
+    __tablename__ = "knowledge_sync_sources"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    table_name: Mapped[str] = mapped_column(String(100), nullable=False, unique=True)
+    key_column: Mapped[str] = mapped_column(String(100), nullable=False)  # 单列主键，文档按它对应到行
+    updated_column: Mapped[str | None] = mapped_column(String(100), nullable=True)  # 为空时每次全表比对内容
+    title_column: Mapped[str | None] = mapped_column(String(100), nullable=True)
+    columns: Mapped[str | None] = mapped_column(Text, nullable=True)  # JSON 格式的列名列表（为空表示所有列）
+    category: Mapped[str | None] = mapped_column(String(100), nullable=True)
+    tags: Mapped[str | None] = mapped_column(String(500), nullable=True)
+    watermark_updated: Mapped[str | None] = mapped_column(String(64), nullable=True)  # 已同步到的 updated 值
+    watermark_key: Mapped[str | None] = mapped_column(String(100), nullable=True)  # 同一 updated 值内已同步到的主键
+    last_synced_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    last_result: Mapped[str | None] = mapped_column(Text, nullable=True)  # JSON 格式的上次同步结果
 
 
-__all__ = ["KnowledgeDocument", "KnowledgeChunk"]
+__all__ = ["KnowledgeDocument", "KnowledgeChunk", "KnowledgeIngestJob", "KnowledgeSyncSource"]
@@ -0,0 +1,165 @@
+"""
+独立检索服务进程
+单独持有 RAGService（嵌入模型 + 向量索引 + BM25），每台机器只加载一份模型；
+多个 API worker 配置相同的 RAG_SERVICE_URL 后，通过本地 Unix socket 或 HTTP 调用本服务，
+知识库管理接口也由 API worker 转发到这里，所有 worker 看到相同的索引代数
+
+启动方式（在 backend 目录下运行，必须单进程）:
+    RAG_SERVICE_URL=unix:///tmp/smart_mall_rag.sock python -m app.rag_server
+    RAG_SERVICE_URL=http://127.0.0.1:8100 python -m app.rag_server
+"""
+import sys
+import os
+# 兼容直接运行 app/rag_server.py：把 backend 加入 path
+_backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _backend not in sys.path:
+    sys.path.insert(0, _backend)
+
+import threading
+from typing import List, Optional
+from urllib.parse import urlparse
+
+from fastapi import Depends, FastAPI, Header, HTTPException
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+
+from app.database import Base, engine, get_db
+from app.utils import load_env
+from app.services.rag_client import TOKEN_HEADER, get_service_url
+
+
+class RetrieveRequest(BaseModel):
+    query: str
+    top_k: Optional[int] = None
+    similarity_threshold: float = 0.15
+    category: Optional[str] = None
+
+
+class ProductIndexRequest(BaseModel):
+    product_ids: List[int] = []
+    removed_ids: List[int] = []
+
+
+class ProductSearchRequest(BaseModel):
+    query: str
+    top_k: Optional[int] = None
+
+
+def verify_service_token(x_rag_token: Optional[str] = Header(None, alias=TOKEN_HEADER)):
+    """配置了 RAG_SERVICE_TOKEN 时校验调用方令牌"""
+    token = os.environ.get("RAG_SERVICE_TOKEN")
+    if token and x_rag_token != token:
+        raise HTTPException(status_code=401, detail="检索服务令牌无效")
+    return True
+
+
+def create_rag_app(init_background: bool = True) -> FastAPI:
+    load_env()
+    Base.metadata.create_all(bind=engine)
+
+    app = FastAPI(title="智慧商城 RAG 检索服务", version="1.0.0")
+
+    # 知识库管理接口（API worker 转发过来的请求）
+    from app.routers import knowledge_base_route
+    app.include_router(knowledge_base_route.router)
+
+    @app.get("/internal/health")
+    def health(_: bool = Depends(verify_service_token)):
+        from app.services.rag_service import is_rag_ready, get_rag_service
+        if not is_rag_ready():
+            return {"ready": False, "generation": 0, "ntotal": 0}
+        rag_service = get_rag_service()
+        store = rag_service.vector_store
+        return {
+            "ready": True,
+            "generation": rag_service.index_generation,
+            "snapshot_generation": store.generation if store is not None else 0,
+            "ntotal": store.ntotal if store is not None else 0,
+        }
+
+    @app.post("/internal/retrieve")
+    def retrieve(payload: RetrieveRequest, _: bool = Depends(verify_service_token),
+                 db: Session = Depends(get_db)):
+        from app.services.rag_service import is_rag_ready, get_rag_service
+        if not is_rag_ready():
+            raise HTTPException(status_code=503, detail="RAG 服务尚未准备好")
+        rag_service = get_rag_service()
+        context_text, result_details = rag_service.retrieve_context(
+            db, payload.query, top_k=payload.top_k, category=payload.category,
+            similarity_threshold=payload.similarity_threshold
+        )
+        return {"context": context_text, "results": result_details, "generation": rag_service.index_generation}
+
+    @app.post("/internal/products/index")
+    def index_products(payload: ProductIndexRequest, _: bool = Depends(verify_service_token),
+                       db: Session = Depends(get_db)):
+        from app.services import product_catalog
+        catalog = product_catalog.get_product_catalog()
+        if catalog is None:
+            raise HTTPException(status_code=503, detail="商品索引尚未准备好")
+        return catalog.apply_changes(db, payload.product_ids, payload.removed_ids)
+
+    @app.post("/internal/products/search")
+    def search_products(payload: ProductSearchRequest, _: bool = Depends(verify_service_token)):
+        from app.services import product_catalog
+        catalog = product_catalog.get_product_catalog()
+        if catalog is None:
+            raise HTTPException(status_code=503, detail="商品索引尚未准备好")
+        hits = catalog.search(payload.query, top_k=payload.top_k)
+        return {"results": [{"product_id": product_id, "similarity": sim} for product_id, sim in hits]}
+
+    if init_background:
+        def init_rag_background():
+            try:
+                from app.services.rag_service import get_rag_service
+                print("🔄 检索服务初始化 RAG 服务...")
+                rag_service = get_rag_service()
+                if rag_service and rag_service.embedding_model:
+                    print("✓ 检索服务已就绪")
+                else:
+                    print("⚠ RAG 服务初始化完成但嵌入模型未加载")
+            except Exception as e:
+                print(f"⚠ RAG 服务初始化失败: {e}")
+            # 商品索引与商品表对账（API 进程的增删改通知会在检索服务未运行时丢失）
+            try:
+                from app.services.product_catalog import reconcile_product_catalog
+                reconcile_product_catalog()
+            except Exception as e:
+                print(f"⚠ 商品索引对账失败: {e}")
+            # 文档导入任务由检索服务进程执行
+            try:
+                from app.services.ingest_service import get_ingest_service
+                get_ingest_service().resume_pending()
+            except Exception as e:
+                print(f"⚠ 恢复文档导入任务失败: {e}")
+
+        threading.Thread(target=init_rag_background, daemon=True).start()
+
+    @app.on_event("shutdown")
+    def shutdown_event():
+        try:
+            from app.services.ingest_service import get_ingest_service
+            get_ingest_service().shutdown()
+        except Exception:
+            pass
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    url = get_service_url()
+    if not url:
+        print("✗ 请设置 RAG_SERVICE_URL（如 unix:///tmp/smart_mall_rag.sock 或 http://127.0.0.1:8100）")
+        sys.exit(1)
+    # 必须单进程：模型和索引只在一个进程中加载
+    if url.startswith("unix://"):
+        uvicorn.run(create_rag_app(), uds=url[len("unix://"):], workers=1)
+    else:
+        parsed = urlparse(url)
+        uvicorn.run(create_rag_app(), host=parsed.hostname or "127.0.0.1", port=parsed.port or 8100, workers=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+知识库管理接口转发（使用独立检索服务时）
+API 进程不持有向量索引，/admin/knowledge-base/* 请求原样转发给检索服务进程处理，
+文档增删改、导入任务和重建索引都在同一个进程中完成，所有 API 进程看到相同的索引代数
+"""
+import os
+from typing import Optional
+
+import httpx
+from fastapi import APIRouter, HTTPException, Request, Response
+
+from ..services.rag_client import get_service_url, parse_service_url, service_headers
+
+PREFIX = "/admin/knowledge-base"
+# 不转发的逐跳首部
+HOP_HEADERS = {"host", "connection", "keep-alive", "transfer-encoding", "te", "upgrade", "content-length"}
+
+
+def create_proxy_router(client: Optional[httpx.AsyncClient] = None) -> APIRouter:
+    """创建转发路由；client 为空时按 RAG_SERVICE_URL 创建（支持 unix:// 地址）"""
+    if client is None:
+        base_url, uds = parse_service_url(get_service_url() or "")
+        transport = httpx.AsyncHTTPTransport(uds=uds) if uds else None
+        # 文件上传和重建索引可能较慢
+        timeout = float(os.environ.get("RAG_SERVICE_PROXY_TIMEOUT", "300"))
+        client = httpx.AsyncClient(base_url=base_url, transport=transport, timeout=timeout)
+
+    router = APIRouter(tags=["knowledge-base"])
+
+    @router.api_route(PREFIX + "/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
+    async def forward(path: str, request: Request):
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_HEADERS}
+        headers.update(service_headers())
+        try:
+            upstream = await client.request(
+                request.method,
+                f"{PREFIX}/{path}",
+                params=list(request.query_params.multi_items()),
+                content=await request.body(),
+                headers=headers,
+            )
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=503, detail=f"检索服务不可用: {e}")
+        response_headers = {
+            k: v for k, v in upstream.headers.items()
+            if k.lower() not in HOP_HEADERS and k.lower() != "content-encoding"
+        }
+        return Response(content=upstream.content, status_code=upstream.status_code, headers=response_headers)
+
+    return router
@@ -11,7 +11,7 @@ import secrets
 from ..database import get_db
 from .. import schemas
 from ..services.rag_service import get_rag_service
-from ..models import KnowledgeDocument, KnowledgeChunk
+from ..models import KnowledgeDocument, KnowledgeChunk, KnowledgeIngestJob, KnowledgeSyncSource
 from ..admin_router import verify_admin
 
 router = APIRouter(prefix="/admin/knowledge-base", tags=["knowledge-base"])
@@ -77,43 +77,34 @@ def update_document(
     _: bool = Depends(verify_admin),
     db: Session = Depends(get_db)
 ):
-    """更新文档（更新内容会触发重新向量化）"""
+    """更新文档（更新内容会重新向量化该文档；启用/停用只增删该文档的向量）"""
     doc = db.query(KnowledgeDocument).filter(KnowledgeDocument.id == document_id).first()
     if not doc:
         raise HTTPException(status_code=404, detail="文档不存在")
-    
-    # 如果内容或标题更新，需要重新向量化
-    need_reindex = False
-    if payload.content is not None or payload.title is not None:
-        need_reindex = True
-    
-    # 更新字段
+
+    # 内容交给 RAG 服务处理（需要重新分块和向量化）
     update_data = payload.model_dump(exclude_unset=True)
+    new_content = update_data.pop("content", None)
+    was_active = doc.active
+
+    # 更新字段
     for key, value in update_data.items():
         setattr(doc, key, value)
-    
+
     db.commit()
-    
-    # 如果内容更新，重新向量化
-    if need_reindex and payload.content is not None:
-        try:
-            rag_service = get_rag_service()
-            # 删除旧块
-            db.query(KnowledgeChunk).filter(KnowledgeChunk.document_id == document_id).delete()
-            db.commit()
-            
-            # 重新添加文档（会重新分块和向量化）
-            doc = rag_service.add_document(
-                db=db,
-                title=doc.title,
-                content=doc.content,
-                source_type=doc.source_type,
-                source_url=doc.source_url,
-                category=doc.category,
-                tags=doc.tags
-            )
-        except Exception as e:
-            print(f"⚠ 重新向量化失败: {e}")
+
+    try:
+        rag_service = get_rag_service()
+        # 启用/停用：只增删该文档的向量
+        if doc.active != was_active:
+            rag_service.set_document_active(db, doc, doc.active)
+        # 如果内容更新，重新分块和向量化（替换该文档的旧向量）
+        if new_content is not None:
+            doc = rag_service.replace_document_content(db, doc, new_content)
+        # 标题、分类等字段会出现在检索结果中，同步块内存存储并使缓存失效
+        rag_service.refresh_document(doc)
+    except Exception as e:
+        print(f"⚠ 重新向量化失败: {e}")
     
     db.refresh(doc)
     return doc
@@ -134,7 +125,7 @@ def delete_document(
         raise HTTPException(status_code=400, detail=f"删除文档失败: {str(e)}")
 
 
-@router.post("/documents/upload", response_model=schemas.KnowledgeDocumentRead, status_code=status.HTTP_201_CREATED)
+@router.post("/documents/upload", response_model=schemas.KnowledgeIngestJobRead, status_code=status.HTTP_202_ACCEPTED)
 def upload_document(
     file: UploadFile = File(...),
     title: Optional[str] = None,
@@ -144,74 +135,98 @@ def upload_document(
     db: Session = Depends(get_db)
 ):
     """
-    上传文档文件
+    上传文档文件（异步导入）
+    文件暂存后立即返回导入任务，解析、清洗、分块、向量化、建索引在后台工作线程中完成，
+    可通过 GET /jobs/{job_id} 查询进度
     支持格式：
     - PDF (.pdf) - 使用 pdfplumber，可保留表格
     - Word (.docx) - 使用 python-docx
-    - Excel (.xlsx, .xls) - 使用 pandas
-    - 文本 (.txt, .md, .csv, .log) - 直接读取
+    - Excel (.xlsx, .xls) / CSV (.csv, .tsv) - 逐行读取（openpyxl 只读模式 / xlrd / csv），按行窗口分块，每块重复表头
+    - 文本 (.txt, .md, .log) - 直接读取
     - 图片 (.jpg, .jpeg, .png, .bmp, .gif, .webp) - 使用 PaddleOCR 或 pytesseract
     """
-    from ..services.document_parser import parse_document
+    from ..services.ingest_service import get_ingest_service
     
-    # 读取文件内容
     file_data = file.file.read()
-    
-    # 获取文件类型
-    file_type = file.content_type
-    filename = file.filename or ""
+    if not file_data:
+        raise HTTPException(status_code=400, detail="上传的文件为空")
     
     try:
-        # 使用文档解析器解析文件
-        print(f"📄 开始解析文件: {filename} (类型: {file_type}, 大小: {len(file_data)} bytes)")
-        parse_result = parse_document(file_data, filename=filename, file_type=file_type)
-        
-        content = parse_result.get("content", "")
-        source_type = parse_result.get("source_type", "file")
-        metadata = parse_result.get("metadata", {})
-        
-        if not content.strip():
-            raise HTTPException(
-                status_code=400, 
-                detail=f"文件内容为空或无法提取文本。解析器: {metadata.get('parser', 'unknown')}"
-            )
-        
-        print(f"✓ 文件解析完成，提取文本长度: {len(content)} 字符")
-        
-        # 使用文件名作为标题（如果没有提供）
-        doc_title = title or (filename or "未命名文档")
-        
-        # 如果文件名没有扩展名，从 metadata 中获取信息
-        if not doc_title or doc_title == "未命名文档":
-            parser_info = metadata.get("parser", "")
-            if parser_info:
-                doc_title = f"文档 ({parser_info})"
-        
-        # 添加文档到知识库（包含向量化）
-        print(f"🔄 开始处理文档: {doc_title} (内容长度: {len(content)} 字符)")
-        rag_service = get_rag_service()
-        doc = rag_service.add_document(
-            db=db,
-            title=doc_title,
-            content=content,
-            source_type=source_type,
-            source_url=filename,
+        return get_ingest_service().submit_upload(
+            db,
+            file_data,
+            filename=file.filename or "",
+            content_type=file.content_type,
+            title=title,
             category=category,
             tags=tags
         )
-        print(f"✓ 文档已成功添加到知识库: {doc_title} (ID: {doc.id}, 块数: {doc.chunk_count})")
-        return doc
-    except HTTPException:
-        raise
     except Exception as e:
-        import traceback
-        error_detail = str(e)
-        print(f"❌ 上传文档失败: {error_detail}")
-        traceback.print_exc()
-        raise HTTPException(
-            status_code=500, 
-            detail=f"上传文档失败: {error_detail}\n\n可能原因：\n1. 文件格式不支持或损坏\n2. 文档解析失败\n3. 向量化处理失败\n4. 数据库操作失败"
+        raise HTTPException(status_code=500, detail=f"创建导入任务失败: {str(e)}")
+
+
+@router.post("/documents/bulk-upload", response_model=schemas.KnowledgeIngestJobRead, status_code=status.HTTP_202_ACCEPTED)
+def bulk_upload_documents(
+    file: UploadFile = File(...),
+    category: Optional[str] = None,
+    tags: Optional[str] = None,
+    _: bool = Depends(verify_admin),
+    db: Session = Depends(get_db)
+):
+    """
+    批量导入压缩包（.zip / .tar / .tar.gz / .tgz）
+    包内每个支持格式的文件导入为一个文档（标题为文件名），后台按批提交数据库事务、
+    按固定批大小向量化，全部完成后统一保存索引；结果（成功数、失败明细）见任务的 result 字段
+    """
+    from ..services.bulk_import import is_archive, ARCHIVE_SUFFIXES
+    from ..services.ingest_service import get_ingest_service
+    
+    filename = file.filename or ""
+    if not is_archive(filename):
+        raise HTTPException(status_code=400, detail=f"仅支持压缩包: {', '.join(ARCHIVE_SUFFIXES)}")
+    file_data = file.file.read()
+    if not file_data:
+        raise HTTPException(status_code=400, detail="上传的文件为空")
+    
+    try:
+        return get_ingest_service().submit_upload(
+            db,
+            file_data,
+            filename=filename,
+            content_type=file.content_type,
+            category=category,
+            tags=tags,
+            kind="archive"
         )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"创建批量导入任务失败: {str(e)}")
+
+
+@router.get("/jobs", response_model=List[schemas.KnowledgeIngestJobRead])
+def list_ingest_jobs(
+    status_filter: Optional[str] = Query(None, alias="status"),
+    limit: int = Query(50, ge=1, le=500),
+    _: bool = Depends(verify_admin),
+    db: Session = Depends(get_db)
+):
+    """获取文档导入任务列表（按创建时间倒序）"""
+    query = db.query(KnowledgeIngestJob)
+    if status_filter:
+        query = query.filter(KnowledgeIngestJob.status == status_filter)
+    return query.order_by(KnowledgeIngestJob.id.desc()).limit(limit).all()
+
+
+@router.get("/jobs/{job_id}", response_model=schemas.KnowledgeIngestJobRead)
+def get_ingest_job(
+    job_id: int,
+    _: bool = Depends(verify_admin),
+    db: Session = Depends(get_db)
+):
+    """获取文档导入任务状态和进度"""
+    job = db.query(KnowledgeIngestJob).filter(KnowledgeIngestJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="导入任务不存在")
+    return job
 
 
 @router.get("/documents/{document_id}/chunks", response_model=List[schemas.KnowledgeChunkRead])
@@ -242,6 +257,7 @@ def search_knowledge(
     """搜索知识库（测试检索功能）"""
     try:
         rag_service = get_rag_service()
+        rag_service.ensure_chunk_store(db)
         search_results = rag_service.search(query, top_k=top_k, category=category)
         
         if not search_results:
@@ -287,6 +303,45 @@ def rebuild_index(
         raise HTTPException(status_code=400, detail=f"重建索引失败: {str(e)}")
 
 
+@router.get("/index/status")
+def index_status(
+    _: bool = Depends(verify_admin),
+    db: Session = Depends(get_db)
+):
+    """向量索引快照状态及与知识块表的一致性检查"""
+    try:
+        rag_service = get_rag_service()
+        report = rag_service.check_index_consistency(db)
+        store = rag_service.vector_store
+        if store is not None:
+            report.update(
+                index_type=store.index_type,
+                ntotal=store.ntotal,
+                memory_mapped=store.mapped_path is not None,
+                snapshot=store.manifest.get("index_file"),
+                snapshot_created_at=store.manifest.get("created_at"),
+            )
+        return report
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"检查索引状态失败: {str(e)}")
+
+
+@router.post("/index/embedding-parity")
+def embedding_parity(
+    samples: Optional[int] = Query(None, ge=2, le=2000, description="抽样块数，默认 RAG_EMBEDDING_PARITY_SAMPLES"),
+    _: bool = Depends(verify_admin),
+    db: Session = Depends(get_db)
+):
+    """
+    比较当前嵌入推理后端（int8 / ONNX）与 fp32 模型在知识库语料上的向量一致性
+    首次调用时加载 fp32 参考模型并保留在内存中，之后的调用直接复用；不想在服务进程中加载时用 scripts/check_embedding_parity.py 离线检查
+    """
+    try:
+        return get_rag_service().check_embedding_parity(db, sample_size=samples)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"嵌入一致性检查失败: {str(e)}")
+
+
 @router.post("/documents/from-url", response_model=schemas.KnowledgeDocumentRead, status_code=status.HTTP_201_CREATED)
 def import_from_url(
     payload: schemas.KnowledgeDocumentFromUrl,
@@ -331,7 +386,7 @@ def import_from_database(
     _: bool = Depends(verify_admin),
     db: Session = Depends(get_db)
 ):
-    """从数据库表导入数据"""
+    """从数据库表导入数据（整表合成一个文档，重复导入时替换该文档；需要按行增量同步请使用 /documents/sync-table）"""
     from ..services.document_parser import parse_from_database
     
     table_name = payload.table_name
@@ -347,6 +402,12 @@ def import_from_database(
         doc_title = payload.title or f"数据库表: {table_name}"
         
         rag_service = get_rag_service()
+        doc = db.query(KnowledgeDocument).filter(KnowledgeDocument.source_url == f"table:{table_name}").first()
+        if doc is not None:
+            doc.title = doc_title
+            doc.category = payload.category
+            doc.tags = payload.tags
+            return rag_service.replace_document_content(db, doc, content)
         doc = rag_service.add_document(
             db=db,
             title=doc_title,
@@ -361,3 +422,56 @@ def import_from_database(
         raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"从数据库导入失败: {str(e)}")
+
+
+@router.post("/documents/sync-table", response_model=schemas.KnowledgeTableSyncResult)
+def sync_table_documents(
+    payload: schemas.KnowledgeTableSync,
+    _: bool = Depends(verify_admin),
+    db: Session = Depends(get_db)
+):
+    """
+    把数据表同步到知识库：每行一个文档（按主键对应），只重新向量化上次同步后 updated 列变化且内容确实变化的行
+    首次同步和 full=true 时全表扫描，并删除表中已不存在的行对应的文档
+    """
+    from ..services.table_sync import sync_table
+    
+    try:
+        return sync_table(
+            db, get_rag_service(), payload.table_name,
+            columns=payload.columns,
+            key_column=payload.key_column,
+            updated_column=payload.updated_column,
+            title_column=payload.title_column,
+            category=payload.category,
+            tags=payload.tags,
+            full=payload.full,
+            batch_size=payload.batch_size
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"数据表同步失败: {str(e)}")
+
+
+@router.post("/products/reindex")
+def reindex_products(
+    _: bool = Depends(verify_admin),
+    db: Session = Depends(get_db)
+):
+    """商品目录向量索引与商品表对账：补建缺失或文本变化的商品向量，删除已不存在的商品向量"""
+    from ..services.product_catalog import get_product_catalog
+    
+    catalog = get_product_catalog()
+    if catalog is None:
+        raise HTTPException(status_code=503, detail="商品索引未启用或 RAG 服务尚未准备好")
+    return dict(catalog.reconcile(db), **catalog.stats())
+
+
+@router.get("/sync-sources", response_model=List[schemas.KnowledgeSyncSourceRead])
+def list_sync_sources(
+    _: bool = Depends(verify_admin),
+    db: Session = Depends(get_db)
+):
+    """已同步的数据表（配置、水位和上次同步结果）"""
+    return db.query(KnowledgeSyncSource).order_by(KnowledgeSyncSource.table_name).all()
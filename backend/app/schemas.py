@@ -378,6 +378,26 @@ class KnowledgeChunkRead(TimestampSchema):
     content: str
     chunk_metadata: Optional[str] = None  # JSON 格式的元数据（与模型属性名一致）
     vector_id: Optional[int] = None
+    duplicate_of: Optional[int] = None  # 近重复块引用的规范块ID
+    
+    class Config:
+        from_attributes = True  # 允许从 SQLAlchemy 模型属性读取
+
+
+class KnowledgeIngestJobRead(TimestampSchema):
+    id: int
+    kind: str = "file"  # file, archive
+    status: str  # pending, running, succeeded, failed
+    stage: str  # queued, parse, clean, embed, index, done
+    progress: float
+    filename: str
+    title: Optional[str] = None
+    category: Optional[str] = None
+    tags: Optional[str] = None
+    document_id: Optional[int] = None
+    result: Optional[str] = None  # JSON 格式的批量导入结果
+    error: Optional[str] = None
+    attempts: int = 0
     
     class Config:
         from_attributes = True  # 允许从 SQLAlchemy 模型属性读取
@@ -399,6 +419,49 @@ class KnowledgeDocumentFromDatabase(BaseModel):
     tags: Optional[str] = None
 
 
+class KnowledgeTableSync(BaseModel):
+    """数据表同步（每行一个文档，未传的配置沿用上次同步的配置）"""
+    table_name: str
+    columns: Optional[List[str]] = None
+    key_column: Optional[str] = None  # 默认使用表的单列主键
+    updated_column: Optional[str] = None  # 默认 updated_at；传空字符串表示每次全表比对内容
+    title_column: Optional[str] = None  # 默认依次尝试 name / title / code / question
+    category: Optional[str] = None
+    tags: Optional[str] = None
+    full: bool = False  # 全表扫描（同时删除表中已不存在的行对应的文档）
+    batch_size: Optional[int] = Field(None, ge=1, le=10000)
+
+
+class KnowledgeTableSyncResult(BaseModel):
+    table_name: str
+    mode: str  # full, incremental
+    scanned: int
+    created: int
+    updated: int
+    unchanged: int
+    deleted: int
+    failed: List[dict] = []
+    watermark: Optional[str] = None
+
+
+class KnowledgeSyncSourceRead(TimestampSchema):
+    id: int
+    table_name: str
+    key_column: str
+    updated_column: Optional[str] = None
+    title_column: Optional[str] = None
+    columns: Optional[str] = None  # JSON 格式的列名列表
+    category: Optional[str] = None
+    tags: Optional[str] = None
+    watermark_updated: Optional[str] = None
+    watermark_key: Optional[str] = None
+    last_synced_at: Optional[datetime] = None
+    last_result: Optional[str] = None  # JSON 格式的上次同步结果
+    
+    class Config:
+        from_attributes = True  # 允许从 SQLAlchemy 模型属性读取
+
+
 # 商品评价和评分
 class ReviewCreate(BaseModel):
     rating: float = Field(..., ge=1, le=5, description="评分，1-5分")
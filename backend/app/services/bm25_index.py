@@ -0,0 +1,220 @@
+"""
+BM25 倒排索引
+词项ID → 紧凑的倒排表数组（文档槽位 / 词频），支持按块增量添加和删除；
+检索时只对查询词的倒排表做 NumPy 向量化打分，耗时与查询词的倒排表长度相关，而非语料规模
+"""
+from __future__ import annotations
+
+import math
+import threading
+from collections import Counter
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+def _term_counts(tokens: Iterable[Hashable]) -> Counter:
+    """词频统计：词项可以是分词字符串或 token id，忽略空白词"""
+    return Counter(t for t in tokens if not isinstance(t, str) or (t and not t.isspace()))
+
+
+class _GrowableArray:
+    """按倍数扩容的一维 NumPy 数组"""
+
+    def __init__(self, dtype, capacity: int = 8):
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.size = 0
+
+    def append(self, value):
+        if self.size == len(self.data):
+            self.data = np.resize(self.data, max(8, len(self.data) * 2))
+        self.data[self.size] = value
+        self.size += 1
+
+    def view(self) -> np.ndarray:
+        return self.data[:self.size]
+
+    def replace(self, values: np.ndarray):
+        self.data = np.array(values, dtype=self.data.dtype)
+        self.size = len(self.data)
+
+
+class _Postings:
+    """单个词项的倒排表"""
+
+    __slots__ = ("slots", "tfs")
+
+    def __init__(self):
+        self.slots = _GrowableArray(np.int32)
+        self.tfs = _GrowableArray(np.float32)
+
+
+class InvertedIndex:
+    """
+    增量 BM25 倒排索引
+
+    文档以外部键（知识块的 vector_id）标识，词项为分词字符串或 token id；删除只做墓碑标记并更新统计量，
+    失效槽位超过一半时整体压缩倒排表
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_ids: Dict[Hashable, int] = {}
+        self._postings: List[_Postings] = []
+        self._df = _GrowableArray(np.int32)  # 词项文档频率（仅计存活文档）
+        # 按槽位存储的文档信息
+        self._slot_keys = _GrowableArray(np.int64)
+        self._doc_len = _GrowableArray(np.float32)
+        self._alive = _GrowableArray(np.bool_)
+        self._slot_terms: List[Optional[np.ndarray]] = []
+        self._key_slot: Dict[int, int] = {}
+        self._total_len = 0.0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._key_slot)
+
+    def __contains__(self, key: int) -> bool:
+        return int(key) in self._key_slot
+
+    @property
+    def vocabulary_size(self) -> int:
+        return len(self.term_ids)
+
+    def add(self, key: int, tokens: Iterable[Hashable]):
+        """添加（或替换）一个文档"""
+        key = int(key)
+        counts = _term_counts(tokens)
+        with self._lock:
+            if key in self._key_slot:
+                self._remove_locked(key)
+
+            slot = self._slot_keys.size
+            self._slot_keys.append(key)
+            length = float(sum(counts.values()))
+            self._doc_len.append(length)
+            self._alive.append(True)
+            term_list = []
+            for term, tf in counts.items():
+                term_id = self.term_ids.get(term)
+                if term_id is None:
+                    term_id = len(self._postings)
+                    self.term_ids[term] = term_id
+                    self._postings.append(_Postings())
+                    self._df.append(0)
+                postings = self._postings[term_id]
+                postings.slots.append(slot)
+                postings.tfs.append(tf)
+                self._df.data[term_id] += 1
+                term_list.append(term_id)
+            self._slot_terms.append(np.asarray(term_list, dtype=np.int32))
+            self._key_slot[key] = slot
+            self._total_len += length
+
+    def remove(self, key: int) -> bool:
+        """删除一个文档，返回是否存在"""
+        with self._lock:
+            removed = self._remove_locked(int(key))
+            if removed and self._slot_keys.size > 1024 and len(self._key_slot) * 2 < self._slot_keys.size:
+                self._compact()
+            return removed
+
+    def _remove_locked(self, key: int) -> bool:
+        slot = self._key_slot.pop(key, None)
+        if slot is None:
+            return False
+        self._alive.data[slot] = False
+        self._total_len -= float(self._doc_len.data[slot])
+        terms = self._slot_terms[slot]
+        if terms is not None and len(terms):
+            self._df.data[terms] -= 1
+        self._slot_terms[slot] = None
+        return True
+
+    def clear(self):
+        with self._lock:
+            self.__init__(self.k1, self.b)
+
+    def _compact(self):
+        """丢弃已删除文档的槽位并重新编号"""
+        alive = self._alive.view()
+        new_slot = np.full(len(alive), -1, dtype=np.int32)
+        new_slot[alive] = np.arange(int(alive.sum()), dtype=np.int32)
+
+        for postings in self._postings:
+            slots = postings.slots.view()
+            keep = alive[slots]
+            postings.slots.replace(new_slot[slots[keep]])
+            postings.tfs.replace(postings.tfs.view()[keep])
+
+        self._slot_keys.replace(self._slot_keys.view()[alive])
+        self._doc_len.replace(self._doc_len.view()[alive])
+        self._alive.replace(np.ones(int(alive.sum()), dtype=np.bool_))
+        self._slot_terms = [t for t, a in zip(self._slot_terms, alive) if a]
+        self._key_slot = {int(k): i for i, k in enumerate(self._slot_keys.view())}
+
+    def search(self, query_tokens: Iterable[Hashable], top_k: int,
+               allowed_keys: Optional[Iterable[int]] = None) -> List[Tuple[int, float]]:
+        """
+        BM25 检索
+
+        参数:
+        - query_tokens: 查询分词结果（重复的词按出现次数加权）
+        - top_k: 返回结果数量
+        - allowed_keys: 只在这些文档中检索（可选）
+
+        返回:
+        - List[(key, score)]: 按分数降序，只包含分数大于 0 的文档
+        """
+        query_counts = _term_counts(query_tokens)
+        with self._lock:
+            n_docs = len(self._key_slot)
+            if n_docs == 0 or not query_counts or top_k <= 0:
+                return []
+            avgdl = self._total_len / n_docs if self._total_len > 0 else 1.0
+            alive = self._alive.view()
+            doc_len = self._doc_len.view()
+
+            allowed_mask = None
+            if allowed_keys is not None:
+                allowed_slots = [self._key_slot[k] for k in allowed_keys if k in self._key_slot]
+                if not allowed_slots:
+                    return []
+                allowed_mask = np.zeros(len(alive), dtype=np.bool_)
+                allowed_mask[allowed_slots] = True
+
+            slot_parts = []
+            score_parts = []
+            for term, qtf in query_counts.items():
+                term_id = self.term_ids.get(term)
+                if term_id is None:
+                    continue
+                df = int(self._df.data[term_id])
+                if df <= 0:
+                    continue
+                postings = self._postings[term_id]
+                slots = postings.slots.view()
+                tfs = postings.tfs.view()
+                keep = alive[slots] if allowed_mask is None else (alive[slots] & allowed_mask[slots])
+                if not keep.any():
+                    continue
+                slots = slots[keep]
+                tfs = tfs[keep]
+                idf = math.log((n_docs - df + 0.5) / (df + 0.5) + 1.0)
+                norm = self.k1 * (1.0 - self.b + self.b * doc_len[slots] / avgdl)
+                slot_parts.append(slots)
+                score_parts.append(qtf * idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+
+            if not slot_parts:
+                return []
+            all_slots = np.concatenate(slot_parts)
+            all_scores = np.concatenate(score_parts)
+            unique_slots, inverse = np.unique(all_slots, return_inverse=True)
+            scores = np.bincount(inverse, weights=all_scores)
+
+            k = min(top_k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+            top = top[np.argsort(-scores[top], kind="stable")]
+            keys = self._slot_keys.view()[unique_slots[top]]
+            return [(int(key), float(score)) for key, score in zip(keys, scores[top]) if score > 0]
@@ -0,0 +1,131 @@
+"""
+知识库批量导入
+逐条流式读取压缩包（zip / tar / tar.gz）或目录中的文件，解析后交给 RAGService.bulk_add_documents，
+整个导入过程只做一次索引落盘和一次 BM25 写入
+"""
+from __future__ import annotations
+
+import tarfile
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from .document_parser import parse_document
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz")
+# 可导入的文件类型（与 document_parser 支持的格式一致），其他文件直接跳过
+SUPPORTED_SUFFIXES = {
+    ".pdf", ".docx", ".xlsx", ".xls", ".txt", ".md", ".csv", ".log",
+    ".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp",
+}
+
+
+def is_archive(filename: Optional[str]) -> bool:
+    """是否为支持的压缩包"""
+    return bool(filename) and filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def _importable(name: str) -> bool:
+    path = PurePosixPath(name)
+    if any(part.startswith(".") or part == "__MACOSX" for part in path.parts):
+        return False
+    return path.suffix.lower() in SUPPORTED_SUFFIXES
+
+
+def _zip_entry_name(info: zipfile.ZipInfo) -> str:
+    """Windows 下打包的 zip 文件名通常是 GBK 编码（未设置 UTF-8 标志位）"""
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode("cp437").decode("gbk")
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+def count_entries(path: Path) -> Optional[int]:
+    """可导入的文件数（zip 和目录可直接统计，tar 需完整读取，返回 None）"""
+    path = Path(path)
+    if path.is_dir():
+        return sum(1 for p in path.rglob("*") if p.is_file() and _importable(p.relative_to(path).as_posix()))
+    if path.name.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            return sum(1 for info in archive.infolist() if not info.is_dir() and _importable(_zip_entry_name(info)))
+    return None
+
+
+def iter_entries(path: Path) -> Iterator[Tuple[str, bytes]]:
+    """逐个读取压缩包或目录中的可导入文件，返回 (相对路径, 文件内容)，同一时刻只持有一个文件"""
+    path = Path(path)
+    if path.is_dir():
+        for file_path in sorted(p for p in path.rglob("*") if p.is_file()):
+            name = file_path.relative_to(path).as_posix()
+            if _importable(name):
+                yield name, file_path.read_bytes()
+    elif path.name.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                name = _zip_entry_name(info)
+                if not info.is_dir() and _importable(name):
+                    yield name, archive.read(info)
+    elif path.name.lower().endswith((".tar", ".tar.gz", ".tgz")):
+        # 流式模式：按顺序读取，不建立成员列表
+        with tarfile.open(path, mode="r|*") as archive:
+            for member in archive:
+                if not member.isfile() or not _importable(member.name):
+                    continue
+                fp = archive.extractfile(member)
+                if fp is not None:
+                    yield member.name, fp.read()
+    else:
+        raise ValueError(f"不支持的压缩包格式: {path.name}（支持 {', '.join(ARCHIVE_SUFFIXES)} 或目录）")
+
+
+def iter_documents(path: Path, category: Optional[str] = None, tags: Optional[str] = None) -> Iterator[Dict]:
+    """解析压缩包或目录中的文件，生成 bulk_add_documents 所需的文档字典（解析失败的条目带 error 字段）"""
+    for name, data in iter_entries(path):
+        item = {
+            "title": PurePosixPath(name).stem or name,
+            "source_url": name,
+            "category": category,
+            "tags": tags,
+        }
+        try:
+            parse_result = parse_document(data, filename=name)
+            content = parse_result.get("content", "")
+            if not content.strip():
+                item["error"] = f"文件内容为空或无法提取文本。解析器: {parse_result.get('metadata', {}).get('parser', 'unknown')}"
+            else:
+                item["content"] = content
+                item["source_type"] = parse_result.get("source_type", "file")
+        except Exception as e:
+            item["error"] = f"解析失败: {e}"
+        yield item
+
+
+def import_archive(db: Session, path: Path, category: Optional[str] = None, tags: Optional[str] = None,
+                   batch_docs: Optional[int] = None, embed_batch_size: Optional[int] = None,
+                   progress: Optional[Callable[[int, Optional[int]], None]] = None) -> Dict:
+    """
+    批量导入压缩包或目录
+
+    参数:
+    - progress: 进度回调 (已处理文件数, 文件总数；总数未知时为 None)
+
+    返回:
+    - Dict: bulk_add_documents 的导入结果，另含 total（文件总数）
+    """
+    from .rag_service import get_rag_service
+
+    total = count_entries(path)
+    print(f"🔄 开始批量导入: {Path(path).name}" + (f"（{total} 个文件）" if total is not None else ""))
+    summary = get_rag_service().bulk_add_documents(
+        db,
+        iter_documents(path, category=category, tags=tags),
+        batch_docs=batch_docs,
+        embed_batch_size=embed_batch_size,
+        progress=(lambda done: progress(done, total)) if progress else None,
+    )
+    summary["total"] = total if total is not None else summary["imported"] + len(summary["failed"])
+    return summary
@@ -4,7 +4,9 @@ Redis 缓存服务
 """
 import json
 import os
-from typing import Optional, Any
+import threading
+from collections import OrderedDict
+from typing import Optional, Any, Dict, Hashable
 from datetime import timedelta
 
 try:
@@ -92,6 +94,16 @@ class CacheService:
             print(f"⚠ 写入缓存失败 (key={key}): {e}")
             return False
     
+    def incr(self, key: str) -> Optional[int]:
+        """原子自增计数器，返回自增后的值"""
+        if not self.enabled or not self.redis_client:
+            return None
+        try:
+            return int(self.redis_client.incr(key))
+        except Exception as e:
+            print(f"⚠ 缓存计数器自增失败 (key={key}): {e}")
+            return None
+    
     def delete(self, *keys: str) -> int:
         """删除缓存键"""
         if not self.enabled or not self.redis_client:
@@ -191,6 +203,61 @@ class CacheService:
         self.delete(key)
 
 
+class LRUCache:
+    """
+    进程内有界 LRU 缓存（线程安全）
+    用于不适合放入 Redis 的对象（如 NumPy 向量），或 Redis 不可用时的降级缓存
+    """
+    
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max(0, int(max_size))
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        """获取缓存值（命中时移到最近使用位置）"""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+    
+    def set(self, key: Hashable, value: Any) -> bool:
+        """设置缓存值，超出容量时淘汰最久未使用的条目"""
+        if self.max_size <= 0:
+            return False
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+        return True
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+    
+    def stats(self) -> Dict:
+        """缓存统计：条目数、容量、命中率"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
 # 全局缓存服务实例
 _cache_service = None
 
@@ -0,0 +1,202 @@
+"""
+知识块内存存储
+按 vector_id 常驻内存保存块内容、所属文档、文档标题、分类和启用状态（列式数组），
+检索结果回填时直接读内存，聊天热路径不再为每个结果查询数据库
+"""
+from __future__ import annotations
+
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from ..models import KnowledgeDocument, KnowledgeChunk
+
+
+class ChunkStore:
+    """
+    列式知识块存储
+
+    块列：vector_id / chunk_id / chunk_index / 文档槽位 / 内容，删除后槽位进入空闲列表复用；
+    文档列：document_id / 标题 / 分类编码 / 启用状态，分类以整数编码存储
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        # 块列
+        self._slot_of: Dict[int, int] = {}  # vector_id -> 块槽位
+        self._chunk_ids = np.zeros(0, dtype=np.int64)
+        self._chunk_index = np.zeros(0, dtype=np.int32)
+        self._chunk_doc = np.zeros(0, dtype=np.int32)  # 块所属文档槽位，-1 表示空闲槽位
+        self._contents: List[Optional[str]] = []
+        self._free_slots: List[int] = []
+        # 文档列
+        self._doc_slot_of: Dict[int, int] = {}  # document_id -> 文档槽位
+        self._doc_ids = np.zeros(0, dtype=np.int64)
+        self._doc_titles: List[str] = []
+        self._doc_category = np.zeros(0, dtype=np.int32)  # 分类编码，-1 表示无分类
+        self._doc_active = np.zeros(0, dtype=np.bool_)
+        self._category_codes: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    # ---------- 写入 ----------
+
+    def load(self, db: Session):
+        """从数据库全量加载（首次检索和重建索引时调用）"""
+        documents = db.query(
+            KnowledgeDocument.id, KnowledgeDocument.title, KnowledgeDocument.category, KnowledgeDocument.active
+        ).all()
+        chunks = db.query(
+            KnowledgeChunk.vector_id, KnowledgeChunk.id, KnowledgeChunk.chunk_index,
+            KnowledgeChunk.document_id, KnowledgeChunk.content
+        ).filter(KnowledgeChunk.vector_id.isnot(None)).all()
+
+        with self._lock:
+            self._reset()
+            for doc_id, title, category, active in documents:
+                self._upsert_document(doc_id, title, category, active)
+            for vector_id, chunk_id, chunk_index, document_id, content in chunks:
+                doc_slot = self._doc_slot_of.get(document_id)
+                if doc_slot is not None:
+                    self._add_chunk(vector_id, chunk_id, chunk_index, doc_slot, content)
+            self.loaded = True
+        print(f"✓ 知识块内存存储已加载: {len(self._slot_of)} 个块，{len(self._doc_slot_of)} 个文档")
+
+    def _category_code(self, category: Optional[str]) -> int:
+        if not category:
+            return -1
+        code = self._category_codes.get(category)
+        if code is None:
+            code = len(self._category_codes)
+            self._category_codes[category] = code
+        return code
+
+    def _upsert_document(self, doc_id: int, title: str, category: Optional[str], active: bool) -> int:
+        slot = self._doc_slot_of.get(doc_id)
+        if slot is None:
+            slot = len(self._doc_ids)
+            self._doc_slot_of[doc_id] = slot
+            self._doc_ids = np.append(self._doc_ids, doc_id)
+            self._doc_titles.append(title)
+            self._doc_category = np.append(self._doc_category, self._category_code(category))
+            self._doc_active = np.append(self._doc_active, bool(active))
+        else:
+            self._doc_titles[slot] = title
+            self._doc_category[slot] = self._category_code(category)
+            self._doc_active[slot] = bool(active)
+        return slot
+
+    def _add_chunk(self, vector_id: int, chunk_id: int, chunk_index: int, doc_slot: int, content: str):
+        slot = self._slot_of.get(vector_id)
+        if slot is None:
+            if self._free_slots:
+                slot = self._free_slots.pop()
+            else:
+                slot = len(self._contents)
+                if slot >= len(self._chunk_ids):
+                    capacity = max(64, len(self._chunk_ids) * 2)
+                    self._chunk_ids = np.resize(self._chunk_ids, capacity)
+                    self._chunk_index = np.resize(self._chunk_index, capacity)
+                    self._chunk_doc = np.resize(self._chunk_doc, capacity)
+                self._contents.append(None)
+            self._slot_of[vector_id] = slot
+        self._chunk_ids[slot] = chunk_id
+        self._chunk_index[slot] = chunk_index
+        self._chunk_doc[slot] = doc_slot
+        self._contents[slot] = content
+
+    def add_chunks(self, doc: KnowledgeDocument, chunks: Iterable[KnowledgeChunk]):
+        """写入（或覆盖）一个文档的块，同时同步文档信息"""
+        if not self.loaded:
+            return
+        with self._lock:
+            doc_slot = self._upsert_document(doc.id, doc.title, doc.category, doc.active)
+            for chunk in chunks:
+                if chunk.vector_id is not None:
+                    self._add_chunk(chunk.vector_id, chunk.id, chunk.chunk_index, doc_slot, chunk.content)
+
+    def remove_chunks(self, vector_ids: Iterable[int]):
+        """按 vector_id 删除块"""
+        if not self.loaded:
+            return
+        with self._lock:
+            for vector_id in vector_ids:
+                slot = self._slot_of.pop(vector_id, None)
+                if slot is None:
+                    continue
+                self._chunk_doc[slot] = -1
+                self._contents[slot] = None
+                self._free_slots.append(slot)
+
+    def update_document(self, doc: KnowledgeDocument):
+        """同步文档的标题、分类、启用状态"""
+        if not self.loaded:
+            return
+        with self._lock:
+            self._upsert_document(doc.id, doc.title, doc.category, doc.active)
+
+    def remove_document(self, document_id: int, vector_ids: Iterable[int]):
+        """删除文档及其块（文档槽位仅标记为停用，避免重排数组）"""
+        if not self.loaded:
+            return
+        with self._lock:
+            self.remove_chunks(vector_ids)
+            slot = self._doc_slot_of.get(document_id)
+            if slot is not None:
+                self._doc_active[slot] = False
+
+    # ---------- 读取 ----------
+
+    def vector_ids_for_category(self, category: str) -> np.ndarray:
+        """指定分类下所有启用文档的块 vector_id（用于检索前过滤）"""
+        with self._lock:
+            code = self._category_codes.get(category)
+            if code is None or not self._slot_of:
+                return np.empty(0, dtype=np.int64)
+            doc_mask = self._doc_active & (self._doc_category == code)
+            used = len(self._contents)
+            chunk_doc = self._chunk_doc[:used]
+            slot_mask = chunk_doc >= 0
+            slot_mask[slot_mask] = doc_mask[chunk_doc[slot_mask]]
+            # 块ID即 vector_id
+            return self._chunk_ids[:used][slot_mask].copy()
+
+    def get_many(self, vector_ids: List[int], category: Optional[str] = None) -> Dict[int, Dict]:
+        """
+        批量取回块信息（只返回启用文档的块；指定分类时只返回该分类的块）
+
+        返回:
+        - Dict[vector_id, Dict]: 包含 chunk_id, document_id, document_title, chunk_index, content
+        """
+        with self._lock:
+            present = [(v, self._slot_of[v]) for v in vector_ids if v in self._slot_of]
+            if not present:
+                return {}
+            slots = np.fromiter((s for _, s in present), dtype=np.int64, count=len(present))
+            doc_slots = self._chunk_doc[slots]
+            keep = self._doc_active[doc_slots]
+            if category:
+                code = self._category_codes.get(category)
+                if code is None:
+                    return {}
+                keep &= self._doc_category[doc_slots] == code
+
+            records = {}
+            for (vector_id, slot), doc_slot, ok in zip(present, doc_slots, keep):
+                if not ok:
+                    continue
+                records[vector_id] = {
+                    "chunk_id": int(self._chunk_ids[slot]),
+                    "document_id": int(self._doc_ids[doc_slot]),
+                    "document_title": self._doc_titles[doc_slot],
+                    "chunk_index": int(self._chunk_index[slot]),
+                    "content": self._contents[slot],
+                }
+            return records
@@ -8,45 +8,20 @@ from sqlalchemy.orm import Session
 from fastapi import UploadFile, HTTPException
 import time
 from pathlib import Path
-import io
-from PIL import Image
-import pytesseract
-try:
-    import fitz  # PyMuPDF
-except ImportError:
-    fitz = None
 try:
     import requests
 except ImportError:
     requests = None
 
-try:
-    import pytesseract
-except ImportError:
-    pytesseract = None
-
-paddle_ocr = None  # PaddleOCR有依赖问题，暂时禁用
-
 from ..models import ChatMessage, Product, Order, ShippingInfo, User
 from ..utils import load_env
+from .ocr_service import get_ocr_service
+from .pdf_extractor import iter_pdf_pages
 
 
 def extract_text_from_image(image_data: bytes) -> str:
     try:
-        load_env()
-        img = Image.open(io.BytesIO(image_data))
-        if pytesseract:
-            try:
-                cmd = os.environ.get("TESSERACT_CMD")
-                if cmd:
-                    import pytesseract as _pt
-                    _pt.pytesseract.tesseract_cmd = cmd
-            except Exception:
-                pass
-            txt = pytesseract.image_to_string(img)
-            txt = (txt or "").strip()
-            return txt
-        return ""
+        return get_ocr_service().recognize(image_data, chat=True)
     except Exception:
         return ""
 
@@ -56,25 +31,10 @@ def extract_text_from_pdf(pdf_data: bytes) -> str:
         load_env()
         max_pages = int(os.environ.get("PDF_MAX_PAGES", "20"))
         max_chars = int(os.environ.get("PDF_MAX_CHARS", "20000"))
-        txt = ""
-        if fitz:
-            doc = fitz.open(stream=pdf_data, filetype="pdf")
-            n = min(getattr(doc, "page_count", len(doc)), max_pages)
-            for i in range(n):
-                try:
-                    page = doc.load_page(i)
-                    t = page.get_text() or ""
-                    if t:
-                        txt += t + "\n"
-                    if len(txt) >= max_chars:
-                        break
-                except Exception:
-                    continue
-            try:
-                doc.close()
-            except Exception:
-                pass
-        txt = (txt or "").strip()
+        # 与知识库文档解析共用逐页流式提取（PyMuPDF 优先，只取文本）
+        pages = iter_pdf_pages(pdf_data, engine="pymupdf", max_pages=max_pages, max_chars=max_chars,
+                               include_tables=False)
+        txt = "\n".join(page["text"] for page in pages if page["text"]).strip()
         if len(txt) > max_chars:
             txt = txt[:max_chars]
         return txt
@@ -326,6 +286,14 @@ def chat(user_id: int, product_id: Optional[int], text: str, db: Session, model_
     product_info = (
         f"商品：{product.name}，分类：{product.category}，价格￥{product.price:.2f}，库存{product.stock}。" if product else ""
     )
+    # 商品目录向量检索：按用户问题在全部商品中查找（如“有没有防水的运动相机”）
+    catalog_info = ""
+    if (text or "").strip():
+        try:
+            from .product_catalog import catalog_context
+            catalog_info = catalog_context(db, text, exclude_id=product.id if product else None)
+        except Exception as e:
+            print(f"⚠ 商品检索失败: {e}")
 
     # last order and logistics summary for user
     order = db.query(Order).filter(Order.user_id == user_id).order_by(Order.id.desc()).first()
@@ -342,15 +310,20 @@ def chat(user_id: int, product_id: Optional[int], text: str, db: Session, model_
     rag_similarity = 0.0
     
     try:
+        from ..services.rag_client import get_rag_client
         from ..services.rag_service import get_rag_service, is_rag_ready
 
-        # 检查 RAG 服务是否已准备好（模型已加载）
-        if not is_rag_ready():
-            print("⏳ RAG 服务尚未准备好，跳过知识库检索")
-        else:
-            rag_service = get_rag_service()
+        # 配置了独立检索服务时通过客户端检索，否则使用进程内 RAG 服务
+        rag_client = get_rag_client()
+        rag_service = None
+        if rag_client is None:
+            # 检查 RAG 服务是否已准备好（模型已加载）
+            if not is_rag_ready():
+                print("⏳ RAG 服务尚未准备好，跳过知识库检索")
+            else:
+                rag_service = get_rag_service()
 
-        if rag_service and rag_service.embedding_model:
+        if rag_client is not None or (rag_service and rag_service.embedding_model):
             # RAG完整流程：
             # 步骤1：向量化用户查询（使用与文档相同的嵌入模型）
             # 步骤2：在向量数据库中检索最相关的文档块（使用余弦相似度计算）
@@ -359,9 +332,14 @@ def chat(user_id: int, product_id: Optional[int], text: str, db: Session, model_
             similarity_threshold = float(os.environ.get("RAG_SIMILARITY_THRESHOLD", "0.2"))
             # 增加top_k以提高召回率（从3增加到5）
             top_k = int(os.environ.get("RAG_TOP_K", "5"))
-            context_text, result_details = rag_service.retrieve_context(
-                db, text, top_k=top_k, similarity_threshold=similarity_threshold
-            )
+            if rag_client is not None:
+                context_text, result_details = rag_client.retrieve_context(
+                    text, top_k=top_k, similarity_threshold=similarity_threshold
+                )
+            else:
+                context_text, result_details = rag_service.retrieve_context(
+                    db, text, top_k=top_k, similarity_threshold=similarity_threshold
+                )
             
             if context_text and result_details:
                 # 计算最高相似度
@@ -402,14 +380,14 @@ def chat(user_id: int, product_id: Optional[int], text: str, db: Session, model_
             "如果参考信息部分相关，结合参考信息和系统信息回答；"
             "如果参考信息不相关，再使用系统信息回答。"
             "回答时不要提及信息来源，直接自然地回答问题即可。"
-            + product_info + logistics_info + rag_context
+            + product_info + catalog_info + logistics_info + rag_context
         )
     else:
         # 如果没有使用知识库，使用常规提示词
         system_prompt = (
             "你是电商客服，使用简洁中文回复，支持售前/售后、物流查询、商品推荐。"
             "优先结合系统提供的信息进行回答，无法确定时要礼貌引导。"
-            + product_info + logistics_info
+            + product_info + catalog_info + logistics_info
         )
 
     # persist user message
@@ -579,17 +557,24 @@ def chat_with_upload(user_id: int, product_id: Optional[int], text: str, images:
     
     # 处理图片 - 进行OCR识别
     image_contents = []  # 存储图片OCR识别内容
+    # 首先读取全部图片内容，一次提交批量识别（已识别过的相同图片直接取缓存）
+    readable = []
     for f in images or []:
-        # 首先读取图片内容进行OCR识别
         try:
             image_data = f.file.read()
-            ocr_text = extract_text_from_image(image_data)
-            if ocr_text:
-                image_contents.append(f"图片 {f.filename} 识别内容:\n{ocr_text}")
             f.file.seek(0)  # 重置文件指针
+            readable.append((f, image_data))
         except:
             pass  # 如果无法读取图片内容，忽略
-        
+    try:
+        ocr_texts = get_ocr_service().recognize_images([image_data for _, image_data in readable], chat=True)
+    except Exception:
+        ocr_texts = []
+    for (f, _), ocr_text in zip(readable, ocr_texts):
+        if ocr_text:
+            image_contents.append(f"图片 {f.filename} 识别内容:\n{ocr_text}")
+
+    for f in images or []:
         # 然后保存图片
         url = save(f, "img")
         urls.append(("image", url))
@@ -0,0 +1,109 @@
+"""
+知识块近重复检测
+按门店、季节复制的政策页面内容几乎相同，逐块写入向量索引会让检索结果的 top-k 被重复内容占满；
+入库时对块文本的字符 shingle 计算 MinHash 签名，经 LSH 分桶召回候选块，
+再由 RAG 服务用嵌入向量余弦相似度确认，确认重复的块只记录引用、不再写入向量
+"""
+from __future__ import annotations
+
+import re
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+
+NUM_PERM = 128  # MinHash 签名长度
+BANDS = 16  # LSH 分段数（每段 8 个值），估计 Jaccard 约 0.7 以上的块才会落入同一个桶
+SHINGLE_SIZE = 5  # 字符 shingle 长度
+
+_IGNORED = re.compile(r"[\W_]+")
+_BASE = np.uint64(1000003)
+_SHIFT = np.uint64(32)
+_EMPTY_SIGNATURE_VALUE = np.iinfo(np.uint32).max
+
+
+def shingle_hashes(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """文本（小写，去掉空白和标点）的字符 shingle 哈希集合"""
+    normalized = _IGNORED.sub("", (text or "").lower())
+    if not normalized:
+        return np.empty(0, dtype=np.uint64)
+    codes = np.frombuffer(normalized.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    window = min(size, len(codes))
+    count = len(codes) - window + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    for offset in range(window):
+        hashes = hashes * _BASE + codes[offset:offset + count]
+    return np.unique(hashes)
+
+
+class DedupIndex:
+    """
+    MinHash + LSH 近重复候选索引（键为知识块ID，只收录启用文档中写入了向量的块）
+
+    非线程安全，由 RAG 服务在写锁内调用
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, bands: int = BANDS, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm 必须是 bands 的整数倍")
+        rng = np.random.default_rng(seed)
+        # 乘法移位哈希族：(a * x + b) mod 2^64 取高 32 位，a 为奇数
+        self._a = rng.integers(1, 2 ** 63, num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._signatures: Dict[int, np.ndarray] = {}
+        self._buckets: List[Dict[bytes, Set[int]]] = [defaultdict(set) for _ in range(bands)]
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._signatures
+
+    def signature(self, text: str) -> np.ndarray:
+        """文本的 MinHash 签名"""
+        hashes = shingle_hashes(text)
+        if not len(hashes):
+            return np.full(len(self._a), _EMPTY_SIGNATURE_VALUE, dtype=np.uint32)
+        return ((hashes[:, None] * self._a + self._b) >> _SHIFT).min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def add(self, key: int, signature: np.ndarray):
+        self.remove(key)
+        self._signatures[key] = signature
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            bucket[band_key].add(key)
+
+    def remove(self, key: int) -> bool:
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return False
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            members = bucket.get(band_key)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del bucket[band_key]
+        return True
+
+    def candidates(self, signature: np.ndarray, min_jaccard: float) -> List[Tuple[int, float]]:
+        """
+        与签名至少共享一个 LSH 桶、且估计 Jaccard 相似度不低于 min_jaccard 的块
+
+        返回:
+        - [(块ID, 估计 Jaccard)]，按相似度从高到低排序
+        """
+        keys = set()
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            keys.update(bucket.get(band_key, ()))
+        if not keys:
+            return []
+        keys = list(keys)
+        similarity = (np.vstack([self._signatures[k] for k in keys]) == signature).mean(axis=1)
+        return sorted(
+            ((key, float(score)) for key, score in zip(keys, similarity) if score >= min_jaccard),
+            key=lambda item: (-item[1], item[0])
+        )
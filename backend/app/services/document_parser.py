@@ -6,25 +6,14 @@ from __future__ import annotations
 
 import os
 import io
-from typing import Optional, Dict, Any
+import codecs
+from typing import Optional, Dict, Any, Iterator, Union
 from pathlib import Path
 
 from ..utils import load_env
 
-# PDF 解析
-try:
-    import pdfplumber
-    PDFPLUMBER_AVAILABLE = True
-except ImportError:
-    PDFPLUMBER_AVAILABLE = False
-    pdfplumber = None
-
-try:
-    import fitz  # PyMuPDF (备用)
-    PYMUPDF_AVAILABLE = True
-except ImportError:
-    PYMUPDF_AVAILABLE = False
-    fitz = None
+# PDF 解析（pdfplumber 优先，PyMuPDF 备用）
+from .pdf_extractor import PDFPLUMBER_AVAILABLE, available_engine, iter_pdf_pages
 
 # Word 文档解析
 try:
@@ -34,13 +23,8 @@ except ImportError:
     PYTHON_DOCX_AVAILABLE = False
     Document = None
 
-# Excel 解析
-try:
-    import pandas as pd
-    PANDAS_AVAILABLE = True
-except ImportError:
-    PANDAS_AVAILABLE = False
-    pd = None
+# Excel 解析（openpyxl 只读模式逐行读取，.xls 用 xlrd）
+from .spreadsheet_reader import OPENPYXL_AVAILABLE, XLRD_AVAILABLE, iter_sheet_rows, spreadsheet_kind
 
 # 网页提取
 try:
@@ -50,106 +34,82 @@ except ImportError:
     TRAFILATURA_AVAILABLE = False
     trafilatura = None
 
-# 图片 OCR
-try:
-    from paddleocr import PaddleOCR
-    PADDLEOCR_AVAILABLE = True
-except ImportError:
-    PADDLEOCR_AVAILABLE = False
-    PaddleOCR = None
+# 图片 OCR（PaddleOCR 优先，pytesseract 备用）
+from .ocr_service import get_ocr_service
 
-# 备用 OCR (pytesseract)
-try:
-    from PIL import Image
-    import pytesseract
-    PYTESSERACT_AVAILABLE = True
-except ImportError:
-    PYTESSERACT_AVAILABLE = False
-    pytesseract = None
-    Image = None
+
+def _format_pdf_page(page: Dict) -> str:
+    """把 pdf_extractor 产出的一页（文本和表格）转为带页码标记的文本"""
+    i = page["page"]
+    text_parts = []
+    if page["text"]:
+        text_parts.append(f"=== 第 {i} 页 ===\n{page['text']}\n")
+    
+    # 表格内容
+    for table_idx, table in enumerate(page["tables"]):
+        table_text = "表格内容：\n"
+        for row in table:
+            if row:
+                # 过滤 None 值
+                row_text = " | ".join([str(cell) if cell else "" for cell in row])
+                table_text += row_text + "\n"
+        text_parts.append(f"=== 第 {i} 页 表格 {table_idx+1} ===\n{table_text}\n")
+    return "".join(text_parts)
 
 
 def parse_pdf(file_data: bytes, filename: Optional[str] = None) -> str:
     """
     解析 PDF 文件（使用 pdfplumber，可保留表格）
-    如果 pdfplumber 不可用，回退到 PyMuPDF
+    如果 pdfplumber 不可用或解析失败，回退到 PyMuPDF；页面由 pdf_extractor 逐页流式提取（大文件可多进程并行）
+    结果是一个字符串，受 PDF_MAX_PAGES / PDF_MAX_CHARS 限制，超出部分截断并打印警告；
+    知识库导入不走这里，用 iter_pdf_text 逐页流式导入全文
     """
     load_env()
     max_pages = int(os.environ.get("PDF_MAX_PAGES", "50"))
     max_chars = int(os.environ.get("PDF_MAX_CHARS", "50000"))
     
-    text_parts = []
-    
-    # 优先使用 pdfplumber（可保留表格）
-    if PDFPLUMBER_AVAILABLE:
+    for engine in ("pdfplumber", "pymupdf"):
+        if available_engine(engine) != engine:
+            continue
+        text_parts = []
+        length = 0  # 已提取内容的累计字符数（不再每页重新拼接全文）
+        pages = 0
         try:
-            pdf_file = io.BytesIO(file_data)
-            with pdfplumber.open(pdf_file) as pdf:
-                total_pages = min(len(pdf.pages), max_pages)
-                
-                for i in range(total_pages):
-                    page = pdf.pages[i]
-                    
-                    # 提取文本
-                    page_text = page.extract_text() or ""
-                    if page_text:
-                        text_parts.append(f"=== 第 {i+1} 页 ===\n{page_text}\n")
-                    
-                    # 提取表格
-                    tables = page.extract_tables()
-                    if tables:
-                        for table_idx, table in enumerate(tables):
-                            if table:
-                                table_text = "表格内容：\n"
-                                for row in table:
-                                    if row:
-                                        # 过滤 None 值
-                                        row_text = " | ".join([str(cell) if cell else "" for cell in row])
-                                        table_text += row_text + "\n"
-                                text_parts.append(f"=== 第 {i+1} 页 表格 {table_idx+1} ===\n{table_text}\n")
-                    
-                    # 检查字符限制
-                    current_text = "".join(text_parts)
-                    if len(current_text) >= max_chars:
-                        break
+            for page in iter_pdf_pages(file_data, engine=engine, max_pages=max_pages, max_chars=max_chars):
+                text_parts.append(_format_pdf_page(page))
+                length += len(text_parts[-1])
+                pages = page["page"]
                 
-                result = "".join(text_parts)
-                if len(result) > max_chars:
-                    result = result[:max_chars]
-                return result.strip()
-        except Exception as e:
-            print(f"⚠ pdfplumber 解析失败: {e}")
-    
-    # 回退到 PyMuPDF
-    if PYMUPDF_AVAILABLE:
-        try:
-            doc = fitz.open(stream=file_data, filetype="pdf")
-            n = min(getattr(doc, "page_count", len(doc)), max_pages)
-            for i in range(n):
-                try:
-                    page = doc.load_page(i)
-                    t = page.get_text() or ""
-                    if t:
-                        text_parts.append(f"=== 第 {i+1} 页 ===\n{t}\n")
-                    if len("".join(text_parts)) >= max_chars:
-                        break
-                except Exception:
-                    continue
-            try:
-                doc.close()
-            except Exception:
-                pass
+                # 检查字符限制
+                if length >= max_chars:
+                    break
             
             result = "".join(text_parts)
             if len(result) > max_chars:
                 result = result[:max_chars]
+                print(f"⚠ PDF 内容超过 PDF_MAX_CHARS={max_chars}，已截断（{filename or '未命名'}，解析到第 {pages} 页）")
+            elif pages >= max_pages:
+                print(f"⚠ PDF 只解析了前 PDF_MAX_PAGES={max_pages} 页，后续页面已忽略（{filename or '未命名'}）")
             return result.strip()
         except Exception as e:
-            print(f"⚠ PyMuPDF 解析失败: {e}")
+            print(f"⚠ {engine} 解析失败: {e}")
     
     return ""
 
 
+def iter_pdf_text(file_data: bytes) -> Iterator[str]:
+    """
+    逐页产出 PDF 文本（格式与 parse_pdf 相同），不受 PDF_MAX_PAGES / PDF_MAX_CHARS 限制，
+    供 RAGService.add_document_stream 流式导入整本手册；没有可用的解析库时抛出 ValueError
+    """
+    if available_engine() is None:
+        raise ValueError("PDF 解析库不可用（需要 pdfplumber 或 PyMuPDF）")
+    for page in iter_pdf_pages(file_data):
+        text = _format_pdf_page(page)
+        if text:
+            yield text
+
+
 def parse_word(file_data: bytes, filename: Optional[str] = None) -> str:
     """解析 Word 文档 (.docx)"""
     if not PYTHON_DOCX_AVAILABLE:
@@ -181,42 +141,27 @@ def parse_word(file_data: bytes, filename: Optional[str] = None) -> str:
 
 
 def parse_excel(file_data: bytes, filename: Optional[str] = None) -> str:
-    """解析 Excel 文档 (.xlsx, .xls)"""
-    if not PANDAS_AVAILABLE:
-        return ""
-    
-    try:
-        excel_file = io.BytesIO(file_data)
-        
-        # 尝试读取所有工作表
-        excel_data = pd.read_excel(excel_file, sheet_name=None, engine='openpyxl')
-        
-        text_parts = []
-        
-        for sheet_name, df in excel_data.items():
-            text_parts.append(f"=== 工作表: {sheet_name} ===\n")
-            
-            # 转换为文本格式（保留表格结构）
-            # 使用制表符分隔，便于阅读
-            text_parts.append(df.to_string(index=False))
-            text_parts.append("\n\n")
-        
-        return "\n".join(text_parts).strip()
-    except Exception as e:
-        print(f"⚠ Excel 文档解析失败: {e}")
-        # 尝试使用 xlrd 引擎（.xls 格式）
+    """
+    解析 Excel 文档 (.xlsx, .xls)
+    逐行读取（不载入 DataFrame），每个工作表输出为表格行；知识库导入大表格时走 RAGService.add_table_stream
+    """
+    # 扩展名对应的格式优先，失败时尝试另一种（扩展名与实际格式不符的文件）
+    kinds = ["xls", "xlsx"] if spreadsheet_kind(filename) == "xls" else ["xlsx", "xls"]
+    for kind in kinds:
+        if (kind == "xlsx" and not OPENPYXL_AVAILABLE) or (kind == "xls" and not XLRD_AVAILABLE):
+            continue
         try:
-            excel_file = io.BytesIO(file_data)
-            excel_data = pd.read_excel(excel_file, sheet_name=None, engine='xlrd')
             text_parts = []
-            for sheet_name, df in excel_data.items():
-                text_parts.append(f"=== 工作表: {sheet_name} ===\n")
-                text_parts.append(df.to_string(index=False))
-                text_parts.append("\n\n")
+            sheet = None
+            for sheet_name, cells in iter_sheet_rows(file_data, filename=f"sheet.{kind}"):
+                if sheet_name != sheet:
+                    sheet = sheet_name
+                    text_parts.append(f"\n=== 工作表: {sheet_name} ===")
+                text_parts.append("| " + " | ".join(cells) + " |")
             return "\n".join(text_parts).strip()
-        except Exception as e2:
-            print(f"⚠ Excel 文档解析失败（xlrd）: {e2}")
-            return ""
+        except Exception as e:
+            print(f"⚠ Excel 文档解析失败（{kind}）: {e}")
+    return ""
 
 
 def parse_webpage(url: str) -> str:
@@ -238,47 +183,14 @@ def parse_webpage(url: str) -> str:
 
 def parse_image(file_data: bytes, filename: Optional[str] = None) -> str:
     """
-    解析图片文件（使用 PaddleOCR，回退到 pytesseract）
+    解析图片文件（使用 PaddleOCR，识别失败或结果为空时逐张回退到 pytesseract；首选引擎由 OCR_ENGINE 指定）
+    识别在 OCR 服务的进程池中进行，模型只加载一次，相同图片直接返回缓存结果
     """
-    load_env()
-    
-    # 优先使用 PaddleOCR
-    if PADDLEOCR_AVAILABLE:
-        try:
-            ocr = PaddleOCR(use_angle_cls=True, lang='ch')
-            result = ocr.ocr(file_data, cls=True)
-            
-            text_parts = []
-            if result and result[0]:
-                for line in result[0]:
-                    if line and len(line) >= 2:
-                        text_info = line[1]
-                        if text_info and len(text_info) >= 2:
-                            text_parts.append(text_info[0])
-            
-            return "\n".join(text_parts).strip()
-        except Exception as e:
-            print(f"⚠ PaddleOCR 解析失败: {e}")
-    
-    # 回退到 pytesseract
-    if PYTESSERACT_AVAILABLE and Image:
-        try:
-            img = Image.open(io.BytesIO(file_data))
-            
-            # 设置 Tesseract 命令路径（如果配置了）
-            try:
-                cmd = os.environ.get("TESSERACT_CMD")
-                if cmd:
-                    pytesseract.pytesseract.tesseract_cmd = cmd
-            except Exception:
-                pass
-            
-            txt = pytesseract.image_to_string(img, lang='chi_sim+eng')
-            return txt.strip()
-        except Exception as e:
-            print(f"⚠ pytesseract 解析失败: {e}")
-    
-    return ""
+    try:
+        return get_ocr_service().recognize(file_data, lang='chi_sim+eng')
+    except Exception as e:
+        print(f"⚠ 图片 OCR 解析失败: {e}")
+        return ""
 
 
 def parse_txt(file_data: bytes, filename: Optional[str] = None) -> str:
@@ -299,6 +211,53 @@ def parse_txt(file_data: bytes, filename: Optional[str] = None) -> str:
         return ""
 
 
+def _text_file_encoding(path: Path, block_size: int = 1 << 20) -> str:
+    """逐块校验是否为 UTF-8（不把文件整体读入内存），不是时按 GBK 读取（与 parse_txt 的回退顺序相同）"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    with open(path, 'rb') as f:
+        try:
+            while True:
+                block = f.read(block_size)
+                decoder.decode(block, final=not block)
+                if not block:
+                    return 'utf-8'
+        except UnicodeDecodeError:
+            return 'gbk'
+
+
+def iter_text_file(path: Union[str, Path], block_chars: int = 65536) -> Iterator[str]:
+    """
+    逐段读取文本文件：按行攒够约 block_chars 个字符产出一段（段落在行边界处切开），
+    供 RAGService.add_document_stream 流式导入，不把整个文件读成一个字符串
+    """
+    path = Path(path)
+    encoding = _text_file_encoding(path)
+    with open(path, encoding=encoding, errors='ignore') as f:
+        lines = []
+        size = 0
+        for line in f:
+            lines.append(line)
+            size += len(line)
+            if size >= block_chars:
+                yield "".join(lines)
+                lines = []
+                size = 0
+        if lines:
+            yield "".join(lines)
+
+
+def stream_kind(filename: Optional[str] = None, file_type: Optional[str] = None) -> Optional[str]:
+    """可以逐页/逐段流式导入的文件类型：'pdf' / 'text'，其他类型返回 None（判断规则与 parse_document 相同）"""
+    ext = Path(filename).suffix.lower() if filename else ""
+    if ext in ('.pdf',) or file_type == 'application/pdf':
+        return "pdf"
+    if ext in ('.docx', '.xlsx', '.xls', '.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp'):
+        return None
+    if ext in ('.txt', '.md', '.csv', '.log') or (file_type and 'text/' in file_type):
+        return "text"
+    return None
+
+
 def parse_document(file_data: bytes, filename: Optional[str] = None, file_type: Optional[str] = None) -> Dict[str, Any]:
     """
     通用文档解析函数
@@ -336,7 +295,7 @@ def parse_document(file_data: bytes, filename: Optional[str] = None, file_type:
     elif ext in ('.xlsx', '.xls') or file_type in ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'application/vnd.ms-excel'):
         content = parse_excel(file_data, filename)
         source_type = "excel"
-        metadata["parser"] = "pandas"
+        metadata["parser"] = "xlrd" if spreadsheet_kind(filename) == "xls" else "openpyxl"
     
     elif ext in ('.txt', '.md', '.csv', '.log') or (file_type and 'text/' in file_type):
         content = parse_txt(file_data, filename)
@@ -346,7 +305,7 @@ def parse_document(file_data: bytes, filename: Optional[str] = None, file_type:
     elif ext in ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp') or (file_type and file_type.startswith('image/')):
         content = parse_image(file_data, filename)
         source_type = "image"
-        metadata["parser"] = "paddleocr" if PADDLEOCR_AVAILABLE else "pytesseract"
+        metadata["parser"] = get_ocr_service().engine or "none"
     
     else:
         # 未知类型，尝试作为文本处理
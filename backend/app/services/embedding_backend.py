@@ -0,0 +1,165 @@
+"""
+嵌入模型 CPU 推理后端
+RAG_EMBEDDING_BACKEND 选择推理方式，返回的模型对象都提供与 SentenceTransformer 相同的 encode 接口：
+- torch: PyTorch fp32 推理（默认）
+- int8: 对 Linear 层做 PyTorch 动态 int8 量化
+- onnx: ONNX Runtime 推理（sentence-transformers >= 3.2，需要可选依赖 optimum[onnxruntime]，未安装时回退到 torch）
+- onnx-int8: 动态 int8 量化的 ONNX 模型，首次使用时导出到 RAG_EMBEDDING_ONNX_DIR
+量化模型的向量与 fp32 向量有细微差异，check_parity 在知识库语料上比较两者的余弦一致性
+"""
+from __future__ import annotations
+
+import importlib.util
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..models import KnowledgeChunk
+
+try:
+    from sentence_transformers import SentenceTransformer
+    SENTENCE_TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    SENTENCE_TRANSFORMERS_AVAILABLE = False
+    SentenceTransformer = None
+
+try:
+    import torch
+    TORCH_AVAILABLE = True
+except ImportError:
+    TORCH_AVAILABLE = False
+    torch = None
+
+# onnx / onnx-int8 后端的可选依赖（只检查是否安装，加载模型时才导入）
+ONNX_RUNTIME_AVAILABLE = all(importlib.util.find_spec(name) is not None for name in ("onnxruntime", "optimum"))
+
+BACKENDS = ("torch", "int8", "onnx", "onnx-int8")
+DEFAULT_BACKEND = "torch"
+
+
+def get_backend_name() -> str:
+    """当前配置的推理后端（未知取值时回退为 torch）"""
+    backend = os.environ.get("RAG_EMBEDDING_BACKEND", DEFAULT_BACKEND).strip().lower()
+    if backend not in BACKENDS:
+        print(f"⚠ 未知的嵌入推理后端 {backend}，使用 {DEFAULT_BACKEND}（可选: {', '.join(BACKENDS)}）")
+        return DEFAULT_BACKEND
+    return backend
+
+
+def _onnx_export_dir(model_name: str) -> Path:
+    """量化 ONNX 模型的导出目录（每个模型一个子目录）"""
+    base = os.environ.get("RAG_EMBEDDING_ONNX_DIR")
+    root = Path(base) if base else Path(__file__).resolve().parent.parent.parent / "embedding_models"
+    return root / model_name.replace("/", "__")
+
+
+def _load_onnx_int8(model_name: str):
+    """加载动态量化的 ONNX 模型；本地没有时先导出 ONNX 再量化（只需一次）"""
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    config = os.environ.get("RAG_EMBEDDING_ONNX_QUANTIZATION", "avx2").lower()  # arm64 / avx2 / avx512 / avx512_vnni
+    export_dir = _onnx_export_dir(model_name)
+    file_name = f"onnx/model_qint8_{config}.onnx"
+    if not (export_dir / file_name).exists():
+        print(f"🔄 导出 int8 量化 ONNX 模型: {model_name} → {export_dir}")
+        model = SentenceTransformer(model_name, device="cpu", backend="onnx")
+        model.save_pretrained(str(export_dir))
+        export_dynamic_quantized_onnx_model(model, config, str(export_dir), file_suffix=f"qint8_{config}")
+    return SentenceTransformer(str(export_dir), device="cpu", backend="onnx", model_kwargs={"file_name": file_name})
+
+
+def load_embedding_model(model_name: str, backend: Optional[str] = None):
+    """
+    按推理后端加载嵌入模型
+
+    参数:
+    - model_name: 模型名称或本地路径
+    - backend: 推理后端（默认读取 RAG_EMBEDDING_BACKEND）
+    """
+    if not SENTENCE_TRANSFORMERS_AVAILABLE:
+        raise RuntimeError("sentence-transformers 未安装")
+    backend = backend or get_backend_name()
+
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+    if backend == "int8":
+        if not TORCH_AVAILABLE:
+            raise RuntimeError("int8 量化需要 PyTorch")
+        model = SentenceTransformer(model_name, device="cpu")
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if backend in ("onnx", "onnx-int8") and not ONNX_RUNTIME_AVAILABLE:
+        raise RuntimeError(f"{backend} 后端需要安装 optimum[onnxruntime]（pip install \"optimum[onnxruntime]\"）")
+    if backend == "onnx":
+        # 可用 RAG_EMBEDDING_ONNX_FILE 指定模型仓库中已导出的文件，如 onnx/model_qint8_avx512_vnni.onnx
+        file_name = os.environ.get("RAG_EMBEDDING_ONNX_FILE")
+        model_kwargs = {"file_name": file_name} if file_name else None
+        return SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+    if backend == "onnx-int8":
+        return _load_onnx_int8(model_name)
+    raise ValueError(f"不支持的嵌入推理后端: {backend}")
+
+
+def sample_corpus_texts(db: Session, sample_size: Optional[int] = None) -> List[str]:
+    """从知识库随机抽取文本块作为一致性检查语料（默认 RAG_EMBEDDING_PARITY_SAMPLES=200）"""
+    sample_size = sample_size or int(os.environ.get("RAG_EMBEDDING_PARITY_SAMPLES", "200"))
+    rows = db.query(KnowledgeChunk.content).order_by(func.random()).limit(sample_size).all()
+    return [content for (content,) in rows if content]
+
+
+def _timed_encode(model, texts: List[str], batch_size: int):
+    start = time.perf_counter()
+    embeddings = model.encode(texts, batch_size=batch_size, normalize_embeddings=True, show_progress_bar=False)
+    return np.asarray(embeddings, dtype="float32"), time.perf_counter() - start
+
+
+def check_parity(model, reference, texts: List[str], min_cosine: Optional[float] = None,
+                 batch_size: int = 32) -> Dict:
+    """
+    比较候选模型与 fp32 参考模型在同一批文本上的向量一致性
+
+    参数:
+    - model: 候选模型（量化 / ONNX 后端）
+    - reference: fp32 参考模型
+    - texts: 语料样本（通常取知识库中的文本块）
+    - min_cosine: 平均余弦相似度阈值（默认 RAG_EMBEDDING_PARITY_MIN_COSINE=0.99）
+
+    返回:
+    - Dict: samples, mean_cosine, min_cosine, neighbor_agreement（样本间最近邻一致的比例）,
+            model_seconds, reference_seconds, speedup, passed
+    """
+    if min_cosine is None:
+        min_cosine = float(os.environ.get("RAG_EMBEDDING_PARITY_MIN_COSINE", "0.99"))
+    texts = [t for t in texts if t and t.strip()]
+    if not texts:
+        return {"samples": 0, "passed": True}
+
+    candidate, model_seconds = _timed_encode(model, texts, batch_size)
+    expected, reference_seconds = _timed_encode(reference, texts, batch_size)
+    cosines = np.sum(candidate * expected, axis=1)
+
+    # 检索排序是否一致：每个样本在其他样本中的最近邻
+    agreement = 1.0
+    if len(texts) > 1:
+        sim_candidate = candidate @ candidate.T
+        sim_expected = expected @ expected.T
+        np.fill_diagonal(sim_candidate, -np.inf)
+        np.fill_diagonal(sim_expected, -np.inf)
+        agreement = float(np.mean(sim_candidate.argmax(axis=1) == sim_expected.argmax(axis=1)))
+
+    mean_cosine = float(cosines.mean())
+    return {
+        "samples": len(texts),
+        "mean_cosine": round(mean_cosine, 6),
+        "min_cosine": round(float(cosines.min()), 6),
+        "neighbor_agreement": round(agreement, 4),
+        "model_seconds": round(model_seconds, 3),
+        "reference_seconds": round(reference_seconds, 3),
+        "speedup": round(reference_seconds / model_seconds, 2) if model_seconds > 0 else None,
+        "threshold": min_cosine,
+        "passed": mean_cosine >= min_cosine,
+    }
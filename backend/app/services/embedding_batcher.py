@@ -0,0 +1,109 @@
+"""
+查询向量微批处理
+并发聊天请求各自对单条查询做 batch=1 的模型推理，多个线程争抢 CPU 核心；
+微批处理器把几毫秒内到达的查询合并成一次 encode 调用，再把结果分发回各个请求
+"""
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+
+class EmbeddingBatcher:
+    """
+    合并并发的单条查询向量化请求
+
+    参数:
+    - encode: 批量编码函数，输入文本列表，返回 (n, dim) 向量矩阵
+    - max_batch_size: 单次推理的最大文本数
+    - max_wait_ms: 收到第一条请求后等待更多请求的最长时间（毫秒）
+    """
+
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0):
+        self.encode = encode
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._stopped = False
+        self.batches = 0
+        self.requests = 0
+        self.max_observed_batch = 0
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        """提交一条文本，返回结果为向量的 Future"""
+        future: Future = Future()
+        if self._stopped:
+            future.set_exception(RuntimeError("嵌入微批处理器已停止"))
+            return future
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text: str, timeout: Optional[float] = None) -> np.ndarray:
+        """同步获取单条文本的向量（与其他线程的请求合并推理）"""
+        return self.submit(text).result(timeout=timeout)
+
+    def _collect(self, first: tuple) -> List[tuple]:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # 停止信号放回队列，本批处理完后退出
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = self._collect(first)
+            # 同一批中的重复查询只推理一次
+            positions: Dict[str, int] = {}
+            for text, _ in batch:
+                positions.setdefault(text, len(positions))
+            try:
+                vectors = np.asarray(self.encode(list(positions)), dtype="float32")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for text, future in batch:
+                future.set_result(vectors[positions[text]])
+            with self._lock:
+                self.batches += 1
+                self.requests += len(batch)
+                self.max_observed_batch = max(self.max_observed_batch, len(batch))
+
+    def stats(self) -> Dict:
+        """批处理统计：batches（推理次数）、requests（请求数）、avg_batch_size"""
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "requests": self.requests,
+                "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+                "max_batch_size": self.max_observed_batch,
+                "max_batch_size_limit": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+            }
+
+    def shutdown(self, timeout: Optional[float] = None):
+        """停止后台线程（队列中已提交的请求会先处理完）"""
+        self._stopped = True
+        self._queue.put(None)
+        self._worker.join(timeout)
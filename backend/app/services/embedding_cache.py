@@ -0,0 +1,273 @@
+"""
+嵌入向量持久化缓存
+按 sha256(模型名 + 文本) 缓存文本块的向量，向量存放在内存映射的 float32 矩阵中，
+重建索引或重复上传相同内容时直接复用，跳过嵌入模型推理
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ..utils import load_env
+
+try:
+    import fcntl  # 跨进程文件锁（Windows 上没有）
+except ImportError:
+    fcntl = None
+
+DIGEST_SIZE = 32  # sha256 摘要字节数
+
+
+def _text_digest(text: str, model_name: str) -> bytes:
+    h = hashlib.sha256()
+    h.update((model_name or "").encode("utf-8"))
+    h.update(b"\x00")
+    h.update((text or "").encode("utf-8"))
+    return h.digest()
+
+
+class _VectorFile:
+    """
+    单一维度的向量文件：<dim>.f32 存储向量矩阵，<dim>.keys 按行顺序追加摘要
+
+    多个进程（多个 uvicorn worker、检索服务、批量导入脚本）可能同时打开同一缓存目录：
+    追加时对 .keys 加排他文件锁，并在锁内按 .keys 的实际长度确定下一行，补上其他进程追加的行后再写入
+    """
+
+    def __init__(self, cache_dir: Path, dim: int):
+        self.dim = dim
+        self.vectors_path = cache_dir / f"embeddings_{dim}.f32"
+        self.keys_path = cache_dir / f"embeddings_{dim}.keys"
+        self.rows: Dict[bytes, int] = {}
+        self.count = 0  # 已读入的行数（.keys 中有对应向量的完整摘要数）
+        self.matrix: Optional[np.memmap] = None
+        self.capacity = 0
+        self._keys_fp = None
+        self._load()
+
+    @contextmanager
+    def _locked(self, exclusive: bool = True):
+        """.keys 文件锁（跨进程）；没有 fcntl 的平台（Windows）只有进程内的锁"""
+        if fcntl is not None:
+            fcntl.flock(self._keys_fp.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._keys_fp.fileno(), fcntl.LOCK_UN)
+
+    def _load(self):
+        self._keys_fp = open(self.keys_path, "a+b")
+        with self._locked():
+            self._sync(repair=True)
+            if self.capacity < 1024:
+                self._open(1024)
+
+    def _sync(self, repair: bool = False):
+        """
+        读入其他进程追加的摘要（调用方持有文件锁）
+        写入中断时尾部可能留下不完整的摘要或没有对应向量的摘要：跳过；repair（持有排他锁）时截断 .keys，
+        之后追加的摘要与向量行重新对齐
+        """
+        disk_rows = self.vectors_path.stat().st_size // (self.dim * 4) if self.vectors_path.exists() else 0
+        keys_size = os.fstat(self._keys_fp.fileno()).st_size
+        valid = min(keys_size // DIGEST_SIZE, disk_rows)
+        if valid < self.count:
+            # 缓存文件被其他进程清空或截短：重新读入
+            self.rows, self.count = {}, 0
+        if valid > self.count:
+            self._keys_fp.seek(self.count * DIGEST_SIZE)
+            data = self._keys_fp.read((valid - self.count) * DIGEST_SIZE)
+            for offset in range(0, len(data), DIGEST_SIZE):
+                self.rows.setdefault(data[offset:offset + DIGEST_SIZE], self.count + offset // DIGEST_SIZE)
+            self.count = valid
+        if repair and keys_size != valid * DIGEST_SIZE:
+            self._keys_fp.truncate(valid * DIGEST_SIZE)
+        if disk_rows > self.capacity:
+            self._open(disk_rows)
+
+    def _open(self, capacity: int):
+        row_bytes = self.dim * 4
+        if self.matrix is not None:
+            self.matrix.flush()
+            self.matrix = None
+        with open(self.vectors_path, "ab") as fp:
+            size = fp.tell()
+            if size < capacity * row_bytes:
+                fp.truncate(capacity * row_bytes)
+        self.capacity = capacity
+        self.matrix = np.memmap(self.vectors_path, dtype="float32", mode="r+", shape=(capacity, self.dim))
+
+    @property
+    def size(self) -> int:
+        return self.count
+
+    def refresh(self):
+        """.keys 比已读入的长时（其他进程追加了向量）读入新增的行"""
+        if os.fstat(self._keys_fp.fileno()).st_size >= (self.count + 1) * DIGEST_SIZE:
+            with self._locked(exclusive=False):
+                self._sync()
+
+    def get(self, digest: bytes) -> Optional[np.ndarray]:
+        row = self.rows.get(digest)
+        if row is None:
+            return None
+        return np.array(self.matrix[row])
+
+    def append(self, digests: List[bytes], vectors: np.ndarray) -> int:
+        """追加向量和摘要（其他进程已写入的摘要跳过），返回实际写入的行数"""
+        with self._locked():
+            self._sync(repair=True)
+            keep = [i for i, digest in enumerate(digests) if digest not in self.rows]
+            if not keep:
+                return 0
+            digests = [digests[i] for i in keep]
+            start = self.count
+            needed = start + len(digests)
+            if needed > self.capacity:
+                self._open(max(needed, self.capacity * 2))
+            self.matrix[start:needed] = vectors[keep]
+            self.matrix.flush()
+            # 先落盘向量再追加摘要，保证每个摘要都有对应的向量
+            self._keys_fp.write(b"".join(digests))
+            self._keys_fp.flush()
+            for offset, digest in enumerate(digests):
+                self.rows[digest] = start + offset
+            self.count = needed
+        return len(digests)
+
+    def close(self):
+        if self.matrix is not None:
+            self.matrix.flush()
+            self.matrix = None
+        if self._keys_fp is not None:
+            self._keys_fp.close()
+            self._keys_fp = None
+
+
+class EmbeddingCache:
+    """嵌入向量持久化缓存（多个进程可以共用同一缓存目录，追加时由文件锁串行化）"""
+
+    def __init__(self, cache_dir: Optional[Path] = None):
+        load_env()
+        self.enabled = os.environ.get("RAG_EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+        self.max_rows = int(os.environ.get("RAG_EMBEDDING_CACHE_MAX_ROWS", "500000"))
+        default_dir = Path(__file__).resolve().parent.parent.parent / "embedding_cache"
+        self.cache_dir = Path(cache_dir or os.environ.get("RAG_EMBEDDING_CACHE_DIR") or default_dir)
+        self.hits = 0
+        self.misses = 0
+        self._files: Dict[int, _VectorFile] = {}
+        self._lock = threading.Lock()
+
+    def _file(self, dim: int) -> _VectorFile:
+        vector_file = self._files.get(dim)
+        if vector_file is None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            vector_file = _VectorFile(self.cache_dir, dim)
+            self._files[dim] = vector_file
+        return vector_file
+
+    def lookup(self, texts: List[str], model_name: str, dim: int) -> Tuple[Dict[int, np.ndarray], List[int]]:
+        """
+        查询缓存
+
+        返回:
+        - (命中的 {文本下标: 向量}, 未命中的文本下标列表)
+        """
+        if not self.enabled or not model_name:
+            return {}, list(range(len(texts)))
+
+        found: Dict[int, np.ndarray] = {}
+        missing: List[int] = []
+        try:
+            with self._lock:
+                vector_file = self._file(dim)
+                vector_file.refresh()
+                for i, text in enumerate(texts):
+                    vector = vector_file.get(_text_digest(text, model_name))
+                    if vector is None:
+                        missing.append(i)
+                    else:
+                        found[i] = vector
+                self.hits += len(found)
+                self.misses += len(missing)
+        except Exception as e:
+            print(f"⚠ 读取嵌入缓存失败: {e}")
+            return {}, list(range(len(texts)))
+        return found, missing
+
+    def store(self, texts: List[str], model_name: str, embeddings: np.ndarray):
+        """写入缓存（已存在的文本跳过，超过容量上限后不再写入）"""
+        if not self.enabled or not model_name or embeddings is None or len(texts) == 0:
+            return
+        try:
+            with self._lock:
+                vector_file = self._file(int(embeddings.shape[1]))
+                digests: List[bytes] = []
+                rows: List[int] = []
+                seen = set()
+                for i, text in enumerate(texts):
+                    digest = _text_digest(text, model_name)
+                    if digest in vector_file.rows or digest in seen:
+                        continue
+                    seen.add(digest)
+                    digests.append(digest)
+                    rows.append(i)
+                room = self.max_rows - vector_file.size
+                if room <= 0 or not digests:
+                    return
+                digests, rows = digests[:room], rows[:room]
+                vector_file.append(digests, np.asarray(embeddings, dtype="float32")[rows])
+        except Exception as e:
+            print(f"⚠ 写入嵌入缓存失败: {e}")
+
+    def clear(self):
+        """清空缓存文件"""
+        with self._lock:
+            for vector_file in self._files.values():
+                vector_file.close()
+            self._files = {}
+            if self.cache_dir.exists():
+                for path in self.cache_dir.glob("embeddings_*"):
+                    path.unlink()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict:
+        """缓存统计：命中率、条目数、磁盘占用"""
+        with self._lock:
+            if self.enabled and self.cache_dir.exists():
+                # 加载磁盘上已有但本进程尚未访问过的维度
+                for path in self.cache_dir.glob("embeddings_*.f32"):
+                    dim = int(path.stem.split("_")[1])
+                    self._file(dim)
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": sum(f.size for f in self._files.values()),
+                "size_bytes": sum(
+                    p.stat().st_size for p in self.cache_dir.glob("embeddings_*")
+                ) if self.cache_dir.exists() else 0,
+                "max_entries": self.max_rows,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# 全局嵌入缓存实例
+_embedding_cache: Optional[EmbeddingCache] = None
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """获取嵌入缓存实例（单例模式）"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache()
+    return _embedding_cache
@@ -0,0 +1,318 @@
+"""
+知识库文档异步导入服务
+上传接口只负责暂存文件并创建导入任务，由有界工作线程池在后台完成
+解析 → 清洗 → 分块 → 向量化 → 建索引（压缩包按批量导入处理）；任务状态存放在
+knowledge_ingest_jobs 表中，服务重启后未完成的任务会重新排队
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional
+
+from sqlalchemy.orm import Session
+
+from ..database import SessionLocal
+from ..models import KnowledgeIngestJob
+from ..utils import load_env
+
+UNFINISHED_STATUSES = ("pending", "running")
+
+
+class IngestionService:
+    """文档导入任务队列（进程内有界线程池）"""
+
+    def __init__(self, upload_dir: Optional[Path] = None, max_workers: Optional[int] = None,
+                 session_factory: Callable[[], Session] = SessionLocal):
+        load_env()
+        self.max_workers = max_workers or int(os.environ.get("RAG_INGEST_WORKERS", "2"))
+        # 同一任务因服务重启被中断的最大次数，超过后标记为失败，避免问题文件反复拖垮服务
+        self.max_attempts = int(os.environ.get("RAG_INGEST_MAX_ATTEMPTS", "3"))
+        default_dir = Path(__file__).resolve().parent.parent.parent / "knowledge_uploads"
+        self.upload_dir = Path(upload_dir or os.environ.get("RAG_INGEST_UPLOAD_DIR") or default_dir)
+        self.session_factory = session_factory
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="kb-ingest")
+        self._queued = set()  # 已提交到线程池的任务ID，避免重复排队
+        self._lock = threading.Lock()
+
+    # ---------- 提交 ----------
+
+    def submit_upload(self, db: Session, file_data: bytes, filename: str, content_type: Optional[str] = None,
+                      title: Optional[str] = None, category: Optional[str] = None,
+                      tags: Optional[str] = None, kind: str = "file") -> KnowledgeIngestJob:
+        """暂存上传文件并创建导入任务，立即返回任务（状态 pending）；kind 为 archive 时按压缩包批量导入"""
+        self.upload_dir.mkdir(parents=True, exist_ok=True)
+        name = (filename or "").lower()
+        suffix = next((s for s in (".tar.gz",) if name.endswith(s)), Path(name).suffix)
+        file_path = self.upload_dir / f"{uuid.uuid4().hex}{suffix}"
+        file_path.write_bytes(file_data)
+
+        job = KnowledgeIngestJob(
+            kind=kind,
+            status="pending",
+            stage="queued",
+            progress=0.0,
+            filename=filename or "",
+            content_type=content_type,
+            file_path=str(file_path),
+            title=title,
+            category=category,
+            tags=tags,
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        self._enqueue(job.id)
+        print(f"✓ 导入任务已创建: #{job.id} {filename} ({len(file_data)} bytes)")
+        return job
+
+    def _enqueue(self, job_id: int):
+        with self._lock:
+            if job_id in self._queued:
+                return
+            self._queued.add(job_id)
+        self._executor.submit(self._run, job_id)
+
+    def resume_pending(self) -> int:
+        """服务启动时重新排队未完成的任务（running 状态说明上次处理被中断），返回排队数量"""
+        db = self.session_factory()
+        try:
+            jobs = db.query(KnowledgeIngestJob).filter(
+                KnowledgeIngestJob.status.in_(UNFINISHED_STATUSES)
+            ).order_by(KnowledgeIngestJob.id).all()
+            resumed = []
+            for job in jobs:
+                if job.status == "running" and job.attempts >= self.max_attempts:
+                    self._discard_partial_document(db, job)
+                    job.status = "failed"
+                    job.error = f"任务已中断 {job.attempts} 次，不再重试"
+                    self._discard_file(job.file_path)
+                    continue
+                job.status = "pending"
+                job.stage = "queued"
+                job.progress = 0.0
+                resumed.append(job.id)
+            db.commit()
+        finally:
+            db.close()
+
+        for job_id in resumed:
+            self._enqueue(job_id)
+        if resumed:
+            print(f"🔄 已恢复 {len(resumed)} 个未完成的导入任务")
+        return len(resumed)
+
+    # ---------- 执行 ----------
+
+    def _update_job(self, job_id: int, values: dict):
+        """在独立会话中更新任务字段（不影响导入过程中尚未提交的文档事务）"""
+        db = self.session_factory()
+        try:
+            db.query(KnowledgeIngestJob).filter(KnowledgeIngestJob.id == job_id).update(
+                values, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _set_progress(self, job_id: int, stage: str, progress: float):
+        self._update_job(job_id, {"stage": stage, "progress": progress})
+
+    def _set_document(self, job_id: int, document_id: int):
+        """记录流式导入已提交的（停用状态）文档ID：进程中途退出时，任务重新执行前据此删除只写了一部分的文档"""
+        self._update_job(job_id, {"document_id": document_id})
+
+    @staticmethod
+    def _discard_partial_document(db: Session, job: KnowledgeIngestJob):
+        """删除上次被中断的执行留下的文档及其块和向量（仅用于未完成的任务）"""
+        if job.document_id is None:
+            return
+        from .rag_service import get_rag_service
+
+        print(f"🔄 导入任务 #{job.id} 上次被中断，删除未完成的文档 #{job.document_id}")
+        get_rag_service().delete_document(db, job.document_id)
+        job.document_id = None
+
+    def _run(self, job_id: int):
+        from .document_parser import iter_pdf_text, iter_text_file, parse_document, stream_kind
+        from .rag_service import get_rag_service
+        from .spreadsheet_reader import iter_sheet_rows, spreadsheet_kind
+
+        db = self.session_factory()
+        try:
+            job = db.query(KnowledgeIngestJob).filter(KnowledgeIngestJob.id == job_id).first()
+            if job is None or job.status != "pending":
+                return
+            job.status = "running"
+            job.stage = "parse"
+            job.progress = 0.1
+            job.attempts += 1
+            db.commit()
+
+            if job.kind == "archive":
+                self._run_archive(db, job)
+                return
+
+            try:
+                self._discard_partial_document(db, job)
+                db.commit()
+                table_kind = spreadsheet_kind(job.filename, job.content_type)
+                document_kind = stream_kind(job.filename, job.content_type)
+                if table_kind:
+                    # 表格（Excel / CSV）直接从暂存文件逐行读取，按行窗口流式分块导入，不整体解析成字符串；
+                    # 块逐批短事务提交，导入期间可直接写库更新进度：embed 阶段按已读行数从 0.5 推进到 0.8
+                    state = {"stage": "parse", "progress": 0.1}
+
+                    def report(stage: str, value: float):
+                        state["stage"], state["progress"] = stage, value
+                        self._set_progress(job_id, stage, value)
+
+                    def report_rows(done: int, total: Optional[int]):
+                        value = round(0.5 + 0.3 * min(done / total, 1.0), 2) if total else 0.0
+                        if state["stage"] == "embed" and value > state["progress"]:
+                            report("embed", value)
+
+                    doc = get_rag_service().add_table_stream(
+                        db=db,
+                        title=job.title or job.filename or "未命名表格",
+                        rows=iter_sheet_rows(Path(job.file_path), filename=job.filename,
+                                             file_type=job.content_type, progress=report_rows),
+                        source_type="csv" if table_kind == "csv" else "excel",
+                        source_url=job.filename,
+                        category=job.category,
+                        tags=job.tags,
+                        progress=report,
+                        document_created=lambda document_id: self._set_document(job_id, document_id),
+                    )
+                elif document_kind:
+                    # PDF 逐页、纯文本按行分段直接交给流式导入，不拼成一个字符串，
+                    # 也不受 PDF_MAX_PAGES / PDF_MAX_CHARS 限制（只用于整体解析成字符串的预览路径）
+                    if document_kind == "pdf":
+                        parts = iter_pdf_text(Path(job.file_path).read_bytes())
+                    else:
+                        parts = iter_text_file(job.file_path)
+                    doc = get_rag_service().add_document_stream(
+                        db=db,
+                        title=job.title or job.filename or "未命名文档",
+                        parts=parts,
+                        source_type=document_kind,
+                        source_url=job.filename,
+                        category=job.category,
+                        tags=job.tags,
+                        progress=lambda stage, value: self._set_progress(job_id, stage, value),
+                        document_created=lambda document_id: self._set_document(job_id, document_id),
+                    )
+                else:
+                    # 解析（Word/OCR 等耗时操作在工作线程中并行执行）
+                    file_data = Path(job.file_path).read_bytes()
+                    parse_result = parse_document(file_data, filename=job.filename, file_type=job.content_type)
+                    content = parse_result.get("content", "")
+                    metadata = parse_result.get("metadata", {})
+                    if not content.strip():
+                        raise ValueError(f"文件内容为空或无法提取文本。解析器: {metadata.get('parser', 'unknown')}")
+
+                    doc_title = job.title or job.filename or "未命名文档"
+                    if doc_title == "未命名文档" and metadata.get("parser"):
+                        doc_title = f"文档 ({metadata['parser']})"
+
+                    doc = get_rag_service().add_document(
+                        db=db,
+                        title=doc_title,
+                        content=content,
+                        source_type=parse_result.get("source_type", "file"),
+                        source_url=job.filename,
+                        category=job.category,
+                        tags=job.tags,
+                        progress=lambda stage, value: self._set_progress(job_id, stage, value),
+                        document_created=lambda document_id: self._set_document(job_id, document_id),
+                    )
+            except Exception as e:
+                db.rollback()
+                job = db.query(KnowledgeIngestJob).filter(KnowledgeIngestJob.id == job_id).first()
+                job.status = "failed"
+                job.error = str(e) or e.__class__.__name__
+                job.document_id = None  # 流式导入失败时文档已删除
+                db.commit()
+                self._discard_file(job.file_path)
+                print(f"❌ 导入任务 #{job_id} 失败: {e}")
+                return
+
+            job = db.query(KnowledgeIngestJob).filter(KnowledgeIngestJob.id == job_id).first()
+            job.status = "succeeded"
+            job.stage = "done"
+            job.progress = 1.0
+            job.document_id = doc.id
+            job.error = None
+            db.commit()
+            self._discard_file(job.file_path)
+            print(f"✓ 导入任务 #{job_id} 完成: 文档 #{doc.id}, 块数: {doc.chunk_count}")
+        except Exception as e:
+            print(f"⚠ 导入任务 #{job_id} 状态更新失败: {e}")
+        finally:
+            db.close()
+            with self._lock:
+                self._queued.discard(job_id)
+
+    def _run_archive(self, db: Session, job: KnowledgeIngestJob):
+        """压缩包批量导入：进度按已处理文件数计算，部分文件失败时任务仍成功，失败明细写入 result"""
+        from .bulk_import import import_archive
+
+        job_id = job.id
+
+        def report(done: int, total: Optional[int]):
+            if total:
+                self._set_progress(job_id, "index", round(0.1 + 0.85 * min(done / total, 1.0), 4))
+
+        try:
+            summary = import_archive(db, Path(job.file_path), category=job.category, tags=job.tags, progress=report)
+        except Exception as e:
+            db.rollback()
+            summary = None
+            error = str(e) or e.__class__.__name__
+
+        job = db.query(KnowledgeIngestJob).filter(KnowledgeIngestJob.id == job_id).first()
+        if summary is not None:
+            job.result = json.dumps(summary, ensure_ascii=False)
+            if summary["imported"] or not summary["failed"]:
+                job.status = "succeeded"
+                job.stage = "done"
+                job.progress = 1.0
+                job.error = None
+            else:
+                job.status = "failed"
+                job.error = "压缩包中没有成功导入的文档"
+        else:
+            job.status = "failed"
+            job.error = error
+        db.commit()
+        self._discard_file(job.file_path)
+        print(f"{'✓' if job.status == 'succeeded' else '❌'} 批量导入任务 #{job_id} 结束: {job.error or '完成'}")
+
+    @staticmethod
+    def _discard_file(file_path: Optional[str]):
+        if not file_path:
+            return
+        try:
+            Path(file_path).unlink(missing_ok=True)
+        except OSError as e:
+            print(f"⚠ 删除暂存文件失败: {e}")
+
+    def shutdown(self, wait: bool = False):
+        """关闭线程池（未执行的任务保留在数据库中，下次启动时恢复）"""
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+# 全局导入服务实例
+_ingest_service: Optional[IngestionService] = None
+
+
+def get_ingest_service() -> IngestionService:
+    """获取导入服务实例（单例模式）"""
+    global _ingest_service
+    if _ingest_service is None:
+        _ingest_service = IngestionService()
+    return _ingest_service
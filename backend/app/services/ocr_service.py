@@ -0,0 +1,304 @@
+"""
+图片 OCR 识别服务
+知识库图片解析和客服聊天上传的图片共用：识别放到有界进程池中执行，模型在每个工作进程中只加载一次，
+多张图片一次提交、按批分给工作进程；识别结果按图片内容哈希缓存，同一张截图重复发送不会再次识别。
+知识库图片 PaddleOCR 优先、识别失败或结果为空时逐张回退到 pytesseract；客服聊天默认只用 pytesseract，
+在服务进程内识别（pytesseract 调用 tesseract 可执行文件，不加载模型），不会排在知识库图片后面
+"""
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, Optional, Sequence
+
+from ..utils import load_env
+from .cache_service import LRUCache
+
+# OCR 引擎（PaddleOCR 中文识别效果好，pytesseract 作为备用）
+# PaddleOCR 只检查是否安装，创建引擎时才导入（只用 pytesseract 的进程不加载 paddle）
+PADDLEOCR_AVAILABLE = importlib.util.find_spec("paddleocr") is not None
+
+try:
+    import pytesseract
+    from PIL import Image
+    PYTESSERACT_AVAILABLE = True
+except ImportError:
+    PYTESSERACT_AVAILABLE = False
+    pytesseract = None
+    Image = None
+
+
+ENGINES = ("paddleocr", "pytesseract")
+
+
+def engine_chain(preferred: Optional[str] = None, fallback: bool = True) -> List[str]:
+    """
+    按优先级排列的可用 OCR 引擎（paddleocr / pytesseract）
+    preferred 排在最前（默认 paddleocr 优先）；fallback=False 时只返回 preferred（不可用时为空列表）
+    """
+    available = {"paddleocr": PADDLEOCR_AVAILABLE, "pytesseract": PYTESSERACT_AVAILABLE}
+    order = [preferred] if preferred in ENGINES else []
+    if fallback or not order:
+        order += [engine for engine in ENGINES if engine not in order]
+    return [engine for engine in order if available[engine]]
+
+
+def image_digest(image_data: bytes) -> str:
+    """图片内容哈希（缓存键）"""
+    return hashlib.sha256(image_data).hexdigest()
+
+
+class _OcrEngine:
+    """加载好的 OCR 引擎（PaddleOCR 的检测、方向分类和识别模型只在创建时加载一次）"""
+
+    def __init__(self, engine: str, tesseract_cmd: Optional[str] = None):
+        self.engine = engine
+        self._ocr = None
+        if engine == "paddleocr":
+            from paddleocr import PaddleOCR
+            self._ocr = PaddleOCR(use_angle_cls=True, lang='ch')
+        elif tesseract_cmd:
+            pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+
+    def recognize(self, image_data: bytes, lang: Optional[str] = None) -> str:
+        """识别单张图片，返回按行拼接的文本（lang 只对 pytesseract 有效）"""
+        if self.engine == "paddleocr":
+            result = self._ocr.ocr(image_data, cls=True)
+            text_parts = []
+            if result and result[0]:
+                for line in result[0]:
+                    if line and len(line) >= 2:
+                        text_info = line[1]
+                        if text_info and len(text_info) >= 2:
+                            text_parts.append(text_info[0])
+            return "\n".join(text_parts).strip()
+        img = Image.open(io.BytesIO(image_data))
+        txt = pytesseract.image_to_string(img, lang=lang) if lang else pytesseract.image_to_string(img)
+        return (txt or "").strip()
+
+    def recognize_batch(self, images: Sequence[bytes], lang: Optional[str] = None) -> List[Optional[str]]:
+        """逐张识别，单张失败时对应位置为 None（不影响同批其他图片）"""
+        texts = []
+        for image_data in images:
+            try:
+                texts.append(self.recognize(image_data, lang))
+            except Exception as e:
+                print(f"⚠ {self.engine} 识别失败: {e}")
+                texts.append(None)
+        return texts
+
+
+def _recognize_with_fallback(load: Callable[[str], _OcrEngine], images: Sequence[bytes], lang: Optional[str],
+                             engines: Sequence[str]) -> List[Optional[str]]:
+    """
+    按引擎顺序逐张识别：前一个引擎识别失败或结果为空的图片交给下一个引擎
+    所有引擎都失败的图片为 None，至少一个引擎识别成功但没有文字的为空字符串
+    """
+    texts: List[Optional[str]] = [None] * len(images)
+    remaining = list(range(len(images)))
+    for name in engines:
+        if not remaining:
+            break
+        try:
+            engine = load(name)
+        except Exception as e:
+            print(f"⚠ {name} 加载失败: {e}")
+            continue
+        batch = engine.recognize_batch([images[i] for i in remaining], lang)
+        for i, text in zip(remaining, batch):
+            if text is not None:
+                texts[i] = text
+        remaining = [i for i in remaining if not texts[i]]
+    return texts
+
+
+# 进程池工作进程中加载的引擎（每个工作进程中每种引擎首次用到时加载一次模型）
+_worker_engines: Dict[str, _OcrEngine] = {}
+_worker_tesseract_cmd: Optional[str] = None
+
+
+def _init_worker(tesseract_cmd: Optional[str]):
+    global _worker_tesseract_cmd
+    _worker_tesseract_cmd = tesseract_cmd
+
+
+def _load_worker_engine(name: str) -> _OcrEngine:
+    engine = _worker_engines.get(name)
+    if engine is None:
+        engine = _worker_engines[name] = _OcrEngine(name, _worker_tesseract_cmd)
+    return engine
+
+
+def _recognize_in_worker(images: List[bytes], lang: Optional[str], engines: List[str]) -> List[Optional[str]]:
+    return _recognize_with_fallback(_load_worker_engine, images, lang, engines)
+
+
+class OCRService:
+    """
+    OCR 识别服务
+
+    - 知识库图片的首选引擎由 OCR_ENGINE 指定（paddleocr / pytesseract，未指定时 PaddleOCR 优先），
+      首选引擎识别失败或结果为空时逐张换另一个引擎重试
+    - 客服聊天图片只用 OCR_CHAT_ENGINE 指定的引擎（默认 pytesseract，不回退）
+    - 用到 PaddleOCR 的识别放到进程池中执行，知识库和客服聊天各用一个进程池（互不排队），
+      每个进程池 OCR_WORKERS 个进程（默认 1，设为 0 时在服务进程内识别）；只用 pytesseract 时直接在服务进程内识别
+    - 每个任务最多 OCR_BATCH_SIZE 张图片，单个任务等待超过 OCR_TIMEOUT 秒时该批返回空文本，
+      并结束该进程池的工作进程（超时的任务仍在工作进程中运行，不结束会一直占着进程），下次识别时重新创建
+    - 识别结果按 (引擎, 语言, 图片 sha256) 缓存在进程内 LRU 中，容量 OCR_CACHE_SIZE；识别失败的结果不缓存
+    """
+
+    def __init__(self):
+        load_env()
+        self.engines = engine_chain(os.environ.get("OCR_ENGINE") or None)
+        self.chat_engines = engine_chain(os.environ.get("OCR_CHAT_ENGINE") or "pytesseract", fallback=False)
+        self.workers = max(0, int(os.environ.get("OCR_WORKERS", "1")))
+        self.batch_size = max(1, int(os.environ.get("OCR_BATCH_SIZE", "4")))
+        self.timeout = float(os.environ.get("OCR_TIMEOUT", "60"))
+        self.tesseract_cmd = os.environ.get("TESSERACT_CMD") or None
+        self.cache = LRUCache(int(os.environ.get("OCR_CACHE_SIZE", "512")))
+        self._pools: Dict[str, ProcessPoolExecutor] = {}  # documents（知识库）/ chat（客服聊天）
+        self._local_engines: Dict[str, _OcrEngine] = {}
+        self._lock = threading.Lock()
+
+    def _get_pool(self, name: str) -> ProcessPoolExecutor:
+        with self._lock:
+            pool = self._pools.get(name)
+            if pool is None:
+                # spawn：服务进程里有推理和导入线程，fork 可能复制到被其他线程持有的锁
+                pool = self._pools[name] = ProcessPoolExecutor(max_workers=self.workers,
+                                                               mp_context=multiprocessing.get_context("spawn"),
+                                                               initializer=_init_worker,
+                                                               initargs=(self.tesseract_cmd,))
+                print(f"✓ OCR 进程池已启动 ({name}, 进程数: {self.workers})")
+            return pool
+
+    def _terminate_pool(self, name: str):
+        """结束进程池的工作进程（识别超时后调用；ProcessPoolExecutor 没有公开的结束工作进程接口）"""
+        with self._lock:
+            pool = self._pools.pop(name, None)
+        if pool is None:
+            return
+        for process in list((pool._processes or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _get_local_engine(self, name: str) -> _OcrEngine:
+        with self._lock:
+            engine = self._local_engines.get(name)
+            if engine is None:
+                engine = self._local_engines[name] = _OcrEngine(name, self.tesseract_cmd)
+            return engine
+
+    def _run_in_pool(self, name: str, batches: List[List[bytes]], lang: Optional[str],
+                     engines: List[str]) -> List[Optional[str]]:
+        pool = self._get_pool(name)
+        futures = [pool.submit(_recognize_in_worker, batch, lang, engines) for batch in batches]
+        texts: List[Optional[str]] = []
+        timed_out = False
+        for future, batch in zip(futures, batches):
+            if timed_out:
+                # 进程池已结束：已完成的批次照常取结果，其余批次返回空文本
+                try:
+                    texts.extend(future.result(timeout=0))
+                except Exception:
+                    texts.extend([None] * len(batch))
+                continue
+            try:
+                texts.extend(future.result(timeout=self.timeout))
+            except FutureTimeoutError:
+                print(f"⚠ OCR 识别超时（{self.timeout:g} 秒），跳过 {len(batch)} 张图片，结束 {name} 进程池")
+                texts.extend([None] * len(batch))
+                timed_out = True
+                self._terminate_pool(name)
+        return texts
+
+    def _recognize_uncached(self, images: List[bytes], lang: Optional[str], engines: List[str],
+                            pool_name: str) -> List[Optional[str]]:
+        if self.workers > 0 and "paddleocr" in engines:
+            batches = [images[i:i + self.batch_size] for i in range(0, len(images), self.batch_size)]
+            try:
+                return self._run_in_pool(pool_name, batches, lang, engines)
+            except (BrokenProcessPool, OSError) as e:
+                print(f"⚠ OCR 进程池不可用，改为在服务进程内识别: {e}")
+                self.shutdown()
+        return _recognize_with_fallback(self._get_local_engine, images, lang, engines)
+
+    @property
+    def engine(self) -> Optional[str]:
+        """知识库图片的首选引擎（没有可用引擎时为 None）"""
+        return self.engines[0] if self.engines else None
+
+    def recognize_images(self, images: Sequence[bytes], lang: Optional[str] = None,
+                         chat: bool = False) -> List[str]:
+        """
+        批量识别图片，返回与输入顺序一致的文本列表（识别失败或引擎不可用时为空字符串）
+        命中缓存的图片和同一批中内容相同的图片只识别一次
+
+        参数:
+        - lang: pytesseract 的语言（如 chi_sim+eng），默认使用 tesseract 的默认语言；PaddleOCR 固定为中文模型
+        - chat: 客服聊天图片（使用 chat_engines 和单独的进程池），否则按知识库图片的引擎顺序识别
+        """
+        if not images:
+            return []
+        engines = list(self.chat_engines if chat else self.engines)
+        if not engines:
+            return [""] * len(images)
+        keys = [("+".join(engines), lang or "", image_digest(image_data)) for image_data in images]
+        results: Dict[tuple, str] = {}
+        pending: Dict[tuple, bytes] = {}
+        for key, image_data in zip(keys, images):
+            if key in results or key in pending:
+                continue
+            cached = self.cache.get(key)
+            if cached is not None:
+                results[key] = cached
+            else:
+                pending[key] = image_data
+
+        if pending:
+            texts = self._recognize_uncached(list(pending.values()), lang, engines, "chat" if chat else "documents")
+            for key, text in zip(pending, texts):
+                if text is not None:
+                    self.cache.set(key, text)
+                results[key] = text or ""
+        return [results[key] for key in keys]
+
+    def recognize(self, image_data: bytes, lang: Optional[str] = None, chat: bool = False) -> str:
+        """识别单张图片"""
+        return self.recognize_images([image_data], lang, chat)[0]
+
+    def stats(self) -> Dict:
+        """引擎、进程池和缓存统计"""
+        return {
+            "engines": self.engines,
+            "chat_engines": self.chat_engines,
+            "workers": self.workers,
+            "pools_started": sorted(self._pools),
+            "cache": self.cache.stats(),
+        }
+
+    def shutdown(self, wait: bool = False):
+        """关闭所有进程池"""
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.shutdown(wait=wait, cancel_futures=True)
+
+
+# 全局 OCR 服务实例
+_ocr_service: Optional[OCRService] = None
+
+
+def get_ocr_service() -> OCRService:
+    """获取 OCR 服务实例（单例模式）"""
+    global _ocr_service
+    if _ocr_service is None:
+        _ocr_service = OCRService()
+    return _ocr_service
@@ -0,0 +1,168 @@
+"""
+PDF 逐页流式提取
+知识库文档解析和客服聊天上传的 PDF 共用：按页惰性产出文本和表格，累计字符数达到上限即停止，
+页数较多时按页区间分给进程池并行提取（pdfplumber 的版面分析是纯 Python 计算，单进程只能用满一个核）
+"""
+from __future__ import annotations
+
+import io
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterator, List, Optional
+
+from ..utils import load_env
+
+# PDF 解析（pdfplumber 可提取表格，PyMuPDF 速度快）
+try:
+    import pdfplumber
+    PDFPLUMBER_AVAILABLE = True
+except ImportError:
+    PDFPLUMBER_AVAILABLE = False
+    pdfplumber = None
+
+try:
+    import fitz  # PyMuPDF
+    PYMUPDF_AVAILABLE = True
+except ImportError:
+    PYMUPDF_AVAILABLE = False
+    fitz = None
+
+
+def available_engine(preferred: Optional[str] = None) -> Optional[str]:
+    """选择提取引擎（pdfplumber / pymupdf），优先使用 preferred，不可用时回退到另一个"""
+    order = ["pymupdf", "pdfplumber"] if preferred == "pymupdf" else ["pdfplumber", "pymupdf"]
+    for engine in order:
+        if engine == "pdfplumber" and PDFPLUMBER_AVAILABLE:
+            return engine
+        if engine == "pymupdf" and PYMUPDF_AVAILABLE:
+            return engine
+    return None
+
+
+def page_chars(page: Dict) -> int:
+    """页面文本和表格单元格的字符数"""
+    return len(page["text"]) + sum(
+        len(str(cell)) for table in page["tables"] for row in table if row for cell in row if cell
+    )
+
+
+class _PdfReader:
+    """打开的 PDF 文档（按页提取，提取完的页释放缓存）"""
+
+    def __init__(self, engine: str, file_data: bytes):
+        self.engine = engine
+        if engine == "pdfplumber":
+            self._doc = pdfplumber.open(io.BytesIO(file_data))
+            self.page_count = len(self._doc.pages)
+        else:
+            self._doc = fitz.open(stream=file_data, filetype="pdf")
+            self.page_count = getattr(self._doc, "page_count", len(self._doc))
+
+    def extract(self, index: int, include_tables: bool = True) -> Dict:
+        """提取第 index 页（从 0 开始）：{"page": 页码, "text": 文本, "tables": [[单元格...]...] 列表}"""
+        if self.engine == "pdfplumber":
+            page = self._doc.pages[index]
+            try:
+                text = page.extract_text() or ""
+                tables = page.extract_tables() if include_tables else []
+            finally:
+                if hasattr(page, "close"):
+                    page.close()  # 释放页面对象缓存的字符和版面信息
+            return {"page": index + 1, "text": text, "tables": [t for t in tables if t]}
+        try:
+            text = self._doc.load_page(index).get_text() or ""
+        except Exception:
+            text = ""  # PyMuPDF 单页损坏时跳过该页
+        return {"page": index + 1, "text": text, "tables": []}
+
+    def close(self):
+        try:
+            self._doc.close()
+        except Exception:
+            pass
+
+
+# 进程池工作进程中打开的文档（每个工作进程只解析一次文件）
+_worker_reader: Optional[_PdfReader] = None
+
+
+def _init_worker(file_data: bytes, engine: str):
+    global _worker_reader
+    _worker_reader = _PdfReader(engine, file_data)
+
+
+def _extract_range(start: int, end: int, include_tables: bool) -> List[Dict]:
+    return [_worker_reader.extract(i, include_tables) for i in range(start, end)]
+
+
+def _iter_parallel(file_data: bytes, engine: str, total: int, include_tables: bool,
+                   workers: int, pages_per_task: int) -> Iterator[Dict]:
+    """按页区间分给进程池提取，按页序产出；在途区间不超过 workers 的两倍，调用方停止读取时取消未开始的区间"""
+    ranges = deque((start, min(start + pages_per_task, total)) for start in range(0, total, pages_per_task))
+    # spawn：服务进程里有推理和导入线程，fork 可能复制到被其他线程持有的锁
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_worker, initargs=(file_data, engine))
+    pending = deque()
+    try:
+        while ranges or pending:
+            while ranges and len(pending) < workers * 2:
+                pending.append(pool.submit(_extract_range, *ranges.popleft(), include_tables))
+            yield from pending.popleft().result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_pdf_pages(file_data: bytes, engine: Optional[str] = None, max_pages: Optional[int] = None,
+                   max_chars: Optional[int] = None, include_tables: bool = True,
+                   workers: Optional[int] = None) -> Iterator[Dict]:
+    """
+    逐页产出 PDF 内容：{"page": 页码（从 1 开始）, "text": 文本, "tables": [[单元格...]...] 列表}
+
+    参数:
+    - engine: pdfplumber（默认，可提取表格）/ pymupdf（更快，不提取表格），不可用时回退到另一个
+    - max_pages: 最多提取的页数
+    - max_chars: 已产出页面的累计字符数（文本和表格单元格）达到后停止
+    - include_tables: 是否提取表格（只对 pdfplumber 有效）
+    - workers: 并行进程数（默认 PDF_PARSE_WORKERS）；大于 1 且页数不少于 PDF_PARALLEL_MIN_PAGES 时
+      每 PDF_PAGES_PER_TASK 页一个任务分给进程池，进程池不可用时回退为单进程逐页提取
+
+    引擎不可用时不产出任何页；打开或提取失败的异常由调用方处理
+    """
+    load_env()
+    engine = available_engine(engine)
+    if engine is None:
+        return
+    workers = int(os.environ.get("PDF_PARSE_WORKERS", "1") if workers is None else workers)
+    min_pages = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "32"))
+    pages_per_task = max(1, int(os.environ.get("PDF_PAGES_PER_TASK", "8")))
+
+    reader = _PdfReader(engine, file_data)
+    try:
+        total = min(reader.page_count, max_pages) if max_pages else reader.page_count
+        next_index = 0
+        chars = 0
+        if workers > 1 and total >= min_pages:
+            pages = _iter_parallel(file_data, engine, total, include_tables, workers, pages_per_task)
+            try:
+                for page in pages:
+                    next_index = page["page"]
+                    yield page
+                    chars += page_chars(page)
+                    if max_chars and chars >= max_chars:
+                        return
+                return
+            except (BrokenProcessPool, OSError) as e:
+                print(f"⚠ PDF 并行提取失败，从第 {next_index + 1} 页起改为单进程提取: {e}")
+            finally:
+                pages.close()
+        for i in range(next_index, total):
+            page = reader.extract(i, include_tables)
+            yield page
+            chars += page_chars(page)
+            if max_chars and chars >= max_chars:
+                return
+    finally:
+        reader.close()
@@ -0,0 +1,295 @@
+"""
+商品目录向量索引
+商品名称、分类和描述向量化后存入独立的向量索引（product_catalog_index.*，与知识库索引分开，向量ID = 商品ID），
+客服聊天按用户问题在全部商品中检索（如“有没有防水的运动相机”），不再只依赖当前商品的一行信息或大模型猜测；
+商品增删改时增量更新，启动时按文本摘要与商品表对账，补上其他途径（批量导入、脚本）产生的变更
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Session
+
+from ..models import Product
+from ..utils import load_env
+from .vector_store import FAISS_AVAILABLE, VectorStore
+
+
+def catalog_enabled() -> bool:
+    load_env()
+    return os.environ.get("PRODUCT_INDEX_ENABLED", "true").lower() == "true"
+
+
+def product_text(product) -> str:
+    """参与向量化的商品文本（价格、库存不参与：变化时无需重新向量化，检索后从数据库读取最新值）"""
+    parts = [product.name or ""]
+    if product.category:
+        parts.append(f"分类：{product.category}")
+    if product.description:
+        parts.append(product.description.strip())
+    return "\n".join(part for part in parts if part)
+
+
+def _text_digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class ProductCatalogIndex:
+    """
+    商品目录向量索引
+
+    - 向量化复用 RAG 服务的嵌入模型和嵌入缓存，索引快照独立存放（路径由 PRODUCT_INDEX_PATH 指定）
+    - 每个商品的文本摘要记录在快照目录的 digests.json 中，文本未变的商品不会重新向量化
+    - 检索返回相似度不低于 PRODUCT_INDEX_THRESHOLD 的前 PRODUCT_INDEX_TOP_K 个商品
+    """
+
+    def __init__(self, rag_service, index_path: Optional[Path] = None):
+        load_env()
+        self.rag_service = rag_service
+        default_path = Path(__file__).resolve().parent.parent.parent / "product_catalog_index.faiss"
+        self.index_path = Path(index_path or os.environ.get("PRODUCT_INDEX_PATH") or default_path)
+        # 文本摘要和索引快照放在同一目录（product_catalog_index.snapshots/）
+        self.digest_path = self.index_path.with_suffix(".snapshots") / "digests.json"
+        self.top_k = int(os.environ.get("PRODUCT_INDEX_TOP_K", "3"))
+        self.similarity_threshold = float(os.environ.get("PRODUCT_INDEX_THRESHOLD", "0.3"))
+        self.batch_size = max(1, int(os.environ.get("PRODUCT_INDEX_BATCH_SIZE", "64")))
+        self.vector_store: Optional[VectorStore] = None
+        self.digests: Dict[int, str] = {}  # 商品ID -> 已向量化文本的摘要
+        self._lock = threading.RLock()
+        self._load()
+
+    @property
+    def ready(self) -> bool:
+        return self.vector_store is not None and self.rag_service.embedding_model is not None
+
+    def _load(self):
+        if not FAISS_AVAILABLE:
+            return
+        model_name = self.rag_service.embedding_model_name
+        dim = self.rag_service.vector_dim
+        self.vector_store = VectorStore(self.index_path, dim)
+        loaded = self.vector_store.load()
+        if loaded and (self.vector_store.model_name != model_name or self.vector_store.d != dim):
+            print("⚠ 商品索引由其他嵌入模型构建，将全部重新向量化")
+            loaded = False
+        if not loaded:
+            self.vector_store.reset(dim, model_name)
+            return
+        try:
+            digests = json.loads(self.digest_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            digests = {}
+        # 摘要只对索引中存在的向量有效（保存中途中断时，缺少的向量在下次对账时补建）
+        stored = set(self.vector_store.ids().tolist())
+        self.digests = {int(product_id): digest for product_id, digest in digests.items() if int(product_id) in stored}
+        print(f"✓ 商品索引已加载: {self.vector_store.ntotal} 个商品")
+
+    def _save(self):
+        self.vector_store.save()
+        tmp_path = self.digest_path.with_name(f"{self.digest_path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(self.digests), encoding="utf-8")
+        os.replace(tmp_path, self.digest_path)
+
+    def _index(self, items: List[Tuple[int, str]]) -> int:
+        """按批向量化并写入索引（调用方持有锁），返回写入的商品数"""
+        written = 0
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start:start + self.batch_size]
+            embeddings = self.rag_service.embed_texts([text for _, text in batch])
+            if embeddings is None:
+                print(f"⚠ 商品向量化失败，跳过 {len(items) - written} 个商品")
+                break
+            self.vector_store.add([product_id for product_id, _ in batch], embeddings)
+            for product_id, text in batch:
+                self.digests[product_id] = _text_digest(text)
+            written += len(batch)
+        return written
+
+    def upsert(self, products: Iterable) -> int:
+        """新增或更新商品向量（文本未变的商品跳过），返回重新向量化的商品数"""
+        if not self.ready:
+            return 0
+        items = [(product.id, product_text(product)) for product in products]
+        with self._lock:
+            changed = [(product_id, text) for product_id, text in items
+                       if self.digests.get(product_id) != _text_digest(text)]
+            written = self._index(changed)
+            if written:
+                self._save()
+        return written
+
+    def remove(self, product_ids: Sequence[int]) -> int:
+        """删除商品向量，返回实际删除的数量"""
+        if not self.ready or not product_ids:
+            return 0
+        with self._lock:
+            removed = self.vector_store.remove(list(product_ids))
+            for product_id in product_ids:
+                self.digests.pop(product_id, None)
+            if removed:
+                self._save()
+        return removed
+
+    def apply_changes(self, db: Session, product_ids: Sequence[int] = (), removed_ids: Sequence[int] = ()) -> Dict:
+        """按商品ID增量更新：product_ids 从数据库读取后 upsert，removed_ids 删除"""
+        removed = self.remove(list(removed_ids))
+        indexed = 0
+        if product_ids:
+            indexed = self.upsert(db.query(Product).filter(Product.id.in_(list(product_ids))).all())
+        return {"indexed": indexed, "removed": removed}
+
+    def reconcile(self, db: Session) -> Dict:
+        """
+        与商品表对账：补建缺失或文本变化的商品向量，删除已不存在的商品向量（启动时和手动重建时调用）
+
+        返回:
+        - Dict: total（商品数）, indexed（重新向量化数）, removed（删除数）
+        """
+        if not self.ready:
+            return {"total": 0, "indexed": 0, "removed": 0}
+        with self._lock:
+            seen = set()
+            changed = []
+            rows = db.query(Product.id, Product.name, Product.category, Product.description).yield_per(1000)
+            for row in rows:
+                seen.add(row.id)
+                text = product_text(row)
+                if self.digests.get(row.id) != _text_digest(text):
+                    changed.append((row.id, text))
+            stale = (set(self.vector_store.ids().tolist()) | set(self.digests)) - seen
+            indexed = self._index(changed)
+            self.vector_store.remove(sorted(stale))
+            for product_id in stale:
+                self.digests.pop(product_id, None)
+            if self.vector_store.dirty:
+                self._save()
+        print(f"✓ 商品索引对账完成: 共 {len(seen)} 个商品，重新向量化 {indexed} 个，移除 {len(stale)} 个")
+        return {"total": len(seen), "indexed": indexed, "removed": len(stale)}
+
+    def search(self, query: str, top_k: Optional[int] = None,
+               similarity_threshold: Optional[float] = None) -> List[Tuple[int, float]]:
+        """按文本检索商品，返回 [(商品ID, 余弦相似度)]，按相似度降序"""
+        if not self.ready or not query or not query.strip():
+            return []
+        # 与知识库检索使用同一个查询向量缓存：同一条用户消息只推理一次
+        embedding = self.rag_service.embed_text(query.strip())
+        if embedding is None:
+            return []
+        with self._lock:
+            if self.vector_store.ntotal == 0 or self.vector_store.d != embedding.shape[0]:
+                return []
+            k = min(top_k or self.top_k, self.vector_store.ntotal)
+            scores, ids = self.vector_store.search(embedding.reshape(1, -1), k)
+        threshold = self.similarity_threshold if similarity_threshold is None else similarity_threshold
+        similarity = self.vector_store.to_cosine(scores[0])
+        return [(int(product_id), float(sim)) for product_id, sim in zip(ids[0], similarity)
+                if product_id >= 0 and sim >= threshold]
+
+    def stats(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "products": self.vector_store.ntotal if self.vector_store is not None else 0,
+            "generation": self.vector_store.generation if self.vector_store is not None else 0,
+        }
+
+
+# 全局商品索引实例
+_product_catalog: Optional[ProductCatalogIndex] = None
+_catalog_lock = threading.Lock()
+
+
+def get_product_catalog() -> Optional[ProductCatalogIndex]:
+    """获取商品目录索引（单例模式）；未启用或 RAG 服务尚未就绪（嵌入模型未加载）时返回 None"""
+    global _product_catalog
+    if _product_catalog is None:
+        from .rag_service import get_rag_service, is_rag_ready
+        if not catalog_enabled() or not is_rag_ready():
+            return None
+        with _catalog_lock:
+            if _product_catalog is None:
+                _product_catalog = ProductCatalogIndex(get_rag_service())
+    return _product_catalog
+
+
+def reconcile_product_catalog() -> Optional[Dict]:
+    """RAG 服务就绪后与商品表对账（服务启动时在后台线程调用）"""
+    catalog = get_product_catalog()
+    if catalog is None:
+        return None
+    from ..database import SessionLocal
+    db = SessionLocal()
+    try:
+        return catalog.reconcile(db)
+    finally:
+        db.close()
+
+
+def on_products_changed(db: Session, product_ids: Sequence[int] = (), removed_ids: Sequence[int] = ()):
+    """
+    商品增删改后增量更新商品索引（商品服务和管理接口在提交后调用）
+    配置了独立检索服务时通知检索服务进程更新；进程内 RAG 服务尚未就绪时跳过，由就绪后的启动对账补上。
+    失败只打印警告，不影响商品接口
+    """
+    if not catalog_enabled() or not (product_ids or removed_ids):
+        return
+    try:
+        from .rag_client import get_rag_client
+        rag_client = get_rag_client()
+        if rag_client is not None:
+            rag_client.index_products(list(product_ids), list(removed_ids))
+            return
+        catalog = get_product_catalog()
+        if catalog is not None:
+            catalog.apply_changes(db, product_ids, removed_ids)
+    except Exception as e:
+        print(f"⚠ 商品索引更新失败: {e}")
+
+
+def search_products(db: Session, query: str, top_k: Optional[int] = None,
+                    exclude_id: Optional[int] = None) -> List[Dict]:
+    """
+    按用户问题检索相关商品
+
+    返回:
+    - List[Dict]: id, name, category, price, stock, description, similarity（按相似度降序；价格和库存为数据库最新值）
+    """
+    if not catalog_enabled() or not query or not query.strip():
+        return []
+    from .rag_client import get_rag_client
+    rag_client = get_rag_client()
+    if rag_client is not None:
+        hits = rag_client.search_products(query, top_k=top_k)
+    else:
+        catalog = get_product_catalog()
+        hits = catalog.search(query, top_k=top_k) if catalog is not None else []
+    hits = [(product_id, sim) for product_id, sim in hits if product_id != exclude_id]
+    if not hits:
+        return []
+    products = {p.id: p for p in db.query(Product).filter(Product.id.in_([product_id for product_id, _ in hits])).all()}
+    return [
+        {
+            "id": product.id, "name": product.name, "category": product.category, "price": product.price,
+            "stock": product.stock, "description": product.description, "similarity": sim,
+        }
+        for product, sim in ((products.get(product_id), sim) for product_id, sim in hits) if product is not None
+    ]
+
+
+def catalog_context(db: Session, query: str, exclude_id: Optional[int] = None) -> str:
+    """客服提示词中的相关商品信息（未检索到时为空字符串）"""
+    products = search_products(db, query, exclude_id=exclude_id)
+    if not products:
+        return ""
+    lines = []
+    for p in products:
+        line = f"{p['name']}（分类：{p['category'] or '-'}，价格￥{p['price']:.2f}，库存{p['stock']}）"
+        description = " ".join((p["description"] or "").split())
+        if description:
+            line += f"：{description[:80]}"
+        lines.append(line)
+    return "与用户问题相关的商品：" + "；".join(lines) + "。"
@@ -7,6 +7,7 @@ from sqlalchemy import func, text
 from .. import schemas
 from ..models import Product, Category
 from .cache_service import get_cache_service
+from .product_catalog import on_products_changed
 import random
 import uuid
 import hashlib
@@ -75,6 +76,8 @@ def create_product(payload: schemas.ProductCreate, db: Session) -> Product:
     # 清除相关缓存
     cache.delete_categories()
     cache.delete_pattern("product:list:*")
+    # 增量更新商品目录向量索引
+    on_products_changed(db, [product.id])
     return product
 
 
@@ -322,6 +325,7 @@ def seed_products(count: int, db: Session) -> List[Product]:
     # 再次刷新以确保图片URL已保存
     for p in created:
         db.refresh(p)
+    on_products_changed(db, [p.id for p in created])
     return created
 
 
@@ -0,0 +1,116 @@
+"""
+RAG 检索服务客户端
+配置 RAG_SERVICE_URL 后，API 进程不再加载嵌入模型和向量索引，
+知识库检索通过本地 Unix socket 或 HTTP 调用独立的检索服务进程（app.rag_server）
+"""
+from __future__ import annotations
+
+import os
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from ..utils import load_env
+
+TOKEN_HEADER = "X-RAG-Token"
+
+
+def parse_service_url(url: str) -> Tuple[str, Optional[str]]:
+    """
+    解析检索服务地址
+
+    返回:
+    - (base_url, uds): unix:///path/rag.sock 返回 ("http://rag", "/path/rag.sock")，HTTP 地址原样返回
+    """
+    if url.startswith("unix://"):
+        return "http://rag", url[len("unix://"):]
+    return url.rstrip("/"), None
+
+
+def get_service_url() -> Optional[str]:
+    """检索服务地址（未配置时返回 None，表示进程内加载 RAG 服务）"""
+    load_env()
+    return os.environ.get("RAG_SERVICE_URL") or None
+
+
+def service_headers() -> Dict[str, str]:
+    token = os.environ.get("RAG_SERVICE_TOKEN")
+    return {TOKEN_HEADER: token} if token else {}
+
+
+class RAGClient:
+    """检索服务的同步客户端（聊天接口使用）"""
+
+    def __init__(self, url: Optional[str] = None, timeout: Optional[float] = None,
+                 http_client: Optional[httpx.Client] = None):
+        load_env()
+        self.url = url or get_service_url() or ""
+        self.timeout = timeout or float(os.environ.get("RAG_SERVICE_TIMEOUT", "10"))
+        if http_client is not None:
+            self.http = http_client
+        else:
+            base_url, uds = parse_service_url(self.url)
+            transport = httpx.HTTPTransport(uds=uds) if uds else None
+            self.http = httpx.Client(base_url=base_url, transport=transport, timeout=self.timeout)
+        self.http.headers.update(service_headers())
+
+    def health(self) -> Dict:
+        """检索服务状态：ready（模型是否已加载）、generation（索引代数）、ntotal（向量数）"""
+        response = self.http.get("/internal/health")
+        response.raise_for_status()
+        return response.json()
+
+    def retrieve_context(self, query: str, top_k: Optional[int] = None,
+                         similarity_threshold: float = 0.15,
+                         category: Optional[str] = None) -> Tuple[str, List[Dict]]:
+        """
+        与 RAGService.retrieve_context 相同的返回值：(上下文文本, 检索结果详情)
+        检索服务尚未就绪时返回空结果
+        """
+        response = self.http.post("/internal/retrieve", json={
+            "query": query,
+            "top_k": top_k,
+            "similarity_threshold": similarity_threshold,
+            "category": category,
+        })
+        if response.status_code == 503:
+            print("⏳ 检索服务尚未准备好，跳过知识库检索")
+            return "", []
+        response.raise_for_status()
+        data = response.json()
+        return data.get("context", ""), data.get("results", [])
+
+    def index_products(self, product_ids: List[int], removed_ids: Optional[List[int]] = None) -> Dict:
+        """通知检索服务增量更新商品索引（商品增删改后调用），返回 {indexed, removed}"""
+        response = self.http.post("/internal/products/index", json={
+            "product_ids": product_ids,
+            "removed_ids": removed_ids or [],
+        })
+        if response.status_code == 503:
+            print("⏳ 检索服务尚未准备好，商品索引将在其启动对账时更新")
+            return {"indexed": 0, "removed": 0}
+        response.raise_for_status()
+        return response.json()
+
+    def search_products(self, query: str, top_k: Optional[int] = None) -> List[Tuple[int, float]]:
+        """与 ProductCatalogIndex.search 相同的返回值：[(商品ID, 相似度)]；检索服务尚未就绪时返回空列表"""
+        response = self.http.post("/internal/products/search", json={"query": query, "top_k": top_k})
+        if response.status_code == 503:
+            return []
+        response.raise_for_status()
+        return [(item["product_id"], item["similarity"]) for item in response.json().get("results", [])]
+
+    def close(self):
+        self.http.close()
+
+
+# 全局客户端实例
+_rag_client: Optional[RAGClient] = None
+
+
+def get_rag_client() -> Optional[RAGClient]:
+    """获取检索服务客户端（单例模式）；未配置 RAG_SERVICE_URL 时返回 None"""
+    global _rag_client
+    if _rag_client is None and get_service_url():
+        _rag_client = RAGClient()
+    return _rag_client
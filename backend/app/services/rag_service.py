@@ -5,16 +5,29 @@ RAG (Retrieval-Augmented Generation) 知识库服务
 from __future__ import annotations
 
 import os
+import io
 import json
 import re
-from typing import List, Dict, Optional, Tuple
+import hashlib
+import functools
+import threading
+from typing import Callable, Iterable, Iterator, List, Dict, Optional, Tuple
 from pathlib import Path
 import numpy as np
 from sqlalchemy.orm import Session
 
 from ..models import KnowledgeDocument, KnowledgeChunk
 from ..utils import load_env
-from .text_cleaner import get_text_cleaner
+from .text_cleaner import get_text_cleaner, iter_text_blocks
+from .vector_store import VectorStore, vector_id_checksum
+from .embedding_cache import get_embedding_cache
+from .embedding_backend import check_parity, get_backend_name, load_embedding_model, sample_corpus_texts
+from .embedding_batcher import EmbeddingBatcher
+from .bm25_index import InvertedIndex
+from .cache_service import LRUCache, get_cache_service
+from .chunk_store import ChunkStore
+from .dedup_index import DedupIndex
+from .tokenizer import get_tokenizer, pack_token_ids, unpack_token_ids
 
 # 向量数据库和嵌入模型
 try:
@@ -31,45 +44,100 @@ except ImportError:
     SENTENCE_TRANSFORMERS_AVAILABLE = False
     SentenceTransformer = None
 
-# BM25 关键词检索
-try:
-    from rank_bm25 import BM25Okapi
-    BM25_AVAILABLE = True
-except ImportError:
-    BM25_AVAILABLE = False
-    BM25Okapi = None
 
-# 中文分词
-try:
-    import jieba
-    JIEBA_AVAILABLE = True
-except ImportError:
-    JIEBA_AVAILABLE = False
-    jieba = None
+def _batched(items: Iterable, size: int) -> Iterator[List]:
+    """按固定大小分批产出（itertools.batched 需要 Python 3.12）"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _on_first(items: Iterable, callback: Callable[[], None]) -> Iterator:
+    """产出第一个元素前调用一次 callback（流式导入真正读到第一页/第一行时才上报进入 clean 阶段）"""
+    started = False
+    for item in items:
+        if not started:
+            started = True
+            callback()
+        yield item
+
+
+def _synchronized(method):
+    """写操作持有 RAG 服务的写锁（后台导入线程与请求线程可能同时修改索引）"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.write_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
 
 
 class RAGService:
     """RAG 知识库服务类"""
     
+    GENERATION_KEY = "rag:index_generation"  # Redis 中共享的索引代数
+    
     def __init__(self):
         load_env()
         self.embedding_model = None
-        self.vector_index = None
+        self.embedding_model_name = None
+        self.embedding_backend = "torch"  # 推理后端：torch / int8 / onnx / onnx-int8（RAG_EMBEDDING_BACKEND）
+        self._parity_reference = None  # 一致性检查用的 fp32 参考模型（接口首次调用时加载，之后复用）
+        self._parity_lock = threading.Lock()
+        self.vector_store: Optional[VectorStore] = None  # ID 映射向量索引（向量ID = 块ID）
         self.vector_dim = 384  # 默认向量维度
         self.index_path = Path(__file__).resolve().parent.parent.parent / "knowledge_base_index.faiss"
         self.chunk_size = int(os.environ.get("RAG_CHUNK_SIZE", "500"))  # 每个块的最大字符数
         self.chunk_overlap = int(os.environ.get("RAG_CHUNK_OVERLAP", "50"))  # 块之间的重叠字符数
         self.top_k = int(os.environ.get("RAG_TOP_K", "5"))  # 检索 Top-K 相关文档（增加到5以提高召回率）
         self.text_cleaner = get_text_cleaner()
+        self.embedding_cache = get_embedding_cache()  # 文本块向量持久化缓存（按内容哈希）
+        # 查询向量 LRU 缓存（键为 模型名 + 规范化查询），重复提问跳过模型推理
+        self.query_embedding_cache = LRUCache(int(os.environ.get("RAG_QUERY_EMBEDDING_CACHE_SIZE", "2048")))
+        # 查询向量微批处理：几毫秒内并发到达的查询合并成一次模型推理（后台线程首次查询时启动）
+        self.query_batch_enabled = os.environ.get("RAG_EMBED_BATCH_ENABLED", "true").lower() == "true"
+        self.query_batch_max_size = int(os.environ.get("RAG_EMBED_BATCH_MAX_SIZE", "32"))
+        self.query_batch_max_wait_ms = float(os.environ.get("RAG_EMBED_BATCH_MAX_WAIT_MS", "5"))
+        self.query_batcher: Optional[EmbeddingBatcher] = None
+        self._batcher_lock = threading.Lock()
+        # 检索结果缓存：键包含索引代数，任何写入都会递增代数，旧结果不会再被命中
+        self.retrieval_cache_enabled = os.environ.get("RAG_RETRIEVAL_CACHE_ENABLED", "true").lower() == "true"
+        self.retrieval_cache_ttl = int(os.environ.get("RAG_RETRIEVAL_CACHE_TTL", "600"))  # Redis 中的过期时间（秒）
+        self.retrieval_cache = LRUCache(int(os.environ.get("RAG_RETRIEVAL_CACHE_SIZE", "1024")))  # Redis 不可用时使用
+        self.cache_service = get_cache_service()
+        self.index_generation = 0
+        # 索引写锁：向量索引 / BM25 / 块存储的修改串行执行，解析和向量化可在锁外并行
+        self.write_lock = threading.RLock()
         # BM25相关
-        self.bm25_index = None  # BM25索引
-        self.bm25_chunk_texts = []  # 存储所有块的文本（用于BM25检索）
-        self.bm25_chunk_map = {}  # 映射：BM25索引 -> vector_id
+        self.tokenizer = get_tokenizer()  # 共享分词器（商品词典，分词结果随块持久化）
+        self.chunk_store = ChunkStore()  # 块内容/文档信息内存存储（首次检索时从数据库加载）
+        self.bm25_index: Optional[InvertedIndex] = None  # BM25倒排索引（键为 vector_id，首次检索时从数据库构建）
         self.use_hybrid_search = os.environ.get("RAG_USE_HYBRID_SEARCH", "true").lower() == "true"  # 是否使用混合检索
         self.hybrid_weight_vector = float(os.environ.get("RAG_HYBRID_WEIGHT_VECTOR", "0.7"))  # 向量检索权重
         self.hybrid_weight_bm25 = float(os.environ.get("RAG_HYBRID_WEIGHT_BM25", "0.3"))  # BM25检索权重
+        # 批量导入：每个数据库事务的文档数、每次向量化的块数
+        self.bulk_batch_docs = int(os.environ.get("RAG_BULK_BATCH_DOCS", "50"))
+        self.bulk_embed_batch_size = int(os.environ.get("RAG_BULK_EMBED_BATCH_SIZE", "256"))
+        # 超过该字符数的文档走流式预处理（边清洗分块边向量化，不同时持有全文的各中间副本和全部块向量）
+        self.stream_min_chars = int(os.environ.get("RAG_STREAM_MIN_CHARS", "500000"))
+        # 近重复块检测：MinHash LSH 召回候选、嵌入余弦确认，重复块只记录对规范块的引用，不写入向量
+        self.dedup_enabled = os.environ.get("RAG_DEDUP_ENABLED", "true").lower() == "true"
+        self.dedup_min_jaccard = float(os.environ.get("RAG_DEDUP_MIN_JACCARD", "0.8"))
+        self.dedup_min_cosine = float(os.environ.get("RAG_DEDUP_MIN_COSINE", "0.95"))
+        self.dedup_index: Optional[DedupIndex] = None  # 首次写入时从数据库构建
+        self.dedup_skipped = 0
         self._initialize_embedding_model()
         self._load_vector_index()
+        self._prepare_vector_index()
+    
+    @property
+    def vector_index(self):
+        """底层 FAISS 索引（兼容旧代码直接访问 vector_index）"""
+        return self.vector_store.index if self.vector_store is not None else None
     
     def _initialize_embedding_model(self, language: Optional[str] = None):
         """
@@ -113,20 +181,22 @@ class RAGService:
         
         try:
             print(f"📥 开始加载嵌入模型: {model_name}...")
-            self.embedding_model = SentenceTransformer(model_name)
+            self.embedding_model = self._load_model(model_name)
             # 获取模型维度
             test_embedding = self.embedding_model.encode(["test"])
             self.vector_dim = test_embedding.shape[1]
-            print(f"✓ 嵌入模型已加载: {model_name}, 维度: {self.vector_dim}, 语言: {language}")
+            self.embedding_model_name = model_name
+            print(f"✓ 嵌入模型已加载: {model_name}, 维度: {self.vector_dim}, 语言: {language}, 推理后端: {self.embedding_backend}")
         except Exception as e:
             print(f"⚠ 加载嵌入模型失败: {e}")
             # 尝试使用备用模型
             if len(model_list) > 1:
                 try:
                     model_name = model_list[1]
-                    self.embedding_model = SentenceTransformer(model_name)
+                    self.embedding_model = self._load_model(model_name)
                     test_embedding = self.embedding_model.encode(["test"])
                     self.vector_dim = test_embedding.shape[1]
+                    self.embedding_model_name = model_name
                     print(f"✓ 使用备用嵌入模型: {model_name}, 维度: {self.vector_dim}")
                 except Exception as e2:
                     print(f"⚠ 备用模型也加载失败: {e2}")
@@ -134,110 +204,343 @@ class RAGService:
             else:
                 self.embedding_model = None
     
+    def _load_model(self, model_name: str):
+        """按 RAG_EMBEDDING_BACKEND 加载嵌入模型，量化 / ONNX 后端加载失败时回退到 fp32"""
+        backend = get_backend_name()
+        if backend != "torch":
+            try:
+                model = load_embedding_model(model_name, backend)
+                self.embedding_backend = backend
+                return model
+            except Exception as e:
+                print(f"⚠ 嵌入推理后端 {backend} 加载失败，回退到 fp32: {e}")
+        self.embedding_backend = "torch"
+        return load_embedding_model(model_name, "torch")
+    
+    @property
+    def embedding_cache_name(self) -> Optional[str]:
+        """嵌入缓存的命名空间：量化 / ONNX 后端的向量与 fp32 向量分开缓存"""
+        if self.embedding_backend == "torch":
+            return self.embedding_model_name
+        return f"{self.embedding_model_name}#{self.embedding_backend}"
+    
+    def check_embedding_parity(self, db: Session, sample_size: Optional[int] = None, reference=None) -> Dict:
+        """
+        在知识库文本块样本上比较当前推理后端与 fp32 模型的向量一致性
+        
+        参数:
+        - sample_size: 抽样块数（默认 RAG_EMBEDDING_PARITY_SAMPLES）
+        - reference: fp32 参考模型（为空时使用只加载一次的参考模型）
+        
+        返回:
+        - Dict: check_parity 的结果，另含 backend、model
+        """
+        if not self.embedding_model:
+            return {"backend": self.embedding_backend, "model": self.embedding_model_name, "samples": 0, "passed": False}
+        if reference is None:
+            reference = self._parity_reference_model()
+        report = check_parity(self.embedding_model, reference, sample_corpus_texts(db, sample_size))
+        report.update(backend=self.embedding_backend, model=self.embedding_model_name)
+        return report
+    
+    def _parity_reference_model(self):
+        """一致性检查的 fp32 参考模型：当前后端就是 fp32 时直接用当前模型，否则首次调用时加载并保留"""
+        if self.embedding_backend == "torch":
+            return self.embedding_model
+        with self._parity_lock:
+            if self._parity_reference is None:
+                print(f"📥 加载 fp32 参考模型用于一致性检查: {self.embedding_model_name}")
+                self._parity_reference = load_embedding_model(self.embedding_model_name, "torch")
+            return self._parity_reference
+    
+    def _verify_embedding_backend(self, db: Session):
+        """启动时检查量化 / ONNX 后端与 fp32 的一致性，未达阈值时回退到 fp32 模型"""
+        reference = self._parity_reference_model()
+        report = self.check_embedding_parity(db, reference=reference)
+        if report["passed"]:
+            print(f"✓ 嵌入推理后端 {self.embedding_backend} 一致性检查通过: {report['samples']} 个样本，"
+                  f"平均余弦 {report.get('mean_cosine')}，最近邻一致率 {report.get('neighbor_agreement')}，"
+                  f"加速 {report.get('speedup')}x")
+            return
+        print(f"⚠ 嵌入推理后端 {self.embedding_backend} 一致性检查未通过（平均余弦 {report.get('mean_cosine')} < "
+              f"{report.get('threshold')}），回退到 fp32")
+        self.embedding_model = reference
+        self.embedding_backend = "torch"
+    
     def _load_vector_index(self):
-        """加载或创建向量索引"""
+        """加载或创建向量索引（ID 映射索引，支持按向量ID增量删除）"""
         if not FAISS_AVAILABLE:
             print("警告: FAISS 未安装，向量索引功能将不可用")
             return
         
+        self.vector_store = VectorStore(self.index_path, self.vector_dim)
         try:
-            if self.index_path.exists():
-                self.vector_index = faiss.read_index(str(self.index_path))
-                print(f"✓ 向量索引已加载: {self.vector_index.ntotal} 个向量")
+            if self.vector_store.load():
+                print(f"✓ 向量索引已加载: {self.vector_store.ntotal} 个向量")
+                if self.vector_store.migrated and not self.vector_store.legacy_ids:
+                    # 度量迁移不涉及向量ID，可直接保存；旧版ID由 _migrate_vector_ids 迁移后保存
+                    self._save_vector_index()
             else:
                 # 创建新的索引
-                self.vector_index = faiss.IndexFlatL2(self.vector_dim)
+                self.vector_store.reset(self.vector_dim, self.embedding_model_name)
                 print("✓ 创建新的向量索引")
         except Exception as e:
             print(f"⚠ 加载向量索引失败: {e}")
-            if self.vector_index is None:
-                self.vector_index = faiss.IndexFlatL2(self.vector_dim)
+            self.vector_store.reset(self.vector_dim, self.embedding_model_name)
     
-    def _save_vector_index(self):
-        """保存向量索引到文件"""
-        if not FAISS_AVAILABLE or self.vector_index is None:
+    def _prepare_vector_index(self):
+        """启动时迁移旧版向量ID；嵌入模型变更时全量重新向量化；快照与 knowledge_chunks 不一致时同步索引"""
+        if self.vector_store is None:
             return
         
         try:
-            faiss.write_index(self.vector_index, str(self.index_path))
+            from ..database import session_scope
+            with session_scope() as db:
+                if (self.embedding_model and self.embedding_backend != "torch"
+                        and os.environ.get("RAG_EMBEDDING_PARITY_CHECK", "false").lower() == "true"):
+                    self._verify_embedding_backend(db)
+                self._migrate_vector_ids(db)
+                if self._embedding_model_changed():
+                    print(f"🔄 嵌入模型已变更（{self.vector_store.model_name} → {self.embedding_model_name}），全量重建向量索引")
+                    self._rebuild_index(db)
+                else:
+                    report = self.check_index_consistency(db)
+                    if not report["consistent"]:
+                        print(f"⚠ 向量索引快照（第 {report['generation']} 代）与知识块表不一致："
+                              f"缺少 {report['missing']} 个向量，多余 {report['stale']} 个向量，开始同步")
+                        self._rebuild_index(db)
+                # 启动时构建 BM25 索引，分词器词典变化后的重新分词结果写回数据库
+                if self.use_hybrid_search and self.bm25_index is None:
+                    self._build_bm25_index(db, persist_tokens=True)
         except Exception as e:
-            print(f"⚠ 保存向量索引失败: {e}")
+            print(f"⚠ 向量索引初始化同步失败: {e}")
     
-    def _tokenize_chinese(self, text: str) -> List[str]:
-        """中文分词（用于BM25）"""
-        if not text:
-            return []
+    def check_index_consistency(self, db: Session) -> Dict:
+        """
+        检查向量索引与 knowledge_chunks 表是否一致（启用文档的块都有向量、没有多余向量）
+        索引无未保存修改时先比对快照清单中的向量数和ID校验和，一致则无需遍历索引
         
-        if JIEBA_AVAILABLE:
-            # 使用jieba分词
-            return list(jieba.cut(text))
-        else:
-            # 简单的中文分词：按字符分割（对于中文，每个字符通常是一个词）
-            # 同时保留英文单词
-            import re
-            # 分离中文字符和英文单词
-            chinese_chars = re.findall(r'[\u4e00-\u9fff]', text)
-            english_words = re.findall(r'[a-zA-Z]+', text)
-            return chinese_chars + english_words
-    
-    def _build_bm25_index(self, db: Optional[Session] = None):
-        """构建BM25索引（从数据库加载所有块）"""
-        if not BM25_AVAILABLE:
+        返回:
+        - Dict: consistent, generation, indexed（索引向量数）, expected（应有向量数）, missing, stale
+        """
+        expected = np.fromiter(
+            (v for (v,) in db.query(KnowledgeChunk.vector_id).join(
+                KnowledgeDocument, KnowledgeChunk.document_id == KnowledgeDocument.id
+            ).filter(
+                KnowledgeDocument.active == True,
+                KnowledgeChunk.vector_id.isnot(None)
+            )),
+            dtype=np.int64
+        )
+        store = self.vector_store
+        report = {
+            "generation": store.generation if store is not None else 0,
+            "expected": int(len(expected)),
+        }
+        if store is None:
+            report.update(consistent=len(expected) == 0, indexed=0, missing=int(len(expected)), stale=0)
+            return report
+        
+        manifest = store.manifest
+        if (not store.dirty and manifest.get("vector_count") == len(expected)
+                and manifest.get("vector_id_checksum") == vector_id_checksum(expected)):
+            report.update(consistent=True, indexed=int(len(expected)), missing=0, stale=0)
+            return report
+        
+        indexed = store.ids()
+        missing = np.setdiff1d(expected, indexed, assume_unique=True)
+        stale = np.setdiff1d(indexed, expected, assume_unique=True)
+        report.update(
+            consistent=not len(missing) and not len(stale),
+            indexed=int(len(indexed)), missing=int(len(missing)), stale=int(len(stale))
+        )
+        return report
+    
+    def _embedding_model_changed(self) -> bool:
+        """索引是否由其他嵌入模型构建（需要全量重新向量化）"""
+        if self.vector_store is None or not self.embedding_model:
+            return False
+        if self.vector_store.d != self.vector_dim:
+            return True
+        stored_model = self.vector_store.model_name
+        return bool(stored_model) and stored_model != self.embedding_model_name
+    
+    @_synchronized
+    def _migrate_vector_ids(self, db: Session):
+        """
+        将旧版向量ID（按位置编号 / 合成ID）迁移为块主键
+        已有向量通过 reconstruct 取回后按新ID重新写入，不需要重新向量化
+        """
+        stale_chunks = db.query(KnowledgeChunk).filter(
+            (KnowledgeChunk.vector_id.is_(None)) | (KnowledgeChunk.vector_id != KnowledgeChunk.id),
+            KnowledgeChunk.duplicate_of.is_(None)  # 近重复块没有自己的向量
+        ).all()
+        if not stale_chunks and not self.vector_store.legacy_ids:
             return
         
+        indexed_ids = set(self.vector_store.ids().tolist())
+        chunks = db.query(KnowledgeChunk).filter(KnowledgeChunk.vector_id.isnot(None)).all()
+        id_pairs = [(c.vector_id, c.id) for c in chunks if c.vector_id in indexed_ids]
+        vectors = self.vector_store.reconstruct([old_id for old_id, _ in id_pairs])
+        
+        # 按新ID重建索引（无对应块的孤立向量一并丢弃）
+        self.vector_store.build(
+            [new_id for _, new_id in id_pairs], vectors,
+            self.vector_store.model_name or self.embedding_model_name, self.vector_store.d
+        )
+        for chunk in stale_chunks:
+            chunk.vector_id = chunk.id
+        db.commit()
+        
+        self.vector_store.legacy_ids = False
+        self._save_vector_index()
+        if self.chunk_store.loaded:
+            self.chunk_store.load(db)
+        self.invalidate_retrieval_cache()
+        print(f"✓ 向量ID已迁移为块ID: {len(stale_chunks)} 个块，保留 {len(id_pairs)} 个向量")
+    
+    def _save_vector_index(self):
+        """保存向量索引到文件"""
+        if not FAISS_AVAILABLE or self.vector_store is None:
+            return
+        
+        if not self.vector_store.model_name and self.embedding_model_name:
+            self.vector_store.meta["model"] = self.embedding_model_name
+        self.vector_store.save()
+    
+    def _add_chunk_vectors(self, chunks: List[KnowledgeChunk], embeddings: Optional[np.ndarray] = None) -> int:
+        """为指定块向量化并按其 vector_id 写入索引（可传入预先计算的向量），返回写入的向量数"""
+        if not chunks or not self.embedding_model or self.vector_store is None:
+            return 0
+        
+        if embeddings is None:
+            embeddings = self.embed_texts([c.content for c in chunks])
+        if embeddings is None:
+            return 0
+        self.vector_store.add([c.vector_id for c in chunks], embeddings)
+        return len(chunks)
+    
+    def _remove_vectors(self, vector_ids: List[int]) -> int:
+        """从索引中删除指定向量，返回实际删除的数量"""
+        if self.dedup_index is not None:
+            for vector_id in vector_ids:
+                if vector_id is not None:
+                    self.dedup_index.remove(vector_id)
+        if self.vector_store is None:
+            return 0
+        return self.vector_store.remove([v for v in vector_ids if v is not None])
+    
+    def _tokenize_chinese(self, text: str) -> List[str]:
+        """中文分词（用于BM25，与其他检索功能共用分词器）"""
+        return self.tokenizer.tokenize(text)
+    
+    def _chunk_token_ids(self, chunk: KnowledgeChunk) -> List[int]:
+        """块的 token id 序列（持久化结果仍有效时直接使用，见 Tokenizer.is_current）"""
+        if chunk.token_ids is not None and self.tokenizer.is_current(chunk.content, chunk.token_version):
+            return unpack_token_ids(chunk.token_ids).tolist()
+        return self._assign_chunk_tokens(chunk)
+    
+    def _assign_chunk_tokens(self, chunk: KnowledgeChunk) -> List[int]:
+        """对块内容分词，并把 token id 写入块记录（随块一起提交）"""
+        ids = self.tokenizer.token_ids(chunk.content)
+        chunk.token_ids = pack_token_ids(ids)
+        chunk.token_version = self.tokenizer.version
+        return ids.tolist()
+    
+    def _build_bm25_index(self, db: Optional[Session] = None, persist_tokens: bool = False):
+        """
+        全量构建BM25倒排索引（从数据库加载所有活跃块，仅用于首次加载和重建索引）
+        持久化 token id 仍有效的块不再分词（分词器版本一致，且内容不含商品词典新增的词）；
+        persist_tokens=True 时把新的分词结果写回数据库，并保存分词词典（之后新增词不再使这些块失效）
+        """
         if db is None:
             # 延迟构建，需要时再构建
             return
         
         try:
             # 从数据库加载所有活跃的块（使用明确的join条件）
-            chunks = db.query(KnowledgeChunk).join(
+            chunks = db.query(
+                KnowledgeChunk.id, KnowledgeChunk.vector_id, KnowledgeChunk.content,
+                KnowledgeChunk.token_ids, KnowledgeChunk.token_version
+            ).join(
                 KnowledgeDocument, KnowledgeChunk.document_id == KnowledgeDocument.id
             ).filter(
-                KnowledgeDocument.active == True
-            ).order_by(KnowledgeChunk.vector_id.asc()).all()
-            
-            if not chunks:
-                self.bm25_index = None
-                self.bm25_chunk_texts = []
-                self.bm25_chunk_map = {}
-                return
+                KnowledgeDocument.active == True,
+                KnowledgeChunk.vector_id.isnot(None)
+            ).all()
             
-            # 构建BM25索引
-            self.bm25_chunk_texts = []
-            self.bm25_chunk_map = {}
-            
-            for chunk in chunks:
-                if chunk.vector_id is not None:
-                    # 分词处理
-                    tokenized = self._tokenize_chinese(chunk.content)
-                    self.bm25_chunk_texts.append(tokenized)
-                    self.bm25_chunk_map[len(self.bm25_chunk_texts) - 1] = chunk.vector_id
-            
-            if self.bm25_chunk_texts:
-                self.bm25_index = BM25Okapi(self.bm25_chunk_texts)
-                print(f"✓ BM25索引已构建: {len(self.bm25_chunk_texts)} 个文档块")
-            else:
-                self.bm25_index = None
+            version = self.tokenizer.version
+            index = InvertedIndex()
+            updates = []
+            for chunk_id, vector_id, content, token_ids, token_version in chunks:
+                if token_ids is not None and self.tokenizer.is_current(content, token_version):
+                    ids = unpack_token_ids(token_ids)
+                else:
+                    ids = self.tokenizer.token_ids(content)
+                    updates.append({"id": chunk_id, "token_ids": pack_token_ids(ids), "token_version": version})
+                index.add(vector_id, ids.tolist())
+            self.bm25_index = index
+            if persist_tokens:
+                if self.tokenizer.new_words:
+                    # 不参与 BM25 的块（停用文档、近似重复块）含新增词时清除分词结果，下次使用时重新分词
+                    scanned = {chunk_id for chunk_id, *_ in chunks}
+                    others = db.query(KnowledgeChunk.id, KnowledgeChunk.content).filter(
+                        KnowledgeChunk.token_version == version
+                    ).all()
+                    updates += [{"id": chunk_id, "token_ids": None, "token_version": None}
+                                for chunk_id, content in others
+                                if chunk_id not in scanned and not self.tokenizer.is_current(content, version)]
+                if updates:
+                    db.bulk_update_mappings(KnowledgeChunk, updates)
+                    db.commit()
+                self.tokenizer.save_dictionary()
+            print(f"✓ BM25索引已构建: {len(index)} 个文档块（重新分词 {len(updates)} 个），词表 {index.vocabulary_size} 个词")
         except Exception as e:
             print(f"⚠ 构建BM25索引失败: {e}")
             import traceback
             traceback.print_exc()
             self.bm25_index = None
     
+    def ensure_chunk_store(self, db: Session):
+        """确保块内存存储已加载（分类过滤和结果回填依赖它）"""
+        if not self.chunk_store.loaded:
+            self.chunk_store.load(db)
+    
+    def _category_vector_ids(self, category: Optional[str]) -> Optional[np.ndarray]:
+        """分类下的候选 vector_id；未指定分类（或块存储未加载、无法过滤）时返回 None"""
+        if not category or not self.chunk_store.loaded:
+            return None
+        return self.chunk_store.vector_ids_for_category(category)
+    
+    def _bm25_add_chunks(self, chunks: List[KnowledgeChunk]):
+        """将块增量加入BM25索引（索引尚未构建时跳过，首次检索时会全量构建）"""
+        if not self.use_hybrid_search or self.bm25_index is None:
+            return
+        for chunk in chunks:
+            if chunk.vector_id is not None:
+                self.bm25_index.add(chunk.vector_id, self._chunk_token_ids(chunk))
+    
+    def _bm25_remove(self, vector_ids: List[int]):
+        """从BM25索引中增量删除块"""
+        if self.bm25_index is None:
+            return
+        for vector_id in vector_ids:
+            if vector_id is not None:
+                self.bm25_index.remove(vector_id)
+    
     def search_bm25(self, query: str, top_k: Optional[int] = None, category: Optional[str] = None) -> List[Dict]:
         """
-        BM25关键词检索
+        BM25关键词检索（只对查询词的倒排表打分）
         
         参数:
         - query: 查询文本
         - top_k: 返回的Top-K结果数量
-        - category: 分类筛选（可选，需要在后续步骤中处理）
+        - category: 分类筛选（可选，在倒排表打分时按块过滤；需已加载块内存存储）
         
         返回:
         - List[Dict]: 包含 vector_id, bm25_score 的结果列表，按BM25分数降序排列
         """
-        if not BM25_AVAILABLE or self.bm25_index is None:
+        if self.bm25_index is None:
             return []
         
         if not query or not query.strip():
@@ -247,28 +550,19 @@ class RAGService:
         
         try:
             # 对查询文本进行分词
-            query_tokens = self._tokenize_chinese(query.strip())
+            query_tokens = self.tokenizer.token_ids(query.strip()).tolist()
             if not query_tokens:
                 return []
             
-            # BM25检索
-            scores = self.bm25_index.get_scores(query_tokens)
-            
-            # 构建结果列表
-            results = []
-            for idx, score in enumerate(scores):
-                vector_id = self.bm25_chunk_map.get(idx)
-                if vector_id is not None and score > 0:  # 只保留分数大于0的结果
-                    results.append({
-                        "vector_id": int(vector_id),
-                        "bm25_score": float(score)
-                    })
-            
-            # 按BM25分数降序排序
-            results.sort(key=lambda x: x["bm25_score"], reverse=True)
+            allowed_ids = self._category_vector_ids(category)
+            if allowed_ids is not None and len(allowed_ids) == 0:
+                return []
             
-            # 返回Top-K
-            return results[:top_k * 2]  # 返回更多候选，用于混合检索
+            # 返回更多候选，用于混合检索
+            return [
+                {"vector_id": vector_id, "bm25_score": score}
+                for vector_id, score in self.bm25_index.search(query_tokens, top_k * 2, allowed_ids)
+            ]
             
         except Exception as e:
             print(f"⚠ BM25检索失败: {e}")
@@ -313,17 +607,49 @@ class RAGService:
         
         return chunks
     
+    @staticmethod
+    def _normalize_query(text: str) -> str:
+        """规范化查询文本（去首尾空白、合并连续空白、英文小写），用作缓存键"""
+        return re.sub(r"\s+", " ", text.strip()).lower()
+    
+    def _encode_queries(self, texts: List[str]) -> np.ndarray:
+        """查询向量推理（使用当前的嵌入模型，一致性检查回退 fp32 后立即生效）"""
+        return self.embedding_model.encode(texts, normalize_embeddings=True, show_progress_bar=False)
+    
+    def _get_query_batcher(self) -> EmbeddingBatcher:
+        if self.query_batcher is None:
+            with self._batcher_lock:
+                if self.query_batcher is None:
+                    self.query_batcher = EmbeddingBatcher(
+                        self._encode_queries,
+                        max_batch_size=self.query_batch_max_size,
+                        max_wait_ms=self.query_batch_max_wait_ms,
+                    )
+        return self.query_batcher
+    
     def embed_text(self, text: str) -> Optional[np.ndarray]:
-        """将文本转换为向量"""
+        """将文本转换为向量（查询向量经 LRU 缓存，返回的数组为只读）"""
         if not self.embedding_model or not text:
             return None
         
+        cache_key = (self.embedding_cache_name, self._normalize_query(text))
+        cached = self.query_embedding_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
-            embedding = self.embedding_model.encode([text], normalize_embeddings=True)[0]
-            return embedding.astype('float32')
+            if self.query_batch_enabled:
+                embedding = self._get_query_batcher().embed(text)
+            else:
+                embedding = self._encode_queries([text])[0]
+            embedding = np.asarray(embedding, dtype='float32')
         except Exception as e:
             print(f"⚠ 文本向量化失败: {e}")
             return None
+        
+        embedding.flags.writeable = False
+        self.query_embedding_cache.set(cache_key, embedding)
+        return embedding
     
     def embed_texts(self, texts: List[str]) -> Optional[np.ndarray]:
         """
@@ -337,39 +663,33 @@ class RAGService:
         if texts and isinstance(texts[0], dict):
             texts = [item.get("content", "") if isinstance(item, dict) else str(item) for item in texts]
         
+        # 先查持久化嵌入缓存，只对未命中的文本做模型推理
+        cached, missing = self.embedding_cache.lookup(texts, self.embedding_cache_name, self.vector_dim)
+        if not missing:
+            return np.vstack([cached[i] for i in range(len(texts))]).astype('float32')
+        
         try:
-            embeddings = self.embedding_model.encode(texts, normalize_embeddings=True, show_progress_bar=False)
-            return embeddings.astype('float32')
+            missing_texts = [texts[i] for i in missing]
+            encoded = self.embedding_model.encode(missing_texts, normalize_embeddings=True, show_progress_bar=False)
+            encoded = np.asarray(encoded, dtype='float32')
         except Exception as e:
             print(f"⚠ 批量文本向量化失败: {e}")
             return None
-    
-    def add_document(self, db: Session, title: str, content: str, source_type: str = "manual", 
-                     source_url: Optional[str] = None, category: Optional[str] = None,
-                     tags: Optional[str] = None) -> KnowledgeDocument:
-        """
-        添加文档到知识库（数据准备阶段）
         
-        完整流程：
-        1. 文本预处理（规范化、结构化、清理、分块、元数据提取）
-        2. 向量化（使用嵌入模型将文本块转换为向量）
-        3. 存储到向量数据库（FAISS）
-        4. 存储到关系数据库（SQLite）
+        self.embedding_cache.store(missing_texts, self.embedding_cache_name, encoded)
+        if not cached:
+            return encoded
         
-        参数:
-        - db: 数据库会话
-        - title: 文档标题
-        - content: 文档内容
-        - source_type: 来源类型（manual, pdf, web, api, database）
-        - source_url: 来源URL
-        - category: 分类
-        - tags: 标签
-        
-        返回:
-        - KnowledgeDocument: 创建的文档对象
+        embeddings = np.empty((len(texts), encoded.shape[1]), dtype='float32')
+        for i, vector in cached.items():
+            embeddings[i] = vector
+        embeddings[missing] = encoded
+        return embeddings
+    
+    def _prepare_content(self, content: str, source_url: Optional[str] = None) -> Tuple[str, Dict, List[Dict]]:
+        """
+        文本预处理（5个子步骤），返回 (清洗后的内容, 元数据, 分块结果)
         """
-        # ========== 步骤1：文本预处理（5个子步骤）==========
-        
         # (1) 文本规范化
         normalized_content = self.text_cleaner.normalize_text(content)
         if not normalized_content:
@@ -384,21 +704,21 @@ class RAGService:
             raise ValueError(f"文档质量评分过低 ({quality_info.get('quality_score', 0):.2f})，已过滤")
         
         # (5) 元数据提取
-        metadata = self.text_cleaner.extract_metadata(cleaned_content, source_url)
-        metadata["quality_score"] = quality_info.get("quality_score", 0.0)
-        metadata_json = json.dumps(metadata, ensure_ascii=False)
+        metadata = self.text_cleaner.extract_metadata(cleaned_content, source_url,
+                                                      quality_score=quality_info.get("quality_score", 0.0))
         
         # (4) 分块优化
         chunk_data = self.chunk_text(cleaned_content)
         if not chunk_data:
             raise ValueError("文档分块失败")
         
-        # 提取块内容列表（用于向量化）
-        chunk_contents = [chunk["content"] for chunk in chunk_data]
-        
-        # ========== 步骤2：存储文档到数据库 ==========
-        # 创建文档记录
-        doc = KnowledgeDocument(
+        return cleaned_content, metadata, chunk_data
+    
+    @staticmethod
+    def _new_document(title: str, cleaned_content: str, metadata: Dict, chunk_data: List[Dict], source_type: str,
+                      source_url: Optional[str], category: Optional[str], tags: Optional[str]) -> KnowledgeDocument:
+        """根据预处理结果创建文档记录（未加入会话）"""
+        return KnowledgeDocument(
             title=title,
             content=cleaned_content,  # 存储清洗后的内容
             source_type=source_type,
@@ -406,95 +726,689 @@ class RAGService:
             category=category,
             tags=tags,
             chunk_count=len(chunk_data),
-            document_metadata=metadata_json,  # 存储元数据
+            document_metadata=json.dumps(metadata, ensure_ascii=False),  # 存储元数据
             quality_score=metadata["quality_score"]  # 存储质量评分
         )
-        db.add(doc)
+    
+    def _new_chunk_records(self, db: Session, doc: KnowledgeDocument, chunk_data: List[Dict],
+                           start: int = 0) -> List[KnowledgeChunk]:
+        """
+        为文档创建块记录并加入会话（同时分词；尚未 flush，块ID和 vector_id 由调用方在 flush 后设置）
+        start 为第一个块的序号（流式导入分批创建块时使用）
+        """
+        chunk_records = []
+        for i, chunk_info in enumerate(chunk_data, start):
+            # 块元数据
+            chunk_metadata = {
+                "title": chunk_info.get("title"),
+                "type": chunk_info.get("type", "paragraph"),
+                "chunk_index": chunk_info.get("chunk_index", i)
+            }
+            chunk_record = KnowledgeChunk(
+                document_id=doc.id,
+                chunk_index=i,
+                content=chunk_info["content"],
+                chunk_metadata=json.dumps(chunk_metadata, ensure_ascii=False)
+            )
+            self._assign_chunk_tokens(chunk_record)
+            db.add(chunk_record)
+            chunk_records.append(chunk_record)
+        return chunk_records
+    
+    def _ensure_dedup_index(self, db: Session) -> Optional[DedupIndex]:
+        """
+        近重复检测索引（首次写入时从数据库加载启用文档中写入了向量的块）
+        未启用去重、或没有嵌入模型和向量索引（无法做余弦确认）时返回 None
+        """
+        if not self.dedup_enabled or not self.embedding_model or self.vector_store is None:
+            return None
+        if self.dedup_index is None:
+            index = DedupIndex()
+            rows = db.query(KnowledgeChunk.id, KnowledgeChunk.content).join(
+                KnowledgeDocument, KnowledgeChunk.document_id == KnowledgeDocument.id
+            ).filter(
+                KnowledgeDocument.active == True,
+                KnowledgeChunk.vector_id.isnot(None)
+            ).all()
+            for chunk_id, content in rows:
+                index.add(chunk_id, index.signature(content))
+            self.dedup_index = index
+            print(f"✓ 近重复检测索引已构建: {len(index)} 个块")
+        return self.dedup_index
+    
+    def _confirm_duplicate(self, db: Session, category: Optional[str], candidates: List[Tuple[int, float]],
+                           embedding: np.ndarray, pending: Dict[int, np.ndarray]) -> Optional[int]:
+        """在同分类的 LSH 候选块中找出与新块嵌入余弦相似度达到阈值的规范块ID"""
+        candidate_ids = [chunk_id for chunk_id, _ in candidates]
+        same_category = {
+            chunk_id for (chunk_id,) in db.query(KnowledgeChunk.id).join(
+                KnowledgeDocument, KnowledgeChunk.document_id == KnowledgeDocument.id
+            ).filter(
+                KnowledgeChunk.id.in_(candidate_ids),
+                KnowledgeDocument.category == category
+            )
+        }
+        for chunk_id in candidate_ids:
+            if chunk_id not in same_category:
+                continue
+            vector = pending.get(chunk_id)
+            if vector is None:
+                try:
+                    vector = self.vector_store.reconstruct([chunk_id])[0]
+                except Exception:
+                    continue  # 候选块没有向量（向量化失败），不作为引用目标
+            if float(np.dot(vector, embedding)) >= self.dedup_min_cosine:
+                return chunk_id
+        return None
+    
+    def _mark_duplicates(self, db: Session, doc: KnowledgeDocument, records: List[KnowledgeChunk],
+                         embeddings: np.ndarray, pending: Dict[int, np.ndarray]) -> np.ndarray:
+        """
+        逐块检测近重复：重复块设置 duplicate_of 并清空 vector_id，其余块作为规范块加入近重复检测索引
+        pending 为同一事务中已确认、尚未写入向量索引的规范块向量（同批文档之间也能去重）
+        
+        返回:
+        - np.ndarray: 需要写入向量的块掩码
+        """
+        keep = np.ones(len(records), dtype=bool)
+        for i, record in enumerate(records):
+            signature = self.dedup_index.signature(record.content)
+            candidates = self.dedup_index.candidates(signature, self.dedup_min_jaccard)
+            canonical_id = (self._confirm_duplicate(db, doc.category, candidates, embeddings[i], pending)
+                            if candidates else None)
+            if canonical_id is None:
+                self.dedup_index.add(record.id, signature)
+                pending[record.id] = embeddings[i]
+            else:
+                record.duplicate_of = canonical_id
+                record.vector_id = None
+                keep[i] = False
+        self.dedup_skipped += int(len(records) - keep.sum())
+        return keep
+    
+    def _promote_duplicates(self, db: Session, canonical_ids: List[int], only_active: bool = False) -> int:
+        """
+        规范块被删除或停用后，把引用它的近重复块之一（启用文档中的块优先）提升为新的规范块，
+        补建向量并写入各索引，其余重复块改为引用新的规范块（只 flush，由调用方提交）
+        only_active=True（规范块仍存在、只是停用）时，没有启用文档中的引用块则保持原引用
+        
+        返回:
+        - int: 提升的块数
+        """
+        canonical_ids = [i for i in canonical_ids if i is not None]
+        if not canonical_ids:
+            return 0
+        rows = db.query(KnowledgeChunk, KnowledgeDocument).join(
+            KnowledgeDocument, KnowledgeChunk.document_id == KnowledgeDocument.id
+        ).filter(KnowledgeChunk.duplicate_of.in_(canonical_ids)).order_by(KnowledgeChunk.id).all()
+        groups: Dict[int, List[Tuple[KnowledgeChunk, KnowledgeDocument]]] = {}
+        for chunk, doc in rows:
+            groups.setdefault(chunk.duplicate_of, []).append((chunk, doc))
+        
+        promoted = []
+        for members in groups.values():
+            active_members = [(c, d) for c, d in members if d.active]
+            if only_active and not active_members:
+                continue
+            chunk, doc = (active_members or members)[0]
+            chunk.duplicate_of = None
+            chunk.vector_id = chunk.id
+            for other, _ in members:
+                if other is not chunk:
+                    other.duplicate_of = chunk.id
+            promoted.append((chunk, doc))
+        if not promoted:
+            return 0
         db.flush()
         
-        # ========== 步骤3：向量化与索引构建 ==========
-        SYNTHETIC_OFFSET = 1000000  # 向量化失败时使用的合成 ID 前缀，避免与 FAISS 冲突
-        chunks_created = False
-        if self.embedding_model and FAISS_AVAILABLE and self.vector_index is not None:
-            # 3.1 批量向量化（使用嵌入模型将文本块转换为向量）
-            embeddings = self.embed_texts(chunk_contents)
-            if embeddings is not None:
-                start_id = self.vector_index.ntotal
-                
-                # 3.2 添加到FAISS向量索引（用于快速相似度检索）
-                self.vector_index.add(embeddings)
-                
-                # 3.3 创建块记录并存储到数据库（包含向量ID映射）
-                for i, (chunk_info, embedding) in enumerate(zip(chunk_data, embeddings)):
-                    # 块元数据
-                    chunk_metadata = {
-                        "title": chunk_info.get("title"),
-                        "type": chunk_info.get("type", "paragraph"),
-                        "chunk_index": chunk_info.get("chunk_index", i)
-                    }
-                    
-                    chunk_record = KnowledgeChunk(
-                        document_id=doc.id,
-                        chunk_index=i,
-                        content=chunk_info["content"],
-                        chunk_metadata=json.dumps(chunk_metadata, ensure_ascii=False),
-                        vector_id=start_id + i  # 存储向量ID，用于检索时映射
-                    )
-                    db.add(chunk_record)
-                chunks_created = True
-
-                print(f"  → 已向量化并存储到FAISS索引（向量ID: {start_id}-{start_id + len(chunk_data) - 1}）")
+        indexed = [(chunk, doc) for chunk, doc in promoted if doc.active]
+        self._add_chunk_vectors([chunk for chunk, _ in indexed])
+        self._bm25_add_chunks([chunk for chunk, _ in indexed])
+        for chunk, doc in promoted:
+            self.chunk_store.add_chunks(doc, [chunk])
+        if self.dedup_index is not None:
+            for chunk, _ in indexed:
+                self.dedup_index.add(chunk.id, self.dedup_index.signature(chunk.content))
+        print(f"  → {len(promoted)} 个近重复块已提升为规范块")
+        return len(promoted)
+    
+    def _store_chunks(self, db: Session, doc: KnowledgeDocument, chunk_data: List[Dict],
+                      embeddings: Optional[np.ndarray] = None) -> List[KnowledgeChunk]:
+        """
+        创建块记录并向量化写入索引（embeddings 为预先计算的块向量，可选）
+        向量ID直接取块主键（稳定、唯一），删除/替换文档时可按ID精确移除向量；
+        与已有块近重复的块只记录 duplicate_of 引用，不写入向量、BM25 和块存储；
+        向量化失败或无嵌入模型时仍创建 chunks 供 BM25 检索，之后重建索引时补建向量；
+        向量在提交前写入索引，调用方用 _commit_stored_chunks 提交（失败时移除这些向量）
+        """
+        # 先于新块 flush 构建近重复检测索引，避免把本文档的块当作已有块
+        dedup_index = self._ensure_dedup_index(db) if doc.active else None
+        chunk_records = self._new_chunk_records(db, doc, chunk_data)
+        db.flush()
+        
+        for chunk_record in chunk_records:
+            chunk_record.vector_id = chunk_record.id
+        
+        if doc.active and self.embedding_model and FAISS_AVAILABLE and self.vector_store is not None:
+            if dedup_index is not None and embeddings is None:
+                embeddings = self.embed_texts([c.content for c in chunk_records])
+            unique_records = chunk_records
+            if dedup_index is not None and embeddings is not None:
+                keep = self._mark_duplicates(db, doc, chunk_records, embeddings, {})
+                unique_records = [c for c, kept in zip(chunk_records, keep) if kept]
+                embeddings = embeddings[keep]
+            if not unique_records:
+                print(f"  → 全部 {len(chunk_records)} 个块与已有内容近重复，未写入新向量")
+            elif self._add_chunk_vectors(unique_records, embeddings):
+                print(f"  → 已向量化并存储到FAISS索引（{len(unique_records)} 个向量）")
             else:
                 print(f"  → 向量化失败，将仅创建 chunks 供 BM25 检索")
+        self.chunk_store.add_chunks(doc, chunk_records)  # 近重复块没有 vector_id，不进入块存储
         
-        # 向量化失败或无嵌入模型时：仍创建 chunks，使用合成 vector_id 供 BM25 检索
-        if not chunks_created:
-            for i, chunk_info in enumerate(chunk_data):
-                chunk_metadata = {
-                    "title": chunk_info.get("title"),
-                    "type": chunk_info.get("type", "paragraph"),
-                    "chunk_index": chunk_info.get("chunk_index", i)
-                }
-                synthetic_id = SYNTHETIC_OFFSET + doc.id * 10000 + i
-                chunk_record = KnowledgeChunk(
-                    document_id=doc.id,
-                    chunk_index=i,
-                    content=chunk_info["content"],
-                    chunk_metadata=json.dumps(chunk_metadata, ensure_ascii=False),
-                    vector_id=synthetic_id  # 合成 ID，仅用于 BM25 检索
-                )
-                db.add(chunk_record)
+        return chunk_records
+    
+    def _commit_stored_chunks(self, db: Session, chunk_records: List[KnowledgeChunk]):
+        """提交 _store_chunks 写入的块；提交失败时回滚，并移除已写入向量索引和块存储的条目"""
+        vector_ids = [c.vector_id for c in chunk_records if c.vector_id is not None]
+        try:
+            db.commit()
+        except Exception:
+            db.rollback()
+            self._remove_vectors(vector_ids)
+            self.chunk_store.remove_chunks(vector_ids)
+            raise
+    
+    def add_document(self, db: Session, title: str, content: str, source_type: str = "manual", 
+                     source_url: Optional[str] = None, category: Optional[str] = None,
+                     tags: Optional[str] = None,
+                     progress: Optional[Callable[[str, float], None]] = None,
+                     document_created: Optional[Callable[[int], None]] = None) -> KnowledgeDocument:
+        """
+        添加文档到知识库（数据准备阶段）
         
-        # 3.4 提交数据库事务
-        db.commit()
+        完整流程：
+        1. 文本预处理（规范化、结构化、清理、分块、元数据提取）
+        2. 向量化（使用嵌入模型将文本块转换为向量）
+        3. 存储到向量数据库（FAISS）
+        4. 存储到关系数据库（SQLite）
+        
+        参数:
+        - db: 数据库会话
+        - title: 文档标题
+        - content: 文档内容
+        - source_type: 来源类型（manual, pdf, web, api, database）
+        - source_url: 来源URL
+        - category: 分类
+        - tags: 标签
+        - progress: 进度回调 (阶段, 0-1)，导入任务用于上报 clean / embed / index 阶段
+        - document_created: 走流式导入时，停用状态的文档记录提交后以文档ID回调（导入任务据此在中断后清理）
+        
+        返回:
+        - KnowledgeDocument: 创建的文档对象
+        """
+        if content and len(content) >= self.stream_min_chars:
+            # 超大文档走流式预处理，按段落边界切段后逐段处理
+            return self.add_document_stream(db, title, iter_text_blocks(content), source_type, source_url,
+                                            category, tags, progress, document_created=document_created)
+
+        report = progress or (lambda stage, value: None)
+        
+        # ========== 步骤1：文本预处理（5个子步骤）==========
+        report("clean", 0.3)
+        cleaned_content, metadata, chunk_data = self._prepare_content(content, source_url)
+        
+        # 在写锁外预先向量化，多个导入任务可并行推理
+        report("embed", 0.5)
+        embeddings = None
+        if self.embedding_model and FAISS_AVAILABLE and self.vector_store is not None:
+            embeddings = self.embed_texts([c["content"] for c in chunk_data])
+        
+        report("index", 0.8)
+        with self.write_lock:
+            return self._insert_document(db, title, cleaned_content, metadata, chunk_data, embeddings,
+                                         source_type, source_url, category, tags)
+    
+    def _insert_document(self, db: Session, title: str, cleaned_content: str, metadata: Dict,
+                         chunk_data: List[Dict], embeddings: Optional[np.ndarray], source_type: str,
+                         source_url: Optional[str], category: Optional[str], tags: Optional[str]) -> KnowledgeDocument:
+        """写入文档、块记录和各索引（调用方持有写锁）"""
+        # ========== 步骤2：存储文档到数据库 ==========
+        # 创建文档记录
+        doc = self._new_document(title, cleaned_content, metadata, chunk_data, source_type, source_url, category, tags)
+        db.add(doc)
+        db.flush()
+        
+        # ========== 步骤3：向量化与索引构建 ==========
+        # 3.1-3.3 创建块记录、批量向量化并按块ID写入FAISS索引
+        chunk_records = self._store_chunks(db, doc, chunk_data, embeddings)
+        
+        # 3.4 提交数据库事务（失败时移除已写入的向量）
+        self._commit_stored_chunks(db, chunk_records)
         db.refresh(doc)
         
         # 3.5 保存向量索引到文件（持久化）
         self._save_vector_index()
         
-        # 3.6 重建BM25索引（如果启用混合检索）
-        if self.use_hybrid_search and BM25_AVAILABLE:
-            self._build_bm25_index(db)
+        # 3.6 增量更新BM25索引（如果启用混合检索）
+        if doc.active:
+            self._bm25_add_chunks(chunk_records)
+        self.invalidate_retrieval_cache()
         
-        print(f"✓ 文档已添加: {title}, 块数: {len(chunk_data)}, 质量评分: {metadata['quality_score']:.2f}")
+        duplicates = sum(1 for c in chunk_records if c.duplicate_of is not None)
+        print(f"✓ 文档已添加: {title}, 块数: {len(chunk_data)}, 质量评分: {metadata['quality_score']:.2f}"
+              + (f", 近重复块: {duplicates}（引用已有块，未写入向量）" if duplicates else ""))
+
+        return doc
+    
+    def add_document_stream(self, db: Session, title: str, parts: Iterable[str], source_type: str = "manual",
+                            source_url: Optional[str] = None, category: Optional[str] = None,
+                            tags: Optional[str] = None,
+                            progress: Optional[Callable[[str, float], None]] = None,
+                            embed_batch_size: Optional[int] = None,
+                            document_created: Optional[Callable[[int], None]] = None) -> KnowledgeDocument:
+        """
+        流式添加大文档（如几百页的产品手册）
+
+        parts 逐页/逐段产出原始文本，规范化、结构化、清理和分块边读边做，
+        块每攒够 embed_batch_size 个（默认 RAG_BULK_EMBED_BATCH_SIZE）就向量化、近重复检测并写入索引；
+        内存中只有当前一批块和要写入文档记录的清洗后全文，不再同时持有全文的各中间副本、全部块和全部块向量
+
+        与 add_document 的区别：
+        - 不做 FAQ 分块；块按标题分节，块元数据带所在节的标题
+        - 每批块在写锁外向量化，再用一个短事务写入，导入期间其他写操作不会被长事务阻塞；
+          文档在全部块写完后才启用，失败时删除文档及已写入的块和向量
+        - 质量评分按逐行累计的统计计算，评分过低时同样拒绝导入
+        """
+        stats: Dict = {}
+        content = io.StringIO()
+        if progress:
+            parts = _on_first(parts, lambda: progress("clean", 0.3))
+        chunks = self.text_cleaner.iter_document_chunks(parts, stats, self.chunk_size, self.chunk_overlap, sink=content)
+        return self._add_chunk_stream(db, title, chunks, stats, content, source_type, source_url, category, tags,
+                                      progress, embed_batch_size, document_created)
+
+    def add_table_stream(self, db: Session, title: str, rows: Iterable[Tuple[str, List[str]]],
+                         source_type: str = "excel", source_url: Optional[str] = None,
+                         category: Optional[str] = None, tags: Optional[str] = None,
+                         progress: Optional[Callable[[str, float], None]] = None,
+                         embed_batch_size: Optional[int] = None,
+                         document_created: Optional[Callable[[int], None]] = None) -> KnowledgeDocument:
+        """
+        流式添加表格文档（几十万行的价格表、SKU 表等）
+
+        rows 逐行产出 (工作表名, 单元格文本列表)（见 spreadsheet_reader.iter_sheet_rows），
+        行按窗口拼成块，每个块重复工作表名和表头；逐批向量化、短事务写入和失败清理与 add_document_stream 相同，
+        内存中只有当前一批块和清洗后全文，不再把工作簿载入 DataFrame 再整体转成字符串
+        """
+        stats: Dict = {}
+        content = io.StringIO()
+        if progress:
+            rows = _on_first(rows, lambda: progress("clean", 0.3))
+        chunks = self.text_cleaner.iter_table_chunks(rows, stats, self.chunk_size, sink=content)
+        return self._add_chunk_stream(db, title, chunks, stats, content, source_type, source_url, category, tags,
+                                      progress, embed_batch_size, document_created)
+
+    def _add_chunk_stream(self, db: Session, title: str, chunks: Iterable[Dict], stats: Dict, content: io.StringIO,
+                          source_type: str, source_url: Optional[str], category: Optional[str], tags: Optional[str],
+                          progress: Optional[Callable[[str, float], None]],
+                          embed_batch_size: Optional[int],
+                          document_created: Optional[Callable[[int], None]] = None) -> KnowledgeDocument:
+        """
+        流式导入的公共部分：文档记录先以停用状态提交，块每攒够一批就在写锁外向量化、再用一个短事务写入，
+        全部写完后按 stats 评分、写入清洗后全文并启用文档（启用前检索不到只写了一部分的文档）；
+        任一步失败时删除文档及已提交的块和向量。进程在导入中途退出时来不及清理，
+        停用的文档ID通过 document_created 回调交给调用方记录（导入任务重新执行前据此删除）
+        """
+        report = progress or (lambda stage, value: None)
+        embed_batch_size = max(1, embed_batch_size or self.bulk_embed_batch_size)
+        use_vectors = bool(self.embedding_model and FAISS_AVAILABLE and self.vector_store is not None)
+
+        with self.write_lock:
+            doc = KnowledgeDocument(title=title, content="", source_type=source_type, source_url=source_url,
+                                    category=category, tags=tags, active=False, chunk_count=0)
+            db.add(doc)
+            db.commit()
+            doc_id = doc.id
+
+        vector_ids: List[int] = []
+        entries: List[Tuple[int, List[int]]] = []  # (vector_id, token id 序列)，启用文档后写入 BM25
+        chunk_count = 0
+        try:
+            if document_created:
+                document_created(doc_id)
+            # 读取、清洗和分块在取下一批块时进行，不持有写锁和数据库事务
+            for batch in _batched(chunks, embed_batch_size):
+                if not chunk_count:
+                    report("embed", 0.5)
+                embeddings = self.embed_texts([chunk["content"] for chunk in batch]) if use_vectors else None
+                batch_entries = self._insert_stream_batch(db, doc, batch, chunk_count, embeddings)
+                vector_ids.extend(vector_id for vector_id, _ in batch_entries)
+                entries.extend(batch_entries)
+                chunk_count += len(batch)
+
+            if not chunk_count:
+                raise ValueError("文档内容为空或清洗后为空" if not stats["non_whitespace"] else "文档分块失败")
+            quality_score = self.text_cleaner.stream_quality_score(stats)
+            if quality_score < self.text_cleaner.quality_threshold:
+                raise ValueError(f"文档质量评分过低 ({quality_score:.2f})，已过滤")
+            metadata = self.text_cleaner.stream_metadata(stats, source_url, quality_score)
+
+            report("index", 0.8)
+            with self.write_lock:
+                doc.content = content.getvalue()  # 存储清洗后的内容
+                doc.chunk_count = chunk_count
+                doc.document_metadata = json.dumps(metadata, ensure_ascii=False)
+                doc.quality_score = quality_score
+                doc.active = True
+                db.commit()
+                db.refresh(doc)
+                self._activate_stream_document(db, doc, vector_ids, entries)
+        except Exception:
+            db.rollback()
+            self.delete_document(db, doc_id)
+            raise
+        finally:
+            content.close()
+
+        duplicates = chunk_count - len(entries)
+        print(f"✓ 文档已流式添加: {title}, 块数: {chunk_count}, 质量评分: {quality_score:.2f}"
+              + (f", 近重复块: {duplicates}（引用已有块，未写入向量）" if duplicates else ""))
+        return doc
 
+    def _insert_stream_batch(self, db: Session, doc: KnowledgeDocument, batch: List[Dict], start: int,
+                             embeddings: Optional[np.ndarray]) -> List[Tuple[int, List[int]]]:
+        """
+        在写锁内用一个短事务写入流式导入的一批块：建记录、近重复检测、写向量和块存储并提交，
+        提交失败时回滚并移除本批已写入的向量
+
+        返回:
+        - [(vector_id, token id 序列)]：本批写入了向量的块
+        """
+        with self.write_lock:
+            # 文档处于停用状态，首次构建近重复检测索引时不会载入本文档已写入的块
+            dedup_index = self._ensure_dedup_index(db) if embeddings is not None else None
+            records = self._new_chunk_records(db, doc, batch, start=start)
+            db.flush()
+            for record in records:
+                record.vector_id = record.id
+            if embeddings is not None and dedup_index is not None:
+                # 前面批次的规范块已写入向量索引，可直接取回向量确认，pending 只需覆盖本批
+                embeddings = embeddings[self._mark_duplicates(db, doc, records, embeddings, {})]
+            indexed = [record for record in records if record.vector_id is not None]
+            vector_ids = [record.vector_id for record in indexed]
+            entries = [(record.vector_id, self._chunk_token_ids(record)) for record in indexed]
+            try:
+                if embeddings is not None and indexed:
+                    self.vector_store.add(vector_ids, embeddings)
+                self.chunk_store.add_chunks(doc, records)  # 文档仍为停用状态，检索结果回填时会被过滤
+                db.commit()
+            except Exception:
+                db.rollback()
+                self._remove_vectors(vector_ids)
+                self.chunk_store.remove_chunks(vector_ids)
+                raise
+        return entries
+
+    def _activate_stream_document(self, db: Session, doc: KnowledgeDocument, vector_ids: List[int],
+                                  entries: List[Tuple[int, List[int]]]):
+        """
+        流式导入的文档启用后写入 BM25、同步块存储的启用状态并落盘索引（调用方持有写锁）
+        导入期间文档处于停用状态，同步向量索引会把它已写入的向量当作失效向量移除，这里补建被移除的向量
+        """
+        if vector_ids and self.vector_store is not None:
+            missing = set(vector_ids).difference(self.vector_store.ids().tolist())
+            if missing:
+                self._add_chunk_vectors(db.query(KnowledgeChunk).filter(KnowledgeChunk.id.in_(missing)).all())
+        self._save_vector_index()
+        if self.use_hybrid_search and self.bm25_index is not None:
+            for vector_id, token_ids in entries:
+                self.bm25_index.add(vector_id, token_ids)
+        self.chunk_store.update_document(doc)
+        self.invalidate_retrieval_cache()
+    
+    def _embed_in_batches(self, texts: List[str], batch_size: int) -> Optional[np.ndarray]:
+        """按固定批大小向量化大量文本，任一批失败返回 None"""
+        parts = []
+        for start in range(0, len(texts), batch_size):
+            part = self.embed_texts(texts[start:start + batch_size])
+            if part is None:
+                return None
+            parts.append(part)
+        return np.vstack(parts) if parts else None
+    
+    def bulk_add_documents(self, db: Session, documents: Iterable[Dict], batch_docs: Optional[int] = None,
+                           embed_batch_size: Optional[int] = None,
+                           progress: Optional[Callable[[int], None]] = None) -> Dict:
+        """
+        批量导入文档（压缩包 / 目录导入）
+        
+        与逐个调用 add_document 相比：每 batch_docs 个文档一次数据库事务、块向量按固定批大小推理，
+        向量索引落盘、BM25 写入和检索缓存失效只在全部导入结束后各做一次
+        
+        参数:
+        - documents: 可迭代的文档字典（title, content, source_type, source_url, category, tags），
+          解析失败的条目可带 error 字段，会直接计入失败列表
+        - batch_docs: 每个数据库事务包含的文档数（默认 RAG_BULK_BATCH_DOCS）
+        - embed_batch_size: 每次向量化的块数（默认 RAG_BULK_EMBED_BATCH_SIZE）
+        - progress: 进度回调，参数为已处理的文档数
+        
+        返回:
+        - Dict: imported（成功数）, chunk_count, duplicate_chunks（近重复、未写入向量的块数）, document_ids,
+          failed（[{source, error}]）
+        """
+        batch_docs = max(1, batch_docs or self.bulk_batch_docs)
+        embed_batch_size = max(1, embed_batch_size or self.bulk_embed_batch_size)
+        summary = {"imported": 0, "chunk_count": 0, "duplicate_chunks": 0, "document_ids": [], "failed": []}
+        bm25_entries: List[Tuple[int, List[int]]] = []  # (vector_id, token id 序列)，全部导入后一次写入 BM25
+        pending = []
+        processed = 0
+        
+        def flush_batch():
+            try:
+                doc_ids, entries, duplicates = self._bulk_insert_batch(db, pending, embed_batch_size)
+            except Exception as e:
+                print(f"⚠ 批量导入事务失败（{len(pending)} 个文档）: {e}")
+                summary["failed"].extend(
+                    {"source": item.get("source_url") or item.get("title"), "error": str(e)} for item, *_ in pending
+                )
+                return
+            summary["imported"] += len(doc_ids)
+            summary["document_ids"].extend(doc_ids)
+            summary["chunk_count"] += len(entries) + duplicates
+            summary["duplicate_chunks"] += duplicates
+            bm25_entries.extend(entries)
+        
+        try:
+            for item in documents:
+                processed += 1
+                source = item.get("source_url") or item.get("title")
+                if item.get("error"):
+                    summary["failed"].append({"source": source, "error": item["error"]})
+                else:
+                    try:
+                        # 文本预处理（规范化、结构化、清理、元数据、分块）
+                        pending.append((item, *self._prepare_content(item.get("content", ""), item.get("source_url"))))
+                    except Exception as e:
+                        summary["failed"].append({"source": source, "error": str(e)})
+                if len(pending) >= batch_docs:
+                    flush_batch()
+                    pending = []
+                if progress:
+                    progress(processed)
+            if pending:
+                flush_batch()
+        finally:
+            # 已提交的批次统一落盘并写入 BM25（中途异常也保证索引与数据库一致）
+            with self.write_lock:
+                if summary["imported"]:
+                    self._save_vector_index()
+                    if self.use_hybrid_search and self.bm25_index is not None:
+                        for vector_id, token_ids in bm25_entries:
+                            self.bm25_index.add(vector_id, token_ids)
+                    self.invalidate_retrieval_cache()
+        
+        print(f"✓ 批量导入完成: 成功 {summary['imported']} 个文档（{summary['chunk_count']} 个块，"
+              f"近重复 {summary['duplicate_chunks']} 个），失败 {len(summary['failed'])} 个")
+        return summary
+    
+    def _bulk_insert_batch(self, db: Session, batch: List[Tuple],
+                           embed_batch_size: int) -> Tuple[List[int], List[Tuple[int, List[int]]], int]:
+        """
+        写入一批预处理后的文档：锁外向量化，锁内建记录、近重复检测、写向量和块存储并提交（不落盘索引）
+        
+        返回:
+        - (文档ID列表, [(vector_id, token id 序列)], 近重复块数)
+        """
+        embeddings = None
+        if self.embedding_model and FAISS_AVAILABLE and self.vector_store is not None:
+            texts = [chunk["content"] for _, _, _, chunk_data in batch for chunk in chunk_data]
+            embeddings = self._embed_in_batches(texts, embed_batch_size)
+            if embeddings is None:
+                print(f"  → 向量化失败，本批 {len(batch)} 个文档将仅创建 chunks 供 BM25 检索")
+        
+        with self.write_lock:
+            dedup_index = self._ensure_dedup_index(db) if embeddings is not None else None
+            docs = []
+            for item, cleaned_content, metadata, chunk_data in batch:
+                doc = self._new_document(
+                    item.get("title") or item.get("source_url") or "未命名文档", cleaned_content, metadata, chunk_data,
+                    item.get("source_type", "file"), item.get("source_url"), item.get("category"), item.get("tags")
+                )
+                db.add(doc)
+                docs.append(doc)
+            db.flush()
+            
+            doc_chunks = [self._new_chunk_records(db, doc, chunk_data) for doc, (_, _, _, chunk_data) in zip(docs, batch)]
+            db.flush()
+            records = [record for chunk_records in doc_chunks for record in chunk_records]
+            for record in records:
+                record.vector_id = record.id
+            if dedup_index is not None:
+                keep = np.ones(len(records), dtype=bool)
+                pending_vectors: Dict[int, np.ndarray] = {}
+                offset = 0
+                for doc, chunk_records in zip(docs, doc_chunks):
+                    end = offset + len(chunk_records)
+                    keep[offset:end] = self._mark_duplicates(db, doc, chunk_records, embeddings[offset:end],
+                                                             pending_vectors)
+                    offset = end
+                embeddings = embeddings[keep]
+            indexed = [record for record in records if record.vector_id is not None]
+            vector_ids = [record.vector_id for record in indexed]
+            entries = [(record.vector_id, self._chunk_token_ids(record)) for record in indexed]
+            doc_ids = [doc.id for doc in docs]
+            
+            try:
+                if embeddings is not None:
+                    self.vector_store.add(vector_ids, embeddings)
+                for doc, chunk_records in zip(docs, doc_chunks):
+                    self.chunk_store.add_chunks(doc, chunk_records)
+                db.commit()
+            except Exception:
+                db.rollback()
+                self._remove_vectors(vector_ids)
+                self.chunk_store.remove_chunks(vector_ids)
+                raise
+        return doc_ids, entries, len(records) - len(indexed)
+    
+    @_synchronized
+    def replace_document_content(self, db: Session, doc: KnowledgeDocument, content: str,
+                                 prepared: Optional[Tuple[str, Dict, List[Dict]]] = None) -> KnowledgeDocument:
+        """
+        替换文档内容：重新分块和向量化该文档，只移除它自己的旧向量
+        prepared 为调用方已算好的 _prepare_content 结果（比对内容是否变化时已预处理过，避免重复清洗分块）
+        """
+        cleaned_content, metadata, chunk_data = prepared or self._prepare_content(content, doc.source_url)
+        
+        old_vector_ids = [
+            v for (v,) in db.query(KnowledgeChunk.vector_id).filter(KnowledgeChunk.document_id == doc.id).all()
+        ]
+        db.query(KnowledgeChunk).filter(KnowledgeChunk.document_id == doc.id).delete()
+        # 先移除旧向量：SQLite 会复用被删除的最大主键，新块可能拿到相同的向量ID
+        self._remove_vectors(old_vector_ids)
+        self._bm25_remove(old_vector_ids)
+        self.chunk_store.remove_chunks(old_vector_ids)
+        # 引用旧块的近重复块（其他文档中）先提升为规范块，再写入新块
+        self._promote_duplicates(db, old_vector_ids)
+        
+        doc.content = cleaned_content
+        doc.chunk_count = len(chunk_data)
+        doc.document_metadata = json.dumps(metadata, ensure_ascii=False)
+        doc.quality_score = metadata["quality_score"]
+        chunk_records = self._store_chunks(db, doc, chunk_data)
+        try:
+            self._commit_stored_chunks(db, chunk_records)
+        except Exception:
+            # 回滚后旧块仍在数据库中，补回前面移除的旧向量
+            old_chunks = db.query(KnowledgeChunk).filter(
+                KnowledgeChunk.document_id == doc.id, KnowledgeChunk.vector_id.isnot(None)
+            ).all()
+            if doc.active and old_chunks:
+                self._add_chunk_vectors(old_chunks)
+                self._bm25_add_chunks(old_chunks)
+                self.chunk_store.add_chunks(doc, old_chunks)
+            raise
+        db.refresh(doc)
+        
+        self._save_vector_index()
+        
+        if doc.active:
+            self._bm25_add_chunks(chunk_records)
+        self.invalidate_retrieval_cache()
+        
+        print(f"✓ 文档已更新: {doc.title}, 块数: {len(chunk_data)}")
         return doc
     
+    @_synchronized
+    def set_document_active(self, db: Session, doc: KnowledgeDocument, active: bool):
+        """
+        启用/停用文档：停用时仅移除其向量，启用时仅为其块补建向量
+        """
+        doc.active = active
+        db.commit()
+        
+        chunks = db.query(KnowledgeChunk).filter(KnowledgeChunk.document_id == doc.id).all()
+        if active:
+            indexed_ids = set(self.vector_store.ids().tolist()) if self.vector_store is not None else set()
+            # 引用的规范块已不在索引中（所在文档停用期间未被提升）的近重复块，恢复为规范块
+            own_ids = {c.id for c in chunks if c.duplicate_of is None}
+            for chunk in chunks:
+                if chunk.duplicate_of is not None and chunk.duplicate_of not in indexed_ids | own_ids:
+                    chunk.duplicate_of = None
+                    chunk.vector_id = chunk.id
+            db.commit()
+            new_chunks = [c for c in chunks if c.vector_id is not None and c.vector_id not in indexed_ids]
+            self._add_chunk_vectors(new_chunks)
+            self._bm25_add_chunks(chunks)
+            self.chunk_store.add_chunks(doc, new_chunks)
+            if self.dedup_index is not None:
+                for chunk in new_chunks:
+                    self.dedup_index.add(chunk.id, self.dedup_index.signature(chunk.content))
+        else:
+            self._remove_vectors([c.vector_id for c in chunks])
+            self._bm25_remove([c.vector_id for c in chunks])
+            # 启用文档中引用本文档块的近重复块提升为规范块，检索仍能命中这些内容
+            if self._promote_duplicates(db, [c.vector_id for c in chunks], only_active=True):
+                db.commit()
+        self._save_vector_index()
+        self.chunk_store.update_document(doc)
+        self.invalidate_retrieval_cache()
+    
     def search(self, query: str, top_k: Optional[int] = None, category: Optional[str] = None, 
                similarity_threshold: float = 0.15) -> List[Dict]:  # 降低默认阈值以提高召回率
         """
-        检索相关文档块（使用余弦相似度）
+        检索相关文档块（使用余弦相似度，similarity_threshold 即余弦相似度阈值）
         
         参数:
         - query: 查询文本
         - top_k: 返回的Top-K结果数量
-        - category: 分类筛选（可选）
+        - category: 分类筛选（可选，通过 FAISS ID 选择器在索引内部过滤；需已加载块内存存储）
         - similarity_threshold: 相似度阈值（0-1），低于此值的结果会被过滤
         
         返回:
         - List[Dict]: 包含 vector_id, distance, similarity 的结果列表，按相似度降序排列
         """
-        if not self.embedding_model or not FAISS_AVAILABLE or self.vector_index is None:
+        if not self.embedding_model or not FAISS_AVAILABLE or self.vector_store is None:
             return []
         
         if not query or not query.strip():
@@ -507,53 +1421,162 @@ class RAGService:
         if query_embedding is None:
             return []
         # 向量索引为空时直接返回，避免 FAISS 的 assert k > 0 报错
-        if self.vector_index.ntotal == 0:
+        if self.vector_store.ntotal == 0:
             return []
         
         # 检查维度是否匹配（旧索引可能由不同嵌入模型创建）
-        if self.vector_index.d != query_embedding.shape[0]:
-            print(f"⚠ 向量维度不匹配：索引 {self.vector_index.d} vs 查询 {query_embedding.shape[0]}，跳过向量检索")
+        if self.vector_store.d != query_embedding.shape[0]:
+            print(f"⚠ 向量维度不匹配：索引 {self.vector_store.d} vs 查询 {query_embedding.shape[0]}，跳过向量检索")
             return []
-        # 搜索向量索引（使用L2距离，后续转换为余弦相似度）
+        # 搜索向量索引（内积索引的分数即余弦相似度；返回的即为向量ID）
         query_embedding = query_embedding.reshape(1, -1)
-        max_results = min(top_k * 3, self.vector_index.ntotal)  # 多检索一些，用于后续筛选（从2倍增加到3倍以提高召回率）
-        distances, indices = self.vector_index.search(query_embedding, max_results)
-        
-        # 计算余弦相似度（FAISS使用L2距离，需要转换为余弦相似度）
-        # 对于归一化的向量，L2距离和余弦距离的关系：cosine_sim = 1 - (L2_distance^2 / 2)
-        # 或者使用：similarity = 1 / (1 + distance)
-        results = []
-        for dist, idx in zip(distances[0], indices[0]):
-            if idx < 0:  # FAISS 返回 -1 表示无效
-                continue
-            
-            # 转换为相似度分数（0-1，1表示最相似）
-            # 对于L2距离，使用更精确的转换：对于归一化向量，cosine_sim ≈ 1 - distance^2/2
-            # 但考虑到实际使用，使用更宽松的转换以提高召回率
-            if dist <= 0:
-                similarity = 1.0
+        allowed_ids = self._category_vector_ids(category)
+        candidate_count = self.vector_store.ntotal if allowed_ids is None else len(allowed_ids)
+        if candidate_count == 0:
+            return []
+        max_results = min(top_k * 3, candidate_count)  # 多检索一些，用于后续筛选（从2倍增加到3倍以提高召回率）
+        scores, indices = self.vector_store.search(query_embedding, max_results, allowed_ids)
+        
+        # 向量化后处理：转换为余弦相似度、过滤无效结果（FAISS 返回 -1）和低于阈值的结果
+        ids = indices[0]
+        similarity = self.vector_store.to_cosine(scores[0])
+        keep = (ids >= 0) & (similarity >= similarity_threshold)
+        ids, similarity = ids[keep], similarity[keep]
+        order = np.argsort(-similarity, kind="stable")[:top_k]
+        # distance 为归一化向量间的平方 L2 距离（2 - 2·cos），与旧版字段含义保持一致
+        return [
+            {"vector_id": int(i), "distance": float(2.0 - 2.0 * sim), "similarity": float(sim)}
+            for i, sim in zip(ids[order], similarity[order])
+        ]
+    
+    @staticmethod
+    def _min_max(scores: np.ndarray) -> np.ndarray:
+        """min-max 归一化到 0-1（所有分数相同时视为同等最相关，均为 1）"""
+        spread = scores.max() - scores.min()
+        if spread <= 0:
+            return np.ones_like(scores)
+        return (scores - scores.min()) / spread
+    
+    def _current_generation(self) -> int:
+        """当前索引代数（Redis 可用时多进程共享，否则为进程内计数）"""
+        if self.cache_service.enabled:
+            shared = self.cache_service.get(self.GENERATION_KEY)
+            if shared is not None:
+                return int(shared)
+        return self.index_generation
+    
+    def invalidate_retrieval_cache(self):
+        """递增索引代数，使所有已缓存的检索结果失效（文档增删改、重建索引后调用）"""
+        self.index_generation += 1
+        shared = self.cache_service.incr(self.GENERATION_KEY)
+        if shared is not None:
+            self.index_generation = shared
+        self.retrieval_cache.clear()
+    
+    def refresh_document(self, doc: KnowledgeDocument):
+        """文档标题/分类等字段变更后同步块内存存储，并使检索结果缓存失效"""
+        self.chunk_store.update_document(doc)
+        self.invalidate_retrieval_cache()
+    
+    def _retrieval_cache_key(self, query: str, top_k: int, category: Optional[str],
+                             similarity_threshold: float, generation: int) -> str:
+        query_hash = hashlib.sha1(self._normalize_query(query).encode("utf-8")).hexdigest()
+        return self.cache_service._make_key(
+            "rag:retrieve", generation, query_hash,
+            category=category or "", top_k=top_k, threshold=similarity_threshold
+        )
+    
+    def retrieve_context(self, db: Session, query: str, top_k: Optional[int] = None, 
+                        category: Optional[str] = None, similarity_threshold: float = 0.3) -> Tuple[str, List[Dict]]:
+        """
+        检索并返回上下文文本（带结果缓存）
+        相同的（规范化查询, 分类, top_k, 阈值, 索引代数）直接返回缓存结果；
+        Redis 可用时缓存到 Redis，否则使用进程内 LRU 缓存
+        """
+        top_k = top_k or self.top_k
+        if not self.retrieval_cache_enabled or not query or not query.strip():
+            return self._retrieve_context(db, query, top_k, category, similarity_threshold)
+        
+        key = self._retrieval_cache_key(query, top_k, category, similarity_threshold, self._current_generation())
+        use_redis = self.cache_service.enabled
+        cached = self.cache_service.get(key) if use_redis else self.retrieval_cache.get(key)
+        if cached is not None:
+            context_text, result_details = cached
+            return context_text, result_details
+        
+        context_text, result_details = self._retrieve_context(db, query, top_k, category, similarity_threshold)
+        # 只缓存有结果的检索（空结果可能是模型/索引尚未就绪）
+        if result_details:
+            if use_redis:
+                self.cache_service.set(key, [context_text, result_details], self.retrieval_cache_ttl)
             else:
-                # 使用更宽松的转换公式，降低阈值要求
-                similarity = float(1 / (1 + dist * 0.5))  # 调整系数以提高相似度分数
-            
-            # 应用相似度阈值过滤
-            if similarity < similarity_threshold:
-                continue
-            
-            results.append({
-                "vector_id": int(idx),
-                "distance": float(dist),
-                "similarity": similarity
-            })
+                self.retrieval_cache.set(key, (context_text, result_details))
+        return context_text, result_details
+    
+    def _fuse_results(self, vector_results: List[Dict], bm25_results: List[Dict], top_k: int) -> List[Dict]:
+        """合并向量检索和 BM25 检索结果：两路分数各自 min-max 归一化后按权重相加，返回综合分数最高的 top_k 个"""
+        vector_ids = np.array([r["vector_id"] for r in vector_results], dtype=np.int64)
+        bm25_ids = np.array([r["vector_id"] for r in bm25_results], dtype=np.int64)
+        all_ids = np.union1d(vector_ids, bm25_ids)
+        vector_pos = np.searchsorted(all_ids, vector_ids)
+        bm25_pos = np.searchsorted(all_ids, bm25_ids)
+        
+        cosine = np.zeros(len(all_ids))
+        distance = np.zeros(len(all_ids))
+        vector_score = np.zeros(len(all_ids))
+        bm25_score = np.zeros(len(all_ids))
+        if vector_results:
+            vector_sim = np.array([r["similarity"] for r in vector_results])
+            cosine[vector_pos] = vector_sim
+            distance[vector_pos] = [r["distance"] for r in vector_results]
+            vector_score[vector_pos] = self._min_max(vector_sim) * self.hybrid_weight_vector
+        if bm25_results:
+            bm25_raw = np.array([r["bm25_score"] for r in bm25_results])
+            bm25_score[bm25_pos] = self._min_max(bm25_raw) * self.hybrid_weight_bm25
+        combined = vector_score + bm25_score
+        
+        # 按综合分数排序，取top_k个结果
+        order = np.argsort(-combined, kind="stable")[:top_k]
+        return [
+            {
+                "vector_id": int(all_ids[i]),
+                "similarity": float(combined[i]),  # 使用综合分数作为相似度
+                "cosine": float(cosine[i]),  # 向量检索的余弦相似度（仅由BM25召回时为0）
+                "vector_score": float(vector_score[i]),
+                "bm25_score": float(bm25_score[i]),
+                "distance": float(distance[i])
+            }
+            for i in order
+        ]
+    
+    def _hydrate_results(self, search_results: List[Dict], category: Optional[str] = None) -> Tuple[str, List[Dict]]:
+        """从块内存存储回填块内容和文档信息（只保留启用文档的块，按分类筛选），按排序组合上下文"""
+        records = self.chunk_store.get_many([r["vector_id"] for r in search_results], category)
         
-        # 按相似度降序排序（最相似的在前面）
-        results.sort(key=lambda x: x["similarity"], reverse=True)
+        context_parts = []
+        result_details = []
+        
+        for result in search_results:
+            record = records.get(result["vector_id"])
+            if record:
+                # 构建上下文片段（移除相似度标注，避免干扰AI判断）
+                context_parts.append(record["content"])
+                
+                # 保存结果详情
+                result_details.append({
+                    **record,
+                    "similarity": result["similarity"],
+                    "cosine": result["cosine"],
+                    "distance": result.get("distance", 0.0),  # 混合检索可能没有distance字段
+                    "vector_score": result.get("vector_score", 0.0),
+                    "bm25_score": result.get("bm25_score", 0.0)
+                })
         
-        # 返回Top-K
-        return results[:top_k]
+        context_text = "\n\n".join(context_parts)
+        return context_text, result_details
     
-    def retrieve_context(self, db: Session, query: str, top_k: Optional[int] = None, 
-                        category: Optional[str] = None, similarity_threshold: float = 0.3) -> Tuple[str, List[Dict]]:
+    def _retrieve_context(self, db: Session, query: str, top_k: int,
+                          category: Optional[str] = None, similarity_threshold: float = 0.3) -> Tuple[str, List[Dict]]:
         """
         检索并返回上下文文本（RAG检索增强的核心方法）
         
@@ -568,8 +1591,10 @@ class RAGService:
         - Tuple[str, List[Dict]]: (上下文文本, 检索结果详情)
         """
         # 步骤1：混合检索（向量检索 + BM25关键词检索）
+        # 确保块内存存储已加载（分类过滤在检索引擎内部完成）
+        self.ensure_chunk_store(db)
         # 确保BM25索引已构建（如果启用混合检索）
-        if self.use_hybrid_search and BM25_AVAILABLE and self.bm25_index is None:
+        if self.use_hybrid_search and self.bm25_index is None:
             self._build_bm25_index(db)
         
         # 1.1 向量检索（语义相似度）
@@ -584,7 +1609,7 @@ class RAGService:
         
         # 1.2 BM25关键词检索（如果启用混合检索）
         bm25_results = []
-        if self.use_hybrid_search and BM25_AVAILABLE:
+        if self.use_hybrid_search:
             # 确保BM25索引已构建
             if self.bm25_index is None:
                 self._build_bm25_index(db)
@@ -597,129 +1622,17 @@ class RAGService:
         if not vector_results and not bm25_results:
             return "", []
         
-        # 归一化分数并合并结果
-        combined_results = {}
-        # 保存原始向量检索结果，用于后续获取distance字段
-        vector_results_map = {r["vector_id"]: r for r in vector_results}
-        
-        # 处理向量检索结果
-        if vector_results:
-            # 归一化相似度分数到0-1范围
-            max_sim = max([r["similarity"] for r in vector_results], default=1.0)
-            min_sim = min([r["similarity"] for r in vector_results], default=0.0)
-            sim_range = max_sim - min_sim if max_sim > min_sim else 1.0
-            
-            for r in vector_results:
-                vector_id = r["vector_id"]
-                # 归一化相似度
-                normalized_sim = (r["similarity"] - min_sim) / sim_range if sim_range > 0 else r["similarity"]
-                combined_results[vector_id] = {
-                    "vector_id": vector_id,
-                    "vector_score": normalized_sim * self.hybrid_weight_vector,
-                    "bm25_score": 0.0,
-                    "combined_score": normalized_sim * self.hybrid_weight_vector,
-                    "distance": r.get("distance", 0.0)  # 保留原始distance字段
-                }
-        
-        # 处理BM25检索结果
-        if bm25_results:
-            # 归一化BM25分数到0-1范围
-            max_bm25 = max([r["bm25_score"] for r in bm25_results], default=1.0)
-            min_bm25 = min([r["bm25_score"] for r in bm25_results], default=0.0)
-            bm25_range = max_bm25 - min_bm25 if max_bm25 > min_bm25 else 1.0
-            
-            for r in bm25_results:
-                vector_id = r["vector_id"]
-                # 归一化BM25分数
-                normalized_bm25 = (r["bm25_score"] - min_bm25) / bm25_range if bm25_range > 0 else r["bm25_score"]
-                
-                if vector_id in combined_results:
-                    # 合并分数
-                    combined_results[vector_id]["bm25_score"] = normalized_bm25 * self.hybrid_weight_bm25
-                    combined_results[vector_id]["combined_score"] += normalized_bm25 * self.hybrid_weight_bm25
-                else:
-                    # 新结果（从BM25检索中获取，可能没有distance字段）
-                    original_vector_result = vector_results_map.get(vector_id, {})
-                    combined_results[vector_id] = {
-                        "vector_id": vector_id,
-                        "vector_score": 0.0,
-                        "bm25_score": normalized_bm25 * self.hybrid_weight_bm25,
-                        "combined_score": normalized_bm25 * self.hybrid_weight_bm25,
-                        "distance": original_vector_result.get("distance", 0.0)  # 如果向量检索中有，则使用
-                    }
-        
-        # 按综合分数排序
-        search_results = sorted(combined_results.values(), key=lambda x: x["combined_score"], reverse=True)
-        
-        # 取top_k个结果
-        search_results = search_results[:top_k]
-        
-        # 转换为原有格式（兼容性）
-        final_results = []
-        for r in search_results:
-            final_results.append({
-                "vector_id": r["vector_id"],
-                "similarity": r["combined_score"],  # 使用综合分数作为相似度
-                "vector_score": r["vector_score"],
-                "bm25_score": r["bm25_score"],
-                "distance": r.get("distance", 0.0)  # 保留distance字段（如果存在）
-            })
-        
-        search_results = final_results
+        search_results = self._fuse_results(vector_results, bm25_results, top_k)
         
         if search_results:
             print(f"✓ 混合检索完成: 向量检索 {len(vector_results)} 个，BM25检索 {len(bm25_results)} 个，合并后 {len(search_results)} 个")
         
-        # 步骤2：从数据库获取块内容
-        vector_ids = [r["vector_id"] for r in search_results]
-        chunks = db.query(KnowledgeChunk).filter(
-            KnowledgeChunk.vector_id.in_(vector_ids),
-            KnowledgeChunk.document_id.in_(
-                db.query(KnowledgeDocument.id).filter(KnowledgeDocument.active == True)
-            )
-        ).all()
-        
-        # 如果指定了分类，进一步筛选
-        if category:
-            doc_ids = [d.id for d in db.query(KnowledgeDocument.id).filter(
-                KnowledgeDocument.category == category,
-                KnowledgeDocument.active == True
-            ).all()]
-            chunks = [c for c in chunks if c.document_id in doc_ids]
-        
-        # 步骤3：按相似度排序并组合上下文
-        chunk_dict = {c.vector_id: c for c in chunks}
-        context_parts = []
-        result_details = []
-        
-        for result in search_results:
-            chunk = chunk_dict.get(result["vector_id"])
-            if chunk:
-                # 获取文档信息
-                doc = db.query(KnowledgeDocument).filter(KnowledgeDocument.id == chunk.document_id).first()
-                doc_title = doc.title if doc else f"文档#{chunk.document_id}"
-                
-                # 构建上下文片段（移除相似度标注，避免干扰AI判断）
-                context_parts.append(chunk.content)
-                
-                # 保存结果详情
-                result_details.append({
-                    "chunk_id": chunk.id,
-                    "document_id": chunk.document_id,
-                    "document_title": doc_title,
-                    "chunk_index": chunk.chunk_index,
-                    "content": chunk.content,
-                    "similarity": result["similarity"],
-                    "distance": result.get("distance", 0.0),  # 混合检索可能没有distance字段
-                    "vector_score": result.get("vector_score", 0.0),
-                    "bm25_score": result.get("bm25_score", 0.0)
-                })
-        
-        context_text = "\n\n".join(context_parts)
-        return context_text, result_details
+        # 步骤2、3：回填块内容并组合上下文
+        return self._hydrate_results(search_results, category)
     
+    @_synchronized
     def delete_document(self, db: Session, document_id: int):
-        """删除文档（需要重建索引）"""
+        """删除文档（仅从索引中移除该文档的向量，无需重新向量化）"""
         doc = db.query(KnowledgeDocument).filter(KnowledgeDocument.id == document_id).first()
         if not doc:
             return
@@ -735,63 +1648,85 @@ class RAGService:
         db.delete(doc)
         db.commit()
         
-        # 重建索引（删除操作较复杂，这里简化处理：重建整个索引）
-        self._rebuild_index(db)
+        # 按向量ID删除该文档的向量
+        removed = self._remove_vectors(vector_ids)
+        self._save_vector_index()
+        print(f"✓ 文档已删除: #{document_id}, 移除向量 {removed} 个")
         
-        # 重建BM25索引
-        if self.use_hybrid_search and BM25_AVAILABLE:
-            self._build_bm25_index(db)
+        # 从BM25索引和块内存存储中移除该文档的块
+        self._bm25_remove(vector_ids)
+        self.chunk_store.remove_document(document_id, vector_ids)
+        
+        # 引用该文档块的近重复块提升为规范块
+        if self._promote_duplicates(db, vector_ids):
+            db.commit()
+            self._save_vector_index()
+        self.invalidate_retrieval_cache()
     
+    @_synchronized
     def _rebuild_index(self, db: Session):
-        """重建向量索引"""
-        if not FAISS_AVAILABLE or not self.embedding_model:
+        """
+        重建（同步）向量索引
+        - 嵌入模型变更时：全量重新向量化所有活跃块
+        - 否则：删除已失效的向量，仅为缺少向量的活跃块补建向量
+        """
+        if not FAISS_AVAILABLE or not self.embedding_model or self.vector_store is None:
             return
         
+        self._migrate_vector_ids(db)
+        
         # 获取所有活跃文档的块（使用明确的join条件）
         chunks = db.query(KnowledgeChunk).join(
             KnowledgeDocument, KnowledgeChunk.document_id == KnowledgeDocument.id
         ).filter(
-            KnowledgeDocument.active == True
+            KnowledgeDocument.active == True,
+            KnowledgeChunk.duplicate_of.is_(None)  # 近重复块引用规范块的向量
         ).order_by(KnowledgeChunk.document_id, KnowledgeChunk.chunk_index).all()
         
-        if not chunks:
-            self.vector_index = faiss.IndexFlatL2(self.vector_dim)
+        if self._embedding_model_changed():
+            # 嵌入模型变更：全量重新向量化
+            embeddings = self.embed_texts([c.content for c in chunks]) if chunks else None
+            if chunks and embeddings is None:
+                return
+            index_type = self.vector_store.build(
+                [c.vector_id for c in chunks],
+                embeddings if chunks else np.empty((0, self.vector_dim), dtype='float32'),
+                self.embedding_model_name, self.vector_dim
+            )
             self._save_vector_index()
-            return
-        
-        # 重新向量化（chunks 是字符串列表）
-        texts = [c.content for c in chunks]
-        embeddings = self.embed_texts(texts)
-        
-        if embeddings is not None:
-            # 创建新索引
-            self.vector_index = faiss.IndexFlatL2(self.vector_dim)
-            self.vector_index.add(embeddings)
-            
-            # 更新向量 ID
-            for i, chunk in enumerate(chunks):
-                chunk.vector_id = i
-            db.commit()
-            
+            print(f"✓ 向量索引已全量重建: {len(chunks)} 个块（模型: {self.embedding_model_name}，索引类型: {index_type}）")
+        else:
+            active_ids = {c.vector_id for c in chunks}
+            indexed_ids = set(self.vector_store.ids().tolist())
+            removed = self._remove_vectors(list(indexed_ids - active_ids))
+            added = self._add_chunk_vectors([c for c in chunks if c.vector_id not in indexed_ids])
+            # 向量数量变化后按需重新选择索引类型并训练（使用已有向量，无需重新向量化）
+            if self.vector_store.needs_retrain():
+                index_type = self.vector_store.retrain()
+                print(f"✓ 向量索引已重新训练: 索引类型 {index_type}")
             self._save_vector_index()
-            print(f"✓ 向量索引已重建: {len(chunks)} 个块")
-            
-            # 重建BM25索引
-            if self.use_hybrid_search and BM25_AVAILABLE:
-                self._build_bm25_index(db)
+            print(f"✓ 向量索引已同步: 共 {self.vector_store.ntotal} 个向量（新增 {added}，移除 {removed}）")
+        
+        # 重建BM25索引和块内存存储
+        if self.use_hybrid_search:
+            self._build_bm25_index(db, persist_tokens=True)
+        self.chunk_store.load(db)
+        self.dedup_index = None  # 下次写入时按同步后的块重新构建
+        self.invalidate_retrieval_cache()
     
+    @_synchronized
     def rebuild_chunks_for_documents_without_chunks(self, db: Session) -> int:
         """
         为没有 chunks 的文档重建 chunks（向量化失败时仍创建 chunks 供 BM25 检索）
         返回处理的文档数量
         """
-        SYNTHETIC_OFFSET = 1000000
         docs = db.query(KnowledgeDocument).filter(
             KnowledgeDocument.active == True,
             KnowledgeDocument.content.isnot(None),
             KnowledgeDocument.content != ""
         ).all()
         count = 0
+        stored: List[KnowledgeChunk] = []
         for doc in docs:
             chunk_count = db.query(KnowledgeChunk).filter(KnowledgeChunk.document_id == doc.id).count()
             if chunk_count > 0:
@@ -800,29 +1735,23 @@ class RAGService:
                 chunk_data = self.chunk_text(doc.content)
                 if not chunk_data:
                     continue
-                for i, chunk_info in enumerate(chunk_data):
-                    synthetic_id = SYNTHETIC_OFFSET + doc.id * 10000 + i
-                    chunk_record = KnowledgeChunk(
-                        document_id=doc.id,
-                        chunk_index=i,
-                        content=chunk_info["content"],
-                        chunk_metadata=json.dumps({
-                            "title": chunk_info.get("title"),
-                            "type": chunk_info.get("type", "paragraph"),
-                            "chunk_index": chunk_info.get("chunk_index", i)
-                        }, ensure_ascii=False),
-                        vector_id=synthetic_id
-                    )
-                    db.add(chunk_record)
+                chunk_records = self._store_chunks(db, doc, chunk_data)
+                self._bm25_add_chunks(chunk_records)
+                stored.extend(chunk_records)
                 doc.chunk_count = len(chunk_data)
                 count += 1
                 print(f"  → 已为文档 #{doc.id}《{doc.title}》重建 {len(chunk_data)} 个 chunks")
             except Exception as e:
                 print(f"⚠ 文档 #{doc.id} 重建 chunks 失败: {e}")
         if count > 0:
-            db.commit()
-            if self.use_hybrid_search and BM25_AVAILABLE:
-                self._build_bm25_index(db)
+            vector_ids = [c.vector_id for c in stored]
+            try:
+                self._commit_stored_chunks(db, stored)
+            except Exception:
+                self._bm25_remove(vector_ids)
+                raise
+            self._save_vector_index()
+            self.invalidate_retrieval_cache()
             print(f"✓ 已为 {count} 个文档重建 chunks")
         return count
 
@@ -839,6 +1768,30 @@ def is_rag_ready() -> bool:
     return _rag_service.embedding_model is not None
 
 
+def get_rag_cache_stats() -> Dict:
+    """RAG 服务的进程内缓存统计（服务尚未初始化时返回空字典，不会触发模型加载）"""
+    if _rag_service is None:
+        return {}
+    return {
+        "query_embedding_cache": _rag_service.query_embedding_cache.stats(),
+        "query_batcher": dict(
+            _rag_service.query_batcher.stats() if _rag_service.query_batcher is not None else {},
+            enabled=_rag_service.query_batch_enabled,
+        ),
+        "retrieval_cache": dict(
+            _rag_service.retrieval_cache.stats(),
+            enabled=_rag_service.retrieval_cache_enabled,
+            backend="redis" if _rag_service.cache_service.enabled else "memory",
+            index_generation=_rag_service.index_generation,
+        ),
+        "dedup": {
+            "enabled": _rag_service.dedup_enabled,
+            "indexed_chunks": len(_rag_service.dedup_index) if _rag_service.dedup_index is not None else 0,
+            "duplicates_skipped": _rag_service.dedup_skipped,
+        },
+    }
+
+
 def get_rag_service() -> RAGService:
     """获取 RAG 服务实例（单例模式）"""
     global _rag_service
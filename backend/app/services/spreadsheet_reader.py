@@ -0,0 +1,191 @@
+"""
+表格文件逐行读取
+Excel（openpyxl 只读模式，.xls 用 xlrd）和 CSV 逐行产出单元格文本，不把整个工作簿载入 DataFrame；
+知识库文档解析和表格流式导入共用
+"""
+from __future__ import annotations
+
+import codecs
+import csv
+import io
+from datetime import date, datetime, time
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+
+# Excel 解析（openpyxl 读取 .xlsx，xlrd 读取旧版 .xls）
+try:
+    import openpyxl
+    OPENPYXL_AVAILABLE = True
+except ImportError:
+    OPENPYXL_AVAILABLE = False
+    openpyxl = None
+
+try:
+    import xlrd
+    XLRD_AVAILABLE = True
+except ImportError:
+    XLRD_AVAILABLE = False
+    xlrd = None
+
+Source = Union[bytes, str, Path]
+
+_SUFFIX_KINDS = {".xlsx": "xlsx", ".xlsm": "xlsx", ".xls": "xls", ".csv": "csv", ".tsv": "csv"}
+_MIME_KINDS = {
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": "xlsx",
+    "application/vnd.ms-excel": "xls",
+    "text/csv": "csv",
+    "text/tab-separated-values": "csv",
+}
+
+
+def spreadsheet_kind(filename: Optional[str] = None, file_type: Optional[str] = None) -> Optional[str]:
+    """按扩展名（优先）或 MIME 类型判断表格格式：xlsx / xls / csv，不是表格文件时返回 None"""
+    if filename:
+        kind = _SUFFIX_KINDS.get(Path(filename).suffix.lower())
+        if kind:
+            return kind
+    return _MIME_KINDS.get((file_type or "").split(";")[0].strip().lower())
+
+
+def format_cell(value) -> str:
+    """单元格值转文本：空值为空串，整数值的浮点数去掉 .0，零点的日期时间只保留日期，连续空白和换行合并为一个空格"""
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        # 按 Excel 显示精度（15 位有效数字）输出，避免 0.30000000000000004 这类二进制误差
+        return str(int(value)) if value.is_integer() else f"{value:.15g}"
+    if isinstance(value, datetime):
+        return value.date().isoformat() if value.time() == time(0) else value.isoformat(sep=" ")
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    return " ".join(str(value).split())
+
+
+def _trim_row(values) -> List[str]:
+    """格式化一行单元格，去掉末尾的空单元格（全空行返回空列表）"""
+    cells = [format_cell(value) for value in values]
+    while cells and not cells[-1]:
+        cells.pop()
+    return cells
+
+
+def _open_binary(source: Source):
+    return io.BytesIO(source) if isinstance(source, bytes) else open(source, "rb")
+
+
+def _detect_encoding(head: bytes) -> str:
+    """CSV 编码：UTF-8（可带 BOM），解码失败时按 GB18030（Excel 另存的中文 CSV 常见）"""
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "gb18030"
+
+
+def _count_lines(source: Source) -> int:
+    if isinstance(source, bytes):
+        return source.count(b"\n") + 1
+    count = 1
+    with open(source, "rb") as fp:
+        for block in iter(lambda: fp.read(1 << 20), b""):
+            count += block.count(b"\n")
+    return count
+
+
+def _iter_xlsx(source: Source) -> Tuple[Optional[int], Iterator[Tuple[str, List[str]]]]:
+    workbook = openpyxl.load_workbook(io.BytesIO(source) if isinstance(source, bytes) else source,
+                                      read_only=True, data_only=True)
+    # 只读模式的行数来自工作表的 dimension 记录，部分工具生成的文件没有该记录
+    sizes = [sheet.max_row for sheet in workbook.worksheets]
+    total = sum(sizes) if all(sizes) else None
+
+    def rows():
+        try:
+            for sheet in workbook.worksheets:
+                for values in sheet.iter_rows(values_only=True):
+                    yield sheet.title, _trim_row(values)
+        finally:
+            workbook.close()
+    return total, rows()
+
+
+def _iter_xls(source: Source) -> Tuple[Optional[int], Iterator[Tuple[str, List[str]]]]:
+    if isinstance(source, bytes):
+        workbook = xlrd.open_workbook(file_contents=source, on_demand=True)
+    else:
+        workbook = xlrd.open_workbook(str(source), on_demand=True)
+    total = None
+
+    def rows():
+        try:
+            for index in range(workbook.nsheets):
+                sheet = workbook.sheet_by_index(index)
+                for i in range(sheet.nrows):
+                    cells = []
+                    for cell in sheet.row(i):
+                        value = cell.value
+                        if cell.ctype == xlrd.XL_CELL_DATE:
+                            value = xlrd.xldate.xldate_as_datetime(value, workbook.datemode)
+                        cells.append(value)
+                    yield sheet.name, _trim_row(cells)
+                workbook.unload_sheet(index)
+        finally:
+            workbook.release_resources()
+    return total, rows()
+
+
+def _iter_csv(source: Source, sheet_name: str, delimiter: Optional[str]) -> Tuple[Optional[int], Iterator[Tuple[str, List[str]]]]:
+    total = _count_lines(source)
+
+    def rows():
+        with _open_binary(source) as raw:
+            head = raw.read(65536)
+            raw.seek(0)
+            text = io.TextIOWrapper(raw, encoding=_detect_encoding(head), errors="replace", newline="")
+            sep = delimiter
+            if sep is None:
+                try:
+                    sep = csv.Sniffer().sniff(head.decode("utf-8", errors="ignore"), delimiters=",;\t|").delimiter
+                except csv.Error:
+                    sep = ","
+            for values in csv.reader(text, delimiter=sep):
+                yield sheet_name, _trim_row(values)
+    return total, rows()
+
+
+def iter_sheet_rows(source: Source, filename: Optional[str] = None, file_type: Optional[str] = None,
+                    progress: Optional[Callable[[int, Optional[int]], None]] = None,
+                    progress_every: int = 1000) -> Iterator[Tuple[str, List[str]]]:
+    """
+    逐行产出表格内容：(工作表名, 单元格文本列表)，跳过全空行，每行末尾的空单元格已去掉
+
+    参数:
+    - source: 文件内容（bytes）或文件路径（大文件直接传路径，不必先读入内存）
+    - filename / file_type: 用于判断格式（xlsx / xls / csv）；CSV 以文件名（不含扩展名）作为工作表名
+    - progress: 每读取 progress_every 行及读取结束时调用 progress(已读行数, 总行数)，总行数未知时为 None
+
+    格式不支持或缺少解析库时抛出 ValueError；文件损坏的异常由调用方处理
+    """
+    kind = spreadsheet_kind(filename, file_type)
+    if kind is None and not isinstance(source, bytes):
+        kind = spreadsheet_kind(str(source))
+    if kind == "xlsx" and OPENPYXL_AVAILABLE:
+        total, rows = _iter_xlsx(source)
+    elif kind == "xls" and XLRD_AVAILABLE:
+        total, rows = _iter_xls(source)
+    elif kind == "csv":
+        name = Path(filename).stem if filename else "Sheet1"
+        delimiter = "\t" if filename and filename.lower().endswith(".tsv") else None
+        total, rows = _iter_csv(source, name, delimiter)
+    else:
+        raise ValueError(f"不支持的表格格式或缺少解析库: {filename or file_type}")
+
+    done = 0
+    for sheet_name, cells in rows:
+        done += 1
+        if progress and done % progress_every == 0:
+            progress(done, total)
+        if cells:
+            yield sheet_name, cells
+    if progress:
+        progress(done, total)
@@ -7,12 +7,116 @@ from __future__ import annotations
 import os
 import re
 import json
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Iterable, Iterator, Optional, TextIO, Tuple
 from datetime import datetime
 from collections import Counter
 
 from ..utils import load_env
 
+# 清洗各阶段使用的正则在导入时编译一次；含义相同的多条规则合并为一个交替模式，每行只匹配一次
+_CONTROL_CHARS = re.compile(r'[\x00-\x08\x0b-\x0c\x0e-\x1f\x7f-\x9f]')
+_SPACE_RUN = re.compile(r' [ \t]+|\t[ \t]*')  # 单个空格无需替换；两个分支都以字面量开头，扫描比 [ \t]{2,}|\t 快
+_NEWLINE_RUN = re.compile(r'\n{3,}')
+# 日期、货币规则按原顺序依次替换（前一条的替换结果可能被后一条匹配），各自用字面量预检跳过不相关文本；
+# 定长重复展开写（\d\d\d\d 比 \d{4} 快）；数字和“元”没有大小写之分，不加 IGNORECASE（加了反而逐字符折叠大小写）
+_DATE_YMD = re.compile(r'(\d\d\d\d)[/-](\d\d?)[/-](\d\d?)')  # 2024/01/11 -> 2024年1月11日
+_DATE_MDY = re.compile(r'(\d\d?)[/-](\d\d?)[/-](\d\d\d\d)')  # 01/11/2024 -> 2024年1月11日
+_CURRENCY_YEN = re.compile(r'¥\s*(\d+(?:\.\d+)?)')  # ¥100 -> ￥100
+_CURRENCY_YUAN = re.compile(r'(\d++(?:\.\d++)?)\s*+元')  # 100元 -> ￥100（占有量词：数字后不是“元”时不再逐位回溯）
+# RMB / CNY 分成两条字符类模式：合并成 (?:RMB|CNY) 加 IGNORECASE 后失去字面量前缀优化，比分开替换两次更慢
+_CURRENCY_RMB = re.compile(r'[Rr][Mm][Bb]\s*(\d+(?:\.\d+)?)')  # RMB100 -> ￥100
+_CURRENCY_CNY = re.compile(r'[Cc][Nn][Yy]\s*(\d+(?:\.\d+)?)')  # CNY100 -> ￥100
+# 保留的字符：中文、英文、数字、基本标点、连字符（用于 3-5、7-10 等范围）、换行、制表符
+_DISALLOWED_CHARS = re.compile(r'[^\u4e00-\u9fa5a-zA-Z0-9\s.,!?;:()（）【】《》「」『』、。，！？；：\n\t\-]')
+
+_LIST_ITEM = re.compile(r'[-*+]\s+|\d+[.)]\s+')
+_LIST_MARKER = re.compile(r'^[-*+\d.)]\s+')
+
+# 噪音行（广告、导航、页脚、纯数字、过短且无意义），一次 match 完成分类
+_NOISE_LINE = re.compile(
+    r'(?:首页|关于我们|联系我们|隐私政策|使用条款|网站地图|返回顶部)'
+    r'|(?:Copyright|©|版权所有)'
+    r'|(?:广告|Advertisement|AD)'
+    r'|(?:关注我们|Follow us|订阅)'
+    r'|(?:分享到|Share to)'
+    r'|(?:Cookie|Cookies)'
+    r'|[\d\s\-]+$'  # 纯数字和分隔符
+    r'|[^\u4e00-\u9fa5a-zA-Z]{0,5}$',  # 过短且无意义
+    re.IGNORECASE
+)
+_MEANINGFUL = re.compile(r'[\u4e00-\u9fa5a-zA-Z]{3,}')
+
+_CHINESE_RUN = re.compile(r'[\u4e00-\u9fa5]+')
+_LATIN_RUN = re.compile(r'[a-zA-Z]+')
+_PUNCTUATION = re.compile(r'[。，！？；：]')
+_SENTENCE_END = re.compile(r'[。！？]')
+_SENTENCE_SPLIT = re.compile(r'[。！？\n]')
+
+_NUMBERED_QA = re.compile(r'(?m)^\s*(\d+[.．、]\s+)')
+_FAQ_MARKER = re.compile(
+    r'(?m)^\s*((?:问|Q|问题)\d*[：:]\s*|(?:答|A|回答)[：:]\s*|'
+    r'[一二三四五六七八九十]+[、．.]\s*)',
+    re.IGNORECASE
+)
+
+_TIME_PATTERNS = [
+    re.compile(r'(\d{4})年(\d{1,2})月(\d{1,2})日'),
+    re.compile(r'(\d{4})[/-](\d{1,2})[/-](\d{1,2})'),
+    re.compile(r'发布时间[：:]\s*(\d{4}[-/]\d{1,2}[-/]\d{1,2})'),
+    re.compile(r'更新时间[：:]\s*(\d{4}[-/]\d{1,2}[-/]\d{1,2})'),
+]
+_AUTHOR_PATTERNS = [
+    re.compile(r'作者[：:]\s*([^\n]+)', re.IGNORECASE),
+    re.compile(r'Author[：:]\s*([^\n]+)', re.IGNORECASE),
+    re.compile(r'来源[：:]\s*([^\n]+)', re.IGNORECASE),
+]
+
+
+def _count_chars(pattern: re.Pattern, text: str) -> int:
+    """按字符连续段匹配并累计长度（比逐字符 findall 生成的列表小得多）"""
+    return sum(map(len, pattern.findall(text)))
+
+
+def _non_whitespace_length(text: str) -> int:
+    """非空白字符数（str.split 与正则 \\s 使用相同的 Unicode 空白定义）"""
+    return len(''.join(text.split()))
+
+
+def _source_type(source_url: Optional[str]) -> Optional[str]:
+    """根据来源URL判断来源类型"""
+    if not source_url:
+        return None
+    if source_url.startswith('http'):
+        return "web"
+    if source_url.endswith('.pdf'):
+        return "pdf"
+    if source_url.endswith(('.docx', '.doc')):
+        return "word"
+    if source_url.startswith('table:'):
+        return "database"
+    return None
+
+
+def iter_text_blocks(text: str, block_chars: int = 65536) -> Iterator[str]:
+    """
+    把已在内存中的长文本切成约 block_chars 字符的片段（优先在空行处切开，其次在换行处），
+    供流式预处理逐段拆行，避免对全文一次生成多个中间副本
+    """
+    start = 0
+    length = len(text)
+    while start < length:
+        end = start + block_chars
+        if end >= length:
+            yield text[start:]
+            return
+        cut = text.find('\n\n', end, end + block_chars)
+        cut = cut + 2 if cut >= 0 else text.find('\n', end) + 1
+        if cut <= 0:
+            yield text[start:]
+            return
+        yield text[start:cut]
+        start = cut
+
 
 class TextCleaner:
     """文本清洗和预处理类"""
@@ -46,35 +150,28 @@ class TextCleaner:
                     text = text.decode('latin-1', errors='ignore')
         
         # 去除控制字符和不可见字符（保留换行和制表符）
-        text = re.sub(r'[\x00-\x08\x0b-\x0c\x0e-\x1f\x7f-\x9f]', '', text)
+        text = _CONTROL_CHARS.sub('', text)
         
         # 标准化空白字符（多个空格/换行合并）
-        text = re.sub(r'[ \t]+', ' ', text)  # 多个空格/制表符合并为一个空格
-        text = re.sub(r'\n{3,}', '\n\n', text)  # 多个换行合并为两个
-        
-        # 标准化日期格式
-        # 匹配各种日期格式并统一
-        date_patterns = [
-            (r'(\d{4})[/-](\d{1,2})[/-](\d{1,2})', r'\1年\2月\3日'),  # 2024/01/11 -> 2024年1月11日
-            (r'(\d{1,2})[/-](\d{1,2})[/-](\d{4})', r'\3年\1月\2日'),  # 01/11/2024 -> 2024年1月11日
-        ]
-        for pattern, replacement in date_patterns:
-            text = re.sub(pattern, replacement, text)
+        text = _SPACE_RUN.sub(' ', text)  # 多个空格/制表符合并为一个空格
+        if '\n\n\n' in text:
+            text = _NEWLINE_RUN.sub('\n\n', text)  # 多个换行合并为两个
+        
+        # 标准化日期格式（没有分隔符的文本不可能匹配）
+        if '/' in text or '-' in text:
+            text = _DATE_YMD.sub(r'\1年\2月\3日', text)
+            text = _DATE_MDY.sub(r'\3年\1月\2日', text)
         
         # 标准化货币格式
-        # 匹配各种货币表示并统一
-        currency_patterns = [
-            (r'¥\s*(\d+(?:\.\d+)?)', r'￥\1'),  # ¥100 -> ￥100
-            (r'(\d+(?:\.\d+)?)\s*元', r'￥\1'),  # 100元 -> ￥100
-            (r'RMB\s*(\d+(?:\.\d+)?)', r'￥\1'),  # RMB100 -> ￥100
-            (r'CNY\s*(\d+(?:\.\d+)?)', r'￥\1'),  # CNY100 -> ￥100
-        ]
-        for pattern, replacement in currency_patterns:
-            text = re.sub(pattern, replacement, text, flags=re.IGNORECASE)
+        if '¥' in text:
+            text = _CURRENCY_YEN.sub(r'￥\1', text)
+        if '元' in text:
+            text = _CURRENCY_YUAN.sub(r'￥\1', text)
+        text = _CURRENCY_RMB.sub(r'￥\1', text)
+        text = _CURRENCY_CNY.sub(r'￥\1', text)
         
         # 去除特殊字符和乱码（保留中文、英文、数字、基本标点、换行）
-        # 保留的字符：中文、英文、数字、基本标点、连字符（用于 3-5、7-10 等范围）、换行、制表符
-        text = re.sub(r'[^\u4e00-\u9fa5a-zA-Z0-9\s.,!?;:()（）【】《》「」『』、。，！？；：\n\t\-]', '', text)
+        text = _DISALLOWED_CHARS.sub('', text)
         
         # 去除首尾空白
         text = text.strip()
@@ -99,28 +196,66 @@ class TextCleaner:
             "code_blocks": []
         }
         
-        lines = text.split('\n')
         processed_lines = []
+        for kind, line, info in self.iter_structure(text.split('\n')):
+            processed_lines.append(line)
+            if kind == "title":
+                structure["titles"].append(info)
+            elif kind == "list":
+                structure["lists"].append(info)
+            elif kind == "table":
+                structure["tables"].append(info)
+            elif kind == "code":
+                structure["code_blocks"].append(info)
+        
+        # 提取段落（非空行序列）
+        paragraphs = []
+        current_para = []
+        for line in processed_lines:
+            if line.strip():
+                current_para.append(line)
+            else:
+                if current_para:
+                    paragraphs.append('\n'.join(current_para))
+                    current_para = []
+        if current_para:
+            paragraphs.append('\n'.join(current_para))
+        
+        structure["paragraphs"] = paragraphs
+        
+        return {
+            "text": '\n'.join(processed_lines),
+            "structure": structure
+        }
+    
+    def iter_structure(self, lines: Iterable[str]) -> Iterator[Tuple[str, str, Optional[Dict]]]:
+        """
+        逐行结构化处理（extract_structure 与流式分块共用）
+
+        产出 (类型, 处理后的行, 结构信息)，类型为 blank / text / title / list / table / code；
+        代码块在结束时作为一行占位产出，代码块内部的行不产出
+        """
         current_code_block = []
         in_code_block = False
-        
+        code_count = 0
+        table_rows = 0
+
         for i, line in enumerate(lines):
             line = line.strip()
             if not line:
-                processed_lines.append("")
+                yield "blank", "", None
                 continue
-            
+
             # 检测代码块
             if line.startswith('```') or line.startswith('~~~'):
                 if in_code_block:
                     # 结束代码块
-                    code_content = '\n'.join(current_code_block)
-                    structure["code_blocks"].append({
-                        "index": len(structure["code_blocks"]),
-                        "content": code_content,
+                    code_count += 1
+                    yield "code", f"[代码块 {code_count}]", {
+                        "index": code_count - 1,
+                        "content": '\n'.join(current_code_block),
                         "language": current_code_block[0] if current_code_block else "text"
-                    })
-                    processed_lines.append(f"[代码块 {len(structure['code_blocks'])}]")
+                    }
                     current_code_block = []
                     in_code_block = False
                 else:
@@ -129,71 +264,38 @@ class TextCleaner:
                     if len(line) > 3:
                         current_code_block.append(line[3:].strip())  # 语言标识
                 continue
-            
+
             if in_code_block:
                 current_code_block.append(line)
                 continue
-            
+
             # 检测标题（以 # 开头或全大写短行）
             if line.startswith('#'):
                 level = len(line) - len(line.lstrip('#'))
                 title_text = line.lstrip('#').strip()
-                structure["titles"].append({
-                    "level": level,
-                    "text": title_text,
-                    "line": i
-                })
-                processed_lines.append(f"【标题{level}】{title_text}")
+                yield "title", f"【标题{level}】{title_text}", {"level": level, "text": title_text, "line": i}
             # 检测列表项
-            elif re.match(r'^[-*+]\s+', line) or re.match(r'^\d+[.)]\s+', line):
-                list_item = re.sub(r'^[-*+\d.)]\s+', '', line)
-                structure["lists"].append({
-                    "text": list_item,
-                    "line": i
-                })
-                processed_lines.append(f"• {list_item}")
+            elif _LIST_ITEM.match(line):
+                list_item = _LIST_MARKER.sub('', line)
+                yield "list", f"• {list_item}", {"text": list_item, "line": i}
             # 检测表格行（包含多个 | 分隔符）
             elif '|' in line and line.count('|') >= 2:
                 cells = [cell.strip() for cell in line.split('|') if cell.strip()]
                 if cells:
-                    structure["tables"].append({
-                        "row": len(structure["tables"]),
-                        "cells": cells
-                    })
-                    processed_lines.append("| " + " | ".join(cells) + " |")
+                    yield "table", "| " + " | ".join(cells) + " |", {"row": table_rows, "cells": cells}
+                    table_rows += 1
             else:
                 # 普通段落
-                processed_lines.append(line)
-        
+                yield "text", line, None
+
         # 处理剩余的代码块
         if in_code_block and current_code_block:
-            code_content = '\n'.join(current_code_block)
-            structure["code_blocks"].append({
-                "index": len(structure["code_blocks"]),
-                "content": code_content,
+            code_count += 1
+            yield "code", f"[代码块 {code_count}]", {
+                "index": code_count - 1,
+                "content": '\n'.join(current_code_block),
                 "language": "text"
-            })
-            processed_lines.append(f"[代码块 {len(structure['code_blocks'])}]")
-        
-        # 提取段落（非空行序列）
-        paragraphs = []
-        current_para = []
-        for line in processed_lines:
-            if line.strip():
-                current_para.append(line)
-            else:
-                if current_para:
-                    paragraphs.append('\n'.join(current_para))
-                    current_para = []
-        if current_para:
-            paragraphs.append('\n'.join(current_para))
-        
-        structure["paragraphs"] = paragraphs
-        
-        return {
-            "text": '\n'.join(processed_lines),
-            "structure": structure
-        }
+            }
     
     def clean_content(self, text: str) -> Tuple[str, Dict]:
         """
@@ -208,19 +310,7 @@ class TextCleaner:
         lines = text.split('\n')
         cleaned_lines = []
         removed_count = 0
-        
-        # 噪音模式（广告、导航、页脚等）
-        noise_patterns = [
-            r'^(首页|关于我们|联系我们|隐私政策|使用条款|网站地图|返回顶部)',
-            r'^(Copyright|©|版权所有)',
-            r'^(广告|Advertisement|AD)',
-            r'^(关注我们|Follow us|订阅)',
-            r'^(分享到|Share to)',
-            r'^(Cookie|Cookies)',
-            r'^[\d\s\-]+$',  # 纯数字和分隔符
-            r'^[^\u4e00-\u9fa5a-zA-Z]{0,5}$',  # 过短且无意义
-        ]
-        
+        min_length = self.min_chunk_length
         seen_lines = set()  # 用于去重
         
         for line in lines:
@@ -229,31 +319,13 @@ class TextCleaner:
                 cleaned_lines.append("")
                 continue
             
-            # 检查是否为噪音
-            is_noise = False
-            for pattern in noise_patterns:
-                if re.match(pattern, line, re.IGNORECASE):
-                    is_noise = True
-                    break
-            
-            if is_noise:
-                removed_count += 1
-                continue
-            
-            # 检查长度（过短的内容可能是噪音）
-            if len(line) < self.min_chunk_length:
-                # 检查是否包含有意义的内容
-                has_meaning = bool(re.search(r'[\u4e00-\u9fa5a-zA-Z]{3,}', line))
-                if not has_meaning:
-                    removed_count += 1
-                    continue
-            
-            # 去重（完全重复）
-            line_hash = hash(line)
-            if line_hash in seen_lines:
+            # 噪音（广告、导航、页脚等）、过短且没有有意义内容的行、完全重复的行
+            if (_NOISE_LINE.match(line)
+                    or (len(line) < min_length and not _MEANINGFUL.search(line))
+                    or line in seen_lines):
                 removed_count += 1
                 continue
-            seen_lines.add(line_hash)
+            seen_lines.add(line)
             
             cleaned_lines.append(line)
         
@@ -272,11 +344,25 @@ class TextCleaner:
         """计算文本质量评分（0-1）"""
         if not text:
             return 0.0
+        return self._quality_score_from_counts(
+            length=len(text),
+            chinese_chars=_count_chars(_CHINESE_RUN, text),
+            latin_chars=_count_chars(_LATIN_RUN, text),
+            non_whitespace=_non_whitespace_length(text),
+            has_punctuation=bool(_PUNCTUATION.search(text)),
+            has_structure='\n' in text or bool(_SENTENCE_END.search(text))
+        )
+
+    @staticmethod
+    def _quality_score_from_counts(length: int, chinese_chars: int, latin_chars: int, non_whitespace: int,
+                                   has_punctuation: bool, has_structure: bool) -> float:
+        """按字符统计计算质量评分（流式预处理逐行累计统计后调用，结果与整段计算一致）"""
+        if not length:
+            return 0.0
         
         score = 0.0
         
         # 长度评分（适中长度得分更高）
-        length = len(text)
         if 100 <= length <= 5000:
             score += 0.3
         elif 50 <= length < 100 or 5000 < length <= 10000:
@@ -285,8 +371,7 @@ class TextCleaner:
             score += 0.1
         
         # 中文内容比例
-        chinese_chars = len(re.findall(r'[\u4e00-\u9fa5]', text))
-        total_chars = len(re.findall(r'[\u4e00-\u9fa5a-zA-Z]', text))
+        total_chars = chinese_chars + latin_chars
         if total_chars > 0:
             chinese_ratio = chinese_chars / total_chars
             if 0.3 <= chinese_ratio <= 0.9:  # 合理的中文比例
@@ -295,17 +380,14 @@ class TextCleaner:
                 score += 0.1
         
         # 信息密度（非空白字符比例）
-        non_whitespace = len(re.sub(r'\s', '', text))
-        if len(text) > 0:
-            density = non_whitespace / len(text)
+        if length > 0:
+            density = non_whitespace / length
             if density > 0.5:
                 score += 0.2
             else:
                 score += 0.1
         
         # 结构完整性（包含标点、换行等）
-        has_punctuation = bool(re.search(r'[。，！？；：]', text))
-        has_structure = bool(re.search(r'\n', text)) or bool(re.search(r'[。！？]', text))
         if has_punctuation and has_structure:
             score += 0.2
         
@@ -324,7 +406,7 @@ class TextCleaner:
             return None
         
         # 优先按「数字. Q:」或「数字. 」分段（如 9. Q: ... 10. Q: ...），每段为完整 Q&A
-        numbered_qa = re.split(r'(?m)^\s*(\d+[.．、]\s+)', text)
+        numbered_qa = _NUMBERED_QA.split(text)
         if len(numbered_qa) >= 3:  # 至少有 1 个编号 + 2 段内容
             segments = []
             for i in range(1, len(numbered_qa), 2):
@@ -337,12 +419,7 @@ class TextCleaner:
                 return segments
         
         # 备选：按 问/答、Q/A、中文序号 分段
-        faq_pattern = re.compile(
-            r'(?m)^\s*((?:问|Q|问题)\d*[：:]\s*|(?:答|A|回答)[：:]\s*|'
-            r'[一二三四五六七八九十]+[、．.]\s*)',
-            re.IGNORECASE
-        )
-        parts = faq_pattern.split(text)
+        parts = _FAQ_MARKER.split(text)
         segments = []
         i = 1
         while i < len(parts):
@@ -422,13 +499,14 @@ class TextCleaner:
         if structure_info.get("titles"):
             current_section = []
             current_title = None
+            titles_by_line = {t["line"]: t for t in structure_info["titles"]}
             
             lines = text.split('\n')
             for i, line in enumerate(lines):
-                # 检查是否是标题行
-                is_title = any(t["line"] == i for t in structure_info["titles"])
+                # 检查是否是标题行（按行号查表，不再逐行遍历全部标题）
+                title_obj = titles_by_line.get(i)
                 
-                if is_title:
+                if title_obj is not None:
                     # 保存之前的章节
                     if current_section and current_title:
                         section_text = '\n'.join(current_section)
@@ -440,8 +518,7 @@ class TextCleaner:
                             })
                     
                     # 开始新章节
-                    title_obj = next((t for t in structure_info["titles"] if t["line"] == i), None)
-                    current_title = title_obj["text"] if title_obj else None
+                    current_title = title_obj["text"]
                     current_section = [line]
                 else:
                     current_section.append(line)
@@ -480,7 +557,7 @@ class TextCleaner:
                         current_chunk = ""
                     
                     # 按句子分割长段落
-                    sentences = re.split(r'[。！？\n]', para)
+                    sentences = _SENTENCE_SPLIT.split(para)
                     for sent in sentences:
                         sent = sent.strip()
                         if not sent:
@@ -522,7 +599,7 @@ class TextCleaner:
             # 如果块太大，需要分割
             if len(content) > chunk_size:
                 # 按句子分割
-                sentences = re.split(r'[。！？\n]', content)
+                sentences = _SENTENCE_SPLIT.split(content)
                 current_subchunk = ""
                 
                 for sent in sentences:
@@ -592,12 +669,335 @@ class TextCleaner:
         
         return final_chunks
     
-    def extract_metadata(self, text: str, source_url: Optional[str] = None) -> Dict[str, any]:
+    @staticmethod
+    def _split_parts(parts: Iterable[str]) -> Iterator[str]:
+        """逐页/逐行输入拆成行：末尾的单个换行只是行结束符，末尾的空行保留为段落分隔"""
+        for part in parts:
+            if part.endswith('\n'):
+                part = part[:-1]
+            yield from part.split('\n')
+
+    def _normalize_events(self, events: Iterable[Tuple[str, str, Optional[Dict]]]) -> Iterator[Tuple[str, str, Optional[Dict]]]:
+        """结构化之后逐行规范化（先识别标题等结构，规范化会去掉 # | 等标记字符），规范化后为空的行视为空行"""
+        for kind, line, info in events:
+            if line:
+                line = self.normalize_text(line)
+                if not line:
+                    kind = "blank"
+            yield kind, line, info
+
+    def _iter_clean_events(self, events: Iterable[Tuple[str, str, Optional[Dict]]], stats: Dict,
+                           sink: Optional[TextIO] = None,
+                           filter_lines: bool = True) -> Iterator[Tuple[str, str, Optional[Dict]]]:
+        """
+        逐行内容清理（规则与 clean_content 相同，标题行不按过短、重复过滤），
+        同时累计质量评分和元数据所需的统计（迭代结束时写入 stats）；去重集合只保存行的哈希，清理后的行写入 sink（可选）
+        filter_lines 为 False 时不过滤任何行，只累计统计（表格行由调用方按单元格生成，不适用噪音规则）
+        """
+        min_length = self.min_chunk_length
+        seen = set()
+        counts = Counter()
+        punctuation = sentence_end = False
+        time_rank = len(_TIME_PATTERNS)  # 已找到的时间信息对应的规则序号（序号小的规则优先）
+        author_rank = len(_AUTHOR_PATTERNS)
+        in_paragraph = False
+        lines = length = 0
+
+        try:
+            for kind, line, info in events:
+                if line:
+                    if filter_lines and _NOISE_LINE.match(line):
+                        counts["removed"] += 1
+                        continue
+                    if filter_lines and kind != "title":
+                        key = hash(line)
+                        if (len(line) < min_length and not _MEANINGFUL.search(line)) or key in seen:
+                            counts["removed"] += 1
+                            continue
+                        seen.add(key)
+
+                    counts["chinese"] += _count_chars(_CHINESE_RUN, line)
+                    latin_runs = _LATIN_RUN.findall(line)
+                    counts["latin"] += sum(map(len, latin_runs))
+                    counts["latin_words"] += len(latin_runs)
+                    counts["non_whitespace"] += _non_whitespace_length(line)
+                    punctuation = punctuation or bool(_PUNCTUATION.search(line))
+                    sentence_end = sentence_end or bool(_SENTENCE_END.search(line))
+                    if kind != "text":
+                        counts[kind + "s"] += 1
+                    if not in_paragraph:
+                        counts["paragraphs"] += 1
+                        in_paragraph = True
+                    # 时间、作者规则都含有固定字符，先用字面量预检跳过不相关的行
+                    if time_rank and ('年' in line or '/' in line or '-' in line):
+                        for rank in range(time_rank):
+                            match = _TIME_PATTERNS[rank].search(line)
+                            if match:
+                                groups = match.groups()
+                                stats["time"] = groups[0] if len(groups) == 1 else '-'.join(groups)
+                                time_rank = rank
+                                break
+                    if author_rank and ('作者' in line or '来源' in line or 'author' in line.lower()):
+                        for rank in range(author_rank):
+                            match = _AUTHOR_PATTERNS[rank].search(line)
+                            if match:
+                                stats["author"] = match.group(1).strip()
+                                author_rank = rank
+                                break
+                else:
+                    in_paragraph = False
+
+                # 与 clean_content 拼接的全文一致：行之间以换行分隔
+                if lines:
+                    length += 1
+                    if sink is not None:
+                        sink.write('\n')
+                lines += 1
+                length += len(line)
+                if sink is not None:
+                    sink.write(line)
+                yield kind, line, info
+        finally:
+            stats.update(counts, lines=lines, length=length, punctuation=punctuation, sentence_end=sentence_end)
+
+    def _chunk_structured(self, events: Iterable[Tuple[str, str, Optional[Dict]]], chunk_size: int,
+                          overlap: int) -> Iterator[Dict[str, any]]:
+        """
+        按结构化行流分块：标题开启新的一节，块带所在节的标题；节内段落拼装到不超过 chunk_size，
+        超过 chunk_size 的段落逐句拼装，超长句子按 chunk_size 切开；块以前一个块末尾 overlap 个字符开头
+        只缓存当前段落和当前块，内存占用与文档长度无关
+        """
+        ready = []  # 已完成、待产出的块
+        title = None
+        current = ""  # 正在拼装的块
+        para = []  # 当前段落的行
+        para_len = 0
+        long_para = False  # 当前段落已超过块大小，改为逐句拼装
+        prev = ""  # 上一个块（含重叠部分），用于生成下一个块的重叠
+        index = 0
+
+        def finish():
+            nonlocal current, prev, index
+            content, current = current.strip(), ""
+            if not content:
+                return
+            if overlap > 0 and len(prev) > overlap:
+                content = prev[-overlap:] + content
+            prev = content
+            content = content[:self.max_chunk_length]
+            if len(content) < self.min_chunk_length:
+                return
+            content = self.normalize_text(content)
+            if content:
+                ready.append({
+                    "content": content,
+                    "title": title,
+                    "type": "section" if title else "paragraph",
+                    "chunk_index": index
+                })
+                index += 1
+
+        def add_sentences(line: str):
+            nonlocal current
+            for sent in _SENTENCE_SPLIT.split(line):
+                sent = sent.strip()
+                for start in range(0, len(sent), chunk_size):
+                    piece = sent[start:start + chunk_size]
+                    if len(current) + len(piece) > chunk_size:
+                        finish()
+                    current += piece + ("。" if start + chunk_size >= len(sent) else "")
+
+        def end_paragraph():
+            nonlocal current, para, para_len, long_para
+            if para:
+                text = '\n'.join(para)
+                if len(current) + len(text) > chunk_size:
+                    finish()
+                current += text + "\n\n"
+            para, para_len, long_para = [], 0, False
+
+        def add_line(line: str):
+            nonlocal para, para_len, long_para
+            if long_para:
+                add_sentences(line)
+                return
+            new_len = para_len + len(line) + (1 if para else 0)
+            if new_len <= chunk_size:
+                para.append(line)
+                para_len = new_len
+                return
+            # 段落超过块大小：先结束当前块，已缓存的行和之后的行都按句子拼装
+            finish()
+            long_para = True
+            for buffered in para:
+                add_sentences(buffered)
+            para, para_len = [], 0
+            add_sentences(line)
+
+        for kind, line, info in events:
+            if kind == "blank":
+                end_paragraph()
+            else:
+                if kind == "title":
+                    end_paragraph()
+                    finish()
+                    title = info["text"]
+                add_line(line)
+            if ready:
+                yield from ready
+                ready.clear()
+
+        end_paragraph()
+        finish()
+        yield from ready
+
+    def iter_chunks(self, lines: Iterable[str], chunk_size: Optional[int] = None,
+                    overlap: Optional[int] = None) -> Iterator[Dict[str, any]]:
+        """
+        流式分块：输入为逐行或逐页产出的文本，结构化后按标题分节、节内按段落拼装，边读边产出块
+        块字段与 chunk_text_optimized 相同（content, title, type, chunk_index），不做 FAQ 分块
+        """
+        return self._chunk_structured(self.iter_structure(self._split_parts(lines)), chunk_size or self.chunk_size,
+                                      self.chunk_overlap if overlap is None else overlap)
+
+    def iter_document_chunks(self, parts: Iterable[str], stats: Dict, chunk_size: Optional[int] = None,
+                             overlap: Optional[int] = None, sink: Optional[TextIO] = None) -> Iterator[Dict[str, any]]:
+        """
+        大文档流式预处理：逐行结构化、规范化、内容清理，清理后的行直接进入流式分块
+        与整段预处理相比不做 FAQ 分块；结构化先于规范化，标题不会被当作特殊字符去掉，块带所在节的标题
+
+        参数:
+        - parts: 逐页/逐段/逐行产出的原始文本（如解析器逐页产出的 PDF 文本；已在内存中的长文本可用 iter_text_blocks 切段）
+        - stats: 调用方传入的字典，迭代过程中累计清理和统计信息，迭代结束后传给 stream_quality_score / stream_metadata
+        - sink: 写入清理后全文的文本流（可选）
+        """
+        self._reset_stream_stats(stats)
+        events = self._normalize_events(self.iter_structure(self._split_parts(parts)))
+        events = self._iter_clean_events(events, stats, sink)
+        return self._chunk_structured(events, chunk_size or self.chunk_size,
+                                      self.chunk_overlap if overlap is None else overlap)
+
+    @staticmethod
+    def _reset_stream_stats(stats: Dict):
+        stats.update(removed=0, lines=0, length=0, chinese=0, latin=0, latin_words=0, non_whitespace=0,
+                     punctuation=False, sentence_end=False, paragraphs=0, titles=0, lists=0, tables=0, codes=0,
+                     time=None, author=None)  # 迭代结束时更新
+
+    @staticmethod
+    def _iter_table_events(rows: Iterable[Tuple[str, List[str]]]) -> Iterator[Tuple[str, str, Optional[Dict]]]:
+        """表格行转为结构化行流：每个工作表以标题行开始，第一行为表头，工作表之间以空行分隔"""
+        sheet = None
+        for sheet_name, cells in rows:
+            header = sheet_name != sheet
+            if header:
+                if sheet is not None:
+                    yield "blank", "", None
+                sheet = sheet_name
+                yield "title", f"=== 工作表: {sheet_name} ===", {"level": 1, "text": sheet_name}
+            yield "table", "| " + " | ".join(cells) + " |", {"header": header}
+
+    def _chunk_row_windows(self, events: Iterable[Tuple[str, str, Optional[Dict]]],
+                           chunk_size: int) -> Iterator[Dict[str, any]]:
+        """
+        表格按行窗口分块：每个块以工作表名和表头开头，随后是总长不超过 chunk_size 的连续数据行，
+        块之间不重叠（表头已提供上下文）；只有表头的工作表单独成块。只缓存当前窗口
+        """
+        sheet = None
+        header = ""
+        window: List[str] = []
+        window_len = 0
+        has_rows = False
+        index = 0
+
+        def make_chunk() -> Dict[str, any]:
+            content = '\n'.join([f"工作表: {sheet}", header] + window)
+            return {"content": content[:self.max_chunk_length], "title": sheet, "type": "table", "chunk_index": index}
+
+        for kind, line, info in events:
+            if kind == "title":
+                if window or (header and not has_rows):
+                    yield make_chunk()
+                    index += 1
+                sheet, header, window, window_len, has_rows = info["text"], "", [], 0, False
+            elif kind == "table" and info["header"]:
+                header = line
+            elif kind == "table":
+                prefix_len = len(sheet) + len(header) + 7  # "工作表: " 和两个换行
+                if window and prefix_len + window_len + len(line) + 1 > chunk_size:
+                    yield make_chunk()
+                    index += 1
+                    window, window_len = [], 0
+                window.append(line)
+                window_len += len(line) + 1
+                has_rows = True
+
+        if window or (header and not has_rows):
+            yield make_chunk()
+
+    def iter_table_chunks(self, rows: Iterable[Tuple[str, List[str]]], stats: Dict, chunk_size: Optional[int] = None,
+                          sink: Optional[TextIO] = None) -> Iterator[Dict[str, any]]:
+        """
+        表格流式分块（Excel / CSV 价格表、SKU 表等）：按行窗口分块，每个块重复工作表名和表头，块类型为 table
+
+        参数:
+        - rows: 逐行产出的 (工作表名, 单元格文本列表)，每个工作表的第一行作为表头（如 spreadsheet_reader.iter_sheet_rows）
+        - stats / sink: 与 iter_document_chunks 相同；表格行不做噪音和重复过滤，写入 sink 的全文中表头只出现一次
+        """
+        self._reset_stream_stats(stats)
+        events = self._iter_clean_events(self._iter_table_events(rows), stats, sink, filter_lines=False)
+        return self._chunk_row_windows(events, chunk_size or self.chunk_size)
+
+    def stream_quality_score(self, stats: Dict) -> float:
+        """流式预处理结束后，按累计统计计算质量评分（与对清理后全文调用 _calculate_quality_score 一致）"""
+        return self._quality_score_from_counts(
+            length=stats["length"],
+            chinese_chars=stats["chinese"],
+            latin_chars=stats["latin"],
+            non_whitespace=stats["non_whitespace"],
+            has_punctuation=stats["punctuation"],
+            has_structure=stats["lines"] > 1 or stats["sentence_end"]
+        )
+
+    def stream_metadata(self, stats: Dict, source_url: Optional[str] = None,
+                        quality_score: Optional[float] = None) -> Dict[str, any]:
+        """流式预处理结束后，按累计统计生成与 extract_metadata 字段相同的元数据"""
+        metadata = {
+            "source_url": source_url,
+            "extracted_at": datetime.utcnow().isoformat(),
+            "structure_tags": [],
+            "quality_score": self.stream_quality_score(stats) if quality_score is None else quality_score,
+            "statistics": {}
+        }
+        if stats.get("time"):
+            metadata["extracted_time"] = stats["time"]
+        if stats.get("author"):
+            metadata["author"] = stats["author"]
+        source_type = _source_type(source_url)
+        if source_type:
+            metadata["source_type"] = source_type
+        for key, tag in (("titles", "has_titles"), ("lists", "has_lists"), ("tables", "has_tables"), ("codes", "has_code")):
+            if stats[key]:
+                metadata["structure_tags"].append(tag)
+        metadata["statistics"] = {
+            "total_length": stats["length"],
+            "char_count": stats["non_whitespace"],
+            "chinese_char_count": stats["chinese"],
+            "english_word_count": stats["latin_words"],
+            "paragraph_count": stats["paragraphs"],
+            "title_count": stats["titles"],
+            "list_count": stats["lists"],
+            "table_count": stats["tables"],
+            "code_block_count": stats["codes"]
+        }
+        return metadata
+
+    def extract_metadata(self, text: str, source_url: Optional[str] = None,
+                         quality_score: Optional[float] = None) -> Dict[str, any]:
         """
         (5) 元数据提取
         - 提取来源、作者、时间等信息
         - 添加文档结构标签
-        - 质量评分标注
+        - 质量评分标注（quality_score 为内容清理阶段已算出的评分，可选）
         """
         metadata = {
             "source_url": source_url,
@@ -610,43 +1010,25 @@ class TextCleaner:
         if not text:
             return metadata
         
-        # 提取时间信息
-        time_patterns = [
-            r'(\d{4})年(\d{1,2})月(\d{1,2})日',
-            r'(\d{4})[/-](\d{1,2})[/-](\d{1,2})',
-            r'发布时间[：:]\s*(\d{4}[-/]\d{1,2}[-/]\d{1,2})',
-            r'更新时间[：:]\s*(\d{4}[-/]\d{1,2}[-/]\d{1,2})',
-        ]
-        
-        for pattern in time_patterns:
-            matches = re.findall(pattern, text)
-            if matches:
-                metadata["extracted_time"] = matches[0] if isinstance(matches[0], str) else '-'.join(matches[0])
+        # 提取时间信息（只需要第一个匹配）
+        for pattern in _TIME_PATTERNS:
+            match = pattern.search(text)
+            if match:
+                groups = match.groups()
+                metadata["extracted_time"] = groups[0] if len(groups) == 1 else '-'.join(groups)
                 break
         
         # 提取作者信息
-        author_patterns = [
-            r'作者[：:]\s*([^\n]+)',
-            r'Author[：:]\s*([^\n]+)',
-            r'来源[：:]\s*([^\n]+)',
-        ]
-        
-        for pattern in author_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
+        for pattern in _AUTHOR_PATTERNS:
+            match = pattern.search(text)
             if match:
                 metadata["author"] = match.group(1).strip()
                 break
         
         # 提取来源信息
-        if source_url:
-            if source_url.startswith('http'):
-                metadata["source_type"] = "web"
-            elif source_url.endswith('.pdf'):
-                metadata["source_type"] = "pdf"
-            elif source_url.endswith(('.docx', '.doc')):
-                metadata["source_type"] = "word"
-            elif source_url.startswith('table:'):
-                metadata["source_type"] = "database"
+        source_type = _source_type(source_url)
+        if source_type:
+            metadata["source_type"] = source_type
         
         # 结构化处理以获取结构标签
         structured = self.extract_structure(text)
@@ -661,16 +1043,18 @@ class TextCleaner:
         if structure_info.get("code_blocks"):
             metadata["structure_tags"].append("has_code")
         
-        # 质量评分
-        _, quality_info = self.clean_content(text)
-        metadata["quality_score"] = quality_info.get("quality_score", 0.0)
+        # 质量评分（调用方已在内容清理阶段算出时直接使用，不再对全文清理一遍）
+        if quality_score is None:
+            _, quality_info = self.clean_content(text)
+            quality_score = quality_info.get("quality_score", 0.0)
+        metadata["quality_score"] = quality_score
         
         # 统计信息
         metadata["statistics"] = {
             "total_length": len(text),
-            "char_count": len(re.sub(r'\s', '', text)),
-            "chinese_char_count": len(re.findall(r'[\u4e00-\u9fa5]', text)),
-            "english_word_count": len(re.findall(r'[a-zA-Z]+', text)),
+            "char_count": _non_whitespace_length(text),
+            "chinese_char_count": _count_chars(_CHINESE_RUN, text),
+            "english_word_count": len(_LATIN_RUN.findall(text)),
             "paragraph_count": len(structure_info.get("paragraphs", [])),
             "title_count": len(structure_info.get("titles", [])),
             "list_count": len(structure_info.get("lists", [])),
@@ -0,0 +1,333 @@
+"""
+中文分词服务
+进程内只加载一次 jieba，并用商品名称、商品分类生成的用户词典补充商品名词和型号（如“行车记录仪”、“X1-Pro”），
+重复文本的分词结果经 LRU 缓存；词项按稳定哈希映射为 64 位 token id，可随知识块持久化，
+知识库 BM25 索引和其他检索功能共用同一个分词器。
+商品词典保存在磁盘上、只增不减：新增或改名的商品带来的新词只使包含这些词的块重新分词，其余块的分词结果继续复用
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Set, Union
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from ..utils import load_env
+from .cache_service import LRUCache
+
+# 中文分词
+try:
+    import jieba
+    JIEBA_AVAILABLE = True
+except ImportError:
+    JIEBA_AVAILABLE = False
+    jieba = None
+
+TOKEN_DTYPE = np.int64
+TOKENIZER_REVISION = "2"  # 分词规则变更时递增，使已持久化的 token id 失效
+
+_NAME_SPLIT = re.compile(r"[^\w\-.+#]+")
+_CHINESE_RUN = re.compile(r"[\u4e00-\u9fff]{2,}")
+# 型号：字母数字混合或带连字符的编号，如 X1-Pro、iPhone15、RTX4090、AB-12
+_MODEL_NUMBER = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)+|[a-z]+\d[a-z0-9]*|\d+[a-z][a-z0-9]*")
+_NON_WORD = re.compile(r"^[\W_]+$")
+_FALLBACK_TOKEN = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*|[\u4e00-\u9fff]")
+_MAX_SUBWORD_LEN = 8
+
+
+def token_id(token: str) -> int:
+    """词项的稳定 token id（blake2b 前 63 位，跨进程、跨重启一致）"""
+    digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") >> 1
+
+
+def pack_token_ids(ids: np.ndarray) -> bytes:
+    """token id 序列序列化为字节（存入 knowledge_chunks.token_ids）"""
+    return np.asarray(ids, dtype=TOKEN_DTYPE).tobytes()
+
+
+def unpack_token_ids(data: Optional[bytes]) -> np.ndarray:
+    return np.frombuffer(data or b"", dtype=TOKEN_DTYPE)
+
+
+def mine_dictionary_words(product_names: Iterable[str], category_names: Iterable[str] = (),
+                          min_freq: int = 2, max_len: int = 8) -> Set[str]:
+    """
+    从商品名称和分类名称生成用户词典
+
+    - 分类名称整体作为词
+    - 商品名称中的型号（字母数字混合、带连字符）作为词
+    - 商品名称中至少出现在 min_freq 个商品里的最长公共中文片段作为词
+      （如“高端行车记录仪523”“便携行车记录仪881”得到“行车记录仪”）
+    """
+    words: Set[str] = set()
+    for name in category_names:
+        name = (name or "").strip().lower()
+        if 2 <= len(name) <= max_len and not _NAME_SPLIT.search(name):
+            words.add(name)
+
+    counts: Counter = Counter()
+    for name in set(n.strip().lower() for n in product_names if n):
+        words.update(m for m in _MODEL_NUMBER.findall(name) if len(m) >= 3)
+        grams = set()
+        for run in _CHINESE_RUN.findall(name):
+            for size in range(2, min(len(run), max_len) + 1):
+                grams.update(run[i:i + size] for i in range(len(run) - size + 1))
+        counts.update(grams)
+
+    frequent = {g: c for g, c in counts.items() if c >= min_freq}
+    # 只保留闭合片段：向任一侧扩展一个字后出现次数都会减少（否则它只是更长片段的一部分）
+    absorbed = set()
+    for gram, count in frequent.items():
+        for part in (gram[1:], gram[:-1]):
+            if len(part) >= 2 and frequent.get(part) == count:
+                absorbed.add(part)
+    words.update(g for g in frequent if g not in absorbed)
+    return words
+
+
+def load_dictionary_words(db: Session) -> Set[str]:
+    """从数据库读取商品名称和分类名称生成用户词典"""
+    from ..models import Category, Product
+
+    product_names = [name for (name,) in db.query(Product.name).all()]
+    category_names = [name for (name,) in db.query(Category.name).all()]
+    category_names += [name for (name,) in db.query(Product.category).distinct().all() if name]
+    return mine_dictionary_words(product_names, category_names,
+                                 min_freq=int(os.environ.get("TOKENIZER_MIN_NAME_FREQ", "2")))
+
+
+def _load_dictionary_from_database() -> Set[str]:
+    try:
+        from ..database import session_scope
+        with session_scope() as db:
+            return load_dictionary_words(db)
+    except Exception as e:
+        print(f"⚠ 从商品数据生成分词词典失败: {e}")
+        return set()
+
+
+_jieba_base = None
+_jieba_base_lock = threading.Lock()
+
+
+def _new_jieba_tokenizer(words: Iterable[str]):
+    """
+    独立的 jieba 分词器（默认词典只从磁盘加载一次，之后复制词频表，不影响全局 jieba），加入用户词典词
+
+    词频按默认词典估计、总词频保持默认词典的值：加入的词只改变包含它的文本的切分，
+    不会因为其他词的加入而改变别处的切分（已持久化的分词结果才能按词判断是否失效）
+    """
+    global _jieba_base
+    with _jieba_base_lock:
+        if _jieba_base is None:
+            _jieba_base = jieba.Tokenizer()
+            _jieba_base.initialize()
+    tokenizer = jieba.Tokenizer()
+    tokenizer.FREQ = dict(_jieba_base.FREQ)
+    tokenizer.total = _jieba_base.total
+    tokenizer.initialized = True
+    for word in words:
+        tokenizer.add_word(word, _jieba_base.suggest_freq(word, False))
+    tokenizer.total = _jieba_base.total
+    return tokenizer
+
+
+class Tokenizer:
+    """
+    共享中文分词器
+
+    参数:
+    - words: 用户词典（为空时首次分词前调用 dictionary_loader 生成）
+    - dictionary_loader: 生成用户词典的函数（默认从商品和分类表读取）
+    - cache_size: 分词结果 LRU 缓存容量
+    - dictionary_path: 保存用户词典的文件（每行一个词）；加载时与新生成的词典合并，
+      新生成但尚未保存的词记为新增词，含新增词的持久化分词结果视为失效（见 is_current）
+    """
+
+    def __init__(self, words: Optional[Iterable[str]] = None,
+                 dictionary_loader: Optional[Callable[[], Set[str]]] = None,
+                 cache_size: Optional[int] = None,
+                 dictionary_path: Optional[Union[str, Path]] = None):
+        load_env()
+        self._words: Optional[Set[str]] = set(words) if words is not None else None
+        self._dictionary_loader = dictionary_loader or _load_dictionary_from_database
+        self.dictionary_path = Path(dictionary_path) if dictionary_path else None
+        self._new_words: Set[str] = set()
+        self._new_words_pattern: Optional[re.Pattern] = None
+        self._jieba = None
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._version: Optional[str] = None
+        self._max_word_len = 1
+        self.cache = LRUCache(int(cache_size if cache_size is not None
+                                  else os.environ.get("TOKENIZER_CACHE_SIZE", "4096")))
+        self.cache_max_chars = int(os.environ.get("TOKENIZER_CACHE_MAX_CHARS", "1000"))
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            if self._words is None:
+                mined = self._dictionary_loader()
+                saved = self._read_saved_words()
+                self._words = saved | mined
+                if self.dictionary_path is not None:
+                    self._set_new_words(mined - saved)
+            if JIEBA_AVAILABLE:
+                tokenizer = _new_jieba_tokenizer(sorted(self._words))
+                user_dict = os.environ.get("TOKENIZER_USER_DICT")
+                if user_dict and os.path.exists(user_dict):
+                    tokenizer.load_userdict(user_dict)
+                self._jieba = tokenizer
+            self._max_word_len = max((len(w) for w in self._words), default=1)
+            engine = 'jieba' if self._jieba else 'fallback'
+            self._version = hashlib.sha1(f"{TOKENIZER_REVISION}:{engine}".encode("utf-8")).hexdigest()[:16]
+            self._loaded = True
+            print(f"✓ 分词器已加载: {'jieba' if self._jieba else '内置词典匹配'}，商品词典 {len(self._words)} 个词"
+                  f"（新增 {len(self._new_words)} 个）")
+
+    def _read_saved_words(self) -> Set[str]:
+        if self.dictionary_path is None:
+            return set()
+        try:
+            return {line.strip() for line in self.dictionary_path.read_text(encoding="utf-8").splitlines() if line.strip()}
+        except OSError:
+            return set()
+
+    def _set_new_words(self, words: Set[str]):
+        self._new_words = set(words)
+        self._new_words_pattern = re.compile(
+            "|".join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+        ) if words else None
+
+    @property
+    def version(self) -> str:
+        """分词器版本（只随分词规则 TOKENIZER_REVISION 和分词引擎变化，商品词典增加词不改变版本）"""
+        self._ensure_loaded()
+        return self._version
+
+    @property
+    def new_words(self) -> Set[str]:
+        """本次加载新增、尚未保存的词典词"""
+        self._ensure_loaded()
+        return set(self._new_words)
+
+    def is_current(self, text: Optional[str], version: Optional[str]) -> bool:
+        """持久化的分词结果是否仍可复用：版本一致，且文本不含尚未保存的新增词（新增词只改变包含它的文本的切分）"""
+        if version != self.version:
+            return False
+        return self._new_words_pattern is None or not self._new_words_pattern.search((text or "").lower())
+
+    def save_dictionary(self):
+        """
+        保存词典（与文件中已有的词合并），之后新增词不再使持久化的分词结果失效
+        调用方在包含新增词的块重新分词并写回数据库后调用
+        """
+        self._ensure_loaded()
+        if self.dictionary_path is None or not self._new_words:
+            return
+        with self._lock:
+            words = self._read_saved_words() | self._words
+            self.dictionary_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.dictionary_path.with_name(f"{self.dictionary_path.name}.{os.getpid()}.tmp")
+            tmp_path.write_text("\n".join(sorted(words)) + "\n", encoding="utf-8")
+            os.replace(tmp_path, self.dictionary_path)
+            self._set_new_words(set())
+
+    @property
+    def words(self) -> Set[str]:
+        self._ensure_loaded()
+        return set(self._words)
+
+    def _is_word(self, token: str) -> bool:
+        if token in self._words:
+            return True
+        return bool(self._jieba and self._jieba.FREQ.get(token))
+
+    def _subwords(self, token: str) -> List[str]:
+        """长词中包含的词典词（搜索引擎模式，使“记录仪”也能匹配“行车记录仪”）"""
+        if len(token) < 2 or len(token) > _MAX_SUBWORD_LEN or not _CHINESE_RUN.fullmatch(token):
+            return []
+        if self._jieba is None:
+            # 内置匹配的其余中文按字切分，词典词也输出单字，保证查询与文档的切分方式可对齐
+            return list(token)
+        return [
+            token[i:i + size]
+            for size in range(2, len(token))
+            for i in range(len(token) - size + 1)
+            if self._is_word(token[i:i + size])
+        ]
+
+    def _cut_fallback(self, text: str) -> List[str]:
+        """未安装 jieba 时：用户词典正向最大匹配，其余中文按字切分，英文数字整体保留"""
+        tokens = []
+        pos = 0
+        while pos < len(text):
+            for size in range(min(self._max_word_len, len(text) - pos), 1, -1):
+                if text[pos:pos + size] in self._words:
+                    tokens.append(text[pos:pos + size])
+                    pos += size
+                    break
+            else:
+                match = _FALLBACK_TOKEN.match(text, pos)
+                if match:
+                    tokens.append(match.group())
+                    pos = match.end()
+                else:
+                    pos += 1
+        return tokens
+
+    def tokenize(self, text: str) -> List[str]:
+        """分词（小写化，去掉空白和标点，长词额外输出其中的词典词）"""
+        if not text:
+            return []
+        cacheable = len(text) <= self.cache_max_chars
+        if cacheable:
+            cached = self.cache.get(text)
+            if cached is not None:
+                return list(cached)
+
+        self._ensure_loaded()
+        normalized = text.lower()
+        pieces = self._jieba.cut(normalized) if self._jieba else self._cut_fallback(normalized)
+        tokens = []
+        for piece in pieces:
+            piece = piece.strip()
+            if not piece or _NON_WORD.match(piece):
+                continue
+            tokens.append(piece)
+            tokens.extend(self._subwords(piece))
+
+        if cacheable:
+            self.cache.set(text, tuple(tokens))
+        return tokens
+
+    def token_ids(self, text: str) -> np.ndarray:
+        """分词并转换为 token id 数组"""
+        return np.fromiter((token_id(t) for t in self.tokenize(text)), dtype=TOKEN_DTYPE)
+
+
+# 全局分词器实例
+_tokenizer: Optional[Tokenizer] = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer() -> Tokenizer:
+    """获取共享分词器（单例模式，词典在首次分词时从商品数据生成，与 TOKENIZER_DICT_PATH 中保存的词典合并）"""
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                load_env()
+                default_path = Path(__file__).resolve().parent.parent.parent / "tokenizer_dictionary.txt"
+                _tokenizer = Tokenizer(dictionary_path=os.environ.get("TOKENIZER_DICT_PATH") or default_path)
+    return _tokenizer
@@ -0,0 +1,541 @@
+"""
+向量存储服务
+以知识块自身的稳定 ID 作为向量 ID，支持按 ID 增量添加/删除向量，避免删除文档时重新向量化整个知识库。
+索引类型可配置（Flat / IVF-Flat / IVF-SQ8 / IVF-PQ / HNSW），重建时按向量数量自动选择并训练，
+近似索引需通过与精确（Flat）索引对比的召回率检查后才会替换当前索引。
+默认使用内积度量（嵌入已归一化，内积即余弦相似度），旧版 L2 索引加载时自动迁移。
+索引以带代数的快照保存（临时文件 → fsync → 原子重命名，MANIFEST 记录当前代数和向量ID校验和），
+加载时使用 FAISS 内存映射，多个进程共享页缓存
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ..utils import load_env
+
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+    faiss = None
+
+INDEX_TYPES = ("flat", "ivf", "ivfsq8", "ivfpq", "hnsw")
+IVF_TYPES = ("ivf", "ivfsq8", "ivfpq")
+MANIFEST_NAME = "MANIFEST.json"
+SNAPSHOT_PATTERN = re.compile(r"^index-(\d+)\.faiss$")
+
+
+def vector_id_checksum(ids) -> str:
+    """向量ID集合的校验和（与顺序无关），用于比对快照与 knowledge_chunks 表"""
+    id_array = np.sort(np.asarray(ids, dtype="<i8").ravel())
+    return hashlib.sha1(id_array.tobytes()).hexdigest()
+
+
+def _fsync_path(path: Path):
+    """将文件（或目录项）刷到磁盘；Windows 不支持打开目录，忽略"""
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _atomic_write_text(path: Path, text: str):
+    """写入临时文件、fsync 后原子替换目标文件"""
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as fp:
+        fp.write(text)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp, path)
+
+
+class VectorStore:
+    """基于 FAISS 的向量存储（Flat/HNSW 使用 IndexIDMap2 包装，IVF 系列使用原生 ID + 哈希直接映射）"""
+
+    def __init__(self, index_path: Path, dim: int):
+        load_env()
+        self.index_path = Path(index_path)  # 旧版单文件索引（仅用于迁移）
+        # 旧版索引元数据（嵌入模型名称、维度、索引类型），用于判断是否需要全量重新向量化或重新训练
+        self.meta_path = self.index_path.with_suffix(".meta.json")
+        # 快照目录：index-<代数>.faiss + MANIFEST.json（当前代数、元数据、向量ID校验和）
+        self.snapshot_dir = self.index_path.with_suffix(".snapshots")
+        self.manifest_path = self.snapshot_dir / MANIFEST_NAME
+        self.manifest: Dict = {}
+        self.generation = 0
+        # 当前索引是否以内存映射方式加载（只读，修改或保存前需完整读入内存）
+        self.mapped_path: Optional[Path] = None
+        # 内存中的索引是否有尚未保存的修改
+        self.dirty = False
+        self.dim = dim
+        self.index = None
+        self.meta: Dict = {}
+        # 加载的是旧版按位置编号的索引，向量 ID 需要迁移为块 ID
+        self.legacy_ids = False
+        # HNSW 不支持物理删除：已删除的向量ID记为墓碑，检索时排除，累积过多时压缩重建
+        self.deleted: set = set()
+        # 加载时发生了迁移（旧版ID或度量），调用方需要保存
+        self.migrated = False
+
+        self.metric = "l2" if os.environ.get("RAG_VECTOR_METRIC", "ip").lower() == "l2" else "ip"  # ip（余弦）/ l2
+        self.configured_type = os.environ.get("RAG_INDEX_TYPE", "auto").lower()  # auto / flat / ivf / ivfsq8 / ivfpq / hnsw
+        self.auto_ivf_threshold = int(os.environ.get("RAG_INDEX_AUTO_IVF_THRESHOLD", "20000"))  # 超过该向量数自动使用 IVF
+        self.auto_sq8_threshold = int(os.environ.get("RAG_INDEX_AUTO_SQ8_THRESHOLD", "500000"))  # 超过该向量数自动使用 IVF-SQ8
+        self.nprobe = int(os.environ.get("RAG_IVF_NPROBE", "16"))
+        self.hnsw_m = int(os.environ.get("RAG_HNSW_M", "32"))
+        self.ef_construction = int(os.environ.get("RAG_HNSW_EF_CONSTRUCTION", "80"))
+        self.ef_search = int(os.environ.get("RAG_HNSW_EF_SEARCH", "64"))
+        self.min_recall = float(os.environ.get("RAG_INDEX_MIN_RECALL", "0.9"))  # 近似索引最低召回率（recall@10）
+        self.use_mmap = os.environ.get("RAG_INDEX_MMAP", "true").lower() == "true"  # 加载快照时使用内存映射
+        self.snapshot_keep = max(1, int(os.environ.get("RAG_INDEX_SNAPSHOT_KEEP", "2")))  # 保留的快照数量
+
+    @property
+    def ntotal(self) -> int:
+        if self.index is None:
+            return 0
+        return self.index.ntotal - len(self.deleted)
+
+    @property
+    def d(self) -> int:
+        return self.index.d if self.index is not None else self.dim
+
+    @property
+    def model_name(self) -> Optional[str]:
+        return self.meta.get("model")
+
+    @property
+    def index_type(self) -> str:
+        return self.meta.get("index_type", "flat")
+
+    def _faiss_metric(self):
+        return faiss.METRIC_INNER_PRODUCT if self.metric == "ip" else faiss.METRIC_L2
+
+    def _flat(self, dim: int):
+        return faiss.IndexFlatIP(dim) if self.metric == "ip" else faiss.IndexFlatL2(dim)
+
+    def to_cosine(self, scores: np.ndarray) -> np.ndarray:
+        """将检索分数转换为余弦相似度（内积索引即余弦；L2 索引为平方距离，cos = 1 - d/2）"""
+        scores = np.asarray(scores, dtype=np.float32)
+        if self.index is not None and self.index.metric_type == faiss.METRIC_L2:
+            scores = 1.0 - scores / 2.0
+        return np.clip(scores, -1.0, 1.0)
+
+    # ---------- 创建与训练 ----------
+
+    def _new_index(self, dim: int, index_type: str = "flat", n_train: int = 0):
+        """按类型创建空索引（IVF 系列需随后训练）"""
+        metric = self._faiss_metric()
+        if index_type == "hnsw":
+            hnsw = faiss.IndexHNSWFlat(dim, self.hnsw_m, metric)
+            hnsw.hnsw.efConstruction = self.ef_construction
+            hnsw.hnsw.efSearch = self.ef_search
+            return faiss.IndexIDMap2(hnsw)
+        if index_type in IVF_TYPES:
+            # nlist ≈ 4·√n，且保证每个聚类中心至少有 39 个训练样本
+            nlist = max(1, min(int(4 * math.sqrt(max(n_train, 1))), n_train // 39))
+            quantizer = self._flat(dim)
+            if index_type == "ivfsq8":
+                index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, faiss.ScalarQuantizer.QT_8bit, metric)
+            elif index_type == "ivfpq":
+                m = max(i for i in range(1, min(dim, 64) + 1) if dim % i == 0)
+                index = faiss.IndexIVFPQ(quantizer, dim, nlist, m, 8, metric)
+            else:
+                index = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+            index.nprobe = min(self.nprobe, nlist)
+            return index
+        return faiss.IndexIDMap2(self._flat(dim))
+
+    def select_index_type(self, n: int) -> str:
+        """根据配置和向量数量选择索引类型"""
+        index_type = self.configured_type
+        if index_type not in INDEX_TYPES:
+            if n >= self.auto_sq8_threshold:
+                index_type = "ivfsq8"
+            elif n >= self.auto_ivf_threshold:
+                index_type = "ivf"
+            else:
+                index_type = "flat"
+        # 训练样本不足时退回精确索引（PQ 的 8 位码本至少需要 256 个样本）
+        if index_type in IVF_TYPES and n < (256 if index_type == "ivfpq" else 39):
+            index_type = "flat"
+        return index_type
+
+    def _recall(self, candidate, vectors: np.ndarray, ids: np.ndarray, k: int = 10, n_queries: int = 200) -> float:
+        """以精确 Flat 索引为基准，计算近似索引在扰动后的样本查询上的 recall@k"""
+        exact = faiss.IndexIDMap2(self._flat(vectors.shape[1]))
+        exact.add_with_ids(vectors, ids)
+        rng = np.random.default_rng(0)
+        sample = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+        queries = vectors[sample] + rng.normal(0, 0.01, size=(len(sample), vectors.shape[1])).astype("float32")
+        k = min(k, len(vectors))
+        _, truth = exact.search(queries, k)
+        _, found = candidate.search(queries, k)
+        hits = sum(len(set(t) & set(f)) for t, f in zip(truth.tolist(), found.tolist()))
+        return hits / float(truth.size)
+
+    def build(self, ids: List[int], embeddings: np.ndarray, model_name: Optional[str] = None,
+              dim: Optional[int] = None) -> str:
+        """
+        用给定向量重建索引：按向量数量选择索引类型并训练，
+        近似索引召回率低于 RAG_INDEX_MIN_RECALL 时退回 Flat 索引
+
+        返回:
+        - str: 最终使用的索引类型
+        """
+        if not FAISS_AVAILABLE:
+            return "flat"
+        dim = dim or (embeddings.shape[1] if len(ids) else self.dim)
+        vectors = np.ascontiguousarray(embeddings, dtype="float32").reshape(-1, dim)
+        id_array = np.asarray(ids, dtype="int64")
+        index_type = self.select_index_type(len(id_array))
+
+        index = self._new_index(dim, index_type, len(id_array))
+        if index_type in IVF_TYPES:
+            index.train(vectors)
+            # 哈希直接映射：支持按ID删除和取回向量
+            index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        if len(id_array):
+            index.add_with_ids(vectors, id_array)
+
+        fallback_from = None
+        if index_type != "flat" and len(id_array):
+            recall = self._recall(index, vectors, id_array)
+            if recall < self.min_recall:
+                print(f"⚠ {index_type} 索引召回率 {recall:.3f} 低于阈值 {self.min_recall}，继续使用 Flat 索引")
+                fallback_from = index_type
+                index_type = "flat"
+                index = self._new_index(dim, "flat")
+                index.add_with_ids(vectors, id_array)
+            else:
+                print(f"✓ {index_type} 索引召回率检查通过: recall@10 = {recall:.3f}")
+
+        self.index = index
+        self.dim = dim
+        self.deleted = set()
+        self.mapped_path = None
+        self.dirty = True
+        self.meta = {
+            "model": model_name if model_name is not None else self.meta.get("model"),
+            "dim": dim,
+            "index_type": index_type,
+            "trained_ntotal": int(len(id_array)),
+            "metric": self.metric,
+        }
+        if fallback_from:
+            self.meta["fallback_from"] = fallback_from
+        return index_type
+
+    def needs_retrain(self) -> bool:
+        """向量数量变化后索引类型不再合适，或 IVF 训练后数据量增长超过 4 倍时需要重新训练"""
+        if self.index is None:
+            return False
+        n = self.ntotal
+        trained = int(self.meta.get("trained_ntotal", 0))
+        grown = n > 4 * max(trained, 1)
+        desired = self.select_index_type(n)
+        if desired != self.index_type:
+            # 召回率检查未通过而退回 Flat 的，数据量显著增长前不再重复尝试
+            return not (self.meta.get("fallback_from") == desired and not grown)
+        return self.index_type in IVF_TYPES and grown
+
+    def retrain(self) -> str:
+        """用索引中现有的向量重新训练/重建索引（不需要重新向量化）"""
+        ids, vectors = self.export()
+        return self.build(ids.tolist(), vectors, dim=self.d)
+
+    def reset(self, dim: Optional[int] = None, model_name: Optional[str] = None):
+        """清空并重新创建索引（无需训练的类型：配置为 HNSW 时使用 HNSW，否则为 Flat）"""
+        if not FAISS_AVAILABLE:
+            return
+        self.dim = dim or self.dim
+        index_type = "hnsw" if self.configured_type == "hnsw" else "flat"
+        self.index = self._new_index(self.dim, index_type)
+        self.deleted = set()
+        self.mapped_path = None
+        self.dirty = True
+        self.meta = {
+            "model": model_name, "dim": self.dim, "index_type": index_type,
+            "trained_ntotal": 0, "metric": self.metric,
+        }
+
+    # ---------- 持久化 ----------
+
+    def _read_manifest(self) -> Dict:
+        if not self.manifest_path.exists():
+            return {}
+        try:
+            return json.loads(self.manifest_path.read_text(encoding="utf-8"))
+        except Exception as e:
+            print(f"⚠ 读取向量索引快照清单失败: {e}")
+            return {}
+
+    def _read_index(self, path: Path, index_type: str, mmap: bool):
+        """读取索引文件；mmap 时 IVF 倒排表、Flat/HNSW 向量存储以只读内存映射方式打开"""
+        if mmap:
+            flag = faiss.IO_FLAG_MMAP if index_type in IVF_TYPES else faiss.IO_FLAG_MMAP_IFC
+            try:
+                index = faiss.read_index(str(path), flag)
+                self.mapped_path = path
+                return index
+            except Exception as e:
+                print(f"⚠ 内存映射加载索引失败，改为完整读入: {e}")
+        self.mapped_path = None
+        return faiss.read_index(str(path))
+
+    def _configure(self, index):
+        """恢复不随索引文件保存的检索参数"""
+        if isinstance(index, faiss.IndexIVF):
+            index.nprobe = min(self.nprobe, index.nlist)
+        elif isinstance(index, faiss.IndexIDMap):
+            inner = faiss.downcast_index(index.index)
+            if isinstance(inner, faiss.IndexHNSW):
+                inner.hnsw.efSearch = self.ef_search
+        return index
+
+    def _ensure_writable(self):
+        """内存映射的索引是只读的：首次修改或保存前完整读入内存"""
+        if self.mapped_path is None:
+            return
+        path = self.mapped_path
+        self.index = self._configure(self._read_index(path, self.index_type, mmap=False))
+
+    def load(self) -> bool:
+        """
+        加载索引：优先加载 MANIFEST 指向的最新快照（内存映射），否则加载旧版单文件索引
+        旧版 IndexFlatL2 按位置编号（位置即 vector_id），加载时原样包装为 ID 映射索引，
+        并标记 legacy_ids，由调用方在有数据库会话时迁移为块 ID；
+        索引度量与配置不同（如旧版 L2 索引）时，用已存储的向量按配置的度量重建（无需重新向量化），
+        并设置 migrated，由调用方保存
+
+        返回:
+        - bool: 是否从文件加载成功
+        """
+        if not FAISS_AVAILABLE:
+            return False
+
+        manifest = self._read_manifest()
+        snapshot_path = self.snapshot_dir / manifest["index_file"] if manifest.get("index_file") else None
+        if snapshot_path is not None and snapshot_path.exists():
+            self.manifest = manifest
+            self.generation = int(manifest.get("generation", 0))
+            self.meta = dict(manifest.get("meta", {}))
+            index = self._read_index(snapshot_path, self.meta.get("index_type", "flat"), self.use_mmap)
+        else:
+            if manifest:
+                print(f"⚠ 快照清单指向的索引文件不存在: {manifest.get('index_file')}")
+            if self.meta_path.exists():
+                try:
+                    self.meta = json.loads(self.meta_path.read_text(encoding="utf-8"))
+                except Exception as e:
+                    print(f"⚠ 读取向量索引元数据失败: {e}")
+                    self.meta = {}
+            if not self.index_path.exists():
+                self.reset(self.dim, self.meta.get("model"))
+                return False
+            index = faiss.read_index(str(self.index_path))
+            # 旧版单文件索引：下次保存时写为快照
+            self.migrated = True
+
+        if not isinstance(index, (faiss.IndexIVF, faiss.IndexIDMap)):
+            # 旧版索引：位置 i 的向量对应 vector_id = i
+            wrapped = faiss.IndexIDMap2(faiss.IndexFlat(index.d, index.metric_type))
+            if index.ntotal > 0:
+                vectors = index.reconstruct_n(0, index.ntotal)
+                wrapped.add_with_ids(vectors, np.arange(index.ntotal, dtype="int64"))
+            index = wrapped
+            self.mapped_path = None
+            self.legacy_ids = True
+            self.meta["index_type"] = "flat"
+        self.index = self._configure(index)
+        self.dim = index.d
+        self.deleted = set(self.meta.get("deleted", []))
+        self.meta.setdefault("dim", index.d)
+        self.migrated = self.migrated or self.legacy_ids
+        self.dirty = False
+
+        if index.metric_type != self._faiss_metric():
+            ids, vectors = self.export()
+            if self.metric == "ip":
+                faiss.normalize_L2(vectors)
+            old_metric = "L2" if index.metric_type == faiss.METRIC_L2 else "IP"
+            self.build(ids.tolist(), vectors, dim=index.d)
+            self.migrated = True
+            print(f"✓ 向量索引度量已迁移: {old_metric} → {self.metric.upper()}（{len(ids)} 个向量，无需重新向量化）")
+        return True
+
+    def save(self):
+        """
+        保存为新一代快照：索引写入临时文件并 fsync，原子重命名为 index-<代数>.faiss，
+        再原子替换 MANIFEST.json；任一步骤中断时，MANIFEST 仍指向上一代完整快照
+        """
+        if not FAISS_AVAILABLE or self.index is None:
+            return
+        try:
+            self._ensure_writable()
+            self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+            # 其他进程可能已写入更新的快照，代数取两者较大值递增
+            generation = max(self.generation, int(self._read_manifest().get("generation", 0))) + 1
+            index_file = f"index-{generation:08d}.faiss"
+            tmp_path = self.snapshot_dir / f"{index_file}.{os.getpid()}.tmp"
+            faiss.write_index(self.index, str(tmp_path))
+            _fsync_path(tmp_path)
+            os.replace(tmp_path, self.snapshot_dir / index_file)
+
+            self.meta["dim"] = self.index.d
+            self.meta["deleted"] = sorted(self.deleted)
+            ids = self.ids()
+            manifest = {
+                "generation": generation,
+                "index_file": index_file,
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "vector_count": int(len(ids)),
+                "max_vector_id": int(ids.max()) if len(ids) else None,
+                "vector_id_checksum": vector_id_checksum(ids),
+                "meta": self.meta,
+            }
+            _atomic_write_text(self.manifest_path, json.dumps(manifest, ensure_ascii=False))
+            _fsync_path(self.snapshot_dir)
+            self.manifest = manifest
+            self.generation = generation
+            self.dirty = False
+            self._prune_snapshots()
+        except Exception as e:
+            print(f"⚠ 保存向量索引失败: {e}")
+
+    def _prune_snapshots(self):
+        """只保留最近 snapshot_keep 代快照，并清理中断遗留的临时文件"""
+        snapshots = sorted(
+            (int(m.group(1)), p) for p in self.snapshot_dir.iterdir()
+            if (m := SNAPSHOT_PATTERN.match(p.name))
+        )
+        stale = [p for generation, p in snapshots[:-self.snapshot_keep] if generation != self.generation]
+        stale += [p for p in self.snapshot_dir.glob(f"*.{os.getpid()}.tmp")]
+        for path in stale:
+            try:
+                path.unlink()
+            except OSError:
+                pass  # Windows 下仍被其他进程内存映射的快照无法删除，下次保存时再清理
+
+    # ---------- 增删查 ----------
+
+    def _stored_ids(self) -> np.ndarray:
+        """索引中物理存储的全部向量 ID（含 HNSW 墓碑）"""
+        if self.index is None or self.index.ntotal == 0:
+            return np.empty(0, dtype="int64")
+        if isinstance(self.index, faiss.IndexIVF):
+            invlists = self.index.invlists
+            parts = [
+                faiss.rev_swig_ptr(invlists.get_ids(i), invlists.list_size(i)).copy()
+                for i in range(self.index.nlist) if invlists.list_size(i) > 0
+            ]
+            return np.concatenate(parts).astype("int64") if parts else np.empty(0, dtype="int64")
+        return faiss.vector_to_array(self.index.id_map).astype("int64")
+
+    def ids(self) -> np.ndarray:
+        """索引中全部有效向量 ID"""
+        stored = self._stored_ids()
+        if self.deleted:
+            stored = stored[~np.isin(stored, np.fromiter(self.deleted, dtype="int64"))]
+        return stored
+
+    def export(self) -> Tuple[np.ndarray, np.ndarray]:
+        """导出全部有效向量 (ID, 向量)，用于重新训练或迁移"""
+        ids = self.ids()
+        if len(ids) == 0:
+            return ids, np.empty((0, self.d), dtype="float32")
+        if isinstance(self.index, faiss.IndexIDMap) and not self.deleted:
+            # ID 映射与底层存储顺序一致，可以整段取回
+            return ids, self.index.index.reconstruct_n(0, self.index.ntotal)
+        return ids, self.reconstruct(ids.tolist())
+
+    def _compact(self, exclude: Optional[np.ndarray] = None):
+        """HNSW：丢弃墓碑（及 exclude 中的ID）后用剩余向量重建图"""
+        ids, vectors = self.export()
+        if exclude is not None and len(exclude):
+            keep = ~np.isin(ids, exclude)
+            ids, vectors = ids[keep], vectors[keep]
+        index = self._new_index(self.d, "hnsw")
+        if len(ids):
+            index.add_with_ids(vectors, ids)
+        self.index = index
+        self.deleted = set()
+        self.mapped_path = None
+        self.dirty = True
+
+    def add(self, ids: List[int], embeddings: np.ndarray):
+        """按指定 ID 添加向量（已存在的 ID 会先被替换）"""
+        if self.index is None or len(ids) == 0:
+            return
+        self._ensure_writable()
+        self.dirty = True
+        id_array = np.asarray(ids, dtype="int64")
+        if self.index_type == "hnsw":
+            # HNSW 无法原地替换：涉及已存在/已删除的ID时先压缩重建
+            if self.index.ntotal and np.isin(id_array, self._stored_ids()).any():
+                self._compact(exclude=id_array)
+        else:
+            self.index.remove_ids(id_array)
+        self.index.add_with_ids(np.ascontiguousarray(embeddings, dtype="float32"), id_array)
+
+    def remove(self, ids: List[int]) -> int:
+        """按 ID 删除向量，返回实际删除的数量"""
+        if self.index is None or len(ids) == 0 or self.index.ntotal == 0:
+            return 0
+        self._ensure_writable()
+        self.dirty = True
+        id_array = np.asarray(ids, dtype="int64")
+        if self.index_type == "hnsw":
+            live = set(self.ids().tolist())
+            removed = {int(i) for i in id_array if int(i) in live}
+            self.deleted |= removed
+            # 墓碑超过 20% 时压缩重建
+            if len(self.deleted) > 0.2 * self.index.ntotal:
+                self._compact()
+            return len(removed)
+        return int(self.index.remove_ids(id_array))
+
+    def reconstruct(self, ids: List[int]) -> np.ndarray:
+        """按 ID 取回已存储的向量（无需重新推理；IVF-SQ8/PQ 为量化后的近似向量）"""
+        if not ids:
+            return np.empty((0, self.d), dtype="float32")
+        return np.vstack([self.index.reconstruct(int(i)) for i in ids]).astype("float32")
+
+    def _search_params(self, selector):
+        if isinstance(self.index, faiss.IndexIVF):
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self.index.nprobe)
+        if self.index_type == "hnsw":
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=self.ef_search)
+        return faiss.SearchParameters(sel=selector)
+
+    def search(self, query: np.ndarray, k: int, ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        检索 k 个最近邻，返回 (距离, 向量ID)
+        指定 ids 时只在这些向量中检索（FAISS ID 选择器，在索引内部过滤）
+        """
+        query = np.ascontiguousarray(query, dtype="float32")
+        if ids is None and not self.deleted:
+            return self.index.search(query, k)
+        if ids is not None:
+            id_array = np.ascontiguousarray(ids, dtype="int64")
+            if self.deleted:
+                id_array = id_array[~np.isin(id_array, np.fromiter(self.deleted, dtype="int64"))]
+            selector = faiss.IDSelectorBatch(id_array)
+        else:
+            tombstones = faiss.IDSelectorBatch(np.fromiter(self.deleted, dtype="int64"))
+            selector = faiss.IDSelectorNot(tombstones)
+        return self.index.search(query, k, params=self._search_params(selector))
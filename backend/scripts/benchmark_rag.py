@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+"""
+RAG 检索性能基准测试
+生成 1k / 10k / 100k 个块的合成中文 FAQ 知识库，用桩嵌入模型（默认）或真实嵌入模型建索引，
+逐阶段统计检索耗时（向量化、FAISS、BM25、结果融合、内容回填、端到端）的 p50/p95/p99、内存占用，
+以及近似向量索引相对精确检索的 recall@k，结果输出为 JSON，可在版本之间对比
+运行方式（需要在 backend 目录下运行）:
+    python scripts/benchmark_rag.py --sizes 1000,10000 --output bench.json
+    python scripts/benchmark_rag.py --model real --sizes 1000 --output bench-real.json
+    python scripts/benchmark_rag.py --sizes 1000 --compare bench.json
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# 添加项目路径
+backend_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_root))
+
+# 基准测试不连接 Redis，也不读写正式索引
+os.environ.setdefault("REDIS_ENABLED", "false")
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.models import KnowledgeChunk
+from app.services.cache_service import LRUCache
+from app.services.embedding_cache import EmbeddingCache
+from app.services.rag_service import RAGService
+from app.services.tokenizer import Tokenizer, mine_dictionary_words
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+STAGES = ("embed", "faiss", "bm25", "fusion", "hydration", "end_to_end")
+
+ADJECTIVES = ["高端", "便携", "智能", "经典", "轻薄", "专业", "家用", "迷你", "旗舰", "复古",
+              "无线", "超清", "静音", "防水", "儿童", "商务", "户外", "加厚", "多功能", "新款"]
+NOUNS = ["手机", "笔记本", "耳机", "电视", "冰箱", "洗衣机", "连衣裙", "运动鞋", "口红", "巧克力",
+         "小说", "篮球", "奶粉", "沙发", "行车记录仪", "积木", "相机", "冲锋衣", "猫粮", "项链", "手表"]
+CITIES = ["北京", "上海", "广州", "深圳", "成都", "杭州", "武汉", "西安", "新疆", "西藏"]
+# (分类, 问题模板, 答案模板, 查询模板)
+TOPICS = [
+    ("售后政策", "{product}可以七天无理由退货吗？",
+     "{product}签收后{days}天内支持无理由退货，需保持商品完好、配件齐全，退货运费{payer}承担，审核通过后{refund}个工作日内原路退款。",
+     "{product}怎么退货"),
+    ("物流配送", "{product}下单后多久发货？",
+     "{product}付款后{hours}小时内从{city}仓发货，普通地区{ship}天送达，偏远地区可能延长，发货后可在订单详情查看物流轨迹。",
+     "{product}多久能发货"),
+    ("质量保修", "{product}的保修期是多久？",
+     "{product}享受{months}个月全国联保，保修期内非人为损坏免费维修，需提供购买凭证和序列号，维修周期约{days}个工作日。",
+     "{product}保修几个月"),
+    ("会员权益", "购买{product}可以使用会员折扣吗？",
+     "{member}会员购买{product}可享受{discount}折优惠，并按实付金额的{points}倍累计积分，积分可在下单时抵扣现金。",
+     "{product}会员打几折"),
+    ("优惠活动", "{product}可以叠加使用优惠券吗？",
+     "{product}每笔订单限用一张店铺券，可与满{amount}减{cut}的平台活动叠加，优惠券过期后不予补发，请在有效期内使用。",
+     "{product}优惠券能叠加吗"),
+    ("支付发票", "{product}支持开具发票吗？",
+     "{product}支持开具电子普通发票和增值税专用发票，订单完成后{days}天内可在订单页申请，电子发票将发送到预留邮箱。",
+     "{product}怎么开发票"),
+]
+
+
+class HashingEmbeddingModel:
+    """
+    桩嵌入模型：分词后每个词映射为固定的随机向量，求和后归一化
+    词相同的文本向量相近，不需要下载模型即可得到有意义的检索结果
+    """
+
+    def __init__(self, tokenizer: Tokenizer, dim: int = 384):
+        self.tokenizer = tokenizer
+        self.dim = dim
+        self._token_vectors: Dict[str, np.ndarray] = {}
+
+    def _token_vector(self, token: str) -> np.ndarray:
+        vector = self._token_vectors.get(token)
+        if vector is None:
+            seed = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dim).astype("float32")
+            self._token_vectors[token] = vector
+        return vector
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=True, show_progress_bar=False, **kwargs):
+        rows = np.zeros((len(texts), self.dim), dtype="float32")
+        for i, text in enumerate(texts):
+            for token in self.tokenizer.tokenize(text):
+                rows[i] += self._token_vector(token)
+        norms = np.linalg.norm(rows, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return rows / norms
+
+
+class BenchmarkRAGService(RAGService):
+    """使用指定嵌入模型的 RAG 服务，索引和嵌入缓存写入临时目录，不执行启动同步"""
+
+    def __init__(self, embedding_model, model_name: str, workdir: Path, tokenizer: Tokenizer):
+        self._benchmark_setup = (embedding_model, model_name, workdir, tokenizer)
+        super().__init__()
+
+    def _initialize_embedding_model(self, language: Optional[str] = None):
+        model, model_name, workdir, tokenizer = self._benchmark_setup
+        self.embedding_model = model
+        self.embedding_model_name = model_name
+        self.vector_dim = int(np.asarray(model.encode(["test"])).shape[1])
+        self.index_path = workdir / "knowledge_base_index.faiss"
+        self.embedding_cache = EmbeddingCache(workdir / "embedding_cache")
+        self.tokenizer = tokenizer
+        # 每次都测量真实的检索路径：关闭结果缓存、查询向量缓存和微批处理
+        self.retrieval_cache_enabled = False
+        self.query_embedding_cache = LRUCache(0)
+        self.query_batch_enabled = False
+        # 合成语料按模板生成，关闭近重复去重以保证每个块都有向量（recall / hit@k 按块统计）
+        self.dedup_enabled = False
+
+    def _prepare_vector_index(self):
+        pass
+
+
+def make_products(rng: random.Random, count: int) -> List[str]:
+    names = set()
+    while len(names) < count:
+        code = f"{rng.choice('ABCDEFGHKMNPRSTX')}{rng.randint(1, 99)}"
+        names.add(f"{rng.choice(ADJECTIVES)}{rng.choice(NOUNS)}{code}")
+    return sorted(names)
+
+
+def generate_corpus(size: int, seed: int = 42) -> Tuple[List[Dict], List[str]]:
+    """生成 size 个 FAQ 文档（每个文档一个块），返回 (文档列表, 商品名列表)"""
+    rng = random.Random(seed)
+    products = make_products(rng, max(1, size // len(TOPICS) + 1))
+    documents = []
+    for i in range(size):
+        product = products[i // len(TOPICS)]
+        category, question, answer, query = TOPICS[i % len(TOPICS)]
+        values = {
+            "product": product, "days": rng.choice([3, 7, 15, 30]), "payer": rng.choice(["由买家", "由商家"]),
+            "refund": rng.randint(1, 7), "hours": rng.choice([24, 48, 72]), "city": rng.choice(CITIES),
+            "ship": rng.randint(1, 5), "months": rng.choice([6, 12, 24]), "member": rng.choice(["黄金", "铂金", "钻石"]),
+            "discount": rng.choice([9.5, 9, 8.8, 8.5]), "points": rng.randint(1, 3),
+            "amount": rng.choice([199, 299, 399]), "cut": rng.choice([20, 30, 50]),
+        }
+        documents.append({
+            "title": f"{product}{category}",
+            "content": f"问：{question.format(**values)}\n答：{answer.format(**values)}",
+            "category": category,
+            "source_type": "benchmark",
+            "query": query.format(**values),
+        })
+    return documents, products
+
+
+def rss_mb() -> Optional[float]:
+    """当前进程常驻内存（MB）"""
+    if PSUTIL_AVAILABLE:
+        return round(psutil.Process().memory_info().rss / 1024 / 1024, 1)
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024, 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+
+def percentiles(samples: List[float]) -> Dict:
+    values = np.asarray(samples, dtype=np.float64) * 1000.0
+    if not len(values):
+        return {}
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 4),
+        "p95_ms": round(float(np.percentile(values, 95)), 4),
+        "p99_ms": round(float(np.percentile(values, 99)), 4),
+        "mean_ms": round(float(values.mean()), 4),
+        "count": int(len(values)),
+    }
+
+
+@contextlib.contextmanager
+def quiet():
+    """屏蔽 RAG 服务的逐条日志输出（避免打印耗时计入检索耗时）"""
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def exact_top_k(vectors: np.ndarray, ids: np.ndarray, queries: np.ndarray, k: int) -> List[set]:
+    """精确内积检索（分块计算，避免 100k×查询数 的大矩阵）"""
+    results = []
+    for start in range(0, len(queries), 256):
+        scores = queries[start:start + 256] @ vectors.T
+        top = np.argpartition(-scores, min(k, scores.shape[1] - 1), axis=1)[:, :k]
+        results.extend(set(ids[row].tolist()) for row in top)
+    return results
+
+
+def run_size(size: int, args, load_model) -> Dict:
+    documents, products = generate_corpus(size, seed=args.seed)
+    tokenizer = Tokenizer(words=mine_dictionary_words(products, [t[0] for t in TOPICS]))
+    model, model_name = load_model(tokenizer)
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine, autoflush=False, autocommit=False)()
+
+    with tempfile.TemporaryDirectory(prefix="rag-bench-") as workdir:
+        rss_before = rss_mb()
+        with quiet():
+            rag = BenchmarkRAGService(model, model_name, Path(workdir), tokenizer)
+        rag.top_k = args.top_k
+
+        print(f"🔄 [{size}] 导入合成知识库...")
+        start = time.perf_counter()
+        with quiet():
+            summary = rag.bulk_add_documents(db, ({k: v for k, v in d.items() if k != "query"} for d in documents))
+            import_seconds = time.perf_counter() - start
+            rag._rebuild_index(db)  # 按向量数选择索引类型并训练，构建 BM25 和块内存存储
+        build_seconds = time.perf_counter() - start
+        build = {
+            "documents": summary["imported"],
+            "chunks": summary["chunk_count"],
+            "import_seconds": round(import_seconds, 3),
+            "build_seconds": round(build_seconds, 3),
+            "index_type": rag.vector_store.index_type if rag.vector_store is not None else None,
+            "bm25_vocabulary": rag.bm25_index.vocabulary_size if rag.bm25_index is not None else 0,
+        }
+
+        # 查询集：按固定随机种子抽样，每个查询对应一个目标文档
+        rng = random.Random(args.seed + size)
+        doc_ids = summary["document_ids"]
+        picks = [rng.randrange(len(documents)) for _ in range(min(args.queries, len(documents)))]
+        queries = [(documents[i]["query"], doc_ids[i]) for i in picks]
+
+        print(f"⏳ [{size}] 运行 {len(queries)} 个查询...")
+        samples = {stage: [] for stage in STAGES}
+        hits = 0
+        candidate_k = args.top_k * 3
+        query_vectors = []
+        with quiet():
+            # 预热（首次检索会初始化 FAISS 线程池等）
+            for query, _ in queries[:5]:
+                rag.retrieve_context(db, query, top_k=args.top_k)
+            for query, target in queries:
+                embedding, seconds = timed(rag.embed_text, query)
+                samples["embed"].append(seconds)
+                query_vectors.append(embedding)
+                _, seconds = timed(rag.vector_store.search, embedding.reshape(1, -1), candidate_k)
+                samples["faiss"].append(seconds)
+                bm25_results, seconds = timed(rag.search_bm25, query, candidate_k)
+                samples["bm25"].append(seconds)
+                vector_results = rag.search(query, candidate_k, None, 0.05)
+                fused, seconds = timed(rag._fuse_results, vector_results, bm25_results, args.top_k)
+                samples["fusion"].append(seconds)
+                _, seconds = timed(rag._hydrate_results, fused)
+                samples["hydration"].append(seconds)
+                (_, details), seconds = timed(rag.retrieve_context, db, query, top_k=args.top_k)
+                samples["end_to_end"].append(seconds)
+                hits += any(d.get("document_id") == target for d in details)
+
+        # 近似索引 recall@k：与原始向量的精确内积检索对比
+        rows = db.query(KnowledgeChunk.vector_id, KnowledgeChunk.content).order_by(KnowledgeChunk.vector_id).all()
+        ids = np.array([vector_id for vector_id, _ in rows], dtype=np.int64)
+        with quiet():
+            vectors = rag.embed_texts([content for _, content in rows])
+        queries_matrix = np.vstack(query_vectors).astype("float32")
+        recall = {}
+        for k in args.recall_k:
+            k = min(k, len(ids))
+            exact = exact_top_k(vectors, ids, queries_matrix, k)
+            _, found = rag.vector_store.search(queries_matrix, k)
+            recall[f"recall@{k}"] = round(float(np.mean([
+                len(exact[i] & set(found[i][found[i] >= 0].tolist())) / k for i in range(len(exact))
+            ])), 4)
+        recall[f"hit@{args.top_k}"] = round(hits / len(queries), 4)
+
+        memory = {
+            "rss_mb": rss_mb(),
+            "rss_delta_mb": round(rss_mb() - rss_before, 1) if rss_before is not None else None,
+            "peak_rss_mb": peak_rss_mb(),
+            "vectors_mb": round(rag.vector_store.ntotal * rag.vector_dim * 4 / 1024 / 1024, 2),
+        }
+
+        result = {
+            "size": size,
+            "build": build,
+            "stages": {stage: percentiles(values) for stage, values in samples.items()},
+            "recall": recall,
+            "memory": memory,
+        }
+        if rag.query_batcher is not None:
+            rag.query_batcher.shutdown(timeout=5)
+        db.close()
+        engine.dispose()
+        return result
+
+
+def make_model_loader(args):
+    if args.model == "stub":
+        return lambda tokenizer: (HashingEmbeddingModel(tokenizer, dim=args.dim), f"benchmark-hashing-{args.dim}")
+
+    from app.services.embedding_backend import get_backend_name, load_embedding_model
+    model_name = args.model_name or os.environ.get("RAG_EMBEDDING_MODEL") or "BAAI/bge-large-zh-v1.5"
+    print(f"📥 加载嵌入模型: {model_name}（推理后端 {get_backend_name()}）")
+    model = load_embedding_model(model_name)
+    return lambda tokenizer: (model, model_name)
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=backend_root, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: Dict, baseline: Dict):
+    """与基线结果逐项对比（耗时看 p95，召回率看绝对差值）"""
+    baseline_by_size = {r["size"]: r for r in baseline.get("results", [])}
+    print(f"\n对比基线: {baseline.get('meta', {}).get('git_revision')} → {current['meta'].get('git_revision')}")
+    for result in current["results"]:
+        old = baseline_by_size.get(result["size"])
+        if old is None:
+            continue
+        print(f"  [{result['size']} 块]")
+        for stage in STAGES:
+            new_p95 = result["stages"].get(stage, {}).get("p95_ms")
+            old_p95 = old["stages"].get(stage, {}).get("p95_ms")
+            if new_p95 is not None and old_p95:
+                print(f"    {stage:<11} p95 {old_p95:>9.3f} → {new_p95:>9.3f} ms ({(new_p95 / old_p95 - 1) * 100:+.1f}%)")
+        for key, value in result["recall"].items():
+            if key in old["recall"]:
+                print(f"    {key:<11} {old['recall'][key]:.4f} → {value:.4f} ({value - old['recall'][key]:+.4f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAG 检索性能基准测试")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="知识库块数，逗号分隔（默认 1000,10000,100000）")
+    parser.add_argument("--queries", type=int, default=200, help="每个规模的查询数")
+    parser.add_argument("--top-k", type=int, default=5, help="检索返回的块数")
+    parser.add_argument("--recall-k", default="10", help="计算 recall@k 的 k 值，逗号分隔")
+    parser.add_argument("--model", choices=["stub", "real"], default="stub", help="stub 为哈希桩模型，real 为配置的嵌入模型")
+    parser.add_argument("--model-name", help="真实嵌入模型名称（默认 RAG_EMBEDDING_MODEL）")
+    parser.add_argument("--dim", type=int, default=384, help="桩模型向量维度")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子（相同种子生成相同的语料和查询）")
+    parser.add_argument("--output", help="结果 JSON 文件路径")
+    parser.add_argument("--compare", help="基线结果 JSON 文件路径")
+    args = parser.parse_args()
+    args.recall_k = [int(k) for k in args.recall_k.split(",") if k.strip()]
+
+    load_model = make_model_loader(args)
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "faiss": getattr(faiss, "__version__", None),
+            "model": args.model if args.model == "stub" else (args.model_name or os.environ.get("RAG_EMBEDDING_MODEL")),
+            "embedding_backend": os.environ.get("RAG_EMBEDDING_BACKEND", "torch"),
+            "index_type_setting": os.environ.get("RAG_INDEX_TYPE", "auto"),
+            "queries": args.queries,
+            "top_k": args.top_k,
+            "seed": args.seed,
+        },
+        "results": [],
+    }
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        result = run_size(size, args, load_model)
+        report["results"].append(result)
+        stages = result["stages"]
+        print(f"✓ [{size}] 索引 {result['build']['index_type']}，构建 {result['build']['build_seconds']}s，"
+              f"端到端 p50/p95/p99 = {stages['end_to_end']['p50_ms']}/{stages['end_to_end']['p95_ms']}/"
+              f"{stages['end_to_end']['p99_ms']} ms，{', '.join(f'{k}={v}' for k, v in result['recall'].items())}，"
+              f"内存 {result['memory']['rss_mb']} MB")
+
+    text = json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+        print(f"✓ 结果已写入 {args.output}")
+    else:
+        print(text)
+
+    if args.compare:
+        compare(report, json.loads(Path(args.compare).read_text(encoding="utf-8")))
+
+
+if __name__ == "__main__":
+    main()
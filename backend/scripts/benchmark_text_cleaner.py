@@ -0,0 +1,662 @@
+#!/usr/bin/env python
+"""
+文本清洗微基准测试
+在夹具语料上对比预编译单遍清洗流水线与旧实现（逐条 re.sub / 逐行遍历噪音规则）的输出和耗时，
+各阶段（规范化、结构化、内容清理、质量评分、元数据提取）的输出必须逐字一致，否则以非零状态退出
+运行方式（需要在 backend 目录下运行）:
+    python scripts/benchmark_text_cleaner.py
+    python scripts/benchmark_text_cleaner.py --docs 500 --repeat 5
+    python scripts/benchmark_text_cleaner.py --input ./knowledge_uploads   # 追加真实文本文件（.txt / .md）
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+# 添加项目路径
+backend_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_root))
+
+from app.services.text_cleaner import TextCleaner
+
+
+class LegacyTextCleaner(TextCleaner):
+    """旧版清洗实现（逐条未编译正则），作为输出一致性和耗时的参照"""
+
+    def normalize_text(self, text: str) -> str:
+        """
+        (1) 文本规范化
+        - 统一编码（UTF-8）
+        - 采用正则表达式去除特殊字符、乱码
+        - 标准化日期、货币等格式
+        """
+        if not text:
+            return ""
+        
+        # 确保 UTF-8 编码
+        if isinstance(text, bytes):
+            try:
+                text = text.decode('utf-8')
+            except UnicodeDecodeError:
+                try:
+                    text = text.decode('gbk', errors='ignore')
+                except:
+                    text = text.decode('latin-1', errors='ignore')
+        
+        # 去除控制字符和不可见字符（保留换行和制表符）
+        text = re.sub(r'[\x00-\x08\x0b-\x0c\x0e-\x1f\x7f-\x9f]', '', text)
+        
+        # 标准化空白字符（多个空格/换行合并）
+        text = re.sub(r'[ \t]+', ' ', text)  # 多个空格/制表符合并为一个空格
+        text = re.sub(r'\n{3,}', '\n\n', text)  # 多个换行合并为两个
+        
+        # 标准化日期格式
+        # 匹配各种日期格式并统一
+        date_patterns = [
+            (r'(\d{4})[/-](\d{1,2})[/-](\d{1,2})', r'\1年\2月\3日'),  # 2024/01/11 -> 2024年1月11日
+            (r'(\d{1,2})[/-](\d{1,2})[/-](\d{4})', r'\3年\1月\2日'),  # 01/11/2024 -> 2024年1月11日
+        ]
+        for pattern, replacement in date_patterns:
+            text = re.sub(pattern, replacement, text)
+        
+        # 标准化货币格式
+        # 匹配各种货币表示并统一
+        currency_patterns = [
+            (r'¥\s*(\d+(?:\.\d+)?)', r'￥\1'),  # ¥100 -> ￥100
+            (r'(\d+(?:\.\d+)?)\s*元', r'￥\1'),  # 100元 -> ￥100
+            (r'RMB\s*(\d+(?:\.\d+)?)', r'￥\1'),  # RMB100 -> ￥100
+            (r'CNY\s*(\d+(?:\.\d+)?)', r'￥\1'),  # CNY100 -> ￥100
+        ]
+        for pattern, replacement in currency_patterns:
+            text = re.sub(pattern, replacement, text, flags=re.IGNORECASE)
+        
+        # 去除特殊字符和乱码（保留中文、英文、数字、基本标点、换行）
+        # 保留的字符：中文、英文、数字、基本标点、连字符（用于 3-5、7-10 等范围）、换行、制表符
+        text = re.sub(r'[^\u4e00-\u9fa5a-zA-Z0-9\s.,!?;:()（）【】《》「」『』、。，！？；：\n\t\-]', '', text)
+        
+        # 去除首尾空白
+        text = text.strip()
+        
+        return text
+    
+    def extract_structure(self, text: str) -> Dict[str, any]:
+        """
+        (2) 结构化处理
+        - 提取标题、段落、列表
+        - 处理表格数据（转为Markdown或结构化文本）
+        - 代码块分离和格式化
+        """
+        if not text:
+            return {"text": "", "structure": {}}
+        
+        structure = {
+            "titles": [],
+            "paragraphs": [],
+            "lists": [],
+            "tables": [],
+            "code_blocks": []
+        }
+        
+        lines = text.split('\n')
+        processed_lines = []
+        current_code_block = []
+        in_code_block = False
+        
+        for i, line in enumerate(lines):
+            line = line.strip()
+            if not line:
+                processed_lines.append("")
+                continue
+            
+            # 检测代码块
+            if line.startswith('```') or line.startswith('~~~'):
+                if in_code_block:
+                    # 结束代码块
+                    code_content = '\n'.join(current_code_block)
+                    structure["code_blocks"].append({
+                        "index": len(structure["code_blocks"]),
+                        "content": code_content,
+                        "language": current_code_block[0] if current_code_block else "text"
+                    })
+                    processed_lines.append(f"[代码块 {len(structure['code_blocks'])}]")
+                    current_code_block = []
+                    in_code_block = False
+                else:
+                    # 开始代码块
+                    in_code_block = True
+                    if len(line) > 3:
+                        current_code_block.append(line[3:].strip())  # 语言标识
+                continue
+            
+            if in_code_block:
+                current_code_block.append(line)
+                continue
+            
+            # 检测标题（以 # 开头或全大写短行）
+            if line.startswith('#'):
+                level = len(line) - len(line.lstrip('#'))
+                title_text = line.lstrip('#').strip()
+                structure["titles"].append({
+                    "level": level,
+                    "text": title_text,
+                    "line": i
+                })
+                processed_lines.append(f"【标题{level}】{title_text}")
+            # 检测列表项
+            elif re.match(r'^[-*+]\s+', line) or re.match(r'^\d+[.)]\s+', line):
+                list_item = re.sub(r'^[-*+\d.)]\s+', '', line)
+                structure["lists"].append({
+                    "text": list_item,
+                    "line": i
+                })
+                processed_lines.append(f"• {list_item}")
+            # 检测表格行（包含多个 | 分隔符）
+            elif '|' in line and line.count('|') >= 2:
+                cells = [cell.strip() for cell in line.split('|') if cell.strip()]
+                if cells:
+                    structure["tables"].append({
+                        "row": len(structure["tables"]),
+                        "cells": cells
+                    })
+                    processed_lines.append("| " + " | ".join(cells) + " |")
+            else:
+                # 普通段落
+                processed_lines.append(line)
+        
+        # 处理剩余的代码块
+        if in_code_block and current_code_block:
+            code_content = '\n'.join(current_code_block)
+            structure["code_blocks"].append({
+                "index": len(structure["code_blocks"]),
+                "content": code_content,
+                "language": "text"
+            })
+            processed_lines.append(f"[代码块 {len(structure['code_blocks'])}]")
+        
+        # 提取段落（非空行序列）
+        paragraphs = []
+        current_para = []
+        for line in processed_lines:
+            if line.strip():
+                current_para.append(line)
+            else:
+                if current_para:
+                    paragraphs.append('\n'.join(current_para))
+                    current_para = []
+        if current_para:
+            paragraphs.append('\n'.join(current_para))
+        
+        structure["paragraphs"] = paragraphs
+        
+        return {
+            "text": '\n'.join(processed_lines),
+            "structure": structure
+        }
+    
+    def clean_content(self, text: str) -> Tuple[str, Dict]:
+        """
+        (3) 内容清理
+        - 去除广告、导航栏、页脚等噪音内容
+        - 过滤低质量文本（过短、无意义内容）
+        - 去重（完全重复和近似重复）
+        """
+        if not text:
+            return "", {"removed": 0, "quality_score": 0.0}
+        
+        lines = text.split('\n')
+        cleaned_lines = []
+        removed_count = 0
+        
+        # 噪音模式（广告、导航、页脚等）
+        noise_patterns = [
+            r'^(首页|关于我们|联系我们|隐私政策|使用条款|网站地图|返回顶部)',
+            r'^(Copyright|©|版权所有)',
+            r'^(广告|Advertisement|AD)',
+            r'^(关注我们|Follow us|订阅)',
+            r'^(分享到|Share to)',
+            r'^(Cookie|Cookies)',
+            r'^[\d\s\-]+$',  # 纯数字和分隔符
+            r'^[^\u4e00-\u9fa5a-zA-Z]{0,5}$',  # 过短且无意义
+        ]
+        
+        seen_lines = set()  # 用于去重
+        
+        for line in lines:
+            line = line.strip()
+            if not line:
+                cleaned_lines.append("")
+                continue
+            
+            # 检查是否为噪音
+            is_noise = False
+            for pattern in noise_patterns:
+                if re.match(pattern, line, re.IGNORECASE):
+                    is_noise = True
+                    break
+            
+            if is_noise:
+                removed_count += 1
+                continue
+            
+            # 检查长度（过短的内容可能是噪音）
+            if len(line) < self.min_chunk_length:
+                # 检查是否包含有意义的内容
+                has_meaning = bool(re.search(r'[\u4e00-\u9fa5a-zA-Z]{3,}', line))
+                if not has_meaning:
+                    removed_count += 1
+                    continue
+            
+            # 去重（完全重复）
+            line_hash = hash(line)
+            if line_hash in seen_lines:
+                removed_count += 1
+                continue
+            seen_lines.add(line_hash)
+            
+            cleaned_lines.append(line)
+        
+        cleaned_text = '\n'.join(cleaned_lines)
+        
+        # 计算质量评分
+        quality_score = self._calculate_quality_score(cleaned_text)
+        
+        # 过滤低质量文本
+        if quality_score < self.quality_threshold:
+            return "", {"removed": len(lines), "quality_score": quality_score}
+        
+        return cleaned_text, {"removed": removed_count, "quality_score": quality_score}
+    
+    def _calculate_quality_score(self, text: str) -> float:
+        """计算文本质量评分（0-1）"""
+        if not text:
+            return 0.0
+        
+        score = 0.0
+        
+        # 长度评分（适中长度得分更高）
+        length = len(text)
+        if 100 <= length <= 5000:
+            score += 0.3
+        elif 50 <= length < 100 or 5000 < length <= 10000:
+            score += 0.2
+        else:
+            score += 0.1
+        
+        # 中文内容比例
+        chinese_chars = len(re.findall(r'[\u4e00-\u9fa5]', text))
+        total_chars = len(re.findall(r'[\u4e00-\u9fa5a-zA-Z]', text))
+        if total_chars > 0:
+            chinese_ratio = chinese_chars / total_chars
+            if 0.3 <= chinese_ratio <= 0.9:  # 合理的中文比例
+                score += 0.3
+            else:
+                score += 0.1
+        
+        # 信息密度（非空白字符比例）
+        non_whitespace = len(re.sub(r'\s', '', text))
+        if len(text) > 0:
+            density = non_whitespace / len(text)
+            if density > 0.5:
+                score += 0.2
+            else:
+                score += 0.1
+        
+        # 结构完整性（包含标点、换行等）
+        has_punctuation = bool(re.search(r'[。，！？；：]', text))
+        has_structure = bool(re.search(r'\n', text)) or bool(re.search(r'[。！？]', text))
+        if has_punctuation and has_structure:
+            score += 0.2
+        
+        return min(score, 1.0)
+    
+    def _try_faq_split(self, text: str) -> Optional[List[str]]:
+        """
+        尝试按 FAQ 格式分块（问/答、Q/A、编号问题等）
+        适用于"常见问题"类文档，每个问答单独成块便于精准检索
+        
+        支持格式示例：
+        - 9. Q: 问题 A: 回答
+        - 问：xxx 答：xxx
+        - 一、问：xxx 答：xxx
+        """
+        if not text or len(text) < 100:
+            return None
+        
+        # 优先按「数字. Q:」或「数字. 」分段（如 9. Q: ... 10. Q: ...），每段为完整 Q&A
+        numbered_qa = re.split(r'(?m)^\s*(\d+[.．、]\s+)', text)
+        if len(numbered_qa) >= 3:  # 至少有 1 个编号 + 2 段内容
+            segments = []
+            for i in range(1, len(numbered_qa), 2):
+                prefix = numbered_qa[i] if i < len(numbered_qa) else ""
+                content = numbered_qa[i + 1] if i + 1 < len(numbered_qa) else ""
+                seg = (prefix + content).strip()
+                if seg and len(seg) >= self.min_chunk_length:
+                    segments.append(seg)
+            if len(segments) >= 3:
+                return segments
+        
+        # 备选：按 问/答、Q/A、中文序号 分段
+        faq_pattern = re.compile(
+            r'(?m)^\s*((?:问|Q|问题)\d*[：:]\s*|(?:答|A|回答)[：:]\s*|'
+            r'[一二三四五六七八九十]+[、．.]\s*)',
+            re.IGNORECASE
+        )
+        parts = faq_pattern.split(text)
+        segments = []
+        i = 1
+        while i < len(parts):
+            prefix = parts[i] if i < len(parts) else ""
+            content = parts[i + 1] if i + 1 < len(parts) else ""
+            if prefix.strip() and content.strip():
+                segments.append((prefix + content).strip())
+            elif content.strip():
+                segments.append(content.strip())
+            i += 2
+        if len(segments) >= 3:
+            return [s for s in segments if s and len(s) >= self.min_chunk_length]
+        return None
+    
+    def extract_metadata(self, text: str, source_url: Optional[str] = None) -> Dict[str, any]:
+        """
+        (5) 元数据提取
+        - 提取来源、作者、时间等信息
+        - 添加文档结构标签
+        - 质量评分标注
+        """
+        metadata = {
+            "source_url": source_url,
+            "extracted_at": datetime.utcnow().isoformat(),
+            "structure_tags": [],
+            "quality_score": 0.0,
+            "statistics": {}
+        }
+        
+        if not text:
+            return metadata
+        
+        # 提取时间信息
+        time_patterns = [
+            r'(\d{4})年(\d{1,2})月(\d{1,2})日',
+            r'(\d{4})[/-](\d{1,2})[/-](\d{1,2})',
+            r'发布时间[：:]\s*(\d{4}[-/]\d{1,2}[-/]\d{1,2})',
+            r'更新时间[：:]\s*(\d{4}[-/]\d{1,2}[-/]\d{1,2})',
+        ]
+        
+        for pattern in time_patterns:
+            matches = re.findall(pattern, text)
+            if matches:
+                metadata["extracted_time"] = matches[0] if isinstance(matches[0], str) else '-'.join(matches[0])
+                break
+        
+        # 提取作者信息
+        author_patterns = [
+            r'作者[：:]\s*([^\n]+)',
+            r'Author[：:]\s*([^\n]+)',
+            r'来源[：:]\s*([^\n]+)',
+        ]
+        
+        for pattern in author_patterns:
+            match = re.search(pattern, text, re.IGNORECASE)
+            if match:
+                metadata["author"] = match.group(1).strip()
+                break
+        
+        # 提取来源信息
+        if source_url:
+            if source_url.startswith('http'):
+                metadata["source_type"] = "web"
+            elif source_url.endswith('.pdf'):
+                metadata["source_type"] = "pdf"
+            elif source_url.endswith(('.docx', '.doc')):
+                metadata["source_type"] = "word"
+            elif source_url.startswith('table:'):
+                metadata["source_type"] = "database"
+        
+        # 结构化处理以获取结构标签
+        structured = self.extract_structure(text)
+        structure_info = structured["structure"]
+        
+        if structure_info.get("titles"):
+            metadata["structure_tags"].append("has_titles")
+        if structure_info.get("lists"):
+            metadata["structure_tags"].append("has_lists")
+        if structure_info.get("tables"):
+            metadata["structure_tags"].append("has_tables")
+        if structure_info.get("code_blocks"):
+            metadata["structure_tags"].append("has_code")
+        
+        # 质量评分
+        _, quality_info = self.clean_content(text)
+        metadata["quality_score"] = quality_info.get("quality_score", 0.0)
+        
+        # 统计信息
+        metadata["statistics"] = {
+            "total_length": len(text),
+            "char_count": len(re.sub(r'\s', '', text)),
+            "chinese_char_count": len(re.findall(r'[\u4e00-\u9fa5]', text)),
+            "english_word_count": len(re.findall(r'[a-zA-Z]+', text)),
+            "paragraph_count": len(structure_info.get("paragraphs", [])),
+            "title_count": len(structure_info.get("titles", [])),
+            "list_count": len(structure_info.get("lists", [])),
+            "table_count": len(structure_info.get("tables", [])),
+            "code_block_count": len(structure_info.get("code_blocks", []))
+        }
+        
+        return metadata
+
+
+# ---------------------------------------------------------------------------
+# 夹具语料：覆盖各清洗规则的边界情况（日期、货币、噪音行、列表、表格、代码块、FAQ、控制字符等）
+# ---------------------------------------------------------------------------
+
+PARAGRAPHS = [
+    "自签收之日起七天内可申请无理由退货，商品需保持完好、配件齐全。",
+    "非质量问题退货运费由买家承担，质量问题由商家承担运费。",
+    "订单支付成功后，仓库会在四十八小时内安排发货，偏远地区配送时间可能延长。",
+    "会员积分可以在下单时抵扣现金，每100积分抵扣1元，积分有效期为12个月。",
+    "The warranty covers manufacturing defects for 12 months from the date of purchase.",
+    "支持 Visa、MasterCard 以及支付宝、微信支付，部分商品支持分期付款 (3-12 期)。",
+    "如需开具增值税专用发票，请在下单后 30 天内联系客服并提供开票信息。",
+    "行车记录仪 X1-Pro 支持 4K 录制，夜视效果优秀，适合 24 小时停车监控。",
+]
+INLINE_VALUES = [
+    "2024/01/11", "2024-1-5", "01/11/2024", "1-5-2024", "2024/01/11/2025", "01/11/2024/05/06", "3-5", "7-10",
+    "¥100", "¥ 99.5", "100元", "12.5 元", "¥100元", "RMB100", "rmb 88", "CNY20", "cny 3.5", "RMB100元",
+    "RMBCNY100", "价格：￥199", "满 300 减 50", "A4 纸", "iPhone15", "50%", "★★★★★", "café", "™", "→",
+]
+NOISE_LINES = [
+    "首页 > 帮助中心 > 售后服务", "关于我们", "Copyright 2024 Smart Mall", "© 2024 智能商城", "版权所有",
+    "广告", "Advertisement: buy now", "AD", "ad banner", "关注我们的公众号", "Follow us on WeChat", "订阅",
+    "分享到微信", "Share to friends", "Cookie 设置", "cookies policy", "2024 - 01 - 11", "12345", "...",
+    "OK", "!!", "——", "第 3 页", "abc", "返回顶部",
+]
+CONTROL_CHARS = ["\x07", "\x0b", "\x1b", "\x7f", "\x85", "\u200b", "\ufeff", "\t", "  ", "\t \t"]
+
+
+def _decorate(rng: random.Random, text: str) -> str:
+    """在句子中插入日期、金额、控制字符和多余空白"""
+    pieces = [text]
+    for _ in range(rng.randint(0, 3)):
+        pieces.insert(rng.randint(0, len(pieces)), rng.choice(INLINE_VALUES))
+    if rng.random() < 0.3:
+        pieces.insert(rng.randint(0, len(pieces)), rng.choice(CONTROL_CHARS))
+    return rng.choice([" ", "", "  ", "\t"]).join(pieces)
+
+
+def _block(rng: random.Random, index: int) -> List[str]:
+    kind = rng.choice(["paragraph", "paragraph", "title", "list", "table", "code", "faq", "noise", "meta", "blank"])
+    if kind == "paragraph":
+        return [_decorate(rng, rng.choice(PARAGRAPHS)) for _ in range(rng.randint(1, 4))]
+    if kind == "title":
+        return [f"{'#' * rng.randint(1, 4)} 第{index}节 {rng.choice(['退货政策', '配送说明', 'Warranty', '会员权益'])}"]
+    if kind == "list":
+        markers = ["- ", "* ", "+ ", "1. ", "2) ", "10. ", "-", "3.5 ", ".) "]
+        return [rng.choice(markers) + _decorate(rng, rng.choice(PARAGRAPHS)[:rng.randint(3, 30)])
+                for _ in range(rng.randint(2, 5))]
+    if kind == "table":
+        rows = ["| 项目 | 说明 | 金额 |", "|---|---|---|"]
+        rows += [f"| {rng.choice(['运费', '退款', '积分'])} | {_decorate(rng, '按订单计算')} | {rng.choice(INLINE_VALUES)} |"
+                 for _ in range(rng.randint(1, 4))]
+        return rows
+    if kind == "code":
+        fence = rng.choice(["```", "~~~"])
+        body = [f"{fence}{rng.choice(['python', 'json', ''])}", "print('退货')", "  x = 1  ", ""]
+        return body + ([fence] if rng.random() < 0.8 else [])
+    if kind == "faq":
+        style = rng.choice(["numbered", "qa", "chinese"])
+        out = []
+        for n in range(1, rng.randint(3, 6)):
+            question, answer = rng.choice(PARAGRAPHS)[:12], _decorate(rng, rng.choice(PARAGRAPHS))
+            if style == "numbered":
+                out.append(f"{n}. Q: {question}？ A: {answer}")
+            elif style == "qa":
+                out += [f"{rng.choice(['问', 'Q', '问题'])}{rng.choice(['', str(n)])}：{question}？",
+                        f"{rng.choice(['答', 'A', '回答'])}：{answer}"]
+            else:
+                out.append(f"{'一二三四五六七八九十'[n - 1]}、{question}：{answer}")
+        return out
+    if kind == "noise":
+        return [rng.choice(NOISE_LINES) for _ in range(rng.randint(1, 3))]
+    if kind == "meta":
+        return [rng.choice(["作者：客服中心", "Author: Support Team", "来源：商城公告", "发布时间：2024-03-15",
+                            "更新时间：2024/3/5", "2023年12月1日 更新"])]
+    return ["", "", ""][:rng.randint(1, 3)]
+
+
+def build_corpus(docs: int, seed: int) -> List[str]:
+    """生成确定性的夹具语料（每篇文档由随机段落、标题、列表、表格、代码块、FAQ、噪音行拼成）"""
+    rng = random.Random(seed)
+    corpus = ["", " ", "\n\n\n", "短", "¥100元", "01/11/2024/05/06", "首页", "你好" * 3]
+    for _ in range(docs):
+        lines = []
+        for index in range(rng.randint(5, 40)):
+            lines += _block(rng, index)
+            if rng.random() < 0.15 and lines:
+                lines.append(rng.choice(lines))  # 重复行
+        corpus.append(rng.choice(["\n", "\n", "\r\n", "\n\n"]).join(lines))
+    return corpus
+
+
+def load_input_files(paths: List[str]) -> List[str]:
+    texts = []
+    for path in paths:
+        path = Path(path)
+        files = sorted(p for p in path.rglob("*") if p.suffix in (".txt", ".md")) if path.is_dir() else [path]
+        for file in files:
+            texts.append(file.read_text(encoding="utf-8", errors="ignore"))
+    return texts
+
+
+# ---------------------------------------------------------------------------
+# 对比与计时
+# ---------------------------------------------------------------------------
+
+def _metadata(cleaner: TextCleaner, text: str) -> Dict:
+    metadata = cleaner.extract_metadata(text, "faq/policy.md")
+    metadata.pop("extracted_at", None)
+    return metadata
+
+
+STAGES: List[Tuple[str, Callable[[TextCleaner, str], object], str]] = [
+    # (阶段名, 调用, 输入：raw 为原文，normalized 为规范化结果，structured 为结构化文本，cleaned 为清理结果)
+    ("normalize_text", lambda c, t: c.normalize_text(t), "raw"),
+    ("extract_structure", lambda c, t: c.extract_structure(t), "normalized"),
+    ("clean_content", lambda c, t: c.clean_content(t), "structured"),
+    ("quality_score", lambda c, t: c._calculate_quality_score(t), "structured"),
+    ("extract_metadata", _metadata, "cleaned"),
+]
+
+
+def stage_inputs(corpus: List[str]) -> Dict[str, List[str]]:
+    """各阶段的输入（用新实现逐级生成；新旧实现在同一输入上比较）"""
+    cleaner = TextCleaner()
+    normalized = [cleaner.normalize_text(t) for t in corpus]
+    structured = [cleaner.extract_structure(t)["text"] for t in normalized]
+    cleaned = [cleaner.clean_content(t)[0] for t in structured]
+    return {"raw": corpus, "normalized": normalized, "structured": structured, "cleaned": cleaned}
+
+
+def _time(func: Callable, cleaner: TextCleaner, texts: List[str], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            func(cleaner, text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _pipeline(cleaner: TextCleaner, text: str):
+    """与 RAGService._prepare_content 相同的预处理流水线"""
+    normalized = cleaner.normalize_text(text)
+    if not normalized:
+        return None
+    structured = cleaner.extract_structure(normalized)
+    cleaned, quality = cleaner.clean_content(structured["text"])
+    if not cleaned:
+        return None
+    if isinstance(cleaner, LegacyTextCleaner):
+        metadata = cleaner.extract_metadata(cleaned)
+    else:
+        metadata = cleaner.extract_metadata(cleaned, quality_score=quality["quality_score"])
+    metadata.pop("extracted_at", None)
+    metadata["quality_score"] = quality["quality_score"]
+    return cleaned, metadata, cleaner.chunk_text_optimized(cleaned)
+
+
+def compare(corpus: List[str], repeat: int) -> Dict:
+    legacy, current = LegacyTextCleaner(), TextCleaner()
+    inputs = stage_inputs(corpus)
+    report = {"documents": len(corpus), "characters": sum(map(len, corpus)), "stages": {}, "mismatches": []}
+
+    stages = STAGES + [("pipeline", _pipeline, "raw")]
+    for name, func, source in stages:
+        texts = inputs[source]
+        for i, text in enumerate(texts):
+            expected, actual = func(legacy, text), func(current, text)
+            if expected != actual:
+                report["mismatches"].append({"stage": name, "document": i, "input": text[:200],
+                                             "legacy": repr(expected)[:300], "current": repr(actual)[:300]})
+        legacy_seconds = _time(func, legacy, texts, repeat)
+        current_seconds = _time(func, current, texts, repeat)
+        report["stages"][name] = {
+            "legacy_ms": round(legacy_seconds * 1000, 2),
+            "current_ms": round(current_seconds * 1000, 2),
+            "speedup": round(legacy_seconds / current_seconds, 2) if current_seconds else None,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文本清洗微基准测试（新旧实现输出一致性与耗时对比）")
+    parser.add_argument("--docs", type=int, default=200, help="生成的夹具文档数")
+    parser.add_argument("--seed", type=int, default=7, help="随机种子（相同种子生成相同的语料）")
+    parser.add_argument("--repeat", type=int, default=3, help="每个阶段计时的重复次数（取最快一次）")
+    parser.add_argument("--input", action="append", default=[], help="追加的真实文本文件或目录，可重复指定")
+    parser.add_argument("--output", help="结果 JSON 文件路径")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.docs, args.seed) + load_input_files(args.input)
+    report = compare(corpus, args.repeat)
+
+    print(f"📥 语料: {report['documents']} 篇文档，{report['characters']} 个字符")
+    for name, stage in report["stages"].items():
+        print(f"  {name:<18} 旧实现 {stage['legacy_ms']:>9} ms   新实现 {stage['current_ms']:>9} ms   加速 {stage['speedup']}x")
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"✓ 结果已写入 {args.output}")
+
+    if report["mismatches"]:
+        print(f"❌ 新旧实现输出不一致: {len(report['mismatches'])} 处，首个差异:")
+        print(json.dumps(report["mismatches"][0], ensure_ascii=False, indent=2))
+        sys.exit(1)
+    print("✓ 所有阶段输出与旧实现一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+知识库批量导入脚本
+将压缩包（.zip / .tar / .tar.gz / .tgz）或目录中的文件批量导入知识库，
+每个文件一个文档；按批提交事务、按固定批大小向量化，导入结束后统一保存索引
+运行方式: python scripts/bulk_import_knowledge.py faq.zip --category 售后政策 (需要在 backend 目录下运行)
+注意: 脚本直接写入向量索引文件，服务运行期间请改用 POST /admin/knowledge-base/documents/bulk-upload 接口
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+# 添加项目路径
+backend_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_root))
+
+from app.database import Base, SessionLocal, engine
+from app.services.bulk_import import import_archive
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量导入知识库文档")
+    parser.add_argument("paths", nargs="+", help="压缩包或目录路径")
+    parser.add_argument("--category", help="文档分类")
+    parser.add_argument("--tags", help="文档标签（逗号分隔）")
+    parser.add_argument("--batch-docs", type=int, help="每个数据库事务的文档数（默认 RAG_BULK_BATCH_DOCS）")
+    parser.add_argument("--embed-batch-size", type=int, help="每次向量化的块数（默认 RAG_BULK_EMBED_BATCH_SIZE）")
+    parser.add_argument("--show-failed", action="store_true", help="输出失败文件明细")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+
+    def report(done, total):
+        if done % 50 == 0 or done == total:
+            print(f"  → 已处理 {done}" + (f"/{total}" if total else "") + " 个文件")
+
+    exit_code = 0
+    for path in args.paths:
+        path = Path(path)
+        if not path.exists():
+            print(f"✗ 路径不存在: {path}")
+            exit_code = 1
+            continue
+        db = SessionLocal()
+        try:
+            summary = import_archive(
+                db, path,
+                category=args.category,
+                tags=args.tags,
+                batch_docs=args.batch_docs,
+                embed_batch_size=args.embed_batch_size,
+                progress=report,
+            )
+        except Exception as e:
+            print(f"✗ 导入失败: {path}: {e}")
+            exit_code = 1
+            continue
+        finally:
+            db.close()
+
+        print(f"✓ {path.name}: 共 {summary['total']} 个文件，成功 {summary['imported']} 个"
+              f"（{summary['chunk_count']} 个块），失败 {len(summary['failed'])} 个")
+        if summary["failed"]:
+            exit_code = 1
+            if args.show_failed:
+                print(json.dumps(summary["failed"], ensure_ascii=False, indent=2))
+
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
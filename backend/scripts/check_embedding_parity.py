@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+嵌入推理后端一致性检查脚本
+在知识库文本块样本上比较 int8 / ONNX 推理后端与 fp32 模型的向量余弦一致性和推理耗时，
+切换 RAG_EMBEDDING_BACKEND 前先用本脚本确认检索质量不受影响
+运行方式: python scripts/check_embedding_parity.py --backend onnx-int8 (需要在 backend 目录下运行)
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+# 添加项目路径
+backend_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_root))
+
+from app.database import SessionLocal
+from app.utils import load_env
+from app.services.embedding_backend import BACKENDS, check_parity, load_embedding_model, sample_corpus_texts
+
+
+def main():
+    load_env()
+    parser = argparse.ArgumentParser(description="比较嵌入推理后端与 fp32 模型的向量一致性")
+    parser.add_argument("--backend", default=os.environ.get("RAG_EMBEDDING_BACKEND", "onnx-int8"),
+                        choices=[b for b in BACKENDS if b != "torch"], help="待检查的推理后端")
+    parser.add_argument("--model", default=os.environ.get("RAG_EMBEDDING_MODEL"), help="嵌入模型（默认 RAG_EMBEDDING_MODEL）")
+    parser.add_argument("--samples", type=int, help="抽样块数（默认 RAG_EMBEDDING_PARITY_SAMPLES）")
+    parser.add_argument("--min-cosine", type=float, help="平均余弦相似度阈值（默认 RAG_EMBEDDING_PARITY_MIN_COSINE）")
+    args = parser.parse_args()
+
+    if not args.model:
+        print("✗ 请通过 --model 或 RAG_EMBEDDING_MODEL 指定嵌入模型")
+        sys.exit(1)
+
+    db = SessionLocal()
+    try:
+        texts = sample_corpus_texts(db, args.samples)
+    finally:
+        db.close()
+    if not texts:
+        print("✗ 知识库中没有文本块，无法检查")
+        sys.exit(1)
+
+    print(f"📥 加载 fp32 模型和 {args.backend} 模型: {args.model}")
+    reference = load_embedding_model(args.model, "torch")
+    model = load_embedding_model(args.model, args.backend)
+    report = check_parity(model, reference, texts, min_cosine=args.min_cosine)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if report["passed"]:
+        print(f"✓ {args.backend} 与 fp32 一致（平均余弦 {report['mean_cosine']}），推理加速 {report['speedup']}x")
+    else:
+        print(f"⚠ {args.backend} 与 fp32 差异过大（平均余弦 {report['mean_cosine']} < {report['threshold']}）")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
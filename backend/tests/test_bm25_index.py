@@ -0,0 +1,96 @@
+"""
+BM25 倒排索引单元测试
+"""
+import math
+from collections import Counter
+
+import pytest
+
+from app.services.bm25_index import InvertedIndex
+
+
+DOCS = {
+    10: ["退货", "政策", "七天", "无理由", "退货"],
+    11: ["发货", "时间", "四十八", "小时"],
+    12: ["退货", "运费", "买家", "承担"],
+    13: ["会员", "积分", "兑换", "优惠券"],
+}
+
+
+def _reference_scores(docs, query, k1=1.5, b=0.75):
+    """逐文档计算 BM25 分数，作为倒排表打分的对照"""
+    n = len(docs)
+    avgdl = sum(len(t) for t in docs.values()) / n
+    scores = {}
+    for key, tokens in docs.items():
+        tf = Counter(tokens)
+        score = 0.0
+        for term in query:
+            df = sum(1 for t in docs.values() if term in t)
+            if not df or not tf[term]:
+                continue
+            idf = math.log((n - df + 0.5) / (df + 0.5) + 1.0)
+            score += idf * tf[term] * (k1 + 1) / (tf[term] + k1 * (1 - b + b * len(tokens) / avgdl))
+        if score > 0:
+            scores[key] = score
+    return scores
+
+
+def _build(docs):
+    index = InvertedIndex()
+    for key, tokens in docs.items():
+        index.add(key, tokens)
+    return index
+
+
+def test_search_matches_reference_scores():
+    index = _build(DOCS)
+    query = ["退货", "运费"]
+
+    results = index.search(query, top_k=10)
+    expected = _reference_scores(DOCS, query)
+
+    assert [key for key, _ in results] == sorted(expected, key=expected.get, reverse=True)
+    for key, score in results:
+        assert score == pytest.approx(expected[key], rel=1e-5)
+
+
+def test_remove_updates_statistics():
+    index = _build(DOCS)
+    index.remove(12)
+
+    remaining = {k: v for k, v in DOCS.items() if k != 12}
+    results = dict(index.search(["退货", "运费"], top_k=10))
+    expected = _reference_scores(remaining, ["退货", "运费"])
+
+    assert set(results) == set(expected) == {10}
+    assert results[10] == pytest.approx(expected[10], rel=1e-5)
+    assert 12 not in index and len(index) == 3
+
+
+def test_add_existing_key_replaces_document():
+    index = _build(DOCS)
+    index.add(11, ["退货", "运费"])
+
+    assert dict(index.search(["发货"], top_k=10)) == {}
+    assert 11 in dict(index.search(["运费"], top_k=10))
+    assert len(index) == len(DOCS)
+
+
+def test_allowed_keys_restrict_candidates():
+    index = _build(DOCS)
+    assert [key for key, _ in index.search(["退货"], top_k=10, allowed_keys=[12, 13])] == [12]
+    assert index.search(["退货"], top_k=10, allowed_keys=[99]) == []
+
+
+def test_compaction_keeps_results():
+    index = InvertedIndex()
+    for key in range(3000):
+        index.add(key, ["通用", f"词{key}"])
+    for key in range(2500):
+        index.remove(key)
+
+    assert len(index) == 500
+    assert index._slot_keys.size < 3000  # 已压缩失效槽位
+    assert [key for key, _ in index.search(["词2999"], top_k=5)] == [2999]
+    assert len(index.search(["通用"], top_k=1000)) == 500
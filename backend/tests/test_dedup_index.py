@@ -0,0 +1,32 @@
+"""
+近重复检测索引单元测试
+"""
+from app.services.dedup_index import DedupIndex, shingle_hashes
+
+
+POLICY = (
+    "{store}退货政策：自签收之日起七天内可申请无理由退货，商品需保持完好、配件齐全。"
+    "非质量问题退货运费由买家承担，质量问题由商家承担运费。"
+)
+SHIPPING = "发货时间说明：订单支付成功后，仓库会在四十八小时内安排发货，偏远地区配送时间可能延长。"
+
+
+def test_shingles_ignore_case_whitespace_and_punctuation():
+    assert set(shingle_hashes("Hello, World 退货")) == set(shingle_hashes("hello world退货！"))
+    assert len(shingle_hashes("短句")) == 1
+    assert len(shingle_hashes(" ，。")) == 0
+
+
+def test_candidates_find_near_duplicates_only():
+    index = DedupIndex()
+    index.add(1, index.signature(POLICY.format(store="朝阳店")))
+    index.add(2, index.signature(SHIPPING))
+
+    candidates = index.candidates(index.signature(POLICY.format(store="徐汇店")), min_jaccard=0.8)
+    assert [key for key, _ in candidates] == [1]
+    assert candidates[0][1] >= 0.8
+    assert index.candidates(index.signature("会员积分可以在下单时抵扣现金，每一百积分抵扣一元。"), 0.8) == []
+
+    assert index.remove(1) and 1 not in index and not index.remove(1)
+    assert index.candidates(index.signature(POLICY.format(store="徐汇店")), min_jaccard=0.8) == []
+    assert len(index) == 1
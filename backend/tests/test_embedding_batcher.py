@@ -0,0 +1,87 @@
+"""
+查询向量微批处理单元测试
+"""
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from app.services.embedding_batcher import EmbeddingBatcher
+
+
+class SlowEncoder:
+    """每次调用固定耗时的桩编码器，记录每次调用的批大小"""
+
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.batches = []
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        time.sleep(self.delay)
+        return np.asarray([[len(t), sum(map(ord, t)) % 97] for t in texts], dtype="float32")
+
+
+def _concurrent_embed(batcher, texts):
+    results = {}
+    barrier = threading.Barrier(len(texts))
+
+    def worker(text):
+        barrier.wait()
+        results[text] = batcher.embed(text, timeout=5)
+
+    threads = [threading.Thread(target=worker, args=(t,)) for t in texts]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_concurrent_requests_are_coalesced():
+    encoder = SlowEncoder()
+    batcher = EmbeddingBatcher(encoder, max_batch_size=32, max_wait_ms=20)
+    texts = [f"问题{i}" for i in range(16)]
+    try:
+        results = _concurrent_embed(batcher, texts)
+    finally:
+        batcher.shutdown(timeout=5)
+
+    assert len(encoder.batches) < len(texts)
+    assert sorted(t for batch in encoder.batches for t in batch) == sorted(texts)
+    expected = encoder(texts)
+    for i, text in enumerate(texts):
+        np.testing.assert_array_equal(results[text], expected[i])
+    stats = batcher.stats()
+    assert stats["requests"] == len(texts) and stats["avg_batch_size"] > 1
+
+
+def test_batch_size_limit_and_duplicates():
+    encoder = SlowEncoder()
+    batcher = EmbeddingBatcher(encoder, max_batch_size=4, max_wait_ms=20)
+    try:
+        results = _concurrent_embed(batcher, [f"问题{i}" for i in range(10)])
+        assert len(results) == 10
+        assert max(len(batch) for batch in encoder.batches) <= 4
+
+        futures = [batcher.submit("重复问题") for _ in range(3)]
+        vectors = [f.result(timeout=5) for f in futures]
+    finally:
+        batcher.shutdown(timeout=5)
+    assert all(batch.count("重复问题") <= 1 for batch in encoder.batches)
+    np.testing.assert_array_equal(vectors[0], vectors[2])
+
+
+def test_encode_errors_are_raised_to_every_caller():
+    def failing(texts):
+        raise RuntimeError("模型推理失败")
+
+    batcher = EmbeddingBatcher(failing, max_wait_ms=1)
+    try:
+        with pytest.raises(RuntimeError, match="模型推理失败"):
+            batcher.embed("怎么退货", timeout=5)
+    finally:
+        batcher.shutdown(timeout=5)
+    with pytest.raises(RuntimeError):
+        batcher.embed("怎么退货", timeout=5)
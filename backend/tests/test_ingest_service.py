@@ -0,0 +1,335 @@
+"""
+文档异步导入服务单元测试（使用桩 RAG 服务，不加载嵌入模型）
+"""
+import io
+import json
+import tarfile
+import zipfile
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import KnowledgeDocument, KnowledgeIngestJob
+from app.services import rag_service as rag_module
+from app.services.bulk_import import iter_entries
+from app.services.ingest_service import IngestionService
+
+
+class StubRAGService:
+    """记录进度回调并直接写入文档记录的桩服务"""
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.stages = []
+        self.deleted = []
+
+    def add_document(self, db, title, content, source_type="manual", source_url=None,
+                     category=None, tags=None, progress=None, document_created=None):
+        for stage, value in (("clean", 0.3), ("embed", 0.5), ("index", 0.8)):
+            progress(stage, value)
+            self.stages.append(stage)
+        if self.fail:
+            raise ValueError("文档分块失败")
+        doc = KnowledgeDocument(title=title, content=content, source_type=source_type,
+                                source_url=source_url, category=category, tags=tags, chunk_count=1)
+        db.add(doc)
+        db.commit()
+        return doc
+
+    def add_document_stream(self, db, title, parts, source_type="manual", source_url=None,
+                            category=None, tags=None, progress=None, document_created=None):
+        # 与真实服务一致：停用状态的文档先提交并回调ID，读完全部片段后启用
+        doc = KnowledgeDocument(title=title, content="", source_type=source_type, source_url=source_url,
+                                category=category, tags=tags, active=False, chunk_count=0)
+        db.add(doc)
+        db.commit()
+        document_created(doc.id)
+        self.parts = []
+        for part in parts:
+            if not self.parts:
+                progress("clean", 0.3)
+                self.stages.append("clean")
+            self.parts.append(part)
+        for stage, value in (("embed", 0.5), ("index", 0.8)):
+            progress(stage, value)
+            self.stages.append(stage)
+        content = "".join(self.parts)
+        if self.fail or not content.strip():
+            self.delete_document(db, doc.id)
+            raise ValueError("文档分块失败" if content.strip() else "文档内容为空或清洗后为空")
+        doc.content = content
+        doc.chunk_count = 1
+        doc.active = True
+        db.commit()
+        return doc
+
+    def add_table_stream(self, db, title, rows, source_type="excel", source_url=None,
+                         category=None, tags=None, progress=None, document_created=None):
+        # 与真实服务一致：读到第一行进入 clean，第一批块读完开始向量化进入 embed，全部读完后 index
+        self.rows = []
+        for row in rows:
+            if not self.rows:
+                progress("clean", 0.3)
+            self.rows.append(row)
+            if len(self.rows) == 100:
+                progress("embed", 0.5)
+        progress("index", 0.8)
+        self.stages.append("table")
+        doc = KnowledgeDocument(title=title, content=str(self.rows), source_type=source_type,
+                                source_url=source_url, category=category, tags=tags, chunk_count=1)
+        db.add(doc)
+        db.commit()
+        return doc
+
+    def bulk_add_documents(self, db, documents, batch_docs=None, embed_batch_size=None, progress=None):
+        summary = {"imported": 0, "chunk_count": 0, "document_ids": [], "failed": []}
+        for done, item in enumerate(documents, 1):
+            if item.get("error"):
+                summary["failed"].append({"source": item["source_url"], "error": item["error"]})
+            else:
+                doc = self.add_document(db, item["title"], item["content"], source_url=item["source_url"],
+                                        category=item.get("category"), progress=lambda *a: None)
+                summary["imported"] += 1
+                summary["document_ids"].append(doc.id)
+            progress(done)
+        return summary
+
+    def delete_document(self, db, document_id):
+        self.deleted.append(document_id)
+        db.query(KnowledgeDocument).filter(KnowledgeDocument.id == document_id).delete()
+        db.commit()
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'kb.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    engine.dispose()
+
+
+def _service(tmp_path, session_factory):
+    return IngestionService(upload_dir=tmp_path / "uploads", max_workers=1, session_factory=session_factory)
+
+
+def _drain(service):
+    service._executor.shutdown(wait=True)
+
+
+def test_upload_job_runs_in_background(tmp_path, session_factory, monkeypatch):
+    stub = StubRAGService()
+    monkeypatch.setattr(rag_module, "get_rag_service", lambda: stub)
+    service = _service(tmp_path, session_factory)
+
+    db = session_factory()
+    job = service.submit_upload(db, "退货政策：七天无理由退货".encode("utf-8"), "退货.txt",
+                                content_type="text/plain", category="售后")
+    assert job.status in ("pending", "running", "succeeded")
+    _drain(service)
+
+    db.expire_all()
+    job = db.get(KnowledgeIngestJob, job.id)
+    assert job.status == "succeeded" and job.stage == "done" and job.progress == 1.0
+    assert job.attempts == 1
+    doc = db.get(KnowledgeDocument, job.document_id)
+    assert doc.title == "退货.txt" and doc.category == "售后"
+    assert doc.source_type == "text" and doc.active
+    assert stub.stages == ["clean", "embed", "index"]
+    assert not list((tmp_path / "uploads").iterdir())  # 暂存文件已清理
+    db.close()
+
+
+def test_failed_job_records_error(tmp_path, session_factory, monkeypatch):
+    monkeypatch.setattr(rag_module, "get_rag_service", lambda: StubRAGService(fail=True))
+    service = _service(tmp_path, session_factory)
+
+    db = session_factory()
+    job = service.submit_upload(db, "内容".encode("utf-8"), "a.txt", content_type="text/plain")
+    empty = service.submit_upload(db, b"   ", "b.txt", content_type="text/plain")
+    _drain(service)
+
+    db.expire_all()
+    job = db.get(KnowledgeIngestJob, job.id)
+    assert job.status == "failed" and "分块失败" in job.error
+    assert job.stage == "index"  # 停留在失败时的阶段
+    empty = db.get(KnowledgeIngestJob, empty.id)
+    assert empty.status == "failed" and "内容为空" in empty.error and empty.document_id is None
+    assert db.query(KnowledgeDocument).count() == 0
+    db.close()
+
+
+def test_resume_pending_requeues_interrupted_jobs(tmp_path, session_factory, monkeypatch):
+    stub = StubRAGService()
+    monkeypatch.setattr(rag_module, "get_rag_service", lambda: stub)
+    upload_dir = tmp_path / "uploads"
+    upload_dir.mkdir()
+    db = session_factory()
+    jobs = []
+    partial = []
+    for name, status, attempts in (("a.txt", "running", 1), ("b.txt", "pending", 0), ("c.txt", "running", 3)):
+        path = upload_dir / name
+        path.write_text("发货时间：四十八小时内发货", encoding="utf-8")
+        job = KnowledgeIngestJob(status=status, stage="embed" if status == "running" else "queued",
+                                 progress=0.5 if status == "running" else 0.0, filename=name,
+                                 content_type="text/plain", file_path=str(path), attempts=attempts)
+        if status == "running":
+            # 流式导入中途退出：停用状态的文档已提交，任务记录了文档ID
+            doc = KnowledgeDocument(title=name, content="", active=False, chunk_count=0)
+            db.add(doc)
+            db.flush()
+            job.document_id = doc.id
+            partial.append(doc.id)
+        db.add(job)
+        jobs.append(job)
+    db.commit()
+
+    service = _service(tmp_path, session_factory)
+    assert service.resume_pending() == 2
+    _drain(service)
+
+    db.expire_all()
+    statuses = [db.get(KnowledgeIngestJob, job.id).status for job in jobs]
+    assert statuses == ["succeeded", "succeeded", "failed"]
+    assert db.get(KnowledgeIngestJob, jobs[0].id).attempts == 2
+    # 重新执行前删除上次留下的文档，不再重试的任务也删除
+    assert sorted(stub.deleted) == partial
+    assert db.query(KnowledgeDocument).count() == 2
+    assert all(doc.active for doc in db.query(KnowledgeDocument))
+    assert db.get(KnowledgeIngestJob, jobs[2].id).document_id is None
+    db.close()
+
+
+def _zip_bytes(entries):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in entries.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def test_iter_entries_reads_zip_tar_and_directory(tmp_path):
+    zip_path = tmp_path / "faq.zip"
+    zip_path.write_bytes(_zip_bytes({
+        "faq/退货.md": "退货说明".encode("utf-8"),
+        "faq/logo.exe": b"MZ",
+        "__MACOSX/faq/._退货.md": b"x",
+    }))
+    # Windows 打包的 GBK 文件名（未设置 UTF-8 标志位）
+    gbk_name = "发货.txt".encode("gbk")
+    placeholder = b"x" * len(gbk_name)
+    gbk_zip = tmp_path / "gbk.zip"
+    gbk_zip.write_bytes(
+        _zip_bytes({placeholder.decode("ascii"): "发货说明".encode("utf-8")}).replace(placeholder, gbk_name)
+    )
+    tar_path = tmp_path / "faq.tar.gz"
+    with tarfile.open(tar_path, "w:gz") as archive:
+        data = "会员说明".encode("utf-8")
+        info = tarfile.TarInfo("faq/会员.txt")
+        info.size = len(data)
+        archive.addfile(info, io.BytesIO(data))
+    folder = tmp_path / "folder"
+    (folder / "sub").mkdir(parents=True)
+    (folder / "sub" / "积分.md").write_text("积分说明", encoding="utf-8")
+    (folder / ".hidden.md").write_text("x", encoding="utf-8")
+
+    assert list(iter_entries(zip_path)) == [("faq/退货.md", "退货说明".encode("utf-8"))]
+    assert [name for name, _ in iter_entries(gbk_zip)] == ["发货.txt"]
+    assert [name for name, _ in iter_entries(tar_path)] == ["faq/会员.txt"]
+    assert [name for name, _ in iter_entries(folder)] == ["sub/积分.md"]
+
+
+def test_archive_job_imports_each_file(tmp_path, session_factory, monkeypatch):
+    monkeypatch.setattr(rag_module, "get_rag_service", lambda: StubRAGService())
+    service = _service(tmp_path, session_factory)
+
+    db = session_factory()
+    data = _zip_bytes({"退货.md": "退货政策说明".encode("utf-8"), "发货.txt": "发货时间说明".encode("utf-8"),
+                       "空白.txt": b"   "})
+    job = service.submit_upload(db, data, "faq.zip", category="售后", kind="archive")
+    _drain(service)
+
+    db.expire_all()
+    job = db.get(KnowledgeIngestJob, job.id)
+    result = json.loads(job.result)
+    assert job.status == "succeeded" and job.progress == 1.0
+    assert result["imported"] == 2 and result["total"] == 3
+    assert [f["source"] for f in result["failed"]] == ["空白.txt"]
+    assert sorted(d.title for d in db.query(KnowledgeDocument)) == ["发货", "退货"]
+    db.close()
+
+
+def test_spreadsheet_upload_is_streamed_by_rows(tmp_path, session_factory, monkeypatch):
+    stub = StubRAGService()
+    monkeypatch.setattr(rag_module, "get_rag_service", lambda: stub)
+    service = _service(tmp_path, session_factory)
+    seen = []
+    real_rows = stub.add_table_stream
+
+    def add_table_stream(db, title, rows, **kw):
+        def tracked():
+            for done, row in enumerate(rows, 1):
+                # 读取下一行前从另一个连接读取任务进度（进度直接写库，不再只保存在内存中）
+                reader = session_factory()
+                job_row = reader.get(KnowledgeIngestJob, job.id)
+                seen.append((done, job_row.stage, job_row.progress))
+                reader.close()
+                yield row
+        return real_rows(db, title, tracked(), **kw)
+
+    monkeypatch.setattr(stub, "add_table_stream", add_table_stream)
+    db = session_factory()
+    data = "SKU,名称\n" + "".join(f"A{i:04d},手机壳{i}号\n" for i in range(2500))
+    job = service.submit_upload(db, data.encode("utf-8"), "库存.csv", content_type="application/vnd.ms-excel")
+    _drain(service)
+
+    db.expire_all()
+    job = db.query(KnowledgeIngestJob).get(job.id)
+    doc = db.query(KnowledgeDocument).get(job.document_id)
+    assert job.status == "succeeded" and stub.stages == ["table"] and doc.source_type == "csv"
+    assert stub.rows[0] == ("库存", ["SKU", "名称"]) and len(stub.rows) == 2501
+    # 阶段随实际读取推进：读第一行时还在 parse，开始向量化前是 clean，之后按已读行数逐步推进
+    stages = [stage for _, stage, _ in seen]
+    assert stages[0] == "parse" and stages[1] == "clean"
+    assert stages.index("embed") == 100 and set(stages[100:]) == {"embed"}
+    progress = [value for _, _, value in seen]
+    assert progress == sorted(progress)
+    assert [seen[i][2] for i in (998, 999, 1999)] == [0.5, 0.62, 0.74]  # 每读 1000 行上报一次
+
+
+def test_pdf_and_text_uploads_are_streamed_without_preview_caps(tmp_path, session_factory, monkeypatch):
+    fitz = pytest.importorskip("fitz")
+    stub = StubRAGService()
+    monkeypatch.setattr(rag_module, "get_rag_service", lambda: stub)
+    # 整体解析的上限只用于预览，导入任务逐页流式导入全文
+    monkeypatch.setenv("PDF_MAX_PAGES", "2")
+    monkeypatch.setenv("PDF_MAX_CHARS", "100")
+    pdf = fitz.open()
+    for i in range(6):
+        pdf.new_page().insert_text((50, 60), f"Manual page {i + 1}: reset the camera", fontsize=10)
+    pdf_data = pdf.tobytes()
+    pdf.close()
+    service = _service(tmp_path, session_factory)
+
+    db = session_factory()
+    job = service.submit_upload(db, pdf_data, "手册.pdf", content_type="application/pdf")
+    _drain(service)
+    db.expire_all()
+    job = db.get(KnowledgeIngestJob, job.id)
+    doc = db.get(KnowledgeDocument, job.document_id)
+    assert job.status == "succeeded" and doc.source_type == "pdf"
+    assert len(stub.parts) == 6 and stub.parts[0].startswith("=== 第 1 页 ===")
+    assert "Manual page 6" in doc.content
+
+    # GBK 编码的大文本按行分段产出，不读成一个字符串
+    text = "".join(f"第{i}条：七天无理由退货\n" for i in range(20000))
+    service = _service(tmp_path, session_factory)
+    job = service.submit_upload(db, text.encode("gbk"), "退货.txt", content_type="text/plain")
+    _drain(service)
+    db.expire_all()
+    job = db.get(KnowledgeIngestJob, job.id)
+    assert job.status == "succeeded"
+    assert len(stub.parts) > 1 and all(part.endswith("\n") for part in stub.parts)
+    assert "".join(stub.parts) == text
+    db.close()
@@ -0,0 +1,130 @@
+"""
+OCR 识别服务单元测试（用桩引擎代替 PaddleOCR / tesseract）
+"""
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app.services import ocr_service
+from app.services.ocr_service import OCRService
+
+
+class _StubEngine(ocr_service._OcrEngine):
+    calls = []
+
+    def __init__(self, engine, tesseract_cmd=None):
+        self.engine = engine
+
+    def recognize(self, image_data, lang=None):
+        _StubEngine.calls.append(image_data)
+        if image_data.startswith(b"bad"):
+            raise ValueError("cannot identify image file")
+        if self.engine == "paddleocr":
+            # PaddleOCR 桩：blank 图片识别不出文字
+            return "" if image_data.startswith(b"blank") else f"{image_data.decode()}|paddle"
+        return f"{image_data.decode()}|{lang or 'default'}"
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setenv("OCR_WORKERS", "0")
+    monkeypatch.setattr(ocr_service, "_OcrEngine", _StubEngine)
+    _StubEngine.calls = []
+    svc = OCRService()
+    svc.engines = svc.chat_engines = ["pytesseract"]
+    return svc
+
+
+def test_identical_images_are_recognized_once(service):
+    texts = service.recognize_images([b"shot-a", b"shot-b", b"shot-a"])
+    assert texts == ["shot-a|default", "shot-b|default", "shot-a|default"]
+    assert _StubEngine.calls == [b"shot-a", b"shot-b"]
+
+    # 客户重发同一张截图：直接命中缓存；换识别语言则重新识别
+    assert service.recognize(b"shot-a") == "shot-a|default"
+    assert service.recognize(b"shot-a", lang="chi_sim+eng") == "shot-a|chi_sim+eng"
+    assert _StubEngine.calls == [b"shot-a", b"shot-b", b"shot-a"]
+    assert service.stats()["cache"]["hits"] == 1
+
+
+def test_failed_recognition_is_not_cached(service):
+    assert service.recognize_images([b"bad-1", b"ok"]) == ["", "ok|default"]
+    assert service.recognize(b"bad-1") == ""
+    assert _StubEngine.calls == [b"bad-1", b"ok", b"bad-1"]
+
+
+def test_pool_batches_and_falls_back_when_broken(service, monkeypatch):
+    service.workers = 2
+    service.batch_size = 2
+    service.engines = ["paddleocr", "pytesseract"]
+    submitted = []
+
+    def broken_pool(name, batches, lang, engines):
+        submitted.append(name)
+        submitted.extend(batches)
+        raise BrokenProcessPool("worker died")
+
+    monkeypatch.setattr(service, "_run_in_pool", broken_pool)
+    texts = service.recognize_images([b"p1", b"p2", b"p3"])
+    assert submitted == ["documents", [b"p1", b"p2"], [b"p3"]]
+    assert texts == ["p1|paddle", "p2|paddle", "p3|paddle"]
+    assert service._pools == {}
+
+    # 客服聊天只用 pytesseract：在服务进程内识别，不经过进程池
+    submitted.clear()
+    assert service.recognize(b"chat-shot", chat=True) == "chat-shot|default"
+    assert submitted == []
+
+
+def test_timed_out_pool_workers_are_terminated(service):
+    class HungProcess:
+        terminated = False
+
+        def terminate(self):
+            self.terminated = True
+
+    class HungPool:
+        def __init__(self):
+            self._processes = {1: HungProcess()}
+
+        def submit(self, *args):
+            return Future()  # 任务一直不结束
+
+        def shutdown(self, wait=False, cancel_futures=False):
+            pass
+
+    pool = HungPool()
+    service.workers, service.batch_size, service.timeout = 1, 1, 0.01
+    service.engines = ["paddleocr", "pytesseract"]
+    service._pools["documents"] = pool
+    assert service.recognize_images([b"scan-1", b"scan-2"]) == ["", ""]
+    # 超时后结束工作进程并丢弃进程池，下次识别重新创建；超时结果不缓存
+    assert pool._processes[1].terminated and service._pools == {}
+    assert service.cache.get(("paddleocr+pytesseract", "", ocr_service.image_digest(b"scan-1"))) is None
+
+
+def test_document_images_fall_back_per_image(service):
+    service.engines = ["paddleocr", "pytesseract"]
+    texts = service.recognize_images([b"menu", b"blank-1", b"bad-2"])
+    # PaddleOCR 没识别出文字的图片换 pytesseract 重试，两个引擎都失败的图片为空
+    assert texts == ["menu|paddle", "blank-1|default", ""]
+    assert _StubEngine.calls == [b"menu", b"blank-1", b"bad-2", b"blank-1", b"bad-2"]
+
+
+def test_chat_defaults_to_pytesseract(monkeypatch):
+    monkeypatch.setattr(ocr_service, "PADDLEOCR_AVAILABLE", True)
+    monkeypatch.setattr(ocr_service, "PYTESSERACT_AVAILABLE", True)
+    monkeypatch.delenv("OCR_ENGINE", raising=False)
+    monkeypatch.delenv("OCR_CHAT_ENGINE", raising=False)
+    svc = OCRService()
+    assert svc.engines == ["paddleocr", "pytesseract"] and svc.chat_engines == ["pytesseract"]
+
+    monkeypatch.setenv("OCR_ENGINE", "pytesseract")
+    monkeypatch.setenv("OCR_CHAT_ENGINE", "paddleocr")
+    svc = OCRService()
+    assert svc.engines == ["pytesseract", "paddleocr"] and svc.chat_engines == ["paddleocr"]
+
+    monkeypatch.setattr(ocr_service, "PYTESSERACT_AVAILABLE", False)
+    monkeypatch.delenv("OCR_CHAT_ENGINE")
+    assert OCRService().chat_engines == []  # 聊天不回退到 PaddleOCR
@@ -0,0 +1,71 @@
+"""
+PDF 逐页流式提取单元测试（用 PyMuPDF 生成测试文件）
+"""
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+fitz = pytest.importorskip("fitz")
+
+from app.services import pdf_extractor
+from app.services.customer_service import extract_text_from_pdf
+from app.services.document_parser import iter_pdf_text, parse_pdf
+from app.services.pdf_extractor import iter_pdf_pages, page_chars
+
+
+def _catalog_pdf(pages: int) -> bytes:
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        for j in range(5):
+            page.insert_text((50, 60 + j * 20), f"Page {i + 1} item {j}: model X{i}-{j} price {i * j}", fontsize=10)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_pages_are_yielded_lazily_until_char_limit():
+    data = _catalog_pdf(10)
+    pages = iter_pdf_pages(data, engine="pymupdf", workers=1)
+    first = next(pages)
+    assert first["page"] == 1 and "Page 1 item 0" in first["text"] and first["tables"] == []
+    pages.close()
+
+    limited = list(iter_pdf_pages(data, engine="pymupdf", max_chars=page_chars(first) * 2, workers=1))
+    assert [p["page"] for p in limited] == [1, 2]
+    assert len(list(iter_pdf_pages(data, max_pages=3, workers=1))) == 3
+
+
+def test_parse_pdf_and_chat_extraction_share_extractor(monkeypatch, capsys):
+    data = _catalog_pdf(6)
+    monkeypatch.setenv("PDF_MAX_CHARS", "250")
+    result = parse_pdf(data)
+    assert result.startswith("=== 第 1 页 ===\nPage 1 item 0") and len(result) <= 250
+    assert "已截断" in capsys.readouterr().out  # 截断时打印警告
+    # 导入任务用的逐页文本不受 PDF_MAX_CHARS 限制
+    pages = list(iter_pdf_text(data))
+    assert len(pages) == 6 and pages[5].startswith("=== 第 6 页 ===")
+
+    monkeypatch.setenv("PDF_MAX_CHARS", "100000")
+    text = extract_text_from_pdf(data)
+    assert "Page 6 item 4" in text and "===" not in text
+
+
+def test_parallel_extraction_matches_sequential_order(monkeypatch):
+    monkeypatch.setenv("PDF_PARALLEL_MIN_PAGES", "1")
+    monkeypatch.setenv("PDF_PAGES_PER_TASK", "2")
+    data = _catalog_pdf(5)
+    sequential = list(iter_pdf_pages(data, workers=1))
+    assert list(iter_pdf_pages(data, workers=2)) == sequential
+
+
+def test_broken_pool_falls_back_to_sequential(monkeypatch):
+    monkeypatch.setenv("PDF_PARALLEL_MIN_PAGES", "1")
+
+    def broken_after_first_page(file_data, engine, total, include_tables, workers, pages_per_task):
+        yield pdf_extractor._PdfReader(engine, file_data).extract(0, include_tables)
+        raise BrokenProcessPool("worker died")
+
+    monkeypatch.setattr(pdf_extractor, "_iter_parallel", broken_after_first_page)
+    pages = list(iter_pdf_pages(_catalog_pdf(4), engine="pymupdf", workers=4))
+    assert [p["page"] for p in pages] == [1, 2, 3, 4]
@@ -0,0 +1,100 @@
+"""
+商品目录向量索引单元测试（字符二元组桩嵌入模型，不加载真实模型）
+"""
+import pytest
+from fastapi.testclient import TestClient
+
+pytest.importorskip("faiss")
+
+from app import rag_server
+from app.models import Product
+from app.services import product_catalog
+from app.services.product_catalog import ProductCatalogIndex, catalog_context
+from app.services.rag_client import RAGClient
+from tests.test_rag_service import BigramEmbeddingModel, kb_db, rag  # noqa: F401  复用知识库测试夹具
+
+PRODUCTS = [
+    ("运动相机X3", "数码", "防水运动相机，裸机防水十米，支持4K录像和防抖，适合潜水冲浪骑行拍摄。"),
+    ("轻薄笔记本14", "电脑", "十四英寸轻薄笔记本电脑，重量一点二公斤，续航十二小时，适合办公学习。"),
+    ("智能手表S", "手表", "智能手表，支持心率血氧监测和运动记录，五十米防水，可以游泳时佩戴。"),
+]
+
+
+@pytest.fixture
+def catalog(rag, kb_db, tmp_path):
+    rag.embedding_model = BigramEmbeddingModel()
+    rag.embedding_model_name = "bigram-model"
+    rag.vector_dim = rag.embedding_model.dim
+    for name, category, description in PRODUCTS:
+        kb_db.add(Product(name=name, category=category, description=description, price=999, stock=5))
+    kb_db.commit()
+    index = ProductCatalogIndex(rag, tmp_path / "product_catalog_index.faiss")
+    index.similarity_threshold = 0.2
+    return index
+
+
+def test_products_are_searchable_and_updated_incrementally(catalog, kb_db, rag, monkeypatch):
+    assert catalog.reconcile(kb_db) == {"total": 3, "indexed": 3, "removed": 0}
+    hits = catalog.search("有没有防水的运动相机", top_k=2)
+    assert hits and hits[0][0] == 1
+
+    # 只改价格和库存：文本未变，不重新向量化
+    encoded = len(rag.embedding_model.encoded_texts)
+    kb_db.get(Product, 2).price = 4999
+    kb_db.commit()
+    assert catalog.apply_changes(kb_db, [2]) == {"indexed": 0, "removed": 0}
+    assert len(rag.embedding_model.encoded_texts) == encoded
+
+    kb_db.get(Product, 2).description = "专业运动相机，防水防尘，夜景拍摄清晰，配有多种潜水固定支架。"
+    kb_db.commit()
+    assert catalog.apply_changes(kb_db, [2], removed_ids=[1]) == {"indexed": 1, "removed": 1}
+    assert 1 not in [product_id for product_id, _ in catalog.search("防水运动相机", top_k=3)]
+
+    # 提示词中的商品信息取数据库最新价格库存，并排除当前咨询的商品
+    monkeypatch.setattr(product_catalog, "get_product_catalog", lambda: catalog)
+    context = catalog_context(kb_db, "有没有防水的运动相机")
+    assert context.startswith("与用户问题相关的商品：轻薄笔记本14（分类：电脑，价格￥4999.00，库存5）")
+    assert "轻薄笔记本14" not in catalog_context(kb_db, "有没有防水的运动相机", exclude_id=2)
+
+
+def test_reconcile_after_restart_only_embeds_changes(catalog, kb_db, rag, tmp_path):
+    catalog.reconcile(kb_db)
+
+    # 服务未运行期间：一个商品被改名，一个被删除，新增一个
+    kb_db.get(Product, 1).name = "运动相机X4"
+    kb_db.delete(kb_db.get(Product, 3))
+    kb_db.add(Product(name="露营帐篷", category="户外", description="双层防雨露营帐篷，三到四人使用。", price=399, stock=8))
+    kb_db.commit()
+
+    encoded = len(rag.embedding_model.encoded_texts)
+    restarted = ProductCatalogIndex(rag, tmp_path / "product_catalog_index.faiss")
+    assert len(restarted.digests) == 3
+    assert restarted.reconcile(kb_db) == {"total": 3, "indexed": 2, "removed": 1}
+    assert len(rag.embedding_model.encoded_texts) == encoded + 2
+    assert set(restarted.vector_store.ids().tolist()) == {1, 2, 4}
+
+
+def test_sidecar_serves_product_index_to_client(monkeypatch):
+    class StubCatalog:
+        def __init__(self):
+            self.changes = []
+
+        def apply_changes(self, db, product_ids, removed_ids):
+            self.changes.append((product_ids, removed_ids))
+            return {"indexed": len(product_ids), "removed": len(removed_ids)}
+
+        def search(self, query, top_k=None):
+            return [(7, 0.82)]
+
+    stub = StubCatalog()
+    monkeypatch.setattr(product_catalog, "get_product_catalog", lambda: stub)
+    sidecar = rag_server.create_rag_app(init_background=False)
+    sidecar.dependency_overrides[rag_server.get_db] = lambda: None
+    client = RAGClient(url="http://rag", http_client=TestClient(sidecar))
+
+    assert client.index_products([3, 4], removed_ids=[5]) == {"indexed": 2, "removed": 1}
+    assert stub.changes == [([3, 4], [5])]
+    assert client.search_products("防水相机", top_k=2) == [(7, 0.82)]
+
+    monkeypatch.setattr(product_catalog, "get_product_catalog", lambda: None)
+    assert client.search_products("防水相机") == []
@@ -0,0 +1,100 @@
+"""
+独立检索服务与客户端单元测试（使用桩 RAG 服务，不加载嵌入模型）
+"""
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app import rag_server
+from app.routers.knowledge_base_proxy import create_proxy_router
+from app.services import rag_service as rag_module
+from app.services.rag_client import RAGClient, parse_service_url
+
+
+class StubVectorStore:
+    generation = 3
+    ntotal = 42
+
+
+class StubRAGService:
+    index_generation = 7
+    vector_store = StubVectorStore()
+
+    def __init__(self):
+        self.calls = []
+
+    def retrieve_context(self, db, query, top_k=None, category=None, similarity_threshold=0.3):
+        self.calls.append((query, top_k, category, similarity_threshold))
+        return "退货政策说明", [{"chunk_id": 1, "document_title": "退货", "content": "退货政策说明", "similarity": 0.8}]
+
+
+@pytest.fixture
+def stub_rag(monkeypatch):
+    stub = StubRAGService()
+    ready = {"value": True}
+    monkeypatch.setattr(rag_module, "get_rag_service", lambda: stub)
+    monkeypatch.setattr(rag_module, "is_rag_ready", lambda: ready["value"])
+    stub.ready = ready
+    return stub
+
+
+@pytest.fixture
+def sidecar():
+    app = rag_server.create_rag_app(init_background=False)
+    app.dependency_overrides[rag_server.get_db] = lambda: None
+    return app
+
+
+def test_parse_service_url():
+    assert parse_service_url("unix:///tmp/rag.sock") == ("http://rag", "/tmp/rag.sock")
+    assert parse_service_url("http://127.0.0.1:8100/") == ("http://127.0.0.1:8100", None)
+
+
+def test_client_retrieves_through_sidecar(sidecar, stub_rag):
+    client = RAGClient(url="http://rag", http_client=TestClient(sidecar))
+
+    context, results = client.retrieve_context("怎么退货", top_k=3, similarity_threshold=0.2)
+    assert context == "退货政策说明"
+    assert results[0]["similarity"] == 0.8
+    assert stub_rag.calls == [("怎么退货", 3, None, 0.2)]
+    assert client.health() == {"ready": True, "generation": 7, "snapshot_generation": 3, "ntotal": 42}
+
+    stub_rag.ready["value"] = False
+    assert client.retrieve_context("怎么退货") == ("", [])
+
+
+def test_service_token_is_required_when_configured(sidecar, stub_rag, monkeypatch):
+    monkeypatch.setenv("RAG_SERVICE_TOKEN", "secret")
+    anonymous = TestClient(sidecar)
+    assert anonymous.post("/internal/retrieve", json={"query": "退货"}).status_code == 401
+
+    client = RAGClient(url="http://rag", http_client=TestClient(sidecar))
+    assert client.retrieve_context("退货")[0] == "退货政策说明"
+
+
+def test_proxy_forwards_knowledge_base_requests():
+    upstream = FastAPI()
+
+    @upstream.api_route("/admin/knowledge-base/{path:path}", methods=["GET", "POST"])
+    async def echo(path: str, request: Request):
+        return {
+            "path": path,
+            "method": request.method,
+            "query": dict(request.query_params),
+            "body": (await request.body()).decode("utf-8"),
+            "authorization": request.headers.get("authorization"),
+        }
+
+    worker = FastAPI()
+    async_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=upstream), base_url="http://rag")
+    worker.include_router(create_proxy_router(async_client))
+
+    response = TestClient(worker).post(
+        "/admin/knowledge-base/search?query=退货&top_k=3", content="{}", auth=("admin", "123456")
+    )
+    data = response.json()
+    assert response.status_code == 200
+    assert data["path"] == "search" and data["method"] == "POST"
+    assert data["query"] == {"query": "退货", "top_k": "3"}
+    assert data["body"] == "{}" and data["authorization"].startswith("Basic ")
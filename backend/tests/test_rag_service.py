@@ -0,0 +1,750 @@
+"""
+RAG 知识库服务单元测试（使用桩嵌入模型，不加载真实模型）
+"""
+import hashlib
+import json
+import multiprocessing
+import shutil
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+faiss = pytest.importorskip("faiss")
+
+from app.database import Base
+from app.models import KnowledgeDocument, KnowledgeChunk
+from app.services import embedding_backend
+from app.services import rag_service as rag_module
+from app.services.cache_service import CacheService
+from app.services.embedding_cache import EmbeddingCache
+from app.services.rag_service import RAGService
+from app.services.tokenizer import Tokenizer, unpack_token_ids
+
+
+class StubEmbeddingModel:
+    """按文本哈希生成确定性单位向量的桩模型，并记录推理次数"""
+
+    def __init__(self, dim: int = 16):
+        self.dim = dim
+        self.encoded_texts = []
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=True, show_progress_bar=False):
+        self.encoded_texts.extend(texts)
+        rows = []
+        for text in texts:
+            seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+            vec = np.random.default_rng(seed).standard_normal(self.dim)
+            rows.append(vec / np.linalg.norm(vec))
+        return np.asarray(rows, dtype="float32")
+
+
+class NoisyEmbeddingModel(StubEmbeddingModel):
+    """模拟量化模型：在桩向量上叠加噪声"""
+
+    def __init__(self, noise: float, dim: int = 16):
+        super().__init__(dim)
+        self.noise = noise
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=True, show_progress_bar=False):
+        vectors = super().encode(texts) + np.random.default_rng(0).normal(0, self.noise, (len(texts), self.dim))
+        return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype("float32")
+
+
+class BigramEmbeddingModel(StubEmbeddingModel):
+    """按字符二元组哈希计数生成向量：近重复文本的向量余弦接近 1"""
+
+    def __init__(self, dim: int = 256):
+        super().__init__(dim)
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=True, show_progress_bar=False):
+        self.encoded_texts.extend(texts)
+        rows = np.zeros((len(texts), self.dim), dtype="float32")
+        for i, text in enumerate(texts):
+            for j in range(len(text) - 1):
+                rows[i, int(hashlib.md5(text[j:j + 2].encode("utf-8")).hexdigest()[:8], 16) % self.dim] += 1
+        return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+FAQ_RETURN = (
+    "退货政策说明：商品签收后七天内可以申请无理由退货，请保持商品完好。"
+    "退货时请在订单页面提交申请，审核通过后寄回商品，运费由买家承担。"
+)
+STORE_RETURN = (
+    "{store}退货政策：自签收之日起七天内可申请无理由退货，商品需保持完好、配件齐全。"
+    "非质量问题退货运费由买家承担，质量问题由商家承担运费。退款将在收到退货后三个工作日内原路退回。"
+)
+STORES = ["朝阳店", "徐汇店", "天河店"]
+FAQ_SHIPPING = (
+    "发货时间说明：订单支付成功后，仓库会在四十八小时内安排发货。"
+    "偏远地区的配送时间可能延长，请耐心等待物流信息更新。"
+)
+
+
+@pytest.fixture
+def kb_db():
+    engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine, autoflush=False, autocommit=False)()
+    try:
+        yield session
+    finally:
+        session.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def rag(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag_module, "SENTENCE_TRANSFORMERS_AVAILABLE", False)
+    monkeypatch.setattr(RAGService, "_load_vector_index", lambda self: None)
+    monkeypatch.setattr(RAGService, "_prepare_vector_index", lambda self: None)
+    # 不连接 Redis：检索结果缓存使用进程内 LRU
+    monkeypatch.setenv("REDIS_ENABLED", "false")
+    monkeypatch.setattr(rag_module, "get_cache_service", CacheService)
+    service = RAGService()
+    monkeypatch.undo()
+
+    service.embedding_model = StubEmbeddingModel()
+    service.embedding_model_name = "stub-model"
+    service.vector_dim = service.embedding_model.dim
+    service.index_path = tmp_path / "knowledge_base_index.faiss"
+    service.embedding_cache = EmbeddingCache(tmp_path / "embedding_cache")
+    service.tokenizer = Tokenizer(words={"行车记录仪"})
+    service._load_vector_index()
+    return service
+
+
+def _indexed_ids(service):
+    return set(service.vector_store.ids().tolist())
+
+
+def test_vector_ids_are_chunk_ids(rag, kb_db):
+    doc = rag.add_document(kb_db, title="退货", content=FAQ_RETURN)
+    chunks = kb_db.query(KnowledgeChunk).filter(KnowledgeChunk.document_id == doc.id).all()
+    assert chunks
+    assert all(c.vector_id == c.id for c in chunks)
+    assert _indexed_ids(rag) == {c.id for c in chunks}
+
+
+def test_failed_commit_removes_written_vectors(rag, kb_db, monkeypatch):
+    doc = rag.add_document(kb_db, title="退货", content=FAQ_RETURN)
+    kept = _indexed_ids(rag)
+
+    def failing_commit():
+        raise RuntimeError("disk I/O error")
+
+    monkeypatch.setattr(kb_db, "commit", failing_commit)
+    with pytest.raises(RuntimeError):
+        rag.add_document(kb_db, title="发货", content=FAQ_SHIPPING)
+    assert _indexed_ids(rag) == kept
+    # 替换内容失败：新块的向量移除，先前移除的旧向量补回
+    with pytest.raises(RuntimeError):
+        rag.replace_document_content(kb_db, doc, FAQ_SHIPPING)
+    monkeypatch.undo()
+
+    assert kb_db.query(KnowledgeDocument).count() == 1 and "七天内" in kb_db.get(KnowledgeDocument, doc.id).content
+    assert _indexed_ids(rag) == kept
+    assert rag.check_index_consistency(kb_db)["consistent"]
+
+
+def test_delete_document_removes_only_its_vectors(rag, kb_db):
+    doc_a = rag.add_document(kb_db, title="退货", content=FAQ_RETURN)
+    doc_b = rag.add_document(kb_db, title="发货", content=FAQ_SHIPPING)
+    ids_b = {c.vector_id for c in kb_db.query(KnowledgeChunk).filter(KnowledgeChunk.document_id == doc_b.id)}
+    encoded_before = len(rag.embedding_model.encoded_texts)
+
+    rag.delete_document(kb_db, doc_a.id)
+
+    assert _indexed_ids(rag) == ids_b
+    assert len(rag.embedding_model.encoded_texts) == encoded_before
+
+
+def test_deactivate_and_reactivate_document(rag, kb_db):
+    doc = rag.add_document(kb_db, title="退货", content=FAQ_RETURN)
+    ids = {c.vector_id for c in kb_db.query(KnowledgeChunk).filter(KnowledgeChunk.document_id == doc.id)}
+
+    rag.set_document_active(kb_db, doc, False)
+    assert _indexed_ids(rag) == set()
+
+    rag.set_document_active(kb_db, doc, True)
+    assert _indexed_ids(rag) == ids
+
+
+def test_replace_document_content_keeps_document(rag, kb_db):
+    doc = rag.add_document(kb_db, title="政策", content=FAQ_RETURN)
+    rag.replace_document_content(kb_db, doc, FAQ_SHIPPING)
+
+    assert kb_db.query(KnowledgeDocument).count() == 1
+    chunks = kb_db.query(KnowledgeChunk).filter(KnowledgeChunk.document_id == doc.id).all()
+    assert _indexed_ids(rag) == {c.vector_id for c in chunks}
+    assert all("发货" in c.content for c in chunks)
+
+
+def test_rebuild_index_only_embeds_missing_chunks(rag, kb_db):
+    rag.add_document(kb_db, title="退货", content=FAQ_RETURN)
+    doc = rag.add_document(kb_db, title="发货", content=FAQ_SHIPPING)
+    missing = kb_db.query(KnowledgeChunk).filter(KnowledgeChunk.document_id == doc.id).all()
+    rag.vector_store.remove([c.vector_id for c in missing])
+    rag.embedding_cache.clear()
+    encoded_before = len(rag.embedding_model.encoded_texts)
+
+    rag._rebuild_index(kb_db)
+
+    assert len(rag.embedding_model.encoded_texts) - encoded_before == len(missing)
+    assert rag.vector_store.ntotal == kb_db.query(KnowledgeChunk).count()
+
+
+def test_rebuild_index_reembeds_when_model_changes(rag, kb_db):
+    rag.add_document(kb_db, title="退货", content=FAQ_RETURN)
+    rag.embedding_model_name = "another-model"
+    encoded_before = len(rag.embedding_model.encoded_texts)
+
+    rag._rebuild_index(kb_db)
+
+    assert len(rag.embedding_model.encoded_texts) - encoded_before == kb_db.query(KnowledgeChunk).count()
+    assert rag.vector_store.model_name == "another-model"
+
+
+def test_legacy_positional_index_is_migrated(rag, kb_db, tmp_path):
+    doc = rag.add_document(kb_db, title="退货", content=FAQ_RETURN)
+    chunks = kb_db.query(KnowledgeChunk).filter(KnowledgeChunk.document_id == doc.id).all()
+    vectors = rag.vector_store.reconstruct([c.vector_id for c in chunks])
+
+    # 模拟旧版：没有快照目录，单文件 IndexFlatL2 按位置编号，块的 vector_id 为位置
+    shutil.rmtree(rag.vector_store.snapshot_dir)
+    legacy = faiss.IndexFlatL2(vectors.shape[1])
+    legacy.add(vectors)
+    faiss.write_index(legacy, str(rag.index_path))
+    for position, chunk in enumerate(chunks):
+        chunk.vector_id = position
+    kb_db.commit()
+
+    rag._load_vector_index()
+    assert rag.vector_store.legacy_ids
+    rag._migrate_vector_ids(kb_db)
+
+    assert all(c.vector_id == c.id for c in chunks)
+    assert _indexed_ids(rag) == {c.id for c in chunks}
+    np.testing.assert_allclose(rag.vector_store.reconstruct([c.id for c in chunks]), vectors)
+
+
+def test_embedding_cache_skips_model_for_unchanged_content(rag, kb_db):
+    doc = rag.add_document(kb_db, title="退货", content=FAQ_RETURN)
+    encoded_before = len(rag.embedding_model.encoded_texts)
+    vectors_before = rag.vector_store.reconstruct(
+        [c.vector_id for c in kb_db.query(KnowledgeChunk).filter(KnowledgeChunk.document_id == doc.id)]
+    )
+
+    rag.replace_document_content(kb_db, doc, FAQ_RETURN)
+
+    assert len(rag.embedding_model.encoded_texts) == encoded_before
+    vectors_after = rag.vector_store.reconstruct(
+        [c.vector_id for c in kb_db.query(KnowledgeChunk).filter(KnowledgeChunk.document_id == doc.id)]
+    )
+    np.testing.assert_allclose(vectors_after, vectors_before)
+    stats = rag.embedding_cache.stats()
+    assert stats["hits"] > 0 and stats["entries"] > 0
+
+
+def test_embedding_cache_persists_and_is_keyed_by_model(tmp_path):
+    texts = ["怎么退货", "多久发货"]
+    vectors = StubEmbeddingModel().encode(texts)
+    EmbeddingCache(tmp_path).store(texts, "model-a", vectors)
+
+    reopened = EmbeddingCache(tmp_path)
+    found, missing = reopened.lookup(texts + ["新问题"], "model-a", vectors.shape[1])
+    assert missing == [2]
+    np.testing.assert_allclose(np.vstack([found[0], found[1]]), vectors)
+
+    _, missing_other_model = reopened.lookup(texts, "model-b", vectors.shape[1])
+    assert missing_other_model == [0, 1]
+
+
+def test_embedding_cache_realigns_keys_after_interrupted_write(tmp_path):
+    model = StubEmbeddingModel()
+    texts = ["怎么退货", "多久发货", "能开发票吗", "支持货到付款吗"]
+    vectors = model.encode(texts)
+    EmbeddingCache(tmp_path).store(texts[:2], "model-a", vectors[:2])
+    keys_path = next(tmp_path.glob("*.keys"))
+    with open(keys_path, "ab") as fp:
+        fp.write(b"\x01" * 10)  # 追加摘要时中断，留下不完整的尾部
+    EmbeddingCache(tmp_path).store(texts[2:3], "model-a", vectors[2:3])
+
+    # 向量文件被截短（只剩第一行）：没有向量的摘要丢弃，之后追加的摘要仍与向量行对齐
+    vectors_path = next(tmp_path.glob("*.f32"))
+    with open(vectors_path, "r+b") as fp:
+        fp.truncate(model.dim * 4)
+    EmbeddingCache(tmp_path).store(texts[3:], "model-a", vectors[3:])
+
+    found, missing = EmbeddingCache(tmp_path).lookup(texts, "model-a", model.dim)
+    assert missing == [1, 2]
+    np.testing.assert_allclose(np.vstack([found[0], found[3]]), vectors[[0, 3]])
+    assert keys_path.stat().st_size == 2 * 32
+
+
+def _store_in_process(cache_dir, tag, count):
+    """子进程：分多批向同一缓存目录追加向量"""
+    cache = EmbeddingCache(cache_dir)
+    model = StubEmbeddingModel()
+    for start in range(0, count, 5):
+        texts = [f"{tag}-{i}" for i in range(start, start + 5)]
+        cache.store(texts, "model-a", model.encode(texts))
+
+
+def test_embedding_cache_appends_from_multiple_processes(tmp_path):
+    cache = EmbeddingCache(tmp_path)
+    assert cache.lookup(["api-0"], "model-a", 16)[1] == [0]
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=_store_in_process, args=(tmp_path, tag, 200)) for tag in ("api", "sidecar")]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(120)
+        assert process.exitcode == 0
+
+    texts = [f"{tag}-{i}" for tag in ("api", "sidecar") for i in range(200)]
+    found, missing = cache.lookup(texts, "model-a", 16)
+    # 两个进程的行互不覆盖，每个摘要都指向自己的向量；先打开的实例也能读到其他进程追加的行
+    assert missing == []
+    np.testing.assert_allclose(np.vstack([found[i] for i in range(len(texts))]), StubEmbeddingModel().encode(texts))
+    assert next(tmp_path.glob("*.keys")).stat().st_size == len(texts) * 32
+
+
+def test_bm25_index_is_updated_incrementally(rag, kb_db):
+    rag._build_bm25_index(kb_db)
+    doc_a = rag.add_document(kb_db, title="退货", content=FAQ_RETURN)
+    doc_b = rag.add_document(kb_db, title="发货", content=FAQ_SHIPPING)
+    ids_a = {c.vector_id for c in kb_db.query(KnowledgeChunk).filter(KnowledgeChunk.document_id == doc_a.id)}
+
+    assert {r["vector_id"] for r in rag.search_bm25("退货 运费")} == ids_a
+
+    rag.set_document_active(kb_db, doc_a, False)
+    assert rag.search_bm25("退货 运费") == []
+    rag.set_document_active(kb_db, doc_a, True)
+    assert {r["vector_id"] for r in rag.search_bm25("退货 运费")} == ids_a
+
+    rag.delete_document(kb_db, doc_a.id)
+    assert rag.search_bm25("退货 运费") == []
+    assert len(rag.bm25_index) == kb_db.query(KnowledgeChunk).filter(KnowledgeChunk.document_id == doc_b.id).count()
+
+
+def test_query_embedding_cache_skips_repeat_questions(rag):
+    first = rag.embed_text("怎么退货")
+    encoded_before = len(rag.embedding_model.encoded_texts)
+
+    again = rag.embed_text("  怎么退货 ")
+    assert len(rag.embedding_model.encoded_texts) == encoded_before
+    np.testing.assert_array_equal(again, first)
+
+    rag.embedding_model_name = "another-model"
+    rag.embed_text("怎么退货")
+    assert len(rag.embedding_model.encoded_texts) == encoded_before + 1
+
+    stats = rag.query_embedding_cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 2
+
+
+def test_concurrent_query_embeddings_share_model_calls(rag):
+    import threading
+
+    calls = []
+    encode = rag.embedding_model.encode
+
+    def slow_encode(texts, **kwargs):
+        calls.append(len(texts))
+        threading.Event().wait(0.05)
+        return encode(texts, **kwargs)
+
+    rag.embedding_model.encode = slow_encode
+    rag.query_batch_max_wait_ms = 20
+    queries = [f"退货问题{i}" for i in range(8)]
+    threads = [threading.Thread(target=rag.embed_text, args=(q,)) for q in queries]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sum(calls) == len(queries) and len(calls) < len(queries)
+    for q in queries:
+        np.testing.assert_allclose(rag.embed_text(q), StubEmbeddingModel().encode([q])[0])
+    rag.query_batcher.shutdown(timeout=5)
+
+
+def test_retrieve_context_cache_is_invalidated_by_writes(rag, kb_db):
+    rag.add_document(kb_db, title="退货", content=FAQ_RETURN)
+    context, details = rag.retrieve_context(kb_db, "退货 运费", top_k=3)
+    assert details
+    encoded_before = len(rag.embedding_model.encoded_texts)
+
+    cached_context, cached_details = rag.retrieve_context(kb_db, " 退货  运费 ", top_k=3)
+    assert (cached_context, cached_details) == (context, details)
+    assert rag.retrieval_cache.hits == 1
+    assert len(rag.embedding_model.encoded_texts) == encoded_before
+
+    generation = rag.index_generation
+    doc = rag.add_document(kb_db, title="发货", content=FAQ_SHIPPING)
+    assert rag.index_generation > generation
+    rag.retrieve_context(kb_db, "退货 运费", top_k=3)
+    assert rag.retrieval_cache.hits == 1
+
+    rag.delete_document(kb_db, doc.id)
+    rag.retrieve_context(kb_db, "退货 运费", top_k=3)
+    assert rag.retrieval_cache.hits == 1
+
+
+def test_retrieve_context_hydrates_without_sql(rag, kb_db):
+    rag.retrieval_cache_enabled = False
+    doc = rag.add_document(kb_db, title="退货", content=FAQ_RETURN, category="售后")
+    rag.add_document(kb_db, title="发货", content=FAQ_SHIPPING, category="物流")
+    rag.retrieve_context(kb_db, "退货 运费", top_k=3)  # 首次检索加载BM25索引和块内存存储
+
+    statements = []
+    event.listen(kb_db.bind, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    _, details = rag.retrieve_context(kb_db, "退货 运费", top_k=3)
+    _, filtered = rag.retrieve_context(kb_db, "退货 运费", top_k=3, category="物流")
+
+    assert statements == []
+    assert details[0]["document_id"] == doc.id and details[0]["document_title"] == "退货"
+    assert all(d["document_title"] == "发货" for d in filtered)
+
+    doc.title = "退货政策"
+    kb_db.commit()
+    rag.refresh_document(doc)
+    _, details = rag.retrieve_context(kb_db, "退货 运费", top_k=3)
+    assert details[0]["document_title"] == "退货政策"
+
+    rag.set_document_active(kb_db, doc, False)
+    _, details = rag.retrieve_context(kb_db, "退货 运费", top_k=3)
+    assert all(d["document_id"] != doc.id for d in details)
+
+
+def test_category_filter_is_applied_inside_search(rag, kb_db):
+    rag.add_document(kb_db, title="退货", content=FAQ_RETURN, category="售后")
+    doc_b = rag.add_document(kb_db, title="发货", content=FAQ_SHIPPING, category="物流")
+    ids_b = {c.vector_id for c in kb_db.query(KnowledgeChunk).filter(KnowledgeChunk.document_id == doc_b.id)}
+    rag.ensure_chunk_store(kb_db)
+    rag._build_bm25_index(kb_db)
+
+    # 查询与“售后”文档完全相同，但限定“物流”分类时只在该分类内检索
+    vector_hits = rag.search(FAQ_RETURN, top_k=1, category="物流", similarity_threshold=-1.0)
+    assert {r["vector_id"] for r in vector_hits} <= ids_b and vector_hits
+    assert rag.search_bm25("发货 退货", category="物流")
+    assert {r["vector_id"] for r in rag.search_bm25("发货 退货", category="物流")} <= ids_b
+    assert rag.search_bm25("退货", category="不存在的分类") == []
+
+    rag.set_document_active(kb_db, doc_b, False)
+    assert rag.search(FAQ_RETURN, top_k=1, category="物流", similarity_threshold=-1.0) == []
+
+
+def test_bulk_add_documents_batches_embeds_and_commits_index_once(rag, kb_db, monkeypatch):
+    rag._build_bm25_index(kb_db)
+    saves = []
+    monkeypatch.setattr(rag.vector_store, "save", lambda *a, **kw: saves.append(1))
+    batch_sizes = []
+    encode = rag.embedding_model.encode
+    monkeypatch.setattr(rag.embedding_model, "encode",
+                        lambda texts, **kw: batch_sizes.append(len(texts)) or encode(texts, **kw))
+    documents = [
+        {"title": f"退货{i}", "content": f"第{i}号说明。" + FAQ_RETURN, "source_url": f"faq/return_{i}.md"}
+        for i in range(4)
+    ] + [
+        {"title": "发货", "content": FAQ_SHIPPING, "source_url": "faq/shipping.md", "category": "物流"},
+        {"title": "空白", "content": "   ", "source_url": "faq/empty.md"},
+        {"source_url": "faq/broken.pdf", "error": "解析失败"},
+    ]
+    processed = []
+
+    summary = rag.bulk_add_documents(kb_db, iter(documents), batch_docs=2, embed_batch_size=3,
+                                     progress=processed.append)
+
+    assert summary["imported"] == 5
+    assert [f["source"] for f in summary["failed"]] == ["faq/empty.md", "faq/broken.pdf"]
+    assert processed == list(range(1, len(documents) + 1))
+    assert len(saves) == 1  # 索引只在最后落盘一次
+    assert batch_sizes and max(batch_sizes) <= 3
+    chunks = kb_db.query(KnowledgeChunk).all()
+    assert summary["chunk_count"] == len(chunks)
+    assert _indexed_ids(rag) == {c.vector_id for c in chunks}
+    assert len(rag.bm25_index) == len(chunks)
+    assert kb_db.query(KnowledgeDocument).filter(KnowledgeDocument.category == "物流").count() == 1
+
+
+def test_index_consistency_check_detects_and_repairs_drift(rag, kb_db):
+    rag.add_document(kb_db, title="退货", content=FAQ_RETURN)
+    doc = rag.add_document(kb_db, title="发货", content=FAQ_SHIPPING)
+    report = rag.check_index_consistency(kb_db)
+    assert report["consistent"] and report["generation"] == rag.vector_store.generation
+
+    # 索引落后于数据库（如保存快照前进程崩溃）
+    lost = [c.vector_id for c in kb_db.query(KnowledgeChunk).filter(KnowledgeChunk.document_id == doc.id)]
+    rag.vector_store.remove(lost)
+    rag._save_vector_index()
+    report = rag.check_index_consistency(kb_db)
+    assert not report["consistent"] and report["missing"] == len(lost) and report["stale"] == 0
+
+    rag._rebuild_index(kb_db)
+    assert rag.check_index_consistency(kb_db)["consistent"]
+
+
+def test_embedding_parity_check_falls_back_to_fp32(rag, kb_db, monkeypatch):
+    rag.add_document(kb_db, title="退货", content=FAQ_RETURN)
+    rag.add_document(kb_db, title="发货", content=FAQ_SHIPPING)
+    reference = StubEmbeddingModel()
+    monkeypatch.setattr(rag_module, "load_embedding_model", lambda name, backend=None: reference)
+
+    rag.embedding_model, rag.embedding_backend = NoisyEmbeddingModel(noise=0.005), "onnx-int8"
+    report = rag.check_embedding_parity(kb_db)
+    assert report["passed"] and report["mean_cosine"] > 0.99 and report["neighbor_agreement"] == 1.0
+    assert report["samples"] == kb_db.query(KnowledgeChunk).count()
+
+    rag.embedding_model = NoisyEmbeddingModel(noise=0.5)
+    rag._verify_embedding_backend(kb_db)
+    assert rag.embedding_model is reference and rag.embedding_backend == "torch"
+
+
+def test_embedding_parity_reference_is_loaded_once(rag, kb_db, monkeypatch):
+    rag.add_document(kb_db, title="退货", content=FAQ_RETURN)
+    loaded = []
+    monkeypatch.setattr(rag_module, "load_embedding_model",
+                        lambda name, backend=None: loaded.append(backend) or StubEmbeddingModel())
+
+    rag.embedding_model, rag.embedding_backend = NoisyEmbeddingModel(noise=0.005), "int8"
+    assert rag.check_embedding_parity(kb_db)["passed"] and rag.check_embedding_parity(kb_db)["passed"]
+    assert loaded == ["torch"]  # 接口重复调用复用同一个 fp32 参考模型
+
+    rag._verify_embedding_backend(kb_db)
+    assert loaded == ["torch"]  # 启动检查同样复用该参考模型
+
+
+def test_onnx_backend_without_onnxruntime_falls_back_to_torch(rag, monkeypatch):
+    monkeypatch.setattr(embedding_backend, "ONNX_RUNTIME_AVAILABLE", False)
+    monkeypatch.setattr(embedding_backend, "SENTENCE_TRANSFORMERS_AVAILABLE", True)
+    monkeypatch.setattr(embedding_backend, "SentenceTransformer", lambda name, **kw: StubEmbeddingModel())
+    monkeypatch.setenv("RAG_EMBEDDING_BACKEND", "onnx")
+    with pytest.raises(RuntimeError, match="optimum"):
+        embedding_backend.load_embedding_model("stub-model")
+    assert isinstance(rag._load_model("stub-model"), StubEmbeddingModel) and rag.embedding_backend == "torch"
+
+
+def test_embedding_cache_is_separated_by_backend(rag):
+    rag.embed_texts(["退货政策"])
+    assert rag.embedding_cache.lookup(["退货政策"], "stub-model", rag.vector_dim)[0]
+
+    rag.embedding_backend = "int8"
+    assert rag.embedding_cache_name == "stub-model#int8"
+    assert not rag.embedding_cache.lookup(["退货政策"], rag.embedding_cache_name, rag.vector_dim)[0]
+
+
+def test_chunk_tokens_are_persisted_and_reused(rag, kb_db, monkeypatch, tmp_path):
+    doc = rag.add_document(kb_db, title="记录仪", content="行车记录仪支持循环录影。" + FAQ_RETURN)
+    chunks = kb_db.query(KnowledgeChunk).filter(KnowledgeChunk.document_id == doc.id).all()
+    assert all(c.token_ids and c.token_version == rag.tokenizer.version for c in chunks)
+    assert unpack_token_ids(chunks[0].token_ids).tolist() == rag.tokenizer.token_ids(chunks[0].content).tolist()
+
+    # 分词器版本未变：全量构建 BM25 不再分词
+    calls = []
+    original = rag.tokenizer.token_ids
+    monkeypatch.setattr(rag.tokenizer, "token_ids", lambda text: calls.append(text) or original(text))
+    rag._build_bm25_index(kb_db)
+    assert calls == []
+    assert rag.search_bm25("记录仪")[0]["vector_id"] == chunks[0].vector_id
+    assert len(calls) == 1
+
+    # 商品词典新增词：只有包含新词的块重新分词并写回数据库，分词器版本不变
+    other = rag.add_document(kb_db, title="退货", content=FAQ_RETURN)
+    other_tokens = [c.token_ids for c in _chunks_of(kb_db, other)]
+    version = rag.tokenizer.version
+    rag.tokenizer = Tokenizer(dictionary_loader=lambda: {"行车记录仪", "循环录影"},
+                              dictionary_path=tmp_path / "tokenizer_dictionary.txt")
+    calls.clear()
+    original = rag.tokenizer.token_ids
+    monkeypatch.setattr(rag.tokenizer, "token_ids", lambda text: calls.append(text) or original(text))
+    rag._build_bm25_index(kb_db, persist_tokens=True)
+    assert rag.tokenizer.version == version
+    assert calls == [c.content for c in chunks if "循环录影" in c.content]
+    assert "循环录影" in rag.tokenizer.tokenize(chunks[0].content)
+    kb_db.expire_all()
+    assert [c.token_ids for c in _chunks_of(kb_db, other)] == other_tokens
+    assert {c.token_version for c in kb_db.query(KnowledgeChunk)} == {version}
+    assert rag.tokenizer.new_words == set()  # 重新分词结果已写回，词典已保存
+
+
+def _use_bigram_model(rag):
+    rag.embedding_model = BigramEmbeddingModel()
+    rag.embedding_model_name = "bigram-model"
+    rag.vector_dim = rag.embedding_model.dim
+    rag._load_vector_index()
+
+
+def _chunks_of(kb_db, doc):
+    return kb_db.query(KnowledgeChunk).filter(KnowledgeChunk.document_id == doc.id).order_by(KnowledgeChunk.id).all()
+
+
+def test_near_duplicate_chunks_reference_canonical_chunk(rag, kb_db):
+    _use_bigram_model(rag)
+    rag.retrieval_cache_enabled = False
+    stores = [rag.add_document(kb_db, title=f"{s}退货", content=STORE_RETURN.format(store=s), category="售后")
+              for s in STORES]
+    shipping = rag.add_document(kb_db, title="发货", content=FAQ_SHIPPING, category="售后")
+    # 不同分类的相同内容不去重（分类过滤检索仍能命中）
+    other = rag.add_document(kb_db, title="退货", content=STORE_RETURN.format(store=STORES[0]), category="物流")
+
+    canonical = _chunks_of(kb_db, stores[0])
+    duplicates = [c for doc in stores[1:] for c in _chunks_of(kb_db, doc)]
+    assert duplicates and all(c.duplicate_of == canonical[0].id and c.vector_id is None for c in duplicates)
+    expected = {c.id for doc in (stores[0], shipping, other) for c in _chunks_of(kb_db, doc)}
+    assert _indexed_ids(rag) == expected
+    assert rag.check_index_consistency(kb_db)["consistent"]
+
+    _, details = rag.retrieve_context(kb_db, "退货运费由谁承担", top_k=3, category="售后")
+    assert details and len({d["content"] for d in details}) == len(details)
+    assert all(d["document_id"] not in (stores[1].id, stores[2].id) for d in details)
+
+
+def test_bulk_import_skips_near_duplicates_within_batch(rag, kb_db):
+    _use_bigram_model(rag)
+    documents = [{"title": f"{s}退货", "content": STORE_RETURN.format(store=s)} for s in STORES]
+    documents.append({"title": "发货", "content": FAQ_SHIPPING})
+
+    summary = rag.bulk_add_documents(kb_db, iter(documents), batch_docs=10)
+
+    chunks = kb_db.query(KnowledgeChunk).all()
+    assert summary["chunk_count"] == len(chunks)
+    assert summary["duplicate_chunks"] == len(STORES) - 1
+    assert len(_indexed_ids(rag)) == len(chunks) - summary["duplicate_chunks"]
+
+
+def test_removing_canonical_chunk_promotes_duplicate(rag, kb_db):
+    _use_bigram_model(rag)
+    docs = [rag.add_document(kb_db, title=f"{s}退货", content=STORE_RETURN.format(store=s)) for s in STORES]
+    rag._build_bm25_index(kb_db)
+
+    # 停用规范块所在文档：启用文档中的重复块提升为规范块
+    rag.set_document_active(kb_db, docs[0], False)
+    promoted = _chunks_of(kb_db, docs[1])[0]
+    assert promoted.duplicate_of is None and promoted.vector_id == promoted.id
+    assert _chunks_of(kb_db, docs[2])[0].duplicate_of == promoted.id
+    assert _indexed_ids(rag) == {promoted.id}
+    assert rag.search_bm25("退货运费")
+
+    # 删除新的规范块所在文档：剩余的重复块再次提升
+    rag.delete_document(kb_db, docs[1].id)
+    last = _chunks_of(kb_db, docs[2])[0]
+    assert last.duplicate_of is None and _indexed_ids(rag) == {last.id}
+    assert rag.check_index_consistency(kb_db)["consistent"]
+
+    # 重新启用最早的文档：它的块一直是规范块，重新写入索引
+    rag.set_document_active(kb_db, docs[0], True)
+    assert _indexed_ids(rag) == {last.id, _chunks_of(kb_db, docs[0])[0].id}
+
+
+def _manual_pages(count):
+    for page in range(1, count + 1):
+        yield (f"# 第{page}章 型号{page}说明\n"
+               f"型号{page}的行车记录仪支持循环录像，存储卡写满后自动覆盖最早的视频。\n"
+               f"安装型号{page}时请先关闭车辆电源，再把支架固定在后视镜附近。\n\n")
+
+
+def test_add_document_stream_embeds_chunks_while_reading_pages(rag, kb_db, monkeypatch):
+    rag._build_bm25_index(kb_db)
+    consumed = []
+    batch_sizes = []
+    encode = rag.embedding_model.encode
+
+    def tracking_encode(texts, **kw):
+        batch_sizes.append((len(texts), len(consumed)))
+        return encode(texts, **kw)
+
+    monkeypatch.setattr(rag.embedding_model, "encode", tracking_encode)
+    pages = (consumed.append(page) or page for page in _manual_pages(12))
+
+    doc = rag.add_document_stream(kb_db, title="行车记录仪手册", parts=pages, source_type="pdf",
+                                  embed_batch_size=4)
+
+    chunks = _chunks_of(kb_db, doc)
+    assert doc.chunk_count == len(chunks) == 12
+    assert [c.chunk_index for c in chunks] == list(range(12))
+    assert json.loads(chunks[2].chunk_metadata)["title"] == "第3章 型号3说明"
+    # 第一批块在读完全部页面之前就已向量化
+    assert [size for size, _ in batch_sizes] == [4, 4, 4] and batch_sizes[0][1] < 12
+    assert _indexed_ids(rag) == {c.id for c in chunks}
+    assert len(rag.bm25_index) == len(chunks)
+    assert "型号12" in doc.content and json.loads(doc.document_metadata)["statistics"]["title_count"] == 12
+    assert rag.check_index_consistency(kb_db)["consistent"]
+
+
+def test_add_document_stream_rolls_back_rejected_document(rag, kb_db, monkeypatch):
+    monkeypatch.setattr(rag.text_cleaner, "quality_threshold", 1.1)
+    created = []
+    with pytest.raises(ValueError, match="质量评分过低"):
+        rag.add_document_stream(kb_db, title="手册", parts=_manual_pages(3), embed_batch_size=2,
+                                document_created=created.append)
+    # 停用状态的文档提交后即回调文档ID（导入任务记录下来，中途退出后据此清理）
+    assert len(created) == 1 and kb_db.get(KnowledgeDocument, created[0]) is None
+    assert kb_db.query(KnowledgeDocument).count() == 0 and kb_db.query(KnowledgeChunk).count() == 0
+    assert _indexed_ids(rag) == set()
+
+
+def test_add_document_stream_commits_batches_without_blocking_writers(rag, tmp_path):
+    # 文件数据库、短超时：导入期间若一直持有写事务，其他连接写库会报 database is locked
+    engine = create_engine(f"sqlite:///{tmp_path / 'kb.db'}",
+                           connect_args={"check_same_thread": False, "timeout": 0.2})
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    db = factory()
+    rag._build_bm25_index(db)
+    observed = {}
+
+    def pages():
+        for i, page in enumerate(_manual_pages(8)):
+            if i == 4:
+                other = factory()
+                other.add(KnowledgeDocument(title="并发写入", content="发票说明", source_type="manual"))
+                other.commit()
+                observed["chunks"] = other.query(KnowledgeChunk).count()
+                observed["active"] = other.query(KnowledgeDocument).filter(
+                    KnowledgeDocument.title == "行车记录仪手册", KnowledgeDocument.active == True).count()
+                _, observed["hits"] = rag.retrieve_context(other, "行车记录仪循环录像", top_k=10,
+                                                          similarity_threshold=-1.0)
+                other.close()
+            yield page
+
+    doc = rag.add_document_stream(db, title="行车记录仪手册", parts=pages(), embed_batch_size=2)
+
+    # 前面的批次已提交，但文档启用前检索不到
+    assert observed == {"chunks": 2, "active": 0, "hits": []}
+    assert doc.active and doc.chunk_count == 8
+    assert _indexed_ids(rag) == {c.id for c in _chunks_of(db, doc)}
+    assert rag.check_index_consistency(db)["consistent"]
+    db.close()
+    engine.dispose()
+
+
+def test_large_content_is_added_through_stream(rag, kb_db, monkeypatch):
+    monkeypatch.setattr(rag, "stream_min_chars", 200)
+    content = "".join(_manual_pages(3))
+    doc = rag.add_document(kb_db, title="手册", content=content)
+    assert [json.loads(c.chunk_metadata)["type"] for c in _chunks_of(kb_db, doc)] == ["section"] * 3
+
+
+def test_add_table_stream_indexes_row_windows_with_header(rag, kb_db):
+    rag._build_bm25_index(kb_db)
+    rows = [("价格表", ["SKU", "名称", "价格"])]
+    rows += [("价格表", [f"A{i:03d}", f"行车记录仪{i}型", f"{199 + i}"]) for i in range(40)]
+    consumed = []
+    stages = []
+    doc = rag.add_table_stream(kb_db, title="价格表.xlsx", rows=(consumed.append(row) or row for row in rows),
+                               source_url="价格表.xlsx", embed_batch_size=3,
+                               progress=lambda stage, value: stages.append((stage, len(consumed))))
+
+    # 读到第一行才进入 clean，第一批块读完后进入 embed，全部行读完才进入 index
+    assert [stage for stage, _ in stages] == ["clean", "embed", "index"]
+    assert stages[0][1] == 1 and 1 < stages[1][1] < len(rows) and stages[2][1] == len(rows)
+
+    chunks = _chunks_of(kb_db, doc)
+    assert doc.source_type == "excel" and doc.chunk_count == len(chunks) > 1
+    assert all(c.content.startswith("工作表: 价格表\n| SKU | 名称 | 价格 |") for c in chunks)
+    assert {json.loads(c.chunk_metadata)["type"] for c in chunks} == {"table"}
+    assert doc.content.count("| SKU | 名称 | 价格 |") == 1 and "| A039 | 行车记录仪39型 | 238 |" in doc.content
+    assert _indexed_ids(rag) == {c.id for c in chunks} and len(rag.bm25_index) == len(chunks)
@@ -0,0 +1,62 @@
+"""
+表格文件逐行读取单元测试（用 openpyxl 生成测试文件）
+"""
+from datetime import datetime
+
+import pytest
+
+openpyxl = pytest.importorskip("openpyxl")
+
+from app.services.document_parser import parse_document
+from app.services.spreadsheet_reader import iter_sheet_rows, spreadsheet_kind
+
+
+def _workbook(path):
+    wb = openpyxl.Workbook()
+    prices = wb.active
+    prices.title = "价格表"
+    prices.append(["SKU", "名称", "价格", "上架日期", None])
+    prices.append(["A001", "手机壳\n透明款", 19.9, datetime(2024, 3, 1), None])
+    prices.append([None, None, None, None, None])
+    prices.append(["A002", "数据线", 0.1 + 0.2, datetime(2024, 3, 2, 9, 30), None])
+    notes = wb.create_sheet("说明")
+    notes.append(["字段", "含义"])
+    notes.append(["SKU", "库存单位编码"])
+    wb.save(path)
+    return path
+
+
+def test_xlsx_rows_are_streamed_per_sheet(tmp_path):
+    path = _workbook(tmp_path / "价格.xlsx")
+    progress = []
+    rows = list(iter_sheet_rows(path, progress=lambda done, total: progress.append((done, total)), progress_every=2))
+    assert rows == [
+        ("价格表", ["SKU", "名称", "价格", "上架日期"]),
+        ("价格表", ["A001", "手机壳 透明款", "19.9", "2024-03-01"]),
+        ("价格表", ["A002", "数据线", "0.3", "2024-03-02 09:30:00"]),
+        ("说明", ["字段", "含义"]),
+        ("说明", ["SKU", "库存单位编码"]),
+    ]
+    # 空行计入已读行数，不产出
+    assert progress == [(2, 6), (4, 6), (6, 6), (6, 6)]
+
+
+def test_csv_encoding_and_delimiter_are_detected(tmp_path):
+    path = tmp_path / "库存.csv"
+    path.write_bytes("SKU;名称;库存\nA001;手机壳;12\n\nA002;\"数据线;1米\";0\n".encode("gb18030"))
+    assert spreadsheet_kind("库存.csv") == "csv" and spreadsheet_kind(None, "text/csv; charset=utf-8") == "csv"
+    assert list(iter_sheet_rows(path, filename="库存.csv")) == [
+        ("库存", ["SKU", "名称", "库存"]),
+        ("库存", ["A001", "手机壳", "12"]),
+        ("库存", ["A002", "数据线;1米", "0"]),
+    ]
+    tsv = "SKU\t价格\nA001\t19.9\n".encode("utf-8-sig")
+    assert list(iter_sheet_rows(tsv, filename="价格.tsv")) == [("价格", ["SKU", "价格"]), ("价格", ["A001", "19.9"])]
+
+
+def test_parse_excel_renders_table_rows_without_pandas(tmp_path):
+    data = _workbook(tmp_path / "价格.xlsx").read_bytes()
+    result = parse_document(data, filename="价格.xlsx")
+    assert result["source_type"] == "excel" and result["metadata"]["parser"] == "openpyxl"
+    assert result["content"].startswith("=== 工作表: 价格表 ===\n| SKU | 名称 | 价格 | 上架日期 |\n| A001 |")
+    assert "=== 工作表: 说明 ===\n| 字段 | 含义 |" in result["content"]
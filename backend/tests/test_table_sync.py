@@ -0,0 +1,99 @@
+"""
+数据表同步单元测试（商品表按行同步到知识库，使用桩嵌入模型）
+"""
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("faiss")
+
+from app.models import KnowledgeDocument, KnowledgeSyncSource, Product
+from app.services.table_sync import row_source_url, sync_table
+from tests.test_rag_service import kb_db, rag  # noqa: F401  复用知识库测试夹具
+
+T1 = datetime(2024, 5, 1, 10, 0, 0)
+T2 = datetime(2024, 5, 2, 9, 30, 0)
+
+DESCRIPTIONS = [
+    "入耳式无线蓝牙耳机，支持主动降噪，单次续航八小时，适合通勤和运动时佩戴。",
+    "大容量双肩背包，防泼水面料，内置笔记本电脑隔层，适合上班和短途旅行使用。",
+    "不锈钢保温杯，容量五百毫升，十二小时保温保冷，杯盖可拆洗，办公居家都合适。",
+    "全棉四件套，柔软亲肤透气，多种颜色可选，机洗不易起球，四季通用的床上用品。",
+    "智能体脂秤，蓝牙连接手机应用，可测体重体脂等多项数据，全家成员共用也方便。",
+]
+
+
+def _add_products(db, count=3, updated_at=T1):
+    for i in range(count):
+        db.add(Product(name=f"商品{i + 1}", description=DESCRIPTIONS[i], price=99 + i, stock=10,
+                       category="日用", created_at=updated_at, updated_at=updated_at))
+    db.commit()
+
+
+def _table_docs(db):
+    return {
+        doc.source_url: doc for doc in
+        db.query(KnowledgeDocument).filter(KnowledgeDocument.source_url.like("table:products#%")).all()
+    }
+
+
+def test_rows_sync_incrementally_by_updated_watermark(rag, kb_db):
+    _add_products(kb_db)
+    first = sync_table(kb_db, rag, "products", category="商品")
+    assert (first["mode"], first["created"], first["failed"]) == ("full", 3, [])
+    docs = _table_docs(kb_db)
+    assert set(docs) == {row_source_url("products", i) for i in (1, 2, 3)}
+    assert docs["table:products#1"].title == "products: 商品1"
+    assert "description: 入耳式无线蓝牙耳机" in docs["table:products#1"].content
+    assert "updated_at" not in docs["table:products#1"].content
+
+    # 没有变化：增量同步不读取任何行
+    again = sync_table(kb_db, rag, "products")
+    assert (again["mode"], again["scanned"]) == ("incremental", 0)
+
+    # 商品2内容变化，商品3只是 updated_at 被刷新：只有商品2重新向量化
+    kb_db.get(Product, 2).description = "升级版双肩背包，新增独立鞋仓和充电接口，面料防水等级提升，适合商务出差。"
+    kb_db.get(Product, 2).updated_at = T2
+    kb_db.get(Product, 3).updated_at = T2
+    kb_db.commit()
+    encoded = len(rag.embedding_model.encoded_texts)
+    result = sync_table(kb_db, rag, "products")
+    assert (result["scanned"], result["updated"], result["unchanged"], result["created"]) == (2, 1, 1, 0)
+    assert all("升级版双肩背包" in text for text in rag.embedding_model.encoded_texts[encoded:])
+    docs = _table_docs(kb_db)
+    assert len(docs) == 3 and "升级版双肩背包" in docs["table:products#2"].content
+    assert docs["table:products#2"].category == "商品"  # 沿用首次同步保存的配置
+
+    source = kb_db.query(KnowledgeSyncSource).filter(KnowledgeSyncSource.table_name == "products").one()
+    assert source.watermark_updated.startswith("2024-05-02 09:30:00") and source.watermark_key == "3"
+
+    # 增量同步发现不了删除，全量同步时清理
+    kb_db.delete(kb_db.get(Product, 1))
+    kb_db.commit()
+    assert sync_table(kb_db, rag, "products")["deleted"] == 0
+    full = sync_table(kb_db, rag, "products", full=True)
+    assert (full["mode"], full["deleted"], full["unchanged"]) == ("full", 1, 2)
+    assert set(_table_docs(kb_db)) == {"table:products#2", "table:products#3"}
+
+
+def test_keyset_batches_cover_rows_with_equal_updated_once(rag, kb_db):
+    _add_products(kb_db, count=5)
+    assert sync_table(kb_db, rag, "products", batch_size=2)["created"] == 5
+
+    # 5 行的 updated_at 相同，跨批次按主键续读，不重复、不遗漏
+    for product in kb_db.query(Product).all():
+        product.description += "本周会员专享九折优惠。"
+        product.updated_at = T2
+    kb_db.commit()
+    result = sync_table(kb_db, rag, "products", batch_size=2)
+    assert (result["mode"], result["scanned"], result["updated"]) == ("incremental", 5, 5)
+    assert len(_table_docs(kb_db)) == 5
+
+
+def test_table_and_columns_are_validated(rag, kb_db):
+    with pytest.raises(ValueError):
+        sync_table(kb_db, rag, "products; DROP TABLE products")
+    with pytest.raises(ValueError):
+        sync_table(kb_db, rag, "knowledge_documents")
+    with pytest.raises(ValueError):
+        sync_table(kb_db, rag, "products", columns=["name", "secret"])
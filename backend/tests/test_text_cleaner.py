@@ -0,0 +1,109 @@
+"""
+文本清洗单元测试（预编译单遍实现需与原有逐条正则实现的输出逐字一致）
+"""
+import io
+
+import pytest
+
+from app.services.text_cleaner import TextCleaner
+
+
+@pytest.fixture
+def cleaner():
+    return TextCleaner()
+
+
+@pytest.mark.parametrize("raw, expected", [
+    # 货币规则按顺序依次替换：¥100 先变为 ￥100，“100元”再被替换一次；￥ 最后被字符过滤去掉
+    ("¥100元", "100"),
+    ("价格 RMB100元，rmb 88", "价格 RMB100，88"),
+    # 日期规则按顺序依次替换：先替换年在前的格式，剩余部分再按月日年匹配
+    ("01/11/2024/05/06", "2024年01月11日年05月06日"),
+    ("2024-1-5 到 3-5 天", "2024年1月5日 到 3-5 天"),
+    ("a\t\tb  c \x07d\n\n\n\ne", "a b c d\n\ne"),
+])
+def test_normalize_text_keeps_sequential_rule_semantics(cleaner, raw, expected):
+    assert cleaner.normalize_text(raw) == expected
+
+
+def test_clean_content_classifies_each_line_once(cleaner):
+    text = (
+        "首页 > 帮助\n退货政策说明：七天无理由退货。\nCopyright 2024\n12345\nOK\n"
+        "退货政策说明：七天无理由退货。\n\n运费由买家承担，质量问题除外。"
+    )
+    cleaned, info = cleaner.clean_content(text)
+    assert cleaned == "退货政策说明：七天无理由退货。\n\n运费由买家承担，质量问题除外。"
+    assert info["removed"] == 5
+    assert info["quality_score"] == pytest.approx(0.6)
+
+
+def test_quality_score_and_metadata_statistics(cleaner):
+    assert cleaner._calculate_quality_score("退货 policy 说明。\n第二行") == pytest.approx(0.8)
+
+    metadata = cleaner.extract_metadata("作者：客服中心\n发布时间：2024-03-15\n退货 policy 说明。", quality_score=0.5)
+    assert metadata["author"] == "客服中心"
+    assert metadata["extracted_time"] == "2024-03-15"
+    assert metadata["quality_score"] == 0.5
+    assert metadata["statistics"]["chinese_char_count"] == 14
+    assert metadata["statistics"]["english_word_count"] == 1
+
+
+def test_iter_chunks_streams_sections_with_titles_and_overlap(cleaner):
+    consumed = []
+
+    def lines():
+        for i in range(1, 1001):
+            consumed.append(i)
+            yield f"# 第{i}节\n"
+            yield "本节说明商品安装步骤，请按照说明书顺序操作。" * 3 + "\n"
+
+    chunks = cleaner.iter_chunks(lines(), chunk_size=100, overlap=10)
+    first, second = next(chunks), next(chunks)
+    assert len(consumed) < 5  # 边读边产出，不需要先读完全部输入
+    assert first["title"] == "第1节" and first["type"] == "section" and first["chunk_index"] == 0
+    assert first["content"].startswith("【标题1】第1节")
+    assert second["title"] == "第2节" and second["content"].startswith(first["content"][-10:])
+    assert sum(1 for _ in chunks) == 998
+
+
+def test_iter_chunks_splits_long_paragraphs_and_sentences(cleaner):
+    text = "\n".join(["退货需要在七天内提交申请，商品保持完好" * 4 + "。"] * 6) + "\n" + "无标点长句" * 100
+    chunks = list(cleaner.iter_chunks([text], chunk_size=120, overlap=0))
+    assert all(c["title"] is None and c["type"] == "paragraph" for c in chunks)
+    assert all(len(c["content"]) <= 121 for c in chunks)
+    assert "".join(c["content"] for c in chunks).count("无标点长句") == 100
+
+
+def test_document_stream_statistics_match_whole_text_cleaning(cleaner):
+    raw = "作者：客服中心\n发布时间：2024-03-15\n\n# 退货说明\n首页 > 帮助\n退货政策说明：七天无理由退货。\n\n- 运费由买家承担，质量问题除外。\n"
+    stats = {}
+    sink = io.StringIO()
+    chunks = list(cleaner.iter_document_chunks([raw[:40], raw[40:]], stats, sink=sink))
+
+    assert chunks and chunks[-1]["title"] == "退货说明"
+    assert cleaner.stream_quality_score(stats) == cleaner._calculate_quality_score(sink.getvalue())
+    metadata = cleaner.stream_metadata(stats, source_url="manual.pdf")
+    assert metadata["author"] == "客服中心" and metadata["extracted_time"] == "2024-03-15"
+    assert metadata["source_type"] == "pdf" and metadata["structure_tags"] == ["has_titles", "has_lists"]
+    assert metadata["statistics"]["total_length"] == len(sink.getvalue())
+
+
+def test_table_chunks_repeat_header_in_every_row_window(cleaner):
+    rows = [("价格表", ["SKU", "名称", "价格"])]
+    rows += [("价格表", [f"A{i:03d}", f"手机壳{i}号", "19.9"]) for i in range(30)]
+    rows += [("说明", ["字段", "含义"]), ("说明", ["SKU", "库存单位编码"])]
+    stats = {}
+    sink = io.StringIO()
+    chunks = list(cleaner.iter_table_chunks(iter(rows), stats, chunk_size=120, sink=sink))
+
+    price_chunks = [c for c in chunks if c["title"] == "价格表"]
+    assert len(price_chunks) > 1 and all(len(c["content"]) <= 120 for c in price_chunks)
+    assert all(c["content"].startswith("工作表: 价格表\n| SKU | 名称 | 价格 |\n| A") for c in price_chunks)
+    # 每个数据行恰好出现在一个块中，行序不变
+    data_rows = [line for c in price_chunks for line in c["content"].split("\n")[2:]]
+    assert data_rows == [f"| A{i:03d} | 手机壳{i}号 | 19.9 |" for i in range(30)]
+    assert chunks[-1] == {"content": "工作表: 说明\n| 字段 | 含义 |\n| SKU | 库存单位编码 |", "title": "说明",
+                          "type": "table", "chunk_index": len(chunks) - 1}
+    # 全文中表头只出现一次，统计按写入全文的行累计
+    assert sink.getvalue().count("| SKU | 名称 | 价格 |") == 1 and sink.getvalue().startswith("=== 工作表: 价格表 ===")
+    assert stats["length"] == len(sink.getvalue()) and stats["tables"] == 33 and stats["titles"] == 2
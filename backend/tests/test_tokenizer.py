@@ -0,0 +1,87 @@
+"""
+共享中文分词器单元测试
+"""
+import pytest
+
+from app.database import Base
+from app.models import Category, Product
+from app.services import tokenizer as tokenizer_module
+from app.services.tokenizer import Tokenizer, load_dictionary_words, mine_dictionary_words, token_id
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+PRODUCT_NAMES = ["高端行车记录仪523", "便携行车记录仪881", "高端手机123", "X1-Pro 智能手表"]
+
+
+def test_dictionary_is_mined_from_product_names():
+    words = mine_dictionary_words(PRODUCT_NAMES, ["汽车", "手机数码"])
+    assert {"行车记录仪", "高端", "x1-pro", "汽车", "手机数码"} <= words
+    # 只出现在一个商品里的片段、被更长片段包含的片段不进入词典
+    assert "便携" not in words and "车记录仪" not in words
+
+
+def test_dictionary_is_loaded_from_database():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add_all([Category(name="汽车")] + [Product(name=n, price=1, stock=1, category="汽车") for n in PRODUCT_NAMES])
+    db.commit()
+    try:
+        assert {"行车记录仪", "汽车"} <= load_dictionary_words(db)
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize("jieba_available", [True, False])
+def test_product_words_are_kept_together(monkeypatch, jieba_available):
+    if jieba_available and not tokenizer_module.JIEBA_AVAILABLE:
+        pytest.skip("jieba 未安装")
+    monkeypatch.setattr(tokenizer_module, "JIEBA_AVAILABLE", jieba_available)
+    tokenizer = Tokenizer(words={"行车记录仪", "x1-pro"})
+
+    tokens = tokenizer.tokenize("高端行车记录仪 X1-Pro，怎么退货？")
+    assert "行车记录仪" in tokens and "x1-pro" in tokens
+    assert "，" not in tokens and " " not in tokens
+    # 查询中的短词也能命中文档中的长词
+    assert set(tokenizer.tokenize("记录仪")) & set(tokens)
+
+
+def test_tokenization_is_memoized_and_ids_are_stable():
+    tokenizer = Tokenizer(words={"行车记录仪"})
+    first = tokenizer.tokenize("行车记录仪怎么安装")
+    assert tokenizer.tokenize("行车记录仪怎么安装") == first
+    assert tokenizer.cache.stats()["hits"] == 1
+    assert tokenizer.token_ids("行车记录仪").tolist()[0] == token_id("行车记录仪")
+
+    # 版本只随分词规则和引擎变化，商品词典加词不改变版本
+    assert Tokenizer(words={"行车记录仪"}).version == tokenizer.version
+    assert Tokenizer(words={"行车记录仪", "积木"}).version == tokenizer.version
+
+
+@pytest.mark.parametrize("jieba_available", [True, False])
+def test_saved_dictionary_only_invalidates_text_with_new_words(monkeypatch, tmp_path, jieba_available):
+    if jieba_available and not tokenizer_module.JIEBA_AVAILABLE:
+        pytest.skip("jieba 未安装")
+    monkeypatch.setattr(tokenizer_module, "JIEBA_AVAILABLE", jieba_available)
+    path = tmp_path / "tokenizer_dictionary.txt"
+    first = Tokenizer(dictionary_loader=lambda: {"行车记录仪"}, dictionary_path=path)
+    assert first.new_words == {"行车记录仪"}
+    first.save_dictionary()
+    assert first.new_words == set() and path.read_text(encoding="utf-8").split() == ["行车记录仪"]
+
+    # 重启后商品改名：旧词保留在词典中，只有新词使包含它的文本失效
+    restarted = Tokenizer(dictionary_loader=lambda: {"积木城堡"}, dictionary_path=path)
+    version = first.version
+    assert restarted.version == version
+    assert restarted.words == {"行车记录仪", "积木城堡"} and restarted.new_words == {"积木城堡"}
+    assert restarted.is_current("行车记录仪怎么安装", version)
+    assert not restarted.is_current("积木城堡适合几岁", version)
+    assert not restarted.is_current("行车记录仪怎么安装", "old-version")
+    # 不含新词的文本切分结果不变
+    text = "行车记录仪支持循环录影，高清夜视，包邮到家"
+    assert restarted.tokenize(text) == first.tokenize(text)
+
+    restarted.save_dictionary()
+    assert restarted.is_current("积木城堡适合几岁", version)
+    assert set(path.read_text(encoding="utf-8").split()) == {"行车记录仪", "积木城堡"}
@@ -0,0 +1,158 @@
+"""
+向量存储（可配置 ANN 索引类型）单元测试
+"""
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from app.services.vector_store import VectorStore
+
+
+def _vectors(n, dim=32, seed=0):
+    data = np.random.default_rng(seed).standard_normal((n, dim)).astype("float32")
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def make_store(tmp_path, monkeypatch):
+    def _make(index_type="auto", **env):
+        monkeypatch.setenv("RAG_INDEX_TYPE", index_type)
+        monkeypatch.setenv("RAG_INDEX_MIN_RECALL", "0.5")
+        for key, value in env.items():
+            monkeypatch.setenv(key, str(value))
+        return VectorStore(tmp_path / "index.faiss", 32)
+    return _make
+
+
+def test_auto_selection_by_ntotal(make_store):
+    store = make_store(RAG_INDEX_AUTO_IVF_THRESHOLD=1000, RAG_INDEX_AUTO_SQ8_THRESHOLD=5000)
+    assert store.select_index_type(999) == "flat"
+    assert store.select_index_type(1000) == "ivf"
+    assert store.select_index_type(5000) == "ivfsq8"
+    assert make_store("ivfpq").select_index_type(100) == "flat"  # 训练样本不足
+
+
+@pytest.mark.parametrize("index_type", ["ivf", "ivfsq8", "ivfpq", "hnsw"])
+def test_ann_index_supports_id_operations(make_store, index_type):
+    store = make_store(index_type)
+    vectors = _vectors(2000)
+    ids = np.arange(10_000, 12_000)
+
+    assert store.build(ids.tolist(), vectors, "stub-model") == index_type
+    assert store.ntotal == 2000
+
+    assert store.remove([10_000, 10_001, 99]) == 2
+    assert store.ntotal == 1998
+    assert not {10_000, 10_001} & set(store.ids().tolist())
+
+    store.add([10_000], vectors[:1])
+    _, found = store.search(vectors[:1], 1)
+    assert found[0][0] == 10_000
+
+    _, found = store.search(vectors[:1], 5, ids=np.array([10_500, 10_501]))
+    assert set(found[0].tolist()) - {-1} <= {10_500, 10_501}
+
+
+def test_hnsw_tombstones_persist_and_compact(make_store):
+    store = make_store("hnsw")
+    vectors = _vectors(100)
+    store.build(list(range(100)), vectors)
+    store.remove([5])
+    store.save()
+
+    reopened = make_store("hnsw")
+    reopened.load()
+    assert reopened.ntotal == 99 and 5 not in set(reopened.ids().tolist())
+    _, found = reopened.search(vectors[5:6], 3)
+    assert 5 not in found[0]
+
+    reopened.remove(list(range(10, 40)))  # 墓碑超过 20%，压缩重建
+    assert not reopened.deleted and reopened.index.ntotal == 69
+
+
+def test_low_recall_falls_back_to_flat(make_store):
+    store = make_store("ivf", RAG_INDEX_MIN_RECALL=1.01)
+    assert store.build(list(range(500)), _vectors(500)) == "flat"
+    assert store.index_type == "flat" and not store.needs_retrain()
+
+
+def test_retrain_upgrades_index_without_reembedding(make_store):
+    store = make_store(RAG_INDEX_AUTO_IVF_THRESHOLD=1000)
+    store.reset(32, "stub-model")
+    vectors = _vectors(1500)
+    store.add(list(range(1500)), vectors)
+
+    assert store.needs_retrain()
+    assert store.retrain() == "ivf"
+    assert store.model_name == "stub-model"
+    assert sorted(store.ids().tolist()) == list(range(1500))
+
+
+def test_l2_index_is_migrated_to_inner_product(make_store, tmp_path):
+    vectors = _vectors(50)
+    l2 = faiss.IndexIDMap2(faiss.IndexFlatL2(32))
+    l2.add_with_ids(vectors, np.arange(100, 150, dtype="int64"))
+    faiss.write_index(l2, str(tmp_path / "index.faiss"))
+
+    store = make_store()
+    store.load()
+    assert store.migrated and store.index.metric_type == faiss.METRIC_INNER_PRODUCT
+    assert sorted(store.ids().tolist()) == list(range(100, 150))
+
+    scores, found = store.search(vectors[:1], 3)
+    cosine = store.to_cosine(scores[0])
+    assert found[0][0] == 100
+    np.testing.assert_allclose(cosine, vectors[found[0] - 100] @ vectors[0], atol=1e-5)
+
+
+def test_to_cosine_for_l2_metric(make_store):
+    store = make_store(RAG_VECTOR_METRIC="l2")
+    vectors = _vectors(20)
+    store.build(list(range(20)), vectors)
+    scores, found = store.search(vectors[:1], 5)
+    np.testing.assert_allclose(store.to_cosine(scores[0]), vectors[found[0]] @ vectors[0], atol=1e-5)
+
+
+def test_snapshots_are_versioned_and_pruned(make_store, tmp_path):
+    store = make_store(RAG_INDEX_SNAPSHOT_KEEP=2)
+    vectors = _vectors(30)
+    store.build(list(range(10)), vectors[:10])
+    for generation in range(1, 4):
+        store.add([10 + generation], vectors[10 + generation:11 + generation])
+        store.save()
+        assert store.generation == generation and not store.dirty
+
+    snapshots = sorted(p.name for p in store.snapshot_dir.glob("index-*.faiss"))
+    assert snapshots == ["index-00000002.faiss", "index-00000003.faiss"]
+    manifest = store.manifest
+    assert manifest["index_file"] == "index-00000003.faiss" and manifest["vector_count"] == 13
+    assert not (tmp_path / "index.faiss").exists()  # 不再写旧版单文件
+
+    # 模拟写入中途崩溃：遗留的临时文件不影响加载上一代完整快照
+    (store.snapshot_dir / "index-00000004.faiss.999.tmp").write_bytes(b"partial")
+    reopened = make_store()
+    assert reopened.load() and reopened.generation == 3
+    assert sorted(reopened.ids().tolist()) == list(range(10)) + [11, 12, 13]
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf", "hnsw"])
+def test_mmap_loaded_index_becomes_writable_on_change(make_store, index_type):
+    store = make_store(index_type)
+    vectors = _vectors(1000)
+    store.build(list(range(1000)), vectors)
+    store.save()
+
+    reopened = make_store(index_type)
+    reopened.load()
+    assert reopened.mapped_path is not None
+    _, found = reopened.search(vectors[:1], 1)
+    assert found[0][0] == 0
+
+    reopened.remove([0])
+    reopened.add([5000], vectors[:1])
+    assert reopened.mapped_path is None
+    _, found = reopened.search(vectors[:1], 1)
+    assert found[0][0] == 5000
+    reopened.save()
+    assert make_store(index_type).load() and reopened.generation == 2
@@ -386,11 +386,18 @@ export const api = {
     if (title) formData.append('title', title)
     if (category) formData.append('category', category)
     if (tags) formData.append('tags', tags)
+    // 上传后立即返回导入任务，解析和向量化在后台进行，通过 knowledgeGetIngestJob 轮询进度
     return adminHttp.post(`/knowledge-base/documents/upload`, formData, {
       headers: { 'Content-Type': 'multipart/form-data' },
-      timeout: 120000  // 120秒超时，因为文档解析和向量化可能需要较长时间
+      timeout: 120000  // 120秒超时（仅文件传输）
     })
   },
+  knowledgeGetIngestJob(jobId){
+    return adminHttp.get(`/knowledge-base/jobs/${jobId}`)
+  },
+  knowledgeListIngestJobs(params){
+    return adminHttp.get(`/knowledge-base/jobs`, { params })
+  },
   knowledgeImportFromUrl(payload){
     return adminHttp.post(`/knowledge-base/documents/from-url`, payload)
   },